@@ -10,6 +10,10 @@ LEGAL: These are original works created for CoachingApp.
 Not affiliated with or endorsed by any third-party authors.
 """
 
+from typing import Optional
+
+from app.services.message_features import MessageFeatures, extract_features, keywords
+
 # Framework 1: Direct Care Feedback™
 DIRECT_CARE_FEEDBACK = """
 **Direct Care Feedback™ Framework**
@@ -541,33 +545,45 @@ PROPRIETARY_FRAMEWORKS = {
 }
 
 
-def get_framework_for_context(user_message: str, emotion: str, goal_link: str) -> str:
+_EXECUTIVE_SIGNALS = keywords("360 feedback", "360", "vp", "c-suite", "senior leader", "executive", "derailer", "blindspot", "reputation", "board")
+_NEW_LEADER_SIGNALS = keywords("new manager", "first time manager", "managing people", "delegation", "team lead", "new leader")
+_COURAGE_SIGNALS = keywords("vulnerable", "authentic", "psychological safety", "courage", "safe", "admit my mistake", "admit a mistake", "afraid of losing")
+_OWNERSHIP_SIGNALS = keywords("imposter", "not ready", "deserve", "doubt", "negotiat", "raise", "promotion", "self doubt", "fraud", "qualified")
+_FEEDBACK_SIGNALS = keywords("feedback", "difficult conversation", "confrontation", "honest", "direct", "hard conversation")
+
+
+def get_framework_for_context(
+    user_message: str,
+    emotion: str,
+    goal_link: str,
+    features: Optional[MessageFeatures] = None,
+) -> str:
     """
     Select most relevant proprietary framework based on context.
     
     Returns framework text to inject into system prompt.
     Priority order: most specific to most general.
     """
-    msg_lower = user_message.lower()
+    f = features or extract_features(user_message)
     
     # Priority 1: Senior executive issues → Executive Evolution
-    if any(k in msg_lower for k in ["360 feedback", "360", "vp", "c-suite", "senior leader", "executive", "derailer", "blindspot", "reputation", "board"]):
+    if f.any(_EXECUTIVE_SIGNALS):
         return EXECUTIVE_EVOLUTION
     
     # Priority 2: New leader → Leadership Foundation
-    if any(k in msg_lower for k in ["new manager", "first time manager", "managing people", "delegation", "team lead", "new leader"]):
+    if f.any(_NEW_LEADER_SIGNALS):
         return LEADERSHIP_FOUNDATION
     
     # Priority 3: Vulnerability, authenticity, trust → Courageous Leadership
-    if any(k in msg_lower for k in ["vulnerable", "authentic", "psychological safety", "courage", "safe", "admit my mistake", "admit a mistake", "afraid of losing"]):
+    if f.any(_COURAGE_SIGNALS):
         return COURAGEOUS_LEADERSHIP
     
     # Priority 4: Self-doubt, career advancement → Power Ownership Model
-    if any(k in msg_lower for k in ["imposter", "not ready", "deserve", "doubt", "negotiat", "raise", "promotion", "self doubt", "fraud", "qualified"]):
+    if f.any(_OWNERSHIP_SIGNALS):
         return POWER_OWNERSHIP_MODEL
     
     # Priority 5: Feedback & difficult conversations → Direct Care Feedback
-    if any(k in msg_lower for k in ["feedback", "difficult conversation", "confrontation", "honest", "direct", "hard conversation"]):
+    if f.any(_FEEDBACK_SIGNALS):
         return DIRECT_CARE_FEEDBACK
     
     # Fallback: pick based on goal
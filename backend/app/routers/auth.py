@@ -54,7 +54,7 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
 
 @router.post("/login")
 async def login(request: LoginRequest):
-    user = user_service.verify_user_password(request.email, request.password)
+    user = await user_service.verify_user_password(request.email, request.password)
     if not user:
         raise HTTPException(status_code=401, detail="Invalid email or password")
     return create_auth_response(user)
@@ -62,11 +62,11 @@ async def login(request: LoginRequest):
 
 @router.post("/register")
 async def register(request: RegisterRequest):
-    existing = user_service.get_user_by_email(request.email)
+    existing = await user_service.get_user_by_email(request.email)
     if existing:
         raise HTTPException(status_code=400, detail="Email already registered")
     
-    user = user_service.create_user(
+    user = await user_service.create_user(
         id=str(uuid.uuid4()),
         email=request.email,
         password=request.password,
@@ -85,22 +85,22 @@ async def apple_signin(request: AppleSignInRequest):
     email = apple_user.get("email")
     
     # Check if user exists
-    user = user_service.get_user_by_apple_id(apple_id)
+    user = await user_service.get_user_by_apple_id(apple_id)
     if not user and email:
-        user = user_service.get_user_by_email(email)
+        user = await user_service.get_user_by_email(email)
     
     if not user:
         # Create new user
-        user = user_service.create_user(
+        user = await user_service.create_user(
             id=str(uuid.uuid4()),
             email=email or f"apple_{apple_id}@placeholder.com",
             password=str(uuid.uuid4()),  # Random password for Apple users
             full_name=apple_user.get("name"),
             apple_id=apple_id,
         )
-    elif not user_service.get_user_by_apple_id(apple_id):
+    elif not await user_service.get_user_by_apple_id(apple_id):
         # Link Apple ID to existing user
-        user = user_service.update_user(user.id, apple_id=apple_id)
+        user = await user_service.update_user(user.id, apple_id=apple_id)
     
     return create_auth_response(user)
 
@@ -126,22 +126,22 @@ async def google_callback(request: GoogleCallbackRequest):
     full_name = google_user.get("name")
     
     # Check if user exists
-    user = user_service.get_user_by_google_id(google_id)
+    user = await user_service.get_user_by_google_id(google_id)
     if not user and email:
-        user = user_service.get_user_by_email(email)
+        user = await user_service.get_user_by_email(email)
     
     if not user:
         # Create new user
-        user = user_service.create_user(
+        user = await user_service.create_user(
             id=str(uuid.uuid4()),
             email=email or f"google_{google_id}@placeholder.com",
             password=str(uuid.uuid4()),  # Random password for Google users
             full_name=full_name,
             google_id=google_id,
         )
-    elif not user_service.get_user_by_google_id(google_id):
+    elif not await user_service.get_user_by_google_id(google_id):
         # Link Google ID to existing user
-        user = user_service.update_user(user.id, google_id=google_id)
+        user = await user_service.update_user(user.id, google_id=google_id)
     
     return create_auth_response(user)
 
@@ -160,22 +160,22 @@ async def google_callback_get(code: str):
     full_name = google_user.get("name")
     
     # Check if user exists
-    user = user_service.get_user_by_google_id(google_id)
+    user = await user_service.get_user_by_google_id(google_id)
     if not user and email:
-        user = user_service.get_user_by_email(email)
+        user = await user_service.get_user_by_email(email)
     
     if not user:
         # Create new user
-        user = user_service.create_user(
+        user = await user_service.create_user(
             id=str(uuid.uuid4()),
             email=email or f"google_{google_id}@placeholder.com",
             password=str(uuid.uuid4()),
             full_name=full_name,
             google_id=google_id,
         )
-    elif not user_service.get_user_by_google_id(google_id):
+    elif not await user_service.get_user_by_google_id(google_id):
         # Link Google ID to existing user
-        user = user_service.update_user(user.id, google_id=google_id)
+        user = await user_service.update_user(user.id, google_id=google_id)
     
     auth_response = create_auth_response(user)
     access_token = auth_response["access_token"]
@@ -210,7 +210,7 @@ async def logout(user_id: str = Depends(get_current_user)):
 
 @router.get("/me")
 async def get_me(user_id: str = Depends(get_current_user)):
-    user = user_service.get_user_by_id(user_id)
+    user = await user_service.get_user_by_id(user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     return user.to_dict()
@@ -222,7 +222,7 @@ async def refresh_token(request: RefreshRequest):
     if not user_id:
         raise HTTPException(status_code=401, detail="Invalid or expired refresh token")
     
-    user = user_service.get_user_by_id(user_id)
+    user = await user_service.get_user_by_id(user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
@@ -1,30 +1,34 @@
 import json
 import asyncio
 import hashlib
+import logging
 import os
-import random
 import time
 import uuid
-from typing import Dict, List, Optional, Union
+import re
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple, Union
 
-from fastapi import APIRouter, HTTPException, Query
-from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi import APIRouter, Header, HTTPException, Query
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from pydantic import BaseModel
 
-from app.services.llm import CoachingRequest, CoachingResponse, get_coaching_response, generate_session_summary, _anthropic_available, _openai_available
-from app.services.cache import build_cache_backend
+from app.services.llm import CoachingRequest, CoachingResponse, get_coaching_response, stream_coaching_response, generate_session_summary, _anthropic_available, _openai_available
+from app.services.cache import get_cache_backend
+from app.services.transcript_store import chain_digest, fold_digest, get_transcript_store
+from app.services.sse import COALESCE_MAX_BYTES, REPLAY_PACING_SECONDS, SSE_DONE, SSEEmitter, coalesce_tokens, split_text
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
-response_cache = build_cache_backend()
+response_cache = get_cache_backend()
 
 IDEMP_TTL_SECONDS = int(os.getenv("IDEMP_TTL_SECONDS", "1200"))
 LOCK_TTL_SECONDS = int(os.getenv("LOCK_TTL_SECONDS", "120"))
 FOLLOWER_WAIT_SECONDS_CHAT = float(os.getenv("FOLLOWER_WAIT_SECONDS_CHAT", "12"))
 FOLLOWER_WAIT_SECONDS_STREAM = float(os.getenv("FOLLOWER_WAIT_SECONDS_STREAM", "120"))
-FOLLOWER_POLL_MIN_SECONDS = float(os.getenv("FOLLOWER_POLL_MIN_SECONDS", "0.25"))
-FOLLOWER_POLL_MAX_SECONDS = float(os.getenv("FOLLOWER_POLL_MAX_SECONDS", "0.50"))
 FOLLOWER_RETRY_AFTER_MS = int(os.getenv("FOLLOWER_RETRY_AFTER_MS", "750"))
 SSE_KEEPALIVE_SECONDS = float(os.getenv("SSE_KEEPALIVE_SECONDS", "10"))
+STREAM_LOG_TTL_SECONDS = int(os.getenv("STREAM_LOG_TTL_SECONDS", "300"))
 
 
 def _require_llm_or_503():
@@ -43,6 +47,8 @@ class ChatStreamRequest(BaseModel):
     coachingStyle: Optional[str] = None
     userId: Optional[str] = "anonymous"
     requestId: Optional[str] = None
+    # Last transcript turn the client has; history comes from the server.
+    lastTurnIndex: Optional[int] = None
 
 
 class ProcessingResponse(BaseModel):
@@ -56,39 +62,78 @@ def _idem_key(user_id: str, request_id: str) -> str:
     return f"idem:{user_id}:{request_id}"
 
 
+def _idem_log_key(user_id: str, request_id: str, run_id: str) -> str:
+    # One log per leader run: a run that died is led again under a new log,
+    # so its frames and ids never mix with the new run's.
+    return f"idemlog:{user_id}:{request_id}:{run_id}"
+
+
 def _idem_lock_key(user_id: str, request_id: str) -> str:
     return f"idemlock:{user_id}:{request_id}"
 
 
-def _summary_cache_key(user_id: str, messages: List[dict]) -> str:
-    canonical = [
-        {
-            "role": str(item.get("role", "")),
-            "content": str(item.get("content", "")),
-        }
-        for item in (messages or [])
+def _idem_sig_key(user_id: str, request_id: str) -> str:
+    # {"signature", "run"} of the streaming leader that owns the requestId.
+    return f"idemsig:{user_id}:{request_id}"
+
+
+async def _history_digest(
+    user_id: str,
+    session_id: Optional[str],
+    messages: List[Tuple[str, str]],
+    claimed: Optional[str],
+) -> str:
+    """
+    Hash-chain digest of ``messages``. A digest the client supplies is taken
+    as is when the session's stored digest of every message but the last,
+    folded with the last message sent, reproduces it; otherwise the whole
+    history is hashed.
+    """
+    if claimed and session_id and messages:
+        try:
+            previous = await get_transcript_store().digest_at(user_id, session_id, len(messages) - 1)
+        except Exception as exc:
+            logger.warning("Transcript digest lookup failed for session %s: %s", session_id, exc)
+            previous = None
+        role, content = messages[-1]
+        if previous and fold_digest(previous, role, content) == claimed:
+            return claimed
+    return chain_digest(messages)
+
+
+async def _summary_cache_key(request: "SessionSummaryRequest") -> str:
+    user_id = request.userId or "anonymous"
+    messages = [
+        (str(item.get("role", "")), str(item.get("content", "")))
+        for item in (request.messages or [])
         if isinstance(item, dict)
     ]
-    raw = json.dumps(canonical, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
-    digest = hashlib.sha256(raw.encode("utf-8")).hexdigest()
+    digest = await _history_digest(user_id, request.sessionId, messages, request.messagesDigest)
     return f"summary:{user_id}:{digest}"
 
 
-def _chat_signature(request: CoachingRequest) -> str:
-    history_payload = [
-        {
-            "role": str(item.role),
-            "content": str(item.content),
-        }
-        for item in (request.history or [])
-    ]
+async def _chat_signature(request: CoachingRequest) -> str:
+    user_id = request.user_id or "anonymous"
+    history = None
+    if request.history is not None or not request.session_id:
+        history = await _history_digest(
+            user_id,
+            request.session_id,
+            [(str(item.role), str(item.content)) for item in (request.history or [])],
+            request.history_digest,
+        )
     payload = {
         "message": request.message,
-        "history": history_payload,
+        "history": history,
         "context": request.context,
         "coaching_style": request.coaching_style,
-        "user_id": request.user_id or "anonymous",
+        "user_id": user_id,
     }
+    if request.session_id:
+        # Without history the stored transcript is used, so "not sent" and
+        # "sent empty" are different requests.
+        payload["session_id"] = request.session_id
+        payload["last_turn_index"] = request.last_turn_index
     raw = json.dumps(payload, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
     return hashlib.sha256(raw.encode("utf-8")).hexdigest()
 
@@ -101,12 +146,15 @@ def _stream_signature(request: ChatStreamRequest) -> str:
         "coaching_style": request.coachingStyle,
         "user_id": request.userId or "anonymous",
     }
+    if request.lastTurnIndex is not None:
+        payload["last_turn_index"] = request.lastTurnIndex
     raw = json.dumps(payload, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
     return hashlib.sha256(raw.encode("utf-8")).hexdigest()
 
 
-def _response_payload(result: CoachingResponse) -> Dict:
-    return result.model_dump()
+def _response_body(result: CoachingResponse) -> bytes:
+    """The response body exactly as FastAPI renders it for these endpoints."""
+    return JSONResponse(content=result.model_dump(mode="json")).body
 
 
 def _response_from_payload(payload: Dict) -> CoachingResponse:
@@ -132,19 +180,46 @@ def _meta_from_result(result: CoachingResponse) -> Dict:
         "quick_replies": result.quick_replies,
         "model_used": result.model_used,
         "upgrade_reasons": result.upgrade_reasons,
+        "turn_index": result.turn_index,
+        "history_digest": result.history_digest,
     }
 
 
-def _cache_record(result: CoachingResponse, signature: str, request_id: str) -> Dict:
+# Idempotency records are stored as
+#   {"response_bytes":N,<metadata>,"response":<rendered body>}
+# so a hit can read the small header and slice the body out of the cached
+# bytes, serving it without decoding or re-validating it. The record is
+# still one JSON object, so get_json/wait_for callers see the usual dict.
+_RECORD_HEADER = re.compile(rb'\{"response_bytes":(\d+),')
+_RECORD_BODY_FIELD = b',"response":'
+
+
+def _encode_record(result: CoachingResponse, signature: str, request_id: str) -> bytes:
+    body = _response_body(result)
     behavior = result.behavior_signals or {}
-    return {
+    header = {
+        "response_bytes": len(body),
         "request_id": request_id,
         "signature": signature,
-        "response": _response_payload(result),
         "pre_state_rev": behavior.get("pre_state_rev"),
         "post_state_rev": behavior.get("post_state_rev"),
         "cached_at_ms": int(time.time() * 1000),
     }
+    encoded = json.dumps(header, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return encoded[:-1] + _RECORD_BODY_FIELD + body + b"}"
+
+
+def _split_record(raw: bytes) -> Tuple[Dict, bytes]:
+    """(record metadata, rendered response body) from a stored record."""
+    match = _RECORD_HEADER.match(raw)
+    if match:
+        size = int(match.group(1))
+        head = raw[: len(raw) - size - 1]
+        if size < len(raw) and head.endswith(_RECORD_BODY_FIELD):
+            return json.loads(head[: -len(_RECORD_BODY_FIELD)] + b"}"), raw[len(head) : -1]
+    # Records written before the body was stored pre-rendered.
+    record = json.loads(raw)
+    return record, _response_body(_response_from_payload(record.get("response") or {}))
 
 
 def _require_matching_signature(record: Dict, signature: str) -> None:
@@ -153,28 +228,205 @@ def _require_matching_signature(record: Dict, signature: str) -> None:
         raise HTTPException(status_code=409, detail="request_id already used for a different payload")
 
 
+async def _require_stream_signature(sig_key: str, cache_key: str, signature: str) -> Optional[Dict]:
+    """
+    409 unless ``signature`` matches the streaming request that owns this
+    requestId: the signature the leader stored next to its chunk log, or
+    its record once the sibling key is gone. Returns the leader's entry
+    (naming its run's chunk log), None if there is none.
+    """
+    run = await response_cache.get_json(sig_key)
+    owner = run or await response_cache.get_json(cache_key)
+    if owner:
+        _require_matching_signature(owner, signature)
+    return run if run and run.get("run") else None
+
+
+async def _leader_running(lock_key: str) -> bool:
+    """Whether some leader holds ``lock_key``; probes it without keeping it."""
+    probe = str(uuid.uuid4())
+    if not await response_cache.acquire_lock(lock_key, probe, 1):
+        return True
+    await response_cache.release_lock(lock_key, probe)
+    return False
+
+
 async def _wait_for_record(cache_key: str, signature: str, wait_seconds: float) -> Optional[Dict]:
-    deadline = time.monotonic() + max(0.0, wait_seconds)
-    while time.monotonic() < deadline:
-        record = await response_cache.get_json(cache_key)
-        if record:
-            _require_matching_signature(record, signature)
-            return record
-        await asyncio.sleep(random.uniform(FOLLOWER_POLL_MIN_SECONDS, FOLLOWER_POLL_MAX_SECONDS))
+    record = await response_cache.wait_for(cache_key, wait_seconds)
+    if record:
+        _require_matching_signature(record, signature)
+        return record
     return None
 
 
-async def _stream_result(result: CoachingResponse):
-    meta = _meta_from_result(result)
-    yield f"data: {json.dumps({'meta': meta}, ensure_ascii=False)}\n\n"
+async def _wait_for_chunks_or_record(
+    log_key: Optional[str], cache_key: str, signature: str, wait_seconds: float
+) -> Tuple[List[Tuple[str, str]], Optional[Dict]]:
+    """
+    Wait for the leader's first stream chunks or, from a leader that does
+    not publish them, its stored record; live chunks win if both exist.
+    Without a ``log_key`` only the record is waited for.
+    """
+    if log_key is None:
+        return [], await _wait_for_record(cache_key, signature, wait_seconds)
+    if wait_seconds <= 0:
+        chunks = await response_cache.read_stream(log_key, "0", 0)
+        return chunks, None if chunks else await _wait_for_record(cache_key, signature, 0)
+
+    chunk_task = asyncio.create_task(response_cache.read_stream(log_key, "0", wait_seconds))
+    record_task = asyncio.create_task(_wait_for_record(cache_key, signature, wait_seconds))
+    done, pending = await asyncio.wait({chunk_task, record_task}, return_when=asyncio.FIRST_COMPLETED)
+    for task in pending:
+        task.cancel()
+    await asyncio.gather(*pending, return_exceptions=True)
+    chunks = chunk_task.result() if chunk_task in done else []
+    if chunks:
+        return chunks, None
+    return [], record_task.result() if record_task in done else None
+
+
+def _sse_event(payload: Dict) -> str:
+    """An event outside the numbered sequence (timeouts, fallbacks)."""
+    return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+
+def _stream_error(error: str, request_id: str) -> str:
+    payload = {"error": error, "request_id": request_id, "retry_after_ms": FOLLOWER_RETRY_AFTER_MS}
+    return _sse_event({"meta": payload})
+
+
+def _sse_event_id(frame: str) -> Optional[int]:
+    """The ``id:`` of an SSE frame produced by this module, if it has one."""
+    if not frame.startswith("id: "):
+        return None
+    try:
+        return int(frame[4 : frame.index("\n")])
+    except ValueError:
+        return None
 
-    words = (result.response or "").split(" ")
-    for i, word in enumerate(words):
-        token = word if i == 0 else f" {word}"
-        yield f"data: {json.dumps({'token': token}, ensure_ascii=False)}\n\n"
-        await asyncio.sleep(0.02)
 
-    yield "data: [DONE]\n\n"
+def _sse_token(frame: str) -> str:
+    """The text of a ``{"token": ...}`` frame, "" for any other frame."""
+    start = frame.find("data: {")
+    if start < 0:
+        return ""
+    try:
+        payload = json.loads(frame[start + 6 :])
+    except ValueError:
+        return ""
+    token = payload.get("token") if isinstance(payload, dict) else None
+    return token if isinstance(token, str) else ""
+
+
+def _parse_last_event_id(raw: Optional[str]) -> Optional[int]:
+    try:
+        return max(0, int((raw or "").strip()))
+    except ValueError:
+        return None
+
+
+def _replay_frames(
+    result: CoachingResponse, after_event: int = 0, delivered_text: Optional[str] = None,
+) -> Tuple[List[str], Dict[str, str]]:
+    """
+    Frames replaying a stored result (its meta, the text split into frames
+    of up to SSE_COALESCE_MAX_BYTES, then [DONE]) and the frame/byte count
+    headers. Events up to ``after_event`` were already delivered and are
+    left out.
+
+    With ``delivered_text``, the text a live stream already sent through
+    event ``after_event``, the frames finish that stream instead: the rest
+    of the text, the final meta and [DONE], numbered on from ``after_event``.
+    """
+    text = result.response or ""
+    if delivered_text is None:
+        emitter = SSEEmitter(after_event)
+        frames = [emitter.event({"meta": _meta_from_result(result)})]
+        frames.extend(emitter.event({"token": piece}) for piece in split_text(text, COALESCE_MAX_BYTES))
+    else:
+        emitter = SSEEmitter(continue_from=after_event)
+        # The streamed text is authoritative (see stream_coaching_response_claude).
+        rest = text[len(delivered_text):] if text.startswith(delivered_text) else ""
+        frames = [emitter.event({"token": piece}) for piece in split_text(rest, COALESCE_MAX_BYTES)]
+        frames.append(emitter.event({"meta": _meta_from_result(result)}))
+    frames.append(emitter.done())
+    return [frame for frame in frames if frame], emitter.headers()
+
+
+async def _stream_frames(frames: List[str]):
+    """Send replay frames at once, or paced by SSE_REPLAY_PACING_MS."""
+    for frame in frames:
+        yield frame
+        if REPLAY_PACING_SECONDS > 0 and '"token"' in frame:
+            await asyncio.sleep(REPLAY_PACING_SECONDS)
+
+
+def _replay_response(result: CoachingResponse, after_event: int = 0) -> StreamingResponse:
+    frames, headers = _replay_frames(result, after_event)
+    return StreamingResponse(_stream_frames(frames), media_type="text/event-stream", headers=headers)
+
+
+async def _stream_live(
+    request: CoachingRequest,
+    on_result: Optional[Callable[[CoachingResponse], Awaitable[None]]] = None,
+):
+    """
+    Forward model tokens, coalesced into frames by time window and size;
+    the final meta carries the full result. Frame and byte totals are only
+    known at the end, so they go out as an SSE comment before [DONE].
+    """
+    emitter = SSEEmitter()
+    async for kind, payload in coalesce_tokens(stream_coaching_response(request)):
+        if kind == "meta":
+            yield emitter.event({"meta": payload})
+        elif kind == "token":
+            yield emitter.event({"token": payload})
+        elif kind == "result":
+            if on_result is not None:
+                await on_result(payload)
+            yield emitter.event({"meta": _meta_from_result(payload)})
+
+    yield emitter.stats_comment()
+    yield emitter.done()
+
+
+# Leader runs of /chat-stream outlive the request that started them; they
+# are referenced here until they finish.
+_stream_runs: Set["asyncio.Task[None]"] = set()
+
+
+async def _stream_run(
+    request: CoachingRequest,
+    log_key: str,
+    lock_key: str,
+    lock_owner: str,
+    on_result: Callable[[CoachingResponse], Awaitable[None]],
+) -> None:
+    """
+    Generate a streamed reply into its chunk log, then release the leader
+    lock. No connection owns the run, so a client that disconnects (the
+    leader's included) can resume from the log.
+    """
+    publishing = True
+    try:
+        async for chunk in _stream_live(request, on_result=on_result):
+            if not publishing:
+                continue
+            try:
+                await response_cache.append_stream(log_key, chunk, STREAM_LOG_TTL_SECONDS)
+            except Exception as exc:
+                logger.warning("Stream chunk publish failed, readers will wait for the record: %s", exc)
+                publishing = False
+    except Exception as exc:
+        logger.error("Streamed reply for %s failed: %s", log_key, exc)
+    finally:
+        await response_cache.release_lock(lock_key, lock_owner)
+
+
+def _start_stream_run(*args) -> None:
+    task = asyncio.create_task(_stream_run(*args), name="chat-stream-run")
+    _stream_runs.add(task)
+    task.add_done_callback(_stream_runs.discard)
 
 
 def _processing_payload(request_id: str, *, poll_url: Optional[str]) -> Dict:
@@ -198,23 +450,24 @@ async def chat(request: CoachingRequest):
     if not request_id:
         return await get_coaching_response(request)
 
-    signature = _chat_signature(request)
+    signature = await _chat_signature(request)
     cache_key = _idem_key(user_id, request_id)
     lock_key = _idem_lock_key(user_id, request_id)
 
-    cached = await response_cache.get_json(cache_key)
+    # One round-trip on Redis: the stored record, or the leader lock.
+    lock_owner = str(uuid.uuid4())
+    cached, got_lock = await response_cache.get_or_acquire(cache_key, lock_key, lock_owner, LOCK_TTL_SECONDS)
     if cached:
-        _require_matching_signature(cached, signature)
-        return _response_from_payload(cached.get("response") or {})
+        record, body = _split_record(cached)
+        _require_matching_signature(record, signature)
+        return Response(content=body, media_type="application/json")
 
-    lock_owner = str(uuid.uuid4())
-    got_lock = await response_cache.acquire_lock(lock_key, lock_owner, LOCK_TTL_SECONDS)
     if got_lock:
         try:
             result = await get_coaching_response(request)
-            await response_cache.set_json(
+            await response_cache.set_raw(
                 cache_key,
-                _cache_record(result, signature, request_id),
+                _encode_record(result, signature, request_id),
                 IDEMP_TTL_SECONDS,
             )
             return result
@@ -240,41 +493,100 @@ async def get_quick_replies(message: str, response: str = "") -> dict:
 
 
 @router.post("/chat-stream")
-async def chat_stream(request: ChatStreamRequest):
-    """SSE stream for iOS client. First emits metadata, then token chunks."""
+async def chat_stream(
+    request: ChatStreamRequest,
+    last_event_id: Optional[str] = Header(None, alias="Last-Event-ID"),
+):
+    """
+    SSE stream for iOS client. First emits metadata, then token chunks.
+
+    Every event carries an ``id:``. Re-posting the same requestId with a
+    ``Last-Event-ID`` header resumes after that event from the retained
+    chunk log (or the stored record), without another LLM call.
+    """
 
     _require_llm_or_503()
 
     user_id = request.userId or "anonymous"
     request_id = (request.requestId or "").strip()
-
-    async def stream_waiting_and_replay(cache_key: str, signature: str, req_id: str):
+    resume_after = _parse_last_event_id(last_event_id)
+
+    async def stream_waiting_and_replay(
+        cache_key: str,
+        lock_key: str,
+        sig_key: str,
+        log_key: Optional[str],
+        signature: str,
+        req_id: str,
+        after_event: int = 0,
+    ):
         deadline = time.monotonic() + max(0.0, FOLLOWER_WAIT_SECONDS_STREAM)
-        last_keepalive_at = 0.0
-
-        while time.monotonic() < deadline:
-            record = await response_cache.get_json(cache_key)
+        wait_seconds = 0.0
+        cursor = "0"
+        # What the client has from the chunk log: the last event id and the text.
+        last_event = after_event
+        delivered: List[str] = []
+
+        def record_frames(record: Dict) -> List[str]:
+            cached_result = _response_from_payload(record.get("response") or {})
+            if cursor == "0":
+                return _replay_frames(cached_result, after_event)[0]
+            # The leader stopped publishing partway through; finish its stream.
+            return _replay_frames(cached_result, last_event, "".join(delivered))[0]
+
+        while True:
+            # Tail the leader's chunk log so tokens arrive as the leader
+            # produces them. Both waits return as soon as there is something
+            # to send; the keepalive interval only bounds silence.
+            if log_key is None:
+                # A leader that has just taken the lock may not have named its log yet.
+                run = await response_cache.get_json(sig_key)
+                if run and run.get("run"):
+                    _require_matching_signature(run, signature)
+                    log_key = _idem_log_key(user_id, request_id, run["run"])
+            if cursor == "0":
+                chunks, record = await _wait_for_chunks_or_record(log_key, cache_key, signature, wait_seconds)
+            else:
+                chunks = await response_cache.read_stream(log_key, cursor, wait_seconds)
+                record = None if chunks else await _wait_for_record(cache_key, signature, 0)
             if record:
-                _require_matching_signature(record, signature)
-                cached_result = _response_from_payload(record.get("response") or {})
-                async for chunk in _stream_result(cached_result):
+                async for chunk in _stream_frames(record_frames(record)):
                     yield chunk
                 return
 
-            now = time.monotonic()
-            if now - last_keepalive_at >= SSE_KEEPALIVE_SECONDS:
-                yield ": keepalive\n\n"
-                last_keepalive_at = now
+            for cursor, chunk in chunks:
+                event_id = _sse_event_id(chunk)
+                if event_id is None or event_id > after_event:
+                    yield chunk
+                if event_id is not None:
+                    last_event = max(last_event, event_id)
+                delivered.append(_sse_token(chunk))
+                if chunk.endswith(SSE_DONE):
+                    return
+            if chunks:
+                # The wait bounds silence from the leader, not the whole reply.
+                deadline = time.monotonic() + max(0.0, FOLLOWER_WAIT_SECONDS_STREAM)
+            elif not await _leader_running(lock_key):
+                # Nobody is generating. The record is stored before the lock
+                # is released, so a run that finished has one by now.
+                record = await _wait_for_record(cache_key, signature, 0)
+                if record:
+                    async for chunk in _stream_frames(record_frames(record)):
+                        yield chunk
+                    return
+                yield _stream_error("processing_interrupted", req_id)
+                yield SSE_DONE
+                return
 
-            await asyncio.sleep(random.uniform(FOLLOWER_POLL_MIN_SECONDS, FOLLOWER_POLL_MAX_SECONDS))
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            if not chunks and wait_seconds > 0:
+                yield ": keepalive\n\n"
+            wait_seconds = min(remaining, SSE_KEEPALIVE_SECONDS)
 
-        timeout_payload = {
-            "error": "processing_timeout",
-            "request_id": req_id,
-            "retry_after_ms": FOLLOWER_RETRY_AFTER_MS,
-        }
-        yield f"data: {json.dumps({'meta': timeout_payload}, ensure_ascii=False)}\n\n"
-        yield "data: [DONE]\n\n"
+        yield _stream_error("processing_timeout", req_id)
+        yield SSE_DONE
 
     coaching_req = CoachingRequest(
         message=request.message,
@@ -282,41 +594,74 @@ async def chat_stream(request: ChatStreamRequest):
         coaching_style=request.coachingStyle,
         user_id=user_id,
         request_id=request_id or None,
+        session_id=request.sessionId,
+        last_turn_index=request.lastTurnIndex,
     )
 
     if not request_id:
-        result = await get_coaching_response(coaching_req)
-        return StreamingResponse(_stream_result(result), media_type="text/event-stream")
+        return StreamingResponse(_stream_live(coaching_req), media_type="text/event-stream")
 
     signature = _stream_signature(request)
     cache_key = _idem_key(user_id, request_id)
     lock_key = _idem_lock_key(user_id, request_id)
+    sig_key = _idem_sig_key(user_id, request_id)
+
+    if resume_after is not None:
+        run = await _require_stream_signature(sig_key, cache_key, signature)
+        log_key = _idem_log_key(user_id, request_id, run["run"]) if run else None
+        # The chunk log holds the frames (and ids) the client saw; it is
+        # kept for STREAM_LOG_TTL_SECONDS, also after the run finished. A
+        # run that stopped without a record is led again below instead.
+        if log_key and await response_cache.read_stream(log_key, "0", 0) and (
+            await response_cache.get_raw(cache_key) or await _leader_running(lock_key)
+        ):
+            return StreamingResponse(
+                stream_waiting_and_replay(cache_key, lock_key, sig_key, log_key, signature, request_id, resume_after),
+                media_type="text/event-stream",
+            )
 
-    cached = await response_cache.get_json(cache_key)
+    lock_owner = str(uuid.uuid4())
+    cached, got_lock = await response_cache.get_or_acquire(cache_key, lock_key, lock_owner, LOCK_TTL_SECONDS)
     if cached:
-        _require_matching_signature(cached, signature)
-        result = _response_from_payload(cached.get("response") or {})
-        return StreamingResponse(_stream_result(result), media_type="text/event-stream")
+        record = json.loads(cached)
+        _require_matching_signature(record, signature)
+        result = _response_from_payload(record.get("response") or {})
+        # Replay ids are deterministic, so resuming a replay is exact. A live
+        # stream whose chunk log has expired resumes by replay numbering.
+        return _replay_response(result, resume_after or 0)
 
-    lock_owner = str(uuid.uuid4())
-    got_lock = await response_cache.acquire_lock(lock_key, lock_owner, LOCK_TTL_SECONDS)
     if not got_lock:
+        run = await _require_stream_signature(sig_key, cache_key, signature)
+        log_key = _idem_log_key(user_id, request_id, run["run"]) if run else None
         return StreamingResponse(
-            stream_waiting_and_replay(cache_key, signature, request_id),
+            stream_waiting_and_replay(cache_key, lock_key, sig_key, log_key, signature, request_id, resume_after or 0),
             media_type="text/event-stream",
         )
 
-    try:
-        result = await get_coaching_response(coaching_req)
-        await response_cache.set_json(
+    async def store_result(result: CoachingResponse) -> None:
+        await response_cache.set_raw(
             cache_key,
-            _cache_record(result, signature, request_id),
+            _encode_record(result, signature, request_id),
             IDEMP_TTL_SECONDS,
         )
-    finally:
-        await response_cache.release_lock(lock_key, lock_owner)
 
-    return StreamingResponse(_stream_result(result), media_type="text/event-stream")
+    # Stored before any chunk is published, so a resume or follower can be
+    # checked against it, and find the run's log, while the run is going.
+    run_id = uuid.uuid4().hex
+    log_key = _idem_log_key(user_id, request_id, run_id)
+    try:
+        await response_cache.set_json(sig_key, {"signature": signature, "run": run_id}, IDEMP_TTL_SECONDS)
+    except Exception:
+        await response_cache.release_lock(lock_key, lock_owner)
+        raise
+
+    # The run holds the lock and writes the log; this response, like any
+    # follower's, only tails it, so a disconnect does not stop the run.
+    _start_stream_run(coaching_req, log_key, lock_key, lock_owner, store_result)
+    return StreamingResponse(
+        stream_waiting_and_replay(cache_key, lock_key, sig_key, log_key, signature, request_id),
+        media_type="text/event-stream",
+    )
 
 
 @router.get("/result", response_model=Union[CoachingResponse, ProcessingResponse])
@@ -325,7 +670,7 @@ async def chat_result(
     user_id: str = Query("anonymous", min_length=1),
 ):
     cache_key = _idem_key(user_id, request_id)
-    record = await response_cache.get_json(cache_key)
+    record = await response_cache.get_raw(cache_key)
     if not record:
         payload = _processing_payload(request_id, poll_url=f"/api/chat/result?user_id={user_id}&request_id={request_id}")
         return JSONResponse(
@@ -333,12 +678,16 @@ async def chat_result(
             content=payload,
             headers={"Retry-After": str(max(1, FOLLOWER_RETRY_AFTER_MS // 1000))},
         )
-    return _response_from_payload(record.get("response") or {})
+    _, body = _split_record(record)
+    return Response(content=body, media_type="application/json")
 
 
 class SessionSummaryRequest(BaseModel):
     messages: List[dict]
     userId: Optional[str] = "anonymous"
+    # With both set and matching the stored transcript, the messages are not re-hashed.
+    sessionId: Optional[str] = None
+    messagesDigest: Optional[str] = None
 
 
 @router.post("/session-summary")
@@ -347,10 +696,10 @@ async def session_summary(request: SessionSummaryRequest):
     _require_llm_or_503()
 
     user_id = request.userId or "anonymous"
-    cache_key = _summary_cache_key(user_id, request.messages)
-    cached = await response_cache.get_json(cache_key)
+    cache_key = await _summary_cache_key(request)
+    cached = await response_cache.get_raw(cache_key)
     if cached:
-        return cached
+        return Response(content=cached, media_type="application/json")
 
     summary = await generate_session_summary(request.messages, user_id)
     if isinstance(summary, dict):
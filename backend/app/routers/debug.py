@@ -1,5 +1,14 @@
 from fastapi import APIRouter
-from app.services.memory_store import load_profile
+from app.services.anthropic_keys import get_anthropic_key_pool
+from app.services.background_jobs import get_background_jobs
+from app.services.cache import get_cache_backend
+from app.services.database import database_stats
+from app.services.escalation_classifier import escalation_classifier_stats
+from app.services.history_compaction import get_history_compactor
+from app.services.memory_store import load_profile_async, profile_cache_stats
+from app.services.llm_clients import get_llm_clients
+from app.services.llm_dispatch import get_llm_dispatcher
+from app.services.llm_claude import classification_stats, prompt_cache_stats
 
 router = APIRouter()
 
@@ -9,5 +18,23 @@ async def get_user_profile(user_id: str):
     """Read-only debug endpoint to inspect persistent coaching memory profile."""
     return {
         "user_id": user_id,
-        "profile": load_profile(user_id)
+        "profile": await load_profile_async(user_id)
+    }
+
+
+@router.get("/api/debug/metrics")
+async def get_metrics():
+    """Read-only counters for shared infrastructure (connection pools, caches)."""
+    return {
+        "llm_clients": get_llm_clients().stats(),
+        "llm_dispatch": get_llm_dispatcher().stats(),
+        "anthropic_keys": get_anthropic_key_pool().stats(),
+        "prompt_cache": prompt_cache_stats(),
+        "database": database_stats(),
+        "profile_cache": profile_cache_stats(),
+        "history_compaction": get_history_compactor().stats(),
+        "background_jobs": get_background_jobs().stats(),
+        "classification": classification_stats(),
+        "escalation_classifier": escalation_classifier_stats(),
+        "cache": get_cache_backend().stats(),
     }
@@ -0,0 +1,266 @@
+"""
+Rate-limit-aware Anthropic key pool.
+
+``ANTHROPIC_API_KEYS`` (comma-separated) lists keys or workspaces with
+separate rate limits; without it the single ``ANTHROPIC_API_KEY`` forms a
+pool of one. Every Claude call leases a key and sends it as that request's
+``x-api-key``.
+
+Each response's ``anthropic-ratelimit-{requests,tokens,input-tokens,
+output-tokens}-{limit,remaining,reset}`` headers update the key's budget,
+and a 429 blocks the key for its ``retry-after``. A lease goes to the key
+with the most headroom: the smallest remaining share of any limit, after
+subtracting this worker's calls still in flight. When every key is spent
+the call waits, up to ``ANTHROPIC_MAX_PACING_SECONDS``, for the earliest
+reset instead of drawing a 429.
+
+Budgets are shared across workers through the CacheBackend: a lease
+publishes the key's latest headers when it is released, and ``acquire``
+adopts any newer state another worker has published, reading it at most
+every ``ANTHROPIC_RATELIMIT_REFRESH_SECONDS`` (and again while pacing). Keys are identified
+there and in metrics by a short hash, never by the key itself.
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from app.services.cache import CacheBackend, get_cache_backend
+from app.services.llm_clients import add_response_observer, anthropic_api_keys
+
+logger = logging.getLogger(__name__)
+
+RATELIMIT_DIMENSIONS = ("requests", "tokens", "input-tokens", "output-tokens")
+# Per-minute limits reset within 60s; older shared state is meaningless.
+_STATE_TTL_SECONDS = 300
+# A 429 without retry-after keeps the key out of rotation this long.
+_DEFAULT_BLOCK_SECONDS = 1.0
+
+
+def key_id(api_key: str) -> str:
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:12]
+
+
+def _state_key(kid: str) -> str:
+    return f"anthropic:ratelimit:{kid}"
+
+
+def _parse_reset(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+    except ValueError:
+        return None
+
+
+def _parse_float(value: Optional[str]) -> Optional[float]:
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+@dataclass
+class _KeyState:
+    api_key: str
+    kid: str
+    # dimension -> {"limit", "remaining", "reset"} (reset as a Unix time)
+    limits: Dict[str, Dict[str, float]] = field(default_factory=dict)
+    blocked_until: float = 0.0
+    observed_at: float = 0.0
+    dirty: bool = False
+    in_flight: int = 0
+    reserved_tokens: int = 0
+    leases: int = 0
+    rate_limited: int = 0
+
+    def _shares(self, now: float) -> List[Tuple[float, float]]:
+        """(remaining share, reset) of each limit that has not reset yet."""
+        shares = []
+        for dimension, entry in self.limits.items():
+            if entry["reset"] <= now or entry["limit"] <= 0:
+                continue
+            reserved = self.in_flight if dimension == "requests" else self.reserved_tokens
+            shares.append(((entry["remaining"] - reserved) / entry["limit"], entry["reset"]))
+        return shares
+
+    def headroom(self, now: float) -> float:
+        """Smallest remaining share of any live limit, 0.0 when the key is spent."""
+        if self.blocked_until > now:
+            return 0.0
+        return max(0.0, min([1.0] + [share for share, _ in self._shares(now)]))
+
+    def available_at(self, now: float) -> float:
+        """When the key next has headroom, assuming this worker's calls finish first."""
+        spent = [reset for share, reset in self._shares(now) if share <= 0]
+        return max([now, self.blocked_until] + spent)
+
+    def observe(self, status: int, headers: Any, now: float) -> None:
+        for dimension in RATELIMIT_DIMENSIONS:
+            prefix = f"anthropic-ratelimit-{dimension}"
+            limit = _parse_float(headers.get(f"{prefix}-limit"))
+            remaining = _parse_float(headers.get(f"{prefix}-remaining"))
+            reset = _parse_reset(headers.get(f"{prefix}-reset"))
+            if limit is not None and remaining is not None:
+                self.limits[dimension] = {"limit": limit, "remaining": remaining, "reset": reset or now + 60}
+        if status == 429:
+            self.rate_limited += 1
+            retry_after = _parse_float(headers.get("retry-after"))
+            self.blocked_until = max(self.blocked_until, now + (retry_after or _DEFAULT_BLOCK_SECONDS))
+        self.observed_at = now
+        self.dirty = True
+
+    def shared(self) -> Dict[str, Any]:
+        return {"limits": self.limits, "blocked_until": self.blocked_until, "observed_at": self.observed_at}
+
+    def adopt(self, entry: Optional[Dict[str, Any]]) -> None:
+        if not isinstance(entry, dict) or entry.get("observed_at", 0) <= self.observed_at:
+            return
+        self.limits = dict(entry.get("limits") or {})
+        self.blocked_until = max(self.blocked_until, float(entry.get("blocked_until") or 0))
+        self.observed_at = float(entry["observed_at"])
+
+
+@dataclass
+class KeyLease:
+    # None when no key is configured: the client's own credentials apply.
+    state: Optional[_KeyState]
+    tokens: int
+
+    @property
+    def headers(self) -> Dict[str, str]:
+        return {"x-api-key": self.state.api_key} if self.state is not None else {}
+
+
+class AnthropicKeyPool:
+    def __init__(
+        self,
+        api_keys: Sequence[str],
+        backend: Optional[CacheBackend] = None,
+        max_pacing_seconds: Optional[float] = None,
+        refresh_interval_seconds: Optional[float] = None,
+    ) -> None:
+        self.api_keys = tuple(api_keys)
+        self.backend = backend or get_cache_backend()
+        self.max_pacing_seconds = (
+            max_pacing_seconds if max_pacing_seconds is not None
+            else float(os.getenv("ANTHROPIC_MAX_PACING_SECONDS", "20"))
+        )
+        self.refresh_interval_seconds = (
+            refresh_interval_seconds if refresh_interval_seconds is not None
+            else float(os.getenv("ANTHROPIC_RATELIMIT_REFRESH_SECONDS", "1"))
+        )
+        self._refreshed_at = float("-inf")
+        self._states = [_KeyState(k, key_id(k)) for k in self.api_keys]
+        self._by_key = {s.api_key: s for s in self._states}
+        self.counters = {"leases": 0, "paced": 0, "paced_past_budget": 0, "sync_failures": 0}
+        self._paced_seconds = 0.0
+
+    async def acquire(self, tokens: int = 0) -> KeyLease:
+        """Lease the key with the most headroom, waiting for a reset if every key is spent."""
+        if not self._states:
+            return KeyLease(None, tokens)
+        deadline = time.monotonic() + self.max_pacing_seconds
+        await self._refresh()
+        paced = False
+        while True:
+            now = time.time()
+            state = max(self._states, key=lambda s: (s.headroom(now), -s.in_flight))
+            if state.headroom(now) > 0:
+                break
+            state = min(self._states, key=lambda s: s.available_at(now))
+            delay = min(state.available_at(now) - now, deadline - time.monotonic())
+            if delay <= 0:
+                if state.available_at(now) > now:
+                    self.counters["paced_past_budget"] += 1
+                break
+            if not paced:
+                paced = True
+                self.counters["paced"] += 1
+            self._paced_seconds += delay
+            await asyncio.sleep(delay)
+            await self._refresh(force=True)
+
+        state.in_flight += 1
+        state.reserved_tokens += tokens
+        state.leases += 1
+        self.counters["leases"] += 1
+        return KeyLease(state, tokens)
+
+    async def release(self, lease: KeyLease) -> None:
+        """Return the lease and share the key's latest budget with other workers."""
+        state = lease.state
+        if state is None:
+            return
+        state.in_flight -= 1
+        state.reserved_tokens -= lease.tokens
+        if state.dirty:
+            state.dirty = False
+            try:
+                await self.backend.set_json(_state_key(state.kid), state.shared(), _STATE_TTL_SECONDS)
+            except Exception as exc:
+                self.counters["sync_failures"] += 1
+                logger.warning("Publishing Anthropic rate-limit state failed: %s", exc)
+
+    def observe(self, api_key: Optional[str], status: int, headers: Any) -> None:
+        state = self._by_key.get(api_key or "")
+        if state is not None:
+            state.observe(status, headers, time.time())
+
+    async def _refresh(self, force: bool = False) -> None:
+        """Adopt other workers' published state, unless it was read within the refresh interval."""
+        now = time.monotonic()
+        if not force and now - self._refreshed_at < self.refresh_interval_seconds:
+            return
+        self._refreshed_at = now
+        try:
+            entries = await asyncio.gather(*(self.backend.get_json(_state_key(s.kid)) for s in self._states))
+        except Exception as exc:
+            self.counters["sync_failures"] += 1
+            logger.warning("Reading Anthropic rate-limit state failed: %s", exc)
+            return
+        for state, entry in zip(self._states, entries):
+            state.adopt(entry)
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.time()
+        return {
+            **self.counters,
+            "paced_seconds": round(self._paced_seconds, 3),
+            "keys": {
+                s.kid: {
+                    "headroom": round(s.headroom(now), 4),
+                    "in_flight": s.in_flight,
+                    "leases": s.leases,
+                    "rate_limited": s.rate_limited,
+                    "blocked_seconds": round(max(0.0, s.blocked_until - now), 3),
+                }
+                for s in self._states
+            },
+        }
+
+
+_key_pool: Optional[AnthropicKeyPool] = None
+
+
+def get_anthropic_key_pool() -> AnthropicKeyPool:
+    """The pool for the configured keys, rebuilt when the configuration changes."""
+    global _key_pool
+    keys = tuple(anthropic_api_keys())
+    if _key_pool is None or _key_pool.api_keys != keys:
+        _key_pool = AnthropicKeyPool(keys)
+    return _key_pool
+
+
+def _observe_response(request: Any, response: Any) -> None:
+    if _key_pool is not None:
+        _key_pool.observe(request.headers.get("x-api-key"), response.status_code, response.headers)
+
+
+add_response_observer("anthropic", _observe_response)
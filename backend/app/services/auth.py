@@ -1,5 +1,6 @@
 import os
 import json
+import asyncio
 import secrets
 import hashlib
 from urllib.parse import urlencode
@@ -11,6 +12,8 @@ import httpx
 import psycopg
 from psycopg.rows import dict_row
 
+from app.services.database import Database, get_database
+
 
 def hash_password(password: str) -> str:
     return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt()).decode("utf-8")
@@ -88,6 +91,7 @@ class UserService:
         self._ensure_db()
 
     def _ensure_db(self):
+        # One-off schema bootstrap at construction; queries go through the pool.
         with psycopg.connect(self.database_url) as conn:
             with conn.cursor() as cur:
                 cur.execute("""
@@ -109,10 +113,17 @@ class UserService:
                 """)
             conn.commit()
 
-    def _get_conn(self):
-        return psycopg.connect(self.database_url)
+    @property
+    def db(self) -> Database:
+        return get_database(self.database_url)
+
+    async def _fetch_user(self, column: str, value: str) -> Optional[dict]:
+        async with self.db.connection() as conn:
+            async with conn.cursor(row_factory=dict_row) as cur:
+                await cur.execute(f"SELECT * FROM users WHERE {column} = %s", (value,))
+                return await cur.fetchone()
 
-    def create_user(
+    async def create_user(
         self,
         id: str,
         email: str,
@@ -121,68 +132,52 @@ class UserService:
         google_id: Optional[str] = None,
         apple_id: Optional[str] = None,
     ) -> User:
-        password_hash = hash_password(password)
+        # bcrypt is deliberately slow; keep it off the event loop.
+        password_hash = await asyncio.to_thread(hash_password, password)
         now = datetime.now(timezone.utc)
-        with self._get_conn() as conn:
-            with conn.cursor() as cur:
-                cur.execute(
-                    """INSERT INTO users 
-                       (id, email, password_hash, full_name, google_id, apple_id, created_at, updated_at)
-                       VALUES (%s, %s, %s, %s, %s, %s, %s, %s)""",
-                    (id, email, password_hash, full_name, google_id, apple_id, now, now),
-                )
-            conn.commit()
-        return self.get_user_by_id(id)
-
-    def get_user_by_id(self, id: str) -> Optional[User]:
-        with self._get_conn() as conn:
-            with conn.cursor(row_factory=dict_row) as cur:
-                cur.execute("SELECT * FROM users WHERE id = %s", (id,))
-                row = cur.fetchone()
+        async with self.db.connection() as conn:
+            await conn.execute(
+                """INSERT INTO users 
+                   (id, email, password_hash, full_name, google_id, apple_id, created_at, updated_at)
+                   VALUES (%s, %s, %s, %s, %s, %s, %s, %s)""",
+                (id, email, password_hash, full_name, google_id, apple_id, now, now),
+            )
+        return await self.get_user_by_id(id)
+
+    async def get_user_by_id(self, id: str) -> Optional[User]:
+        row = await self._fetch_user("id", id)
         if not row:
             return None
         return self._row_to_user(row)
 
-    def get_user_by_email(self, email: str) -> Optional[User]:
-        with self._get_conn() as conn:
-            with conn.cursor(row_factory=dict_row) as cur:
-                cur.execute("SELECT * FROM users WHERE email = %s", (email,))
-                row = cur.fetchone()
+    async def get_user_by_email(self, email: str) -> Optional[User]:
+        row = await self._fetch_user("email", email)
         if not row:
             return None
         return self._row_to_user(row)
 
-    def get_user_by_google_id(self, google_id: str) -> Optional[User]:
-        with self._get_conn() as conn:
-            with conn.cursor(row_factory=dict_row) as cur:
-                cur.execute("SELECT * FROM users WHERE google_id = %s", (google_id,))
-                row = cur.fetchone()
+    async def get_user_by_google_id(self, google_id: str) -> Optional[User]:
+        row = await self._fetch_user("google_id", google_id)
         if not row:
             return None
         return self._row_to_user(row)
 
-    def get_user_by_apple_id(self, apple_id: str) -> Optional[User]:
-        with self._get_conn() as conn:
-            with conn.cursor(row_factory=dict_row) as cur:
-                cur.execute("SELECT * FROM users WHERE apple_id = %s", (apple_id,))
-                row = cur.fetchone()
+    async def get_user_by_apple_id(self, apple_id: str) -> Optional[User]:
+        row = await self._fetch_user("apple_id", apple_id)
         if not row:
             return None
         return self._row_to_user(row)
 
-    def verify_user_password(self, email: str, password: str) -> Optional[User]:
-        with self._get_conn() as conn:
-            with conn.cursor(row_factory=dict_row) as cur:
-                cur.execute("SELECT * FROM users WHERE email = %s", (email,))
-                row = cur.fetchone()
+    async def verify_user_password(self, email: str, password: str) -> Optional[User]:
+        row = await self._fetch_user("email", email)
         if not row:
             return None
         password_hash = row["password_hash"]
-        if verify_password(password, password_hash):
+        if await asyncio.to_thread(verify_password, password, password_hash):
             return self._row_to_user(row)
         return None
 
-    def update_user(self, id: str, **kwargs) -> Optional[User]:
+    async def update_user(self, id: str, **kwargs) -> Optional[User]:
         updates = []
         values = []
         for key, value in kwargs.items():
@@ -191,18 +186,16 @@ class UserService:
                 updates.append(f"{key} = %s")
                 values.append(value)
         if not updates:
-            return self.get_user_by_id(id)
+            return await self.get_user_by_id(id)
         updates.append("updated_at = %s")
         values.append(datetime.now(timezone.utc))
         values.append(id)
-        with self._get_conn() as conn:
-            with conn.cursor() as cur:
-                cur.execute(
-                    f"UPDATE users SET {', '.join(updates)} WHERE id = %s",
-                    values,
-                )
-            conn.commit()
-        return self.get_user_by_id(id)
+        async with self.db.connection() as conn:
+            await conn.execute(
+                f"UPDATE users SET {', '.join(updates)} WHERE id = %s",
+                values,
+            )
+        return await self.get_user_by_id(id)
 
     def _row_to_user(self, row: dict) -> User:
         return User(
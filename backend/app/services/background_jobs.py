@@ -0,0 +1,189 @@
+"""
+Bounded pool for fire-and-forget work (Haiku classification, history
+summaries).
+
+Jobs are queued under a key; a job submitted while another with the same
+key is still waiting replaces it, so a burst of turns from one user is
+classified once, on the latest turn. At most ``BACKGROUND_QUEUE_MAX`` jobs
+wait (the oldest is dropped to make room) and ``BACKGROUND_CONCURRENCY``
+run at a time. The pool is started and drained by the app lifespan; on
+shutdown waiting jobs get ``BACKGROUND_DRAIN_SECONDS`` to finish before
+they are dropped.
+
+Outside the lifespan (scripts, tests) jobs run as plain tasks, still
+tracked so they are neither garbage-collected nor unaccounted for.
+"""
+
+import asyncio
+import itertools
+import logging
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+JobFactory = Callable[[], Awaitable[Any]]
+
+
+@dataclass
+class _Job:
+    factory: JobFactory
+    enqueued_at: float
+
+
+class BackgroundJobQueue:
+    def __init__(
+        self,
+        max_queue: Optional[int] = None,
+        concurrency: Optional[int] = None,
+        drain_seconds: Optional[float] = None,
+    ) -> None:
+        self.max_queue = max(1, max_queue if max_queue is not None else int(os.getenv("BACKGROUND_QUEUE_MAX", "1000")))
+        self.concurrency = max(1, concurrency if concurrency is not None else int(os.getenv("BACKGROUND_CONCURRENCY", "4")))
+        self.drain_seconds = drain_seconds if drain_seconds is not None else float(os.getenv("BACKGROUND_DRAIN_SECONDS", "10"))
+        self._pending: "OrderedDict[str, _Job]" = OrderedDict()
+        self._workers: List[asyncio.Task] = []
+        self._unmanaged: Set[asyncio.Task] = set()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._stopping = False
+        self._running = 0
+        self._anonymous = itertools.count()
+        self.counters = {
+            "submitted": 0, "coalesced": 0, "dropped": 0, "completed": 0, "failed": 0, "unmanaged": 0,
+        }
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._max_depth = 0
+
+    @property
+    def started(self) -> bool:
+        return bool(self._workers) and not self._stopping
+
+    def submit(self, factory: JobFactory, key: Optional[str] = None) -> None:
+        """
+        Queue ``factory()`` to run in the background. A job still waiting
+        under the same ``key`` is replaced. Must be called from the event loop.
+        """
+        self.counters["submitted"] += 1
+        if not self.started:
+            self.counters["unmanaged"] += 1
+            task = asyncio.ensure_future(self._run(factory, time.monotonic()))
+            self._unmanaged.add(task)
+            task.add_done_callback(self._unmanaged.discard)
+            return
+
+        if key is None:
+            key = f"_job:{next(self._anonymous)}"
+        job = _Job(factory, time.monotonic())
+        if key in self._pending:
+            # Keep the original enqueue time and queue position: the job has
+            # been waiting that long, only its payload is newer.
+            job.enqueued_at = self._pending[key].enqueued_at
+            self._pending[key] = job
+            self.counters["coalesced"] += 1
+            return
+        if len(self._pending) >= self.max_queue:
+            dropped, _ = self._pending.popitem(last=False)
+            self.counters["dropped"] += 1
+            logger.warning("Background queue full; dropped job %s", dropped)
+        self._pending[key] = job
+        self._max_depth = max(self._max_depth, len(self._pending))
+        self._wakeup.set()
+
+    async def _run(self, factory: JobFactory, enqueued_at: float) -> None:
+        wait = time.monotonic() - enqueued_at
+        self._wait_total += wait
+        self._wait_max = max(self._wait_max, wait)
+        self._running += 1
+        try:
+            await factory()
+            self.counters["completed"] += 1
+        except Exception as exc:
+            self.counters["failed"] += 1
+            logger.warning("Background job failed (non-fatal): %s", exc)
+        finally:
+            self._running -= 1
+
+    async def _worker(self) -> None:
+        while True:
+            while not self._pending:
+                if self._stopping:
+                    return
+                self._wakeup.clear()
+                await self._wakeup.wait()
+            _, job = self._pending.popitem(last=False)
+            await self._run(job.factory, job.enqueued_at)
+
+    def start(self) -> None:
+        if self.started:
+            return
+        self._stopping = False
+        self._wakeup = asyncio.Event()
+        self._workers = [
+            asyncio.create_task(self._worker(), name=f"background-job-{n}") for n in range(self.concurrency)
+        ]
+
+    async def stop(self) -> None:
+        """Let workers finish the queue, up to ``drain_seconds``, then drop the rest."""
+        workers, self._workers = self._workers, []
+        self._stopping = True
+        if self._wakeup is not None:
+            self._wakeup.set()
+        tasks = workers + list(self._unmanaged)
+        if not tasks:
+            return
+        _, still_running = await asyncio.wait(tasks, timeout=self.drain_seconds)
+        if still_running or self._pending:
+            logger.warning(
+                "Background queue drain timed out: %d running, %d waiting dropped",
+                len(still_running), len(self._pending),
+            )
+            self.counters["dropped"] += len(self._pending) + len(still_running)
+            self._pending.clear()
+            for task in still_running:
+                task.cancel()
+            await asyncio.gather(*still_running, return_exceptions=True)
+
+    async def join(self) -> None:
+        """Wait until nothing is waiting or running."""
+        while self._pending or self._running or self._unmanaged:
+            if self._unmanaged:
+                await asyncio.gather(*list(self._unmanaged), return_exceptions=True)
+            else:
+                await asyncio.sleep(0.01)
+
+    def stats(self) -> Dict[str, Any]:
+        started = self.counters["completed"] + self.counters["failed"]
+        return {
+            "started": self.started,
+            "depth": len(self._pending),
+            "max_depth": self._max_depth,
+            "running": self._running,
+            "max_queue": self.max_queue,
+            "concurrency": self.concurrency,
+            "wait_avg_ms": round(self._wait_total / started * 1000, 2) if started else 0.0,
+            "wait_max_ms": round(self._wait_max * 1000, 2),
+            **self.counters,
+        }
+
+
+_background_jobs: Optional[BackgroundJobQueue] = None
+
+
+def get_background_jobs() -> BackgroundJobQueue:
+    global _background_jobs
+    if _background_jobs is None:
+        _background_jobs = BackgroundJobQueue()
+    return _background_jobs
+
+
+async def startup_background_jobs() -> None:
+    get_background_jobs().start()
+
+
+async def shutdown_background_jobs() -> None:
+    if _background_jobs is not None:
+        await _background_jobs.stop()
@@ -1,10 +1,14 @@
 import asyncio
+import heapq
 import json
 import logging
 import os
 import threading
 import time
-from typing import Any, Dict, Optional
+import zlib
+from collections import OrderedDict, deque
+from itertools import islice
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Set, Tuple
 
 logger = logging.getLogger(__name__)
 
@@ -16,6 +20,54 @@ def _env_bool(name: str, default: bool) -> bool:
     return raw.strip().lower() in {"1", "true", "yes", "on"}
 
 
+# wait_for re-reads the key at least this often, so a lost notification
+# costs at most this much latency rather than the whole wait.
+WAIT_RECHECK_SECONDS = float(os.getenv("CACHE_WAIT_RECHECK_SECONDS", "2.0"))
+
+# Entries kept per stream log; older ones are trimmed as new ones arrive.
+STREAM_MAX_ENTRIES = int(os.getenv("CACHE_STREAM_MAX_ENTRIES", "4096"))
+
+
+class _KeyWaiters:
+    """Per-key asyncio.Events, woken from whichever loop or thread stores the key."""
+
+    def __init__(self) -> None:
+        self._waiters: Dict[str, Set[Tuple[asyncio.AbstractEventLoop, asyncio.Event]]] = {}
+        self._mutex = threading.Lock()
+
+    def add(self, key: str) -> Tuple[asyncio.AbstractEventLoop, asyncio.Event]:
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        with self._mutex:
+            self._waiters.setdefault(key, set()).add(waiter)
+        return waiter
+
+    def remove(self, key: str, waiter: Tuple[asyncio.AbstractEventLoop, asyncio.Event]) -> None:
+        with self._mutex:
+            waiters = self._waiters.get(key)
+            if waiters is not None:
+                waiters.discard(waiter)
+                if not waiters:
+                    self._waiters.pop(key, None)
+
+    def notify(self, key: str) -> None:
+        with self._mutex:
+            waiters = list(self._waiters.get(key, ()))
+        for loop, event in waiters:
+            if loop.is_closed():
+                continue
+            loop.call_soon_threadsafe(event.set)
+
+    def __len__(self) -> int:
+        with self._mutex:
+            return sum(len(w) for w in self._waiters.values())
+
+
+def _encode(value: Dict[str, Any]) -> bytes:
+    # Same rendering as Starlette's JSONResponse, so stored bytes can be
+    # served as a response body unchanged.
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
 class CacheBackend:
     async def get_json(self, key: str) -> Optional[Dict[str, Any]]:
         raise NotImplementedError
@@ -23,12 +75,104 @@ class CacheBackend:
     async def set_json(self, key: str, value: Dict[str, Any], ttl_seconds: int) -> bool:
         raise NotImplementedError
 
+    async def get_raw(self, key: str) -> Optional[bytes]:
+        """The stored JSON document as bytes, without decoding it."""
+        value = await self.get_json(key)
+        return _encode(value) if value is not None else None
+
+    async def set_raw(self, key: str, payload: bytes, ttl_seconds: int) -> bool:
+        """Store an already-encoded JSON object; ``get_json`` decodes it like any other value."""
+        return await self.set_json(key, json.loads(payload), ttl_seconds)
+
     async def acquire_lock(self, key: str, owner: str, ttl_seconds: int) -> bool:
         raise NotImplementedError
 
     async def release_lock(self, key: str, owner: str) -> None:
         raise NotImplementedError
 
+    async def get_or_acquire(self, key: str, lock_key: str, owner: str, ttl_seconds: int) -> Tuple[Optional[bytes], bool]:
+        """
+        ``(value, False)`` if ``key`` holds a value, otherwise ``(None, acquired)``
+        after trying to take ``lock_key`` for ``owner``.
+        """
+        payload = await self.get_raw(key)
+        if payload is not None:
+            return payload, False
+        return None, await self.acquire_lock(lock_key, owner, ttl_seconds)
+
+    async def incr(self, key: str) -> int:
+        """Atomically increment a shared counter (no expiry) and return its new value."""
+        raise NotImplementedError
+
+    async def get_counter(self, key: str) -> int:
+        raise NotImplementedError
+
+    async def publish(self, channel: str, message: Dict[str, Any]) -> None:
+        """Broadcast to every ``subscribe(channel)`` iterator, across workers where the backend is shared."""
+        raise NotImplementedError
+
+    def subscribe(self, channel: str) -> AsyncIterator[Dict[str, Any]]:
+        raise NotImplementedError
+
+    async def wait_for(self, key: str, timeout: float) -> Optional[Dict[str, Any]]:
+        """
+        Return the value at ``key`` as soon as it is stored (immediately if it
+        already is), or None after ``timeout`` seconds.
+        """
+        raise NotImplementedError
+
+    async def append_stream(
+        self, key: str, entry: str, ttl_seconds: int, max_entries: Optional[int] = None
+    ) -> str:
+        """
+        Append ``entry`` to the stream log at ``key`` and return its id. The
+        log expires ``ttl_seconds`` after the last append and keeps about
+        ``max_entries`` entries (``CACHE_STREAM_MAX_ENTRIES`` by default).
+        """
+        raise NotImplementedError
+
+    async def read_stream(self, key: str, after: str, timeout: float) -> List[Tuple[str, str]]:
+        """
+        ``(id, entry)`` pairs appended after the id ``after`` ("0" for the
+        start), waiting up to ``timeout`` seconds for the first one.
+        """
+        raise NotImplementedError
+
+    def add_key_listener(self, callback: Callable[[Optional[str]], None]) -> bool:
+        """
+        Call ``callback(key)`` whenever a value is stored, by any worker
+        sharing the backend, and ``callback(None)`` when notifications may
+        have been missed. Returns False if the backend cannot notify.
+        """
+        return False
+
+    def key_listener_active(self) -> bool:
+        """Whether key notifications are currently being delivered."""
+        return False
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": type(self).__name__}
+
+    async def _wait_notified(self, waiters: _KeyWaiters, key: str, timeout: float) -> Optional[Dict[str, Any]]:
+        deadline = time.monotonic() + max(0.0, timeout)
+        waiter = waiters.add(key)
+        _, event = waiter
+        try:
+            while True:
+                # Registered before reading, so a store between the read and
+                # the wait still sets the event.
+                event.clear()
+                value = await self.get_json(key)
+                remaining = deadline - time.monotonic()
+                if value is not None or remaining <= 0:
+                    return value
+                try:
+                    await asyncio.wait_for(event.wait(), timeout=min(remaining, WAIT_RECHECK_SECONDS))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            waiters.remove(key, waiter)
+
 
 class NoopCache(CacheBackend):
     async def get_json(self, key: str) -> Optional[Dict[str, Any]]:
@@ -37,97 +181,851 @@ class NoopCache(CacheBackend):
     async def set_json(self, key: str, value: Dict[str, Any], ttl_seconds: int) -> bool:
         return False
 
+    async def get_raw(self, key: str) -> Optional[bytes]:
+        return None
+
+    async def set_raw(self, key: str, payload: bytes, ttl_seconds: int) -> bool:
+        return False
+
     async def acquire_lock(self, key: str, owner: str, ttl_seconds: int) -> bool:
         return True
 
     async def release_lock(self, key: str, owner: str) -> None:
         return None
 
+    async def incr(self, key: str) -> int:
+        return 0
+
+    async def get_counter(self, key: str) -> int:
+        return 0
+
+    async def publish(self, channel: str, message: Dict[str, Any]) -> None:
+        return None
+
+    async def subscribe(self, channel: str) -> AsyncIterator[Dict[str, Any]]:
+        return
+        yield
+
+    async def wait_for(self, key: str, timeout: float) -> Optional[Dict[str, Any]]:
+        return None
+
+    async def append_stream(
+        self, key: str, entry: str, ttl_seconds: int, max_entries: Optional[int] = None
+    ) -> str:
+        return "0"
+
+    async def read_stream(self, key: str, after: str, timeout: float) -> List[Tuple[str, str]]:
+        return []
+
+
+class _Shard:
+    """One slice of InMemoryCache: its own mutex, LRU order and expiry heap."""
+
+    __slots__ = ("mutex", "values", "locks", "heap", "bytes", "counters")
 
-class InMemoryCache(CacheBackend):
     def __init__(self) -> None:
-        self._values: Dict[str, tuple[float, Dict[str, Any]]] = {}
-        self._locks: Dict[str, tuple[float, str]] = {}
+        self.mutex = threading.Lock()
+        # key -> (expires_at, payload); insertion order is LRU order.
+        self.values: "OrderedDict[str, Tuple[float, bytes]]" = OrderedDict()
+        self.locks: Dict[str, Tuple[float, str]] = {}
+        # (expires_at, key) for values and locks. Entries superseded by a
+        # newer expiry, an eviction or a release stay until popped and are
+        # skipped then.
+        self.heap: List[Tuple[float, str]] = []
+        self.bytes = 0
+        self.counters = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0}
+
+
+class _StreamLog:
+    """In-memory stream log: a ring of (sequence, entry) pairs."""
+
+    __slots__ = ("expires_at", "last_seq", "entries")
+
+    def __init__(self, max_entries: int) -> None:
+        self.expires_at = 0.0
+        self.last_seq = 0
+        self.entries: "deque[Tuple[int, str]]" = deque(maxlen=max(1, max_entries))
+
+
+class InMemoryCache(CacheBackend):
+    """
+    Single-process backend. Keys are spread over ``shards`` independently
+    locked shards; each keeps a min-heap of expiry times, so expiring
+    entries costs O(log n) per entry instead of a scan per operation.
+    Values are also expired lazily when read. ``max_entries`` and
+    ``max_bytes`` (split evenly across shards) bound memory by evicting the
+    least recently used values; locks and counters are never evicted.
+    """
+
+    def __init__(
+        self,
+        max_entries: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+        shards: Optional[int] = None,
+    ) -> None:
+        shard_count = max(1, shards if shards is not None else int(os.getenv("INMEMORY_CACHE_SHARDS", "16")))
+        self.max_entries = max_entries if max_entries is not None else int(os.getenv("INMEMORY_CACHE_MAX_ENTRIES", "100000"))
+        self.max_bytes = max_bytes if max_bytes is not None else int(os.getenv("INMEMORY_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+        self._shards = [_Shard() for _ in range(shard_count)]
+        self._shard_max_entries = max(1, self.max_entries // shard_count) if self.max_entries > 0 else 0
+        self._shard_max_bytes = max(1, self.max_bytes // shard_count) if self.max_bytes > 0 else 0
+        self._counters: Dict[str, int] = {}
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = {}
+        self._waiters = _KeyWaiters()
+        self._key_listeners: List[Callable[[Optional[str]], None]] = []
+        self._streams: Dict[str, _StreamLog] = {}
+        self._stream_waiters = _KeyWaiters()
+        self._next_stream_sweep = 0.0
         self._mutex = threading.Lock()
 
-    def _cleanup_locked(self) -> None:
-        now = time.monotonic()
-        stale_values = [k for k, (exp, _) in self._values.items() if exp <= now]
-        for key in stale_values:
-            self._values.pop(key, None)
+    def _shard(self, key: str) -> _Shard:
+        return self._shards[hash(key) % len(self._shards)]
 
-        stale_locks = [k for k, (exp, _) in self._locks.items() if exp <= now]
-        for key in stale_locks:
-            self._locks.pop(key, None)
+    def _expire_locked(self, shard: _Shard, now: float) -> None:
+        heap = shard.heap
+        while heap and heap[0][0] <= now:
+            expires_at, key = heapq.heappop(heap)
+            entry = shard.values.get(key)
+            if entry is not None and entry[0] == expires_at:
+                del shard.values[key]
+                shard.bytes -= len(entry[1])
+                shard.counters["expirations"] += 1
+            lock = shard.locks.get(key)
+            if lock is not None and lock[0] == expires_at:
+                del shard.locks[key]
+        # Superseded entries never reach the top while their key is live;
+        # rebuild once they dominate the heap.
+        if len(heap) > 64 and len(heap) > 2 * (len(shard.values) + len(shard.locks)):
+            heap[:] = [(exp, k) for k, (exp, _) in shard.values.items()]
+            heap.extend((exp, k) for k, (exp, _) in shard.locks.items())
+            heapq.heapify(heap)
 
-    async def get_json(self, key: str) -> Optional[Dict[str, Any]]:
-        with self._mutex:
-            self._cleanup_locked()
-            entry = self._values.get(key)
-            if not entry:
+    def _evict_locked(self, shard: _Shard) -> None:
+        values = shard.values
+        while values and (
+            (self._shard_max_entries and len(values) > self._shard_max_entries)
+            or (self._shard_max_bytes and shard.bytes > self._shard_max_bytes)
+        ):
+            _, (_, payload) = values.popitem(last=False)
+            shard.bytes -= len(payload)
+            shard.counters["evictions"] += 1
+
+    async def get_raw(self, key: str) -> Optional[bytes]:
+        # The stored bytes themselves: immutable, so no copy is needed.
+        shard = self._shard(key)
+        now = time.monotonic()
+        with shard.mutex:
+            self._expire_locked(shard, now)
+            entry = shard.values.get(key)
+            if entry is None:
+                shard.counters["misses"] += 1
                 return None
-            _, value = entry
-            return json.loads(json.dumps(value, ensure_ascii=False))
+            shard.values.move_to_end(key)
+            shard.counters["hits"] += 1
+            return entry[1]
+
+    async def get_json(self, key: str) -> Optional[Dict[str, Any]]:
+        payload = await self.get_raw(key)
+        # Decoded outside the shard lock; every caller gets its own dict.
+        return json.loads(payload) if payload is not None else None
 
     async def set_json(self, key: str, value: Dict[str, Any], ttl_seconds: int) -> bool:
+        return await self.set_raw(key, _encode(value), ttl_seconds)
+
+    async def set_raw(self, key: str, payload: bytes, ttl_seconds: int) -> bool:
         ttl = max(1, int(ttl_seconds))
-        with self._mutex:
-            self._cleanup_locked()
-            self._values[key] = (time.monotonic() + ttl, json.loads(json.dumps(value, ensure_ascii=False)))
+        payload = bytes(payload)
+        shard = self._shard(key)
+        now = time.monotonic()
+        expires_at = now + ttl
+        with shard.mutex:
+            self._expire_locked(shard, now)
+            previous = shard.values.pop(key, None)
+            if previous is not None:
+                shard.bytes -= len(previous[1])
+            shard.values[key] = (expires_at, payload)
+            shard.bytes += len(payload)
+            heapq.heappush(shard.heap, (expires_at, key))
+            self._evict_locked(shard)
+        self._waiters.notify(key)
+        for callback in self._key_listeners:
+            callback(key)
+        return True
+
+    def add_key_listener(self, callback: Callable[[Optional[str]], None]) -> bool:
+        self._key_listeners.append(callback)
+        return True
+
+    def key_listener_active(self) -> bool:
+        return True
+
+    def delete(self, key: str) -> bool:
+        """Drop a stored value; returns whether there was one."""
+        shard = self._shard(key)
+        with shard.mutex:
+            entry = shard.values.pop(key, None)
+            if entry is None:
+                return False
+            shard.bytes -= len(entry[1])
             return True
 
+    def clear(self) -> None:
+        """Drop every stored value; locks and counters are kept."""
+        for shard in self._shards:
+            with shard.mutex:
+                shard.values.clear()
+                shard.bytes = 0
+
+    async def wait_for(self, key: str, timeout: float) -> Optional[Dict[str, Any]]:
+        return await self._wait_notified(self._waiters, key, timeout)
+
     async def acquire_lock(self, key: str, owner: str, ttl_seconds: int) -> bool:
         ttl = max(1, int(ttl_seconds))
-        with self._mutex:
-            self._cleanup_locked()
-            if key in self._locks:
+        shard = self._shard(key)
+        now = time.monotonic()
+        with shard.mutex:
+            self._expire_locked(shard, now)
+            existing = shard.locks.get(key)
+            if existing is not None and existing[0] > now:
                 return False
-            self._locks[key] = (time.monotonic() + ttl, owner)
+            shard.locks[key] = (now + ttl, owner)
+            heapq.heappush(shard.heap, (now + ttl, key))
             return True
 
     async def release_lock(self, key: str, owner: str) -> None:
+        shard = self._shard(key)
+        with shard.mutex:
+            existing = shard.locks.get(key)
+            if existing is not None and existing[1] == owner:
+                del shard.locks[key]
+
+    def stats(self) -> Dict[str, Any]:
+        entries = total_bytes = locks = 0
+        counters = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0}
+        for shard in self._shards:
+            with shard.mutex:
+                entries += len(shard.values)
+                total_bytes += shard.bytes
+                locks += len(shard.locks)
+                for name, value in shard.counters.items():
+                    counters[name] += value
+        return {
+            "backend": "memory",
+            "entries": entries,
+            "bytes": total_bytes,
+            "locks": locks,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "shards": len(self._shards),
+            **counters,
+        }
+
+    async def append_stream(
+        self, key: str, entry: str, ttl_seconds: int, max_entries: Optional[int] = None
+    ) -> str:
+        now = time.monotonic()
         with self._mutex:
-            self._cleanup_locked()
-            existing = self._locks.get(key)
-            if not existing:
-                return
-            _, current_owner = existing
-            if current_owner == owner:
-                self._locks.pop(key, None)
+            if now >= self._next_stream_sweep:
+                for stale in [k for k, log in self._streams.items() if log.expires_at <= now]:
+                    del self._streams[stale]
+                self._next_stream_sweep = now + 1.0
+            log = self._streams.get(key)
+            if log is None:
+                log = self._streams[key] = _StreamLog(max_entries or STREAM_MAX_ENTRIES)
+            log.last_seq += 1
+            log.entries.append((log.last_seq, entry))
+            log.expires_at = now + max(1, int(ttl_seconds))
+            seq = log.last_seq
+        self._stream_waiters.notify(key)
+        return str(seq)
+
+    def _read_stream_now(self, key: str, after: int) -> List[Tuple[str, str]]:
+        with self._mutex:
+            log = self._streams.get(key)
+            if log is None:
+                return []
+            if log.expires_at <= time.monotonic():
+                del self._streams[key]
+                return []
+            if not log.entries or after >= log.last_seq:
+                return []
+            # Sequences are contiguous, so the first unread entry is found
+            # by offset; entries trimmed from the ring are skipped.
+            start = max(0, after - log.entries[0][0] + 1)
+            return [(str(seq), entry) for seq, entry in islice(log.entries, start, None)]
+
+    async def read_stream(self, key: str, after: str, timeout: float) -> List[Tuple[str, str]]:
+        position = int(after or 0)
+        deadline = time.monotonic() + max(0.0, timeout)
+        waiter = self._stream_waiters.add(key)
+        _, event = waiter
+        try:
+            while True:
+                event.clear()
+                entries = self._read_stream_now(key, position)
+                remaining = deadline - time.monotonic()
+                if entries or remaining <= 0:
+                    return entries
+                try:
+                    await asyncio.wait_for(event.wait(), timeout=min(remaining, WAIT_RECHECK_SECONDS))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self._stream_waiters.remove(key, waiter)
+
+    async def incr(self, key: str) -> int:
+        with self._mutex:
+            value = self._counters.get(key, 0) + 1
+            self._counters[key] = value
+            return value
+
+    async def get_counter(self, key: str) -> int:
+        with self._mutex:
+            return self._counters.get(key, 0)
+
+    async def publish(self, channel: str, message: Dict[str, Any]) -> None:
+        payload = json.dumps(message, ensure_ascii=False)
+        with self._mutex:
+            queues = list(self._subscribers.get(channel, ()))
+        for queue in queues:
+            queue.put_nowait(json.loads(payload))
+
+    async def subscribe(self, channel: str) -> AsyncIterator[Dict[str, Any]]:
+        queue: asyncio.Queue = asyncio.Queue()
+        with self._mutex:
+            self._subscribers.setdefault(channel, set()).add(queue)
+        try:
+            while True:
+                yield await queue.get()
+        finally:
+            with self._mutex:
+                subscribers = self._subscribers.get(channel)
+                if subscribers is not None:
+                    subscribers.discard(queue)
+                    if not subscribers:
+                        self._subscribers.pop(channel, None)
+
+
+class CacheCodec:
+    """
+    Storage encoding for values in a shared backend. Encoded values start
+    with a 4-byte header: ``0xFF``, the codec version, the serializer id
+    and the compression id. JSON text never starts with ``0xFF``, so
+    values written before the codec existed are read as plain JSON.
+
+    ``serializer`` is ``json`` or ``msgpack``; ``compression`` is ``zstd``,
+    ``zlib`` or ``none``. Values of at least ``min_compress_bytes`` are
+    compressed when that makes them smaller. msgpack and zstd need the
+    optional ``msgpack`` / ``zstandard`` packages and fall back to JSON /
+    zlib without them.
+    """
+
+    MAGIC = 0xFF
+    VERSION = 1
+    SERIALIZERS = {"json": 0, "msgpack": 1}
+    COMPRESSIONS = {"none": 0, "zlib": 1, "zstd": 2}
+
+    def __init__(
+        self,
+        serializer: Optional[str] = None,
+        compression: Optional[str] = None,
+        min_compress_bytes: Optional[int] = None,
+    ) -> None:
+        serializer = (serializer or os.getenv("CACHE_CODEC", "json")).strip().lower()
+        compression = (compression or os.getenv("CACHE_COMPRESSION", "zstd")).strip().lower()
+        self.min_compress_bytes = (
+            min_compress_bytes if min_compress_bytes is not None else int(os.getenv("CACHE_COMPRESS_MIN_BYTES", "1024"))
+        )
+        self._msgpack = self._zstd_compressor = self._zstd_decompressor = None
+        try:
+            import msgpack
+
+            self._msgpack = msgpack
+        except ImportError:
+            pass
+        try:
+            import zstandard
+
+            self._zstd_compressor = zstandard.ZstdCompressor(level=3)
+            self._zstd_decompressor = zstandard.ZstdDecompressor()
+        except ImportError:
+            pass
+
+        if serializer not in self.SERIALIZERS:
+            raise ValueError(f"Unknown cache codec: {serializer}")
+        if serializer == "msgpack" and self._msgpack is None:
+            logger.warning("msgpack is not installed, cache values stay JSON")
+            serializer = "json"
+        if compression not in self.COMPRESSIONS:
+            raise ValueError(f"Unknown cache compression: {compression}")
+        if compression == "zstd" and self._zstd_compressor is None:
+            compression = "zlib"
+        self.serializer = serializer
+        self.compression = compression
+        self._mutex = threading.Lock()
+        self._counters = {"encoded": 0, "compressed": 0, "raw_bytes": 0, "stored_bytes": 0, "legacy_reads": 0}
+
+    def encode(self, payload: bytes) -> bytes:
+        """Encode a JSON document (as UTF-8 bytes) for storage."""
+        if self.serializer == "msgpack":
+            return self._frame(self._msgpack.packb(json.loads(payload)), len(payload))
+        return self._frame(payload, len(payload))
+
+    def encode_value(self, value: Dict[str, Any]) -> bytes:
+        if self.serializer == "msgpack":
+            body = self._msgpack.packb(value)
+            return self._frame(body, len(body))
+        payload = _encode(value)
+        return self._frame(payload, len(payload))
+
+    def decode(self, stored: bytes) -> bytes:
+        """The stored value as JSON bytes."""
+        serializer, body = self._unframe(stored)
+        if serializer == self.SERIALIZERS["msgpack"]:
+            return _encode(self._msgpack.unpackb(body))
+        return body
+
+    def decode_value(self, stored: bytes) -> Any:
+        serializer, body = self._unframe(stored)
+        if serializer == self.SERIALIZERS["msgpack"]:
+            return self._msgpack.unpackb(body)
+        return json.loads(body)
+
+    def _frame(self, body: bytes, raw_size: int) -> bytes:
+        compression = 0
+        if self.compression != "none" and len(body) >= self.min_compress_bytes:
+            if self.compression == "zstd":
+                packed = self._zstd_compressor.compress(body)
+            else:
+                packed = zlib.compress(body)
+            if len(packed) < len(body):
+                body, compression = packed, self.COMPRESSIONS[self.compression]
+        stored = bytes((self.MAGIC, self.VERSION, self.SERIALIZERS[self.serializer], compression)) + body
+        with self._mutex:
+            self._counters["encoded"] += 1
+            self._counters["compressed"] += bool(compression)
+            self._counters["raw_bytes"] += raw_size
+            self._counters["stored_bytes"] += len(stored)
+        return stored
+
+    def _unframe(self, stored: bytes) -> Tuple[int, bytes]:
+        if not stored or stored[0] != self.MAGIC:
+            with self._mutex:
+                self._counters["legacy_reads"] += 1
+            return self.SERIALIZERS["json"], stored
+        if len(stored) < 4 or stored[1] != self.VERSION:
+            raise ValueError("Unsupported cache value encoding")
+        serializer, compression, body = stored[2], stored[3], stored[4:]
+        if compression == self.COMPRESSIONS["zlib"]:
+            body = zlib.decompress(body)
+        elif compression == self.COMPRESSIONS["zstd"]:
+            if self._zstd_decompressor is None:
+                raise ValueError("zstandard is required to read this cache value")
+            body = self._zstd_decompressor.decompress(body)
+        elif compression:
+            raise ValueError("Unsupported cache value compression")
+        if serializer == self.SERIALIZERS["msgpack"] and self._msgpack is None:
+            raise ValueError("msgpack is required to read this cache value")
+        return serializer, body
+
+    def stats(self) -> Dict[str, Any]:
+        with self._mutex:
+            counters = dict(self._counters)
+        return {
+            "serializer": self.serializer,
+            "compression": self.compression,
+            "min_compress_bytes": self.min_compress_bytes,
+            **counters,
+            "compression_ratio": round(counters["raw_bytes"] / counters["stored_bytes"], 4) if counters["stored_bytes"] else 0.0,
+        }
 
 
 class RedisCache(CacheBackend):
-    def __init__(self, redis_url: str) -> None:
+    # set_json publishes the key here; one subscriber per process wakes
+    # the local wait_for callers.
+    KEY_SET_CHANNEL = "cache:key-set"
+
+    # Delete the lock only while ``owner`` still holds it.
+    RELEASE_LOCK_SCRIPT = """
+    if redis.call('GET', KEYS[1]) == ARGV[1] then
+        return redis.call('DEL', KEYS[1])
+    end
+    return 0
+    """
+
+    # {1, value} if the key is set, else {0, 1|0} for whether the lock was taken.
+    GET_OR_ACQUIRE_SCRIPT = """
+    local value = redis.call('GET', KEYS[1])
+    if value then
+        return {1, value}
+    end
+    if redis.call('SET', KEYS[2], ARGV[1], 'NX', 'EX', ARGV[2]) then
+        return {0, 1}
+    end
+    return {0, 0}
+    """
+
+    def __init__(self, redis_url: str, codec: Optional[CacheCodec] = None) -> None:
         try:
             from redis.asyncio import Redis
         except Exception as exc:  # pragma: no cover - handled by factory fallback
             raise RuntimeError("redis package is not available") from exc
 
-        self._client = Redis.from_url(redis_url, encoding="utf-8", decode_responses=True)
+        # Values are binary (see CacheCodec); strings are decoded where needed.
+        self._client = Redis.from_url(redis_url)
+        self.codec = codec or CacheCodec()
+        # Script objects run via EVALSHA and load the script on NOSCRIPT.
+        self._release_lock = self._client.register_script(self.RELEASE_LOCK_SCRIPT)
+        self._get_or_acquire = self._client.register_script(self.GET_OR_ACQUIRE_SCRIPT)
+        self._waiters = _KeyWaiters()
+        self._key_listeners: List[Callable[[Optional[str]], None]] = []
+        self._listener: Optional[asyncio.Task] = None
+        self._listening = asyncio.Event()
 
     async def get_json(self, key: str) -> Optional[Dict[str, Any]]:
         raw = await self._client.get(key)
         if not raw:
             return None
         try:
-            parsed = json.loads(raw)
+            parsed = self.codec.decode_value(raw)
             return parsed if isinstance(parsed, dict) else None
         except Exception:
             return None
 
+    async def get_raw(self, key: str) -> Optional[bytes]:
+        raw = await self._client.get(key)
+        return self._decode_raw(raw) if raw else None
+
+    def _decode_raw(self, raw: bytes) -> Optional[bytes]:
+        try:
+            return self.codec.decode(raw)
+        except Exception as exc:
+            logger.warning("Unreadable cache value: %s", exc)
+            return None
+
     async def set_json(self, key: str, value: Dict[str, Any], ttl_seconds: int) -> bool:
+        return await self._store(key, self.codec.encode_value(value), ttl_seconds)
+
+    async def set_raw(self, key: str, payload: bytes, ttl_seconds: int) -> bool:
+        return await self._store(key, self.codec.encode(payload), ttl_seconds)
+
+    async def _store(self, key: str, stored_value: bytes, ttl_seconds: int) -> bool:
         ttl = max(1, int(ttl_seconds))
-        payload = json.dumps(value, ensure_ascii=False)
-        return bool(await self._client.set(key, payload, ex=ttl))
+        stored = bool(await self._client.set(key, stored_value, ex=ttl))
+        if stored:
+            try:
+                await self._client.publish(self.KEY_SET_CHANNEL, key)
+            except Exception as exc:
+                logger.warning("Cache key notification failed: %s", exc)
+        return stored
+
+    async def _listen_key_sets(self) -> None:
+        while True:
+            pubsub = self._client.pubsub(ignore_subscribe_messages=True)
+            try:
+                await pubsub.subscribe(self.KEY_SET_CHANNEL)
+                self._listening.set()
+                async for message in pubsub.listen():
+                    if message.get("type") == "message":
+                        key = message["data"].decode("utf-8")
+                        self._waiters.notify(key)
+                        for callback in self._key_listeners:
+                            callback(key)
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                logger.warning("Cache key notification listener failed: %s", exc)
+            finally:
+                self._listening.clear()
+                for callback in self._key_listeners:
+                    callback(None)
+                try:
+                    await pubsub.aclose()
+                except Exception:
+                    pass
+            await asyncio.sleep(1.0)
+
+    def _ensure_listener(self) -> None:
+        if self._listener is None or self._listener.done():
+            self._listener = asyncio.create_task(self._listen_key_sets(), name="cache-key-set-listener")
+
+    def add_key_listener(self, callback: Callable[[Optional[str]], None]) -> bool:
+        self._key_listeners.append(callback)
+        return True
+
+    def key_listener_active(self) -> bool:
+        self._ensure_listener()
+        return self._listening.is_set()
+
+    async def wait_for(self, key: str, timeout: float) -> Optional[Dict[str, Any]]:
+        self._ensure_listener()
+        try:
+            # Without the subscription a store could go unnoticed until the
+            # next recheck; don't hold the caller up longer than that.
+            await asyncio.wait_for(self._listening.wait(), timeout=min(max(0.0, timeout), WAIT_RECHECK_SECONDS))
+        except asyncio.TimeoutError:
+            pass
+        return await self._wait_notified(self._waiters, key, timeout)
 
     async def acquire_lock(self, key: str, owner: str, ttl_seconds: int) -> bool:
         ttl = max(1, int(ttl_seconds))
         return bool(await self._client.set(key, owner, ex=ttl, nx=True))
 
     async def release_lock(self, key: str, owner: str) -> None:
-        current = await self._client.get(key)
-        if current == owner:
-            await self._client.delete(key)
+        await self._release_lock(keys=[key], args=[owner])
+
+    async def get_or_acquire(self, key: str, lock_key: str, owner: str, ttl_seconds: int) -> Tuple[Optional[bytes], bool]:
+        found, result = await self._get_or_acquire(keys=[key, lock_key], args=[owner, max(1, int(ttl_seconds))])
+        if int(found):
+            return self._decode_raw(result), False
+        return None, bool(int(result))
+
+    async def append_stream(
+        self, key: str, entry: str, ttl_seconds: int, max_entries: Optional[int] = None
+    ) -> str:
+        async with self._client.pipeline(transaction=False) as pipe:
+            pipe.xadd(key, {"c": entry}, maxlen=max_entries or STREAM_MAX_ENTRIES, approximate=True)
+            pipe.expire(key, max(1, int(ttl_seconds)))
+            entry_id, _ = await pipe.execute()
+        return entry_id.decode("utf-8")
+
+    async def read_stream(self, key: str, after: str, timeout: float) -> List[Tuple[str, str]]:
+        # No BLOCK for a non-blocking read: XREAD treats BLOCK 0 as "forever".
+        block = max(1, int(timeout * 1000)) if timeout > 0 else None
+        response = await self._client.xread({key: after or "0"}, count=512, block=block)
+        entries: List[Tuple[str, str]] = []
+        for _, messages in response or ():
+            for entry_id, fields in messages:
+                entries.append((entry_id.decode("utf-8"), fields[b"c"].decode("utf-8")))
+        return entries
+
+    async def incr(self, key: str) -> int:
+        return int(await self._client.incr(key))
+
+    async def get_counter(self, key: str) -> int:
+        raw = await self._client.get(key)
+        try:
+            return int(raw) if raw else 0
+        except ValueError:
+            return 0
+
+    async def publish(self, channel: str, message: Dict[str, Any]) -> None:
+        await self._client.publish(channel, json.dumps(message, ensure_ascii=False))
+
+    async def subscribe(self, channel: str) -> AsyncIterator[Dict[str, Any]]:
+        pubsub = self._client.pubsub(ignore_subscribe_messages=True)
+        await pubsub.subscribe(channel)
+        try:
+            async for message in pubsub.listen():
+                if message.get("type") != "message":
+                    continue
+                try:
+                    parsed = json.loads(message["data"])
+                except Exception:
+                    continue
+                if isinstance(parsed, dict):
+                    yield parsed
+        finally:
+            try:
+                await pubsub.unsubscribe(channel)
+            finally:
+                await pubsub.aclose()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": "redis", "codec": self.codec.stats()}
+
+
+class TieredCache(CacheBackend):
+    """
+    A per-worker InMemoryCache (L1) in front of a shared backend (L2),
+    usually RedisCache. Reads are served from L1 when possible; L2 misses
+    are remembered for ``negative_ttl_seconds`` so the common "no record
+    yet" lookup does not hit the network every time. Every store, on any
+    worker, drops the key from L1 via the backend's key notifications, and
+    L1 is bypassed while those notifications are not being delivered.
+
+    wait_for, locks, counters and pub/sub always go to L2.
+    """
+
+    def __init__(
+        self,
+        remote: CacheBackend,
+        max_entries: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+        ttl_seconds: Optional[float] = None,
+        negative_ttl_seconds: Optional[float] = None,
+    ) -> None:
+        self.remote = remote
+        self.local = InMemoryCache(
+            max_entries=max_entries if max_entries is not None else int(os.getenv("CACHE_L1_MAX_ENTRIES", "10000")),
+            max_bytes=max_bytes if max_bytes is not None else int(os.getenv("CACHE_L1_MAX_BYTES", str(64 * 1024 * 1024))),
+        )
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else float(os.getenv("CACHE_L1_TTL_SECONDS", "30"))
+        self.negative_ttl_seconds = (
+            negative_ttl_seconds if negative_ttl_seconds is not None else float(os.getenv("CACHE_L1_NEGATIVE_TTL_SECONDS", "1.0"))
+        )
+        # key -> expires_at of a remembered L2 miss; insertion order is age.
+        self._negative: "OrderedDict[str, float]" = OrderedDict()
+        # Bumped by every invalidation; a read that raced one does not fill L1.
+        self._generation = 0
+        self._mutex = threading.Lock()
+        self._counters = {"l1_hits": 0, "negative_hits": 0, "l2_hits": 0, "l2_misses": 0, "invalidations": 0, "bypassed": 0}
+        self._notified = remote.add_key_listener(self._on_key_set)
+
+    def _on_key_set(self, key: Optional[str]) -> None:
+        with self._mutex:
+            self._generation += 1
+            if key is None:
+                self._negative.clear()
+                dropped = True
+            else:
+                dropped = self._negative.pop(key, None) is not None
+        if key is None:
+            self.local.clear()
+        else:
+            dropped = self.local.delete(key) or dropped
+        if dropped:
+            self._count("invalidations")
+
+    def _count(self, name: str) -> None:
+        with self._mutex:
+            self._counters[name] += 1
+
+    def _l1_usable(self) -> bool:
+        if self._notified and self.remote.key_listener_active():
+            return True
+        self._count("bypassed")
+        return False
+
+    async def _lookup_local(self, key: str) -> Tuple[Optional[bytes], bool, int]:
+        """(L1 value, remembered miss, generation to install under)."""
+        payload = await self.local.get_raw(key)
+        if payload is not None:
+            self._count("l1_hits")
+            return payload, False, 0
+        now = time.monotonic()
+        with self._mutex:
+            expires_at = self._negative.get(key)
+            if expires_at is not None:
+                if expires_at > now:
+                    self._counters["negative_hits"] += 1
+                    return None, True, 0
+                del self._negative[key]
+            return None, False, self._generation
+
+    async def _install(self, key: str, payload: Optional[bytes], generation: int) -> None:
+        with self._mutex:
+            self._counters["l2_hits" if payload is not None else "l2_misses"] += 1
+            if self._generation != generation:
+                return
+            if payload is None:
+                if self.negative_ttl_seconds > 0:
+                    self._negative[key] = time.monotonic() + self.negative_ttl_seconds
+                    while len(self._negative) > max(1, self.local.max_entries):
+                        self._negative.popitem(last=False)
+                return
+        await self.local.set_raw(key, payload, self.ttl_seconds)
+        with self._mutex:
+            raced = self._generation != generation
+        if raced:
+            # An invalidation landed while installing; it may have run first.
+            self.local.delete(key)
+
+    async def get_raw(self, key: str) -> Optional[bytes]:
+        if not self._l1_usable():
+            return await self.remote.get_raw(key)
+        payload, known_miss, generation = await self._lookup_local(key)
+        if payload is not None or known_miss:
+            return payload
+        payload = await self.remote.get_raw(key)
+        await self._install(key, payload, generation)
+        return payload
+
+    async def get_or_acquire(self, key: str, lock_key: str, owner: str, ttl_seconds: int) -> Tuple[Optional[bytes], bool]:
+        if not self._l1_usable():
+            return await self.remote.get_or_acquire(key, lock_key, owner, ttl_seconds)
+        payload = await self.local.get_raw(key)
+        if payload is not None:
+            self._count("l1_hits")
+            return payload, False
+        # A remembered miss is not trusted here: the record may have been
+        # stored, and its lock released, before this worker heard of it.
+        # The remote check costs the same round-trip as the lock alone.
+        with self._mutex:
+            generation = self._generation
+        payload, acquired = await self.remote.get_or_acquire(key, lock_key, owner, ttl_seconds)
+        await self._install(key, payload, generation)
+        return payload, acquired
+
+    async def get_json(self, key: str) -> Optional[Dict[str, Any]]:
+        payload = await self.get_raw(key)
+        if payload is None:
+            return None
+        try:
+            parsed = json.loads(payload)
+            return parsed if isinstance(parsed, dict) else None
+        except Exception:
+            return None
+
+    async def set_raw(self, key: str, payload: bytes, ttl_seconds: int) -> bool:
+        # The backend's own notification for this store drops the key from
+        # L1 again, so the next read refills it from L2.
+        return await self.remote.set_raw(key, payload, ttl_seconds)
+
+    async def set_json(self, key: str, value: Dict[str, Any], ttl_seconds: int) -> bool:
+        return await self.set_raw(key, _encode(value), ttl_seconds)
+
+    async def wait_for(self, key: str, timeout: float) -> Optional[Dict[str, Any]]:
+        return await self.remote.wait_for(key, timeout)
+
+    async def append_stream(
+        self, key: str, entry: str, ttl_seconds: int, max_entries: Optional[int] = None
+    ) -> str:
+        return await self.remote.append_stream(key, entry, ttl_seconds, max_entries)
+
+    async def read_stream(self, key: str, after: str, timeout: float) -> List[Tuple[str, str]]:
+        return await self.remote.read_stream(key, after, timeout)
+
+    async def acquire_lock(self, key: str, owner: str, ttl_seconds: int) -> bool:
+        return await self.remote.acquire_lock(key, owner, ttl_seconds)
+
+    async def release_lock(self, key: str, owner: str) -> None:
+        await self.remote.release_lock(key, owner)
+
+    async def incr(self, key: str) -> int:
+        return await self.remote.incr(key)
+
+    async def get_counter(self, key: str) -> int:
+        return await self.remote.get_counter(key)
+
+    async def publish(self, channel: str, message: Dict[str, Any]) -> None:
+        await self.remote.publish(channel, message)
+
+    def subscribe(self, channel: str) -> AsyncIterator[Dict[str, Any]]:
+        return self.remote.subscribe(channel)
+
+    def add_key_listener(self, callback: Callable[[Optional[str]], None]) -> bool:
+        return self.remote.add_key_listener(callback)
+
+    def key_listener_active(self) -> bool:
+        return self.remote.key_listener_active()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._mutex:
+            counters = dict(self._counters)
+            negative_entries = len(self._negative)
+        lookups = counters["l1_hits"] + counters["negative_hits"] + counters["l2_hits"] + counters["l2_misses"]
+        local = self.local.stats()
+        return {
+            "backend": "tiered",
+            **counters,
+            "l1_hit_rate": round((counters["l1_hits"] + counters["negative_hits"]) / lookups, 4) if lookups else 0.0,
+            "l1": {key: local[key] for key in ("entries", "bytes", "max_entries", "max_bytes", "evictions", "expirations")},
+            "negative_entries": negative_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "negative_ttl_seconds": self.negative_ttl_seconds,
+            "l2": self.remote.stats(),
+        }
 
 
 def build_cache_backend() -> CacheBackend:
@@ -139,6 +1037,9 @@ def build_cache_backend() -> CacheBackend:
     if redis_url:
         try:
             backend = RedisCache(redis_url)
+            if _env_bool("CACHE_L1_ENABLED", False):
+                logger.info("Cache backend: redis with in-process L1")
+                return TieredCache(backend)
             logger.info("Cache backend: redis")
             return backend
         except Exception as exc:
@@ -146,3 +1047,14 @@ def build_cache_backend() -> CacheBackend:
 
     logger.info("Cache backend: in-memory")
     return InMemoryCache()
+
+
+_cache_backend: Optional[CacheBackend] = None
+
+
+def get_cache_backend() -> CacheBackend:
+    """Process-wide backend shared by the response cache and the profile cache."""
+    global _cache_backend
+    if _cache_backend is None:
+        _cache_backend = build_cache_backend()
+    return _cache_backend
@@ -1,5 +1,11 @@
 from typing import List, Optional
 
+from app.services.message_features import MessageFeatures, extract_features, keywords
+
+_CAREER_ADVANCEMENT = keywords("promotion", "vp", "director", "career growth")
+_LEADERSHIP = keywords("team", "manager", "leadership", "stakeholder")
+_EXECUTION = keywords("focus", "productivity", "prioritize", "execution")
+
 
 def build_context_packet(user_message: str, history: Optional[List[dict]] = None, explicit_context: Optional[str] = None) -> str:
     parts = []
@@ -17,14 +23,14 @@ def build_context_packet(user_message: str, history: Optional[List[dict]] = None
     return "\n".join(parts)
 
 
-def infer_goal_link(user_message: str) -> str:
-    t = (user_message or "").lower()
+def infer_goal_link(user_message: str, features: Optional[MessageFeatures] = None) -> str:
+    f = features or extract_features(user_message)
 
-    if any(k in t for k in ["promotion", "vp", "director", "career growth"]):
+    if f.any(_CAREER_ADVANCEMENT):
         return "career_advancement"
-    if any(k in t for k in ["team", "manager", "leadership", "stakeholder"]):
+    if f.any(_LEADERSHIP):
         return "leadership_effectiveness"
-    if any(k in t for k in ["focus", "productivity", "prioritize", "execution"]):
+    if f.any(_EXECUTION):
         return "execution_excellence"
 
     return "professional_growth"
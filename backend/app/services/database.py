@@ -0,0 +1,165 @@
+"""
+Shared async Postgres access.
+
+One psycopg ``AsyncConnectionPool`` per database URL, used by ProfileStore
+and UserService so request handlers never open a connection per query or
+block the event loop on I/O.
+
+The default pool (DATABASE_URL) is opened and closed by the FastAPI
+lifespan in main.py. Pools belong to the event loop that opened them.
+Code running on a loop without a pool (scripts via ``run_blocking``,
+tests driving the app without its lifespan) gets a one-off connection
+instead, so short-lived loops never leave pool workers behind.
+"""
+
+import asyncio
+import logging
+import os
+import weakref
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Dict, Optional, TypeVar
+
+import psycopg
+from psycopg_pool import AsyncConnectionPool
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    raw = os.getenv(name)
+    if raw is None:
+        return default
+    return raw.strip().lower() in {"1", "true", "yes", "on"}
+
+
+class Database:
+    """Pooled async connections for one database URL."""
+
+    def __init__(self, database_url: str) -> None:
+        self.database_url = database_url
+        self.min_size = int(os.getenv("DB_POOL_MIN_SIZE", "1"))
+        self.max_size = max(self.min_size, int(os.getenv("DB_POOL_MAX_SIZE", "10")))
+        self.acquire_timeout = float(os.getenv("DB_POOL_TIMEOUT_SECONDS", "10"))
+        self.max_idle = float(os.getenv("DB_POOL_MAX_IDLE_SECONDS", "300"))
+        self.statement_timeout_ms = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "5000"))
+        self.health_check = _env_bool("DB_POOL_HEALTH_CHECK", True)
+        self._pools: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, AsyncConnectionPool]" = (
+            weakref.WeakKeyDictionary()
+        )
+
+    async def _configure(self, conn: psycopg.AsyncConnection) -> None:
+        if self.statement_timeout_ms > 0:
+            await conn.execute(f"SET statement_timeout = {int(self.statement_timeout_ms)}")
+            await conn.commit()
+
+    async def pool(self) -> AsyncConnectionPool:
+        loop = asyncio.get_running_loop()
+        pool = self._pools.get(loop)
+        if pool is None or pool.closed:
+            pool = AsyncConnectionPool(
+                self.database_url,
+                min_size=self.min_size,
+                max_size=self.max_size,
+                timeout=self.acquire_timeout,
+                max_idle=self.max_idle,
+                configure=self._configure,
+                check=AsyncConnectionPool.check_connection if self.health_check else None,
+                name="coachingapp",
+                open=False,
+            )
+            self._pools[loop] = pool
+            await pool.open(wait=False)
+        return pool
+
+    @asynccontextmanager
+    async def connection(self) -> AsyncIterator[psycopg.AsyncConnection]:
+        """Borrow a connection; the transaction commits on success, rolls back on error."""
+        pool = self._pools.get(asyncio.get_running_loop())
+        if pool is not None and not pool.closed:
+            async with pool.connection() as conn:
+                yield conn
+            return
+        conn = await psycopg.AsyncConnection.connect(self.database_url)
+        async with conn:
+            await self._configure(conn)
+            yield conn
+
+    async def close(self) -> None:
+        """Close the pool owned by the running loop."""
+        pool = self._pools.pop(asyncio.get_running_loop(), None)
+        if pool is not None and not pool.closed:
+            try:
+                await pool.close()
+            except Exception as exc:
+                logger.warning("Closing database pool failed: %s", exc)
+
+    def stats(self) -> Dict[str, Any]:
+        pools = [p for p in list(self._pools.values()) if not p.closed]
+        totals: Dict[str, int] = {}
+        for pool in pools:
+            for key, value in pool.get_stats().items():
+                totals[key] = totals.get(key, 0) + int(value)
+        return {
+            "min_size": self.min_size,
+            "max_size": self.max_size,
+            "statement_timeout_ms": self.statement_timeout_ms,
+            "health_check": self.health_check,
+            "open_pools": len(pools),
+            **totals,
+        }
+
+
+_databases: Dict[str, Database] = {}
+
+
+def get_database(database_url: Optional[str] = None) -> Database:
+    url = database_url or os.getenv("DATABASE_URL")
+    if not url:
+        raise RuntimeError("DATABASE_URL environment variable is required for database access")
+    db = _databases.get(url)
+    if db is None:
+        db = _databases[url] = Database(url)
+    return db
+
+
+def database_stats() -> Dict[str, Any]:
+    return {"pools": [db.stats() for db in _databases.values()]}
+
+
+async def startup_database() -> Optional[Database]:
+    if not os.getenv("DATABASE_URL"):
+        return None
+    db = get_database()
+    await db.pool()
+    return db
+
+
+async def shutdown_database() -> None:
+    """Close every pool owned by the running loop."""
+    for db in list(_databases.values()):
+        await db.close()
+
+
+def run_blocking(awaitable: Awaitable[T]) -> T:
+    """
+    Run a database coroutine from synchronous code (scripts, tests). Inside
+    the event loop use the async API instead; this refuses to block it.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        pass
+    else:
+        if asyncio.iscoroutine(awaitable):
+            awaitable.close()
+        raise RuntimeError("run_blocking() called from a running event loop; await the async API instead")
+
+    async def _main() -> T:
+        try:
+            return await awaitable
+        finally:
+            await shutdown_database()
+
+    return asyncio.run(_main())
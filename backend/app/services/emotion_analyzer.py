@@ -1,18 +1,25 @@
-from typing import Literal
+from typing import Literal, Optional
+
+from app.services.message_features import MessageFeatures, extract_features, keywords
 
 EmotionLabel = Literal["neutral", "distressed", "low_confidence", "motivated", "uncertain"]
 
+_DISTRESSED = keywords("hopeless", "panic", "can't", "overwhelmed", "burnout", "anxious")
+_LOW_CONFIDENCE = keywords("imposter", "not good enough", "doubt", "afraid to fail")
+_MOTIVATED = keywords("excited", "ready", "committed", "motivated")
+_UNCERTAIN = keywords("not sure", "confused", "unclear", "maybe")
+
 
-def detect_emotion(message: str) -> EmotionLabel:
-    text = (message or "").lower()
+def detect_emotion(message: str, features: Optional[MessageFeatures] = None) -> EmotionLabel:
+    f = features or extract_features(message)
 
-    if any(k in text for k in ["hopeless", "panic", "can't", "overwhelmed", "burnout", "anxious"]):
+    if f.any(_DISTRESSED):
         return "distressed"
-    if any(k in text for k in ["imposter", "not good enough", "doubt", "afraid to fail"]):
+    if f.any(_LOW_CONFIDENCE):
         return "low_confidence"
-    if any(k in text for k in ["excited", "ready", "committed", "motivated"]):
+    if f.any(_MOTIVATED):
         return "motivated"
-    if any(k in text for k in ["not sure", "confused", "unclear", "maybe"]):
+    if f.any(_UNCERTAIN):
         return "uncertain"
 
     return "neutral"
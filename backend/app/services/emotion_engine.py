@@ -4,6 +4,8 @@ from dataclasses import dataclass
 from datetime import datetime
 from typing import Dict
 
+from app.services.message_features import MessageFeatures, extract_features, keywords
+
 
 EMOTION_LABELS = [
     "high_stress",
@@ -27,30 +29,34 @@ def _clip01(v: float) -> float:
     return max(0.0, min(1.0, v))
 
 
-def analyze_text_emotion(text: str) -> EmotionAnalysis:
-    t = (text or "").lower()
+_STRESS_TERMS = keywords("overwhelmed", "anxious", "pressure", "burnout", "panic", "stressed")
+_CONFIDENCE_TERMS = keywords("not good enough", "imposter", "doubt", "hesitate", "afraid")
+_ENERGY_TERMS = keywords("excited", "motivated", "energized", "ready", "let's do it")
+_FRUSTRATION_TERMS = keywords("blocked", "stuck", "frustrated", "politics", "can't move")
+_ANALYTICAL_TERMS = keywords("tradeoff", "framework", "strategy", "options", "prioritize", "roadmap")
+_CERTAINTY_TERMS = keywords("definitely", "clearly", "certain", "must")
+_UNCERTAINTY_TERMS = keywords("maybe", "not sure", "unclear", "might", "perhaps")
+
+_DEADLINE_TRIGGERS = keywords("deadline", "due", "urgent", "eod")
+_MEETING_TRIGGERS = keywords("meeting", "1:1", "all-hands", "board")
+_TEAM_TRIGGERS = keywords("team", "conflict", "manager", "stakeholder")
 
-    stress_terms = ["overwhelmed", "anxious", "pressure", "burnout", "panic", "stressed"]
-    confidence_terms = ["not good enough", "imposter", "doubt", "hesitate", "afraid"]
-    energy_terms = ["excited", "motivated", "energized", "ready", "let's do it"]
-    frustration_terms = ["blocked", "stuck", "frustrated", "politics", "can't move"]
-    analytical_terms = ["tradeoff", "framework", "strategy", "options", "prioritize", "roadmap"]
 
-    def score_for(terms: list[str]) -> float:
-        hits = sum(1 for x in terms if x in t)
-        return _clip01(hits / 3.0)
+def analyze_text_emotion(text: str, features: MessageFeatures | None = None) -> EmotionAnalysis:
+    f = features or extract_features(text)
+    t = f.text
 
-    high_stress = score_for(stress_terms)
-    low_confidence = score_for(confidence_terms)
-    high_energy = score_for(energy_terms)
-    frustration = score_for(frustration_terms)
-    analytical_mode = score_for(analytical_terms)
+    def score_for(terms: tuple[str, ...]) -> float:
+        return _clip01(f.count(terms) / 3.0)
 
-    certainty_terms = ["definitely", "clearly", "certain", "must"]
-    uncertainty_terms = ["maybe", "not sure", "unclear", "might", "perhaps"]
+    high_stress = score_for(_STRESS_TERMS)
+    low_confidence = score_for(_CONFIDENCE_TERMS)
+    high_energy = score_for(_ENERGY_TERMS)
+    frustration = score_for(_FRUSTRATION_TERMS)
+    analytical_mode = score_for(_ANALYTICAL_TERMS)
 
-    certainty = _clip01(sum(1 for x in certainty_terms if x in t) / 3.0)
-    uncertainty = _clip01(sum(1 for x in uncertainty_terms if x in t) / 3.0)
+    certainty = _clip01(f.count(_CERTAINTY_TERMS) / 3.0)
+    uncertainty = _clip01(f.count(_UNCERTAINTY_TERMS) / 3.0)
 
     words = [w for w in t.split() if w.strip()]
     complexity = _clip01(len(words) / 80.0)
@@ -86,16 +92,16 @@ def analyze_text_emotion(text: str) -> EmotionAnalysis:
     )
 
 
-def infer_context_triggers(text: str, now: datetime | None = None) -> Dict[str, str]:
-    t = (text or "").lower()
+def infer_context_triggers(text: str, now: datetime | None = None, features: MessageFeatures | None = None) -> Dict[str, str]:
+    f = features or extract_features(text)
     now = now or datetime.now()
 
     trigger = "general"
-    if any(k in t for k in ["deadline", "due", "urgent", "eod"]):
+    if f.any(_DEADLINE_TRIGGERS):
         trigger = "deadline_pressure"
-    elif any(k in t for k in ["meeting", "1:1", "all-hands", "board"]):
+    elif f.any(_MEETING_TRIGGERS):
         trigger = "meeting_context"
-    elif any(k in t for k in ["team", "conflict", "manager", "stakeholder"]):
+    elif f.any(_TEAM_TRIGGERS):
         trigger = "team_conflict"
 
     return {
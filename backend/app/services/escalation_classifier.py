@@ -0,0 +1,224 @@
+"""
+Local escalation-risk and session-tag classifier.
+
+A hashed bag of words and word bigrams (the user message and the coach
+reply hash into separate namespaces) scored by a linear model with NumPy:
+a softmax over the escalation risks and one sigmoid per session tag. It is
+trained offline from logged Haiku labels by
+``scripts/train_escalation_classifier.py`` and shipped as a versioned
+``.npz`` artifact named by ``ESCALATION_MODEL_PATH``, loaded once at
+startup.
+
+Turns it predicts with at least ``ESCALATION_CONFIDENCE_THRESHOLD`` skip
+the Haiku classifier; uncertain turns, plus an
+``ESCALATION_HAIKU_SAMPLE_RATE`` share of confident ones kept for fresh
+labels, still go to Haiku. With ``ESCALATION_LABEL_LOG`` set, each Haiku
+label is appended there as a JSON line of training data.
+"""
+
+import json
+import logging
+import os
+import random
+import re
+import zlib
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+MODEL_FORMAT = 1
+RISK_LABELS = ("none", "low", "medium", "high")
+DEFAULT_FEATURES = 1 << 16
+MAX_TAGS = 3
+
+CONFIDENCE_THRESHOLD = float(os.getenv("ESCALATION_CONFIDENCE_THRESHOLD", "0.85"))
+HAIKU_SAMPLE_RATE = float(os.getenv("ESCALATION_HAIKU_SAMPLE_RATE", "0.02"))
+LABEL_LOG_PATH = os.getenv("ESCALATION_LABEL_LOG", "").strip()
+
+_TOKEN = re.compile(r"\w+")
+
+
+def hashed_features(message: str, response: str, n_features: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Sparse ``(indices, values)``: log-scaled, L2-normalized hashed n-gram counts."""
+    counts: Dict[int, float] = {}
+    for namespace, text in (("u", message), ("c", response)):
+        tokens = _TOKEN.findall((text or "").lower())
+        for gram in tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]:
+            index = zlib.crc32(f"{namespace}:{gram}".encode("utf-8")) % n_features
+            counts[index] = counts.get(index, 0.0) + 1.0
+    indices = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+    values = np.log1p(np.fromiter(counts.values(), dtype=np.float32, count=len(counts)))
+    norm = float(np.linalg.norm(values))
+    if norm:
+        values /= norm
+    return indices, values
+
+
+@dataclass
+class EscalationPrediction:
+    escalation_risk: str
+    confidence: float
+    session_tags: List[str] = field(default_factory=list)
+
+    def as_classification(self) -> Dict[str, Any]:
+        """The prediction in the Haiku classifier's result shape."""
+        return {
+            "escalation_risk": self.escalation_risk,
+            "escalation_reason": None,
+            "goal_update": None,
+            "session_tags": list(self.session_tags),
+        }
+
+
+class EscalationClassifier:
+    def __init__(
+        self,
+        risk_weights: np.ndarray,
+        risk_bias: np.ndarray,
+        tag_weights: np.ndarray,
+        tag_bias: np.ndarray,
+        tag_labels: List[str],
+        risk_labels: Tuple[str, ...] = RISK_LABELS,
+        metadata: Optional[Dict[str, Any]] = None,
+        tag_threshold: float = 0.5,
+    ) -> None:
+        self.risk_weights = np.asarray(risk_weights, dtype=np.float32)
+        self.risk_bias = np.asarray(risk_bias, dtype=np.float32)
+        self.tag_weights = np.asarray(tag_weights, dtype=np.float32).reshape(self.risk_weights.shape[0], len(tag_labels))
+        self.tag_bias = np.asarray(tag_bias, dtype=np.float32).reshape(len(tag_labels))
+        self.risk_labels = tuple(risk_labels)
+        self.tag_labels = list(tag_labels)
+        self.n_features = self.risk_weights.shape[0]
+        self.metadata = dict(metadata or {})
+        self.tag_threshold = tag_threshold
+
+    @property
+    def version(self) -> str:
+        return str(self.metadata.get("version", "unversioned"))
+
+    def predict(self, message: str, response: str) -> EscalationPrediction:
+        indices, values = hashed_features(message, response, self.n_features)
+        logits = self.risk_bias + values @ self.risk_weights[indices]
+        probs = np.exp(logits - logits.max())
+        probs /= probs.sum()
+        best = int(probs.argmax())
+
+        tags: List[str] = []
+        if self.tag_labels:
+            tag_probs = 1.0 / (1.0 + np.exp(-(self.tag_bias + values @ self.tag_weights[indices])))
+            for i in np.argsort(-tag_probs)[:MAX_TAGS]:
+                if tag_probs[i] >= self.tag_threshold:
+                    tags.append(self.tag_labels[int(i)])
+        return EscalationPrediction(self.risk_labels[best], float(probs[best]), tags)
+
+    def save(self, path: str) -> None:
+        metadata = {
+            **self.metadata,
+            "format": MODEL_FORMAT,
+            "n_features": self.n_features,
+            "risk_labels": list(self.risk_labels),
+            "tag_labels": self.tag_labels,
+        }
+        with open(path, "wb") as fh:
+            np.savez_compressed(
+                fh,
+                metadata=np.array(json.dumps(metadata)),
+                risk_weights=self.risk_weights,
+                risk_bias=self.risk_bias,
+                tag_weights=self.tag_weights,
+                tag_bias=self.tag_bias,
+            )
+
+    @classmethod
+    def load(cls, path: str) -> "EscalationClassifier":
+        with np.load(path, allow_pickle=False) as data:
+            metadata = json.loads(str(data["metadata"]))
+            if metadata.get("format") != MODEL_FORMAT:
+                raise ValueError(f"Unsupported escalation model format: {metadata.get('format')!r}")
+            return cls(
+                data["risk_weights"],
+                data["risk_bias"],
+                data["tag_weights"],
+                data["tag_bias"],
+                tag_labels=metadata["tag_labels"],
+                risk_labels=tuple(metadata["risk_labels"]),
+                metadata=metadata,
+            )
+
+
+_classifier: Optional[EscalationClassifier] = None
+_loaded = False
+_counts: Dict[str, int] = {"confident": 0, "uncertain": 0, "sampled": 0, "errors": 0}
+
+
+def get_escalation_classifier() -> Optional[EscalationClassifier]:
+    """The model from ``ESCALATION_MODEL_PATH``, loaded on first use; None without one."""
+    global _classifier, _loaded
+    if not _loaded:
+        _loaded = True
+        path = os.getenv("ESCALATION_MODEL_PATH", "").strip()
+        if path:
+            try:
+                _classifier = EscalationClassifier.load(path)
+                logger.info("Escalation classifier %s loaded from %s", _classifier.version, path)
+            except Exception as exc:
+                logger.warning("Escalation classifier not loaded from %s: %s", path, exc)
+    return _classifier
+
+
+async def startup_escalation_classifier() -> None:
+    get_escalation_classifier()
+
+
+def confident_classification(message: str, response: str) -> Optional[Dict[str, Any]]:
+    """
+    The local classification when the model is confident, else None (the
+    turn goes to Haiku). A sample of confident turns also returns None so
+    Haiku keeps producing training labels.
+    """
+    classifier = get_escalation_classifier()
+    if classifier is None:
+        return None
+    try:
+        prediction = classifier.predict(message, response)
+    except Exception as exc:
+        _counts["errors"] += 1
+        logger.warning("Escalation classifier failed: %s", exc)
+        return None
+    if prediction.confidence < CONFIDENCE_THRESHOLD:
+        _counts["uncertain"] += 1
+        return None
+    if HAIKU_SAMPLE_RATE > 0 and random.random() < HAIKU_SAMPLE_RATE:
+        _counts["sampled"] += 1
+        return None
+    _counts["confident"] += 1
+    return prediction.as_classification()
+
+
+def log_label(message: str, response: str, result: Dict[str, Any]) -> None:
+    """Append a Haiku label to ``ESCALATION_LABEL_LOG`` (blocking; run off the loop)."""
+    if not LABEL_LOG_PATH or result.get("escalation_risk") not in RISK_LABELS:
+        return
+    record = {
+        "ts": datetime.now(timezone.utc).isoformat(),
+        "message": message,
+        "response": response,
+        "escalation_risk": result["escalation_risk"],
+        "session_tags": result.get("session_tags") or [],
+    }
+    with open(LABEL_LOG_PATH, "a", encoding="utf-8") as fh:
+        fh.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+def escalation_classifier_stats() -> Dict[str, Any]:
+    classifier = get_escalation_classifier()
+    return {
+        "loaded": classifier is not None,
+        "version": classifier.version if classifier is not None else None,
+        "threshold": CONFIDENCE_THRESHOLD,
+        **_counts,
+    }
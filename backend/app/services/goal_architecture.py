@@ -2,9 +2,28 @@ from __future__ import annotations
 
 from typing import Dict, Any, List
 
-
-def infer_goal_hierarchy(user_message: str, goal_link: str, profile: Dict[str, Any] | None = None) -> Dict[str, List[str]]:
-    t = (user_message or "").lower()
+from app.services.message_features import MessageFeatures, extract_features, keywords
+
+_STRATEGIC_CAREER = keywords("promotion", "vp", "director", "career")
+_STRATEGIC_ORG = keywords("org", "stakeholder", "impact", "influence")
+_STRATEGIC_SKILL = keywords("skill", "learn", "develop")
+_TACTICAL_PROJECT = keywords("project", "deliver", "roadmap", "plan")
+_TACTICAL_TEAM = keywords("team", "manager", "1:1", "delegate")
+_TACTICAL_COMMS = keywords("communication", "presentation", "message")
+_TACTICAL_PROCESS = keywords("process", "workflow", "efficiency", "optimize")
+_DAILY_MEETING = keywords("meeting", "tomorrow", "today", "prep")
+_DAILY_CONVERSATION = keywords("difficult conversation", "conflict", "hard talk")
+_DAILY_DECISION = keywords("decide", "decision", "tradeoff")
+_DAILY_STRESS = keywords("stress", "overwhelmed", "anxious", "burnout")
+
+
+def infer_goal_hierarchy(
+    user_message: str,
+    goal_link: str,
+    profile: Dict[str, Any] | None = None,
+    features: MessageFeatures | None = None,
+) -> Dict[str, List[str]]:
+    f = features or extract_features(user_message)
     profile = profile or {}
 
     strategic: List[str] = []
@@ -12,31 +31,31 @@ def infer_goal_hierarchy(user_message: str, goal_link: str, profile: Dict[str, A
     daily: List[str] = []
 
     # Strategic layer (3-12 months)
-    if goal_link == "career_advancement" or any(k in t for k in ["promotion", "vp", "director", "career"]):
+    if goal_link == "career_advancement" or f.any(_STRATEGIC_CAREER):
         strategic += ["Career advancement objective", "Leadership effectiveness improvement"]
-    if any(k in t for k in ["org", "stakeholder", "impact", "influence"]):
+    if f.any(_STRATEGIC_ORG):
         strategic += ["Organizational impact target"]
-    if any(k in t for k in ["skill", "learn", "develop"]):
+    if f.any(_STRATEGIC_SKILL):
         strategic += ["Skill development priority"]
 
     # Tactical layer (1-6 weeks)
-    if any(k in t for k in ["project", "deliver", "roadmap", "plan"]):
+    if f.any(_TACTICAL_PROJECT):
         tactical += ["Specific project outcome"]
-    if any(k in t for k in ["team", "manager", "1:1", "delegate"]):
+    if f.any(_TACTICAL_TEAM):
         tactical += ["Team development objective"]
-    if any(k in t for k in ["communication", "presentation", "message"]):
+    if f.any(_TACTICAL_COMMS):
         tactical += ["Communication improvement target"]
-    if any(k in t for k in ["process", "workflow", "efficiency", "optimize"]):
+    if f.any(_TACTICAL_PROCESS):
         tactical += ["Process optimization target"]
 
     # Daily action layer (immediate)
-    if any(k in t for k in ["meeting", "tomorrow", "today", "prep"]):
+    if f.any(_DAILY_MEETING):
         daily += ["Meeting preparation + follow-up"]
-    if any(k in t for k in ["difficult conversation", "conflict", "hard talk"]):
+    if f.any(_DAILY_CONVERSATION):
         daily += ["Difficult conversation navigation"]
-    if any(k in t for k in ["decide", "decision", "tradeoff"]):
+    if f.any(_DAILY_DECISION):
         daily += ["Decision-making support"]
-    if any(k in t for k in ["stress", "overwhelmed", "anxious", "burnout"]):
+    if f.any(_DAILY_STRESS):
         daily += ["Stress regulation technique"]
 
     # profile-informed defaults
@@ -0,0 +1,238 @@
+"""
+Token-budgeted conversation history.
+
+The history sent to the model is capped at ``HISTORY_TOKEN_BUDGET``
+estimated input tokens. The most recent messages that fit are sent
+verbatim; everything before them is represented by a summary of that
+prefix, written by the cheap model on the background job queue and cached
+in the CacheBackend under the prefix's hash-chain digest (see
+transcript_store). History loaded from the transcript comes with each
+message's stored digest, so the key is looked up rather than rehashed;
+history sent by the client is hashed.
+
+The cut is rounded to a multiple of ``HISTORY_SUMMARY_SPAN`` messages,
+counted from the start of the session, so the summarized prefix, and with
+it the cache key, changes only once per span, also when the history is a
+transcript window that slides every turn. Each new summary folds the previous span's summary and the span's
+messages, keeping every summarizer call small. Until the summary for the
+current prefix is ready the previous one is used; the messages between the
+two are left out for those turns.
+
+Token counts are a local estimate (about four characters per token, one
+per CJK character), not the tokenizer's.
+"""
+
+import logging
+import os
+import uuid
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from app.services.background_jobs import get_background_jobs
+from app.services.cache import CacheBackend, get_cache_backend
+from app.services.transcript_store import EMPTY_DIGEST, chain_digest
+
+logger = logging.getLogger(__name__)
+
+# Per-message framing overhead (role marker, separators).
+MESSAGE_OVERHEAD_TOKENS = 4
+
+Summarizer = Callable[[Optional[str], List[Dict[str, Any]]], Awaitable[str]]
+
+
+def estimate_tokens(text: str) -> int:
+    if not text:
+        return 0
+    wide = sum(1 for ch in text if ord(ch) >= 0x2E80)
+    return (len(text) - wide + 3) // 4 + wide
+
+
+def message_tokens(message: Dict[str, Any]) -> int:
+    return estimate_tokens(str(message.get("content", ""))) + MESSAGE_OVERHEAD_TOKENS
+
+
+def _summary_key(user_id: str, digest: str) -> str:
+    return f"histsum:{user_id}:{digest}"
+
+
+@dataclass
+class CompactedHistory:
+    # Messages sent verbatim, oldest first.
+    messages: List[Dict[str, Any]]
+    # Summary of the history before ``messages``, if one is available.
+    summary: Optional[str] = None
+    # Messages covered by ``summary``, and older messages sent in no form.
+    summarized: int = 0
+    omitted: int = 0
+    tokens: int = 0
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "verbatim": len(self.messages),
+            "summarized": self.summarized,
+            "omitted": self.omitted,
+            "tokens": self.tokens,
+        }
+
+
+class HistoryCompactor:
+    def __init__(
+        self,
+        backend: Optional[CacheBackend] = None,
+        budget_tokens: Optional[int] = None,
+        span: Optional[int] = None,
+        summary_max_tokens: Optional[int] = None,
+        ttl_seconds: Optional[int] = None,
+    ) -> None:
+        self.backend = backend or get_cache_backend()
+        self.budget_tokens = budget_tokens if budget_tokens is not None else int(os.getenv("HISTORY_TOKEN_BUDGET", "3000"))
+        # Even, so spans hold whole user/assistant pairs.
+        span = span if span is not None else int(os.getenv("HISTORY_SUMMARY_SPAN", "8"))
+        self.span = max(2, span + span % 2)
+        self.summary_max_tokens = (
+            summary_max_tokens if summary_max_tokens is not None else int(os.getenv("HISTORY_SUMMARY_MAX_TOKENS", "400"))
+        )
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else int(os.getenv("HISTORY_SUMMARY_TTL_SECONDS", "86400"))
+        self.counters = {"compacted": 0, "summary_hits": 0, "stale_summaries": 0, "summaries_built": 0, "summary_failures": 0}
+
+    def fit(self, history: List[Dict[str, Any]]) -> CompactedHistory:
+        """The newest messages within the budget, with no summary."""
+        kept, used = self._newest_within(history, self.budget_tokens)
+        return CompactedHistory(history[len(history) - kept:], omitted=len(history) - kept, tokens=used)
+
+    def _newest_within(self, history: List[Dict[str, Any]], budget: int):
+        used = 0
+        kept = 0
+        for message in reversed(history):
+            size = message_tokens(message)
+            if used + size > budget:
+                break
+            used += size
+            kept += 1
+        return kept, used
+
+    async def compact(
+        self,
+        user_id: str,
+        history: List[Dict[str, Any]],
+        summarize: Optional[Summarizer] = None,
+        digests: Optional[List[Optional[str]]] = None,
+        start: int = 0,
+    ) -> CompactedHistory:
+        """
+        Fit ``history`` into the budget, summarizing the older part. Without
+        ``summarize`` the older part is dropped. ``digests``, when given, are
+        the stored hash-chain digests through each message of ``history``;
+        ``start`` is the session position of ``history[0]``.
+        """
+        total = sum(message_tokens(m) for m in history)
+        if total <= self.budget_tokens:
+            return CompactedHistory(list(history), tokens=total)
+        if summarize is None:
+            return self.fit(history)
+        self.counters["compacted"] += 1
+
+        kept, _ = self._newest_within(history, max(0, self.budget_tokens - self.summary_max_tokens))
+        cut = len(history) - kept
+        boundary = min(len(history), -(-(start + cut) // self.span) * self.span - start)
+        previous = boundary - self.span
+
+        previous_digest, digest = _span_digests(history, previous, boundary, digests)
+        summary = await self._cached(user_id, digest)
+        if summary is not None:
+            self.counters["summary_hits"] += 1
+            covered = boundary
+        else:
+            self._schedule(user_id, history[:boundary], previous_digest if previous > 0 else None, digest, summarize)
+            summary = await self._cached(user_id, previous_digest) if previous > 0 else None
+            covered = previous if summary is not None else 0
+            if summary is not None:
+                self.counters["stale_summaries"] += 1
+
+        recent = history[boundary:]
+        tokens = sum(message_tokens(m) for m in recent) + (estimate_tokens(summary) if summary else 0)
+        return CompactedHistory(
+            recent, summary=summary, summarized=covered, omitted=boundary - covered, tokens=tokens,
+        )
+
+    async def _cached(self, user_id: str, digest: str) -> Optional[str]:
+        try:
+            entry = await self.backend.get_json(_summary_key(user_id, digest))
+        except Exception as exc:
+            logger.warning("History summary lookup failed: %s", exc)
+            return None
+        return entry.get("summary") if isinstance(entry, dict) else None
+
+    def _schedule(
+        self,
+        user_id: str,
+        prefix: List[Dict[str, Any]],
+        previous_digest: Optional[str],
+        digest: str,
+        summarize: Summarizer,
+    ) -> None:
+        # Keyed by the summary: a build still waiting is not queued twice.
+        key = _summary_key(user_id, digest)
+        get_background_jobs().submit(lambda: self._build(user_id, prefix, previous_digest, key, summarize), key=key)
+
+    async def _build(
+        self,
+        user_id: str,
+        prefix: List[Dict[str, Any]],
+        previous_digest: Optional[str],
+        key: str,
+        summarize: Summarizer,
+    ) -> None:
+        # The lock keeps other workers from summarizing the same prefix.
+        lock_key = f"{key}:lock"
+        owner = uuid.uuid4().hex
+        try:
+            if not await self.backend.acquire_lock(lock_key, owner, 120):
+                return
+            try:
+                if await self.backend.get_json(key) is not None:
+                    return  # built while this job waited
+                previous = await self._cached(user_id, previous_digest) if previous_digest else None
+                messages = prefix[-self.span:] if previous is not None else prefix
+                summary = (await summarize(previous, messages)).strip()
+                if summary:
+                    await self.backend.set_json(key, {"summary": summary, "messages": len(prefix)}, self.ttl_seconds)
+                    self.counters["summaries_built"] += 1
+            finally:
+                await self.backend.release_lock(lock_key, owner)
+        except Exception as exc:
+            self.counters["summary_failures"] += 1
+            logger.warning("History summary failed (non-fatal): %s", exc)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "budget_tokens": self.budget_tokens,
+            "span": self.span,
+            **self.counters,
+        }
+
+
+def _pairs(messages: List[Dict[str, Any]]):
+    return ((str(m.get("role", "")), str(m.get("content", ""))) for m in messages)
+
+
+def _span_digests(
+    history: List[Dict[str, Any]], previous: int, boundary: int, digests: Optional[List[Optional[str]]],
+):
+    """Digests of ``history[:previous]`` and ``history[:boundary]``, stored ones when all are known."""
+    if digests is not None and len(digests) == len(history) and boundary > 0:
+        stored_previous = digests[previous - 1] if previous > 0 else EMPTY_DIGEST
+        if stored_previous and digests[boundary - 1]:
+            return stored_previous, digests[boundary - 1]
+    previous_digest = chain_digest(_pairs(history[:max(0, previous)]))
+    return previous_digest, chain_digest(_pairs(history[max(0, previous):boundary]), previous_digest)
+
+
+_history_compactor: Optional[HistoryCompactor] = None
+
+
+def get_history_compactor() -> HistoryCompactor:
+    global _history_compactor
+    if _history_compactor is None:
+        _history_compactor = HistoryCompactor()
+    return _history_compactor
@@ -7,13 +7,14 @@ availability helpers so chat.py imports don't need to change.
 All actual LLM logic lives in llm_claude.py (three-model architecture).
 """
 
-from typing import List, Optional
+from typing import Any, AsyncIterator, List, Optional, Tuple
 from pydantic import BaseModel
 
 from app.services.llm_claude import (
     _anthropic_available,
     _openai_available,
     get_coaching_response_claude,
+    stream_coaching_response_claude,
     generate_session_summary_claude,
     _generate_quick_replies,
     _detect_crisis as detect_crisis,
@@ -42,6 +43,13 @@ class CoachingRequest(BaseModel):
     coaching_style: Optional[str] = None
     user_id: Optional[str] = "anonymous"
     request_id: Optional[str] = None
+    # Server-side transcript: with a session and no history, the stored
+    # conversation up to last_turn_index is used.
+    session_id: Optional[str] = None
+    last_turn_index: Optional[int] = None
+    # Hash-chain digest of ``history`` (see transcript_store); when it
+    # matches the stored one the server does not re-hash the history.
+    history_digest: Optional[str] = None
 
 
 class CoachingResponse(BaseModel):
@@ -65,23 +73,16 @@ class CoachingResponse(BaseModel):
     # Three-model fields
     model_used: Optional[str] = None
     upgrade_reasons: Optional[List[str]] = None
+    # Transcript turn this exchange was stored as, and the transcript's
+    # hash-chain digest after it
+    turn_index: Optional[int] = None
+    history_digest: Optional[str] = None
 
 # ---------------------------------------------------------------------------
 # Public API  (called by chat.py)
 # ---------------------------------------------------------------------------
 
-async def get_coaching_response(request: CoachingRequest) -> CoachingResponse:
-    """Delegate to the three-model Claude service."""
-    history = [{"role": m.role, "content": m.content} for m in (request.history or [])]
-
-    result = await get_coaching_response_claude(
-        message=request.message,
-        history=history,
-        user_id=request.user_id or "anonymous",
-        coaching_style=request.coaching_style,
-        context=request.context,
-    )
-
+def _to_coaching_response(result: dict) -> CoachingResponse:
     return CoachingResponse(
         response=result.get("response", ""),
         quick_replies=result.get("quick_replies", []),
@@ -102,8 +103,57 @@ async def get_coaching_response(request: CoachingRequest) -> CoachingResponse:
         outcome_prediction=result.get("outcome_prediction"),
         model_used=result.get("model_used"),
         upgrade_reasons=result.get("upgrade_reasons"),
+        turn_index=result.get("turn_index"),
+        history_digest=result.get("history_digest"),
+    )
+
+
+def _history_dicts(request: CoachingRequest) -> Optional[List[dict]]:
+    if request.history is None:
+        return None
+    return [{"role": m.role, "content": m.content} for m in request.history]
+
+
+async def get_coaching_response(request: CoachingRequest) -> CoachingResponse:
+    """Delegate to the three-model Claude service."""
+    history = _history_dicts(request)
+
+    result = await get_coaching_response_claude(
+        message=request.message,
+        history=history,
+        user_id=request.user_id or "anonymous",
+        coaching_style=request.coaching_style,
+        context=request.context,
+        session_id=request.session_id,
+        last_turn_index=request.last_turn_index,
     )
 
+    return _to_coaching_response(result)
+
+
+async def stream_coaching_response(request: CoachingRequest) -> AsyncIterator[Tuple[str, Any]]:
+    """
+    Delegate to the streaming Claude service.
+
+    Yields ("meta", dict) and ("token", str) events, then a final
+    ("result", CoachingResponse).
+    """
+    history = _history_dicts(request)
+
+    async for kind, payload in stream_coaching_response_claude(
+        message=request.message,
+        history=history,
+        user_id=request.user_id or "anonymous",
+        coaching_style=request.coaching_style,
+        context=request.context,
+        session_id=request.session_id,
+        last_turn_index=request.last_turn_index,
+    ):
+        if kind == "result":
+            yield kind, _to_coaching_response(payload)
+        else:
+            yield kind, payload
+
 
 async def generate_session_summary(messages: List[dict], user_id: str = "anonymous") -> dict:
     """Delegate to the Claude summary function."""
@@ -6,30 +6,41 @@ Opus 4.6    — complex/deep turns, ~10%          ($5/$25 per MTok)
 Haiku 4.5   — async background classification   ($1/$5  per MTok)
 
 Auto-upgrade from Sonnet → Opus on:
-  1. Conversation length > 40 turns  (long_context)
-  2. Complex multi-option decisions  (complex_decision)
-  3. Deep self-reflection / patterns (deep_reflection)
-  4. Strategic career planning       (strategic_planning)
-  5. Escalation risk: medium or high (escalation_prep)
-
-Haiku runs *after* the main response is returned (fire-and-forget) to:
-  - Classify escalation risk for the next turn
+  1. Complex multi-option decisions  (complex_decision)
+  2. Deep self-reflection / patterns (deep_reflection)
+  3. Strategic career planning       (strategic_planning)
+  4. Escalation risk: medium or high (escalation_prep)
+
+Conversation length alone never upgrades: long histories are compacted to
+a token budget instead (see history_compaction).
+
+Haiku runs *after* the main response is returned (on the background job
+queue, see background_jobs) to:
+  - Classify escalation risk for the next turn (unless the reply carried it
+    or the local classifier is confident; see escalation_classifier)
   - Extract goal updates
   - Generate background session tags
+  - Summarize older history for compaction
 """
 
 import os
 import json
 import asyncio
+import functools
 import logging
 import re
 from dataclasses import asdict, dataclass, field
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, AsyncIterator, Awaitable, Dict, List, Optional, Tuple, Union
 
 from app.services.style_router import route_style, STYLE_PROMPTS
 from app.services.emotion_analyzer import detect_emotion
 from app.services.context_engine import build_context_packet, infer_goal_link
-from app.services.memory_store import load_profile, save_profile, update_profile_from_turn
+from app.services.memory_store import ProfileSession, apply_turn_to_profile
+from app.services.transcript_store import Transcript, get_transcript_store
+from app.services.history_compaction import CompactedHistory, get_history_compactor
+from app.services.background_jobs import get_background_jobs
+from app.services.llm_dispatch import BACKGROUND, INTERACTIVE, SUMMARY, get_llm_dispatcher
+from app.services.escalation_classifier import confident_classification, log_label
 from app.services.emotion_engine import analyze_text_emotion, infer_context_triggers
 from app.services.behavior_tracker import update_behavior_signals, style_preference_shift
 from app.services.goal_architecture import (
@@ -37,6 +48,9 @@ from app.services.goal_architecture import (
     progressive_skill_building, outcome_prediction,
 )
 from app.prompts.proprietary_frameworks import get_framework_for_context
+from app.services.llm_clients import anthropic_api_keys, get_llm_clients
+from app.services.anthropic_keys import get_anthropic_key_pool
+from app.services.message_features import MessageFeatures, extract_features, keywords, pattern, word_pattern
 
 logger = logging.getLogger(__name__)
 
@@ -97,6 +111,39 @@ Hard limits per turn:
 - Ask at most one question total
 - Prefer one short paragraph and one concrete next step"""
 
+# Turn-independent instructions. Kept together with GROW_SYSTEM_PROMPT in the
+# first (cached) system block; anything that varies goes in later blocks.
+TURN_CONTRACT_PROMPT = "\n\n".join([
+    "Structure each turn: (1) brief acknowledgment, (2) one diagnostic question OR one concise recommendation, (3) one concrete next step only when enough context exists.",
+    "If the user message is broad (e.g., 'performance is slipping', 'I feel stuck', 'things are off'), ask one clarifying question first and avoid giving a long diagnosis.",
+    "If enforce_inquiry_first is true: ask exactly one clarifying question and avoid frameworks/advice lists in this turn.",
+    "Return ONLY valid JSON: {\"response\": string, \"quick_replies\": [string×4], \"suggested_actions\": [string]}. "
+    "quick_replies must be 3-8 words, user-selectable, tailored to the message. No markdown outside JSON.",
+    "response must be <=120 words and include at most one question mark total.",
+])
+
+STABLE_SYSTEM_PROMPT = f"{GROW_SYSTEM_PROMPT}\n\n{TURN_CONTRACT_PROMPT}"
+
+# Opt-in (INLINE_CLASSIFICATION_ENABLED): the coaching call also returns
+# what the background Haiku pass would, saving that call on most turns.
+CLASSIFICATION_CONTRACT_PROMPT = (
+    "Also add \"classification\" as the last JSON key: {\"escalation_risk\": \"none|low|medium|high\", "
+    "\"escalation_reason\": one sentence or null, \"goal_update\": the goal the user is working toward or null, "
+    "\"session_tags\": [1-3 short topic tags]}. Judge escalation risk from the whole conversation."
+)
+
+ESCALATION_RISKS = ("none", "low", "medium", "high")
+
+
+def _inline_classification_enabled() -> bool:
+    return os.getenv("INLINE_CLASSIFICATION_ENABLED", "false").strip().lower() in {"1", "true", "yes", "on"}
+
+
+def _stable_system_prompt() -> str:
+    if _inline_classification_enabled():
+        return f"{STABLE_SYSTEM_PROMPT}\n\n{CLASSIFICATION_CONTRACT_PROMPT}"
+    return STABLE_SYSTEM_PROMPT
+
 
 def _enforce_response_limits(text: str) -> str:
     """Enforce concise output and at most one question mark."""
@@ -123,63 +170,235 @@ def _enforce_response_limits(text: str) -> str:
     return "".join(out_chars)
 
 
+_LIMIT_STRIP_CHARS = " ,;:-"
+
+
+class _StreamingResponseLimits:
+    """
+    Incremental form of _enforce_response_limits.
+
+    Feeding the response text in arbitrary chunks and concatenating the
+    returned pieces plus finish() yields exactly what the batch function
+    returns for the whole text. Trailing " ,;:-" runs are held back because
+    the batch version strips them when the word budget truncates.
+    """
+
+    def __init__(self, max_words: int = 120) -> None:
+        self.max_words = max_words
+        self.truncated = False
+        self._words = 0
+        self._questions = 0
+        self._started = False
+        self._pending_space = False
+        self._held = ""
+
+    def feed(self, text: str) -> str:
+        if self.truncated or not text:
+            return ""
+        out: List[str] = []
+        for ch in text:
+            if ch.isspace():
+                if self._started:
+                    self._pending_space = True
+                continue
+            if self._pending_space or not self._started:
+                if self._words == self.max_words:
+                    self.truncated = True
+                    self._held = ""
+                    out.append("...")
+                    break
+                self._words += 1
+                if self._pending_space:
+                    self._held += " "
+                    self._pending_space = False
+                self._started = True
+            if ch in _LIMIT_STRIP_CHARS:
+                self._held += ch
+                continue
+            if ch in ("?", "？"):
+                self._questions += 1
+                if self._questions > 1:
+                    ch = "."
+            out.append(self._held)
+            out.append(ch)
+            self._held = ""
+        return "".join(out)
+
+    def finish(self) -> str:
+        held, self._held = self._held, ""
+        return "" if self.truncated else held
+
+
+_JSON_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+
+class _ResponseFieldExtractor:
+    """
+    Incrementally decode the top-level ``response`` string of the JSON
+    contract from a raw model stream, returning text as soon as it arrives.
+    Everything outside that string (fences, other keys) is skipped.
+    """
+
+    def __init__(self) -> None:
+        self.done = False
+        self._state = "scan"
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._key: List[str] = []
+        self._unicode: Optional[str] = None
+        self._high_surrogate: Optional[int] = None
+
+    def feed(self, chunk: str) -> str:
+        out: List[str] = []
+        for ch in chunk or "":
+            if self.done:
+                break
+            if self._state == "value":
+                self._feed_value(ch, out)
+            elif self._state == "colon":
+                if ch.isspace():
+                    continue
+                self._state = "open" if ch == ":" else "scan"
+                if ch != ":":
+                    self._feed_scan(ch)
+            elif self._state == "open":
+                if ch.isspace():
+                    continue
+                if ch == '"':
+                    self._state = "value"
+                else:
+                    self._state = "scan"
+                    self._feed_scan(ch)
+            else:
+                self._feed_scan(ch)
+        return "".join(out)
+
+    def _feed_scan(self, ch: str) -> None:
+        if self._in_string:
+            if self._escape:
+                self._escape = False
+                self._key.append(ch)
+            elif ch == "\\":
+                self._escape = True
+            elif ch == '"':
+                self._in_string = False
+                if self._depth == 1 and "".join(self._key) == "response":
+                    self._state = "colon"
+            else:
+                self._key.append(ch)
+            return
+        if ch in "{[":
+            self._depth += 1
+        elif ch in "}]":
+            self._depth -= 1
+        elif ch == '"':
+            self._in_string = True
+            self._key = []
+
+    def _feed_value(self, ch: str, out: List[str]) -> None:
+        if self._unicode is not None:
+            self._unicode += ch
+            if len(self._unicode) < 4:
+                return
+            try:
+                code = int(self._unicode, 16)
+            except ValueError:
+                code = 0xFFFD
+            self._unicode = None
+            if 0xD800 <= code <= 0xDBFF:
+                self._high_surrogate = code
+                return
+            if 0xDC00 <= code <= 0xDFFF and self._high_surrogate is not None:
+                code = 0x10000 + ((self._high_surrogate - 0xD800) << 10) + (code - 0xDC00)
+            self._high_surrogate = None
+            out.append(chr(code))
+            return
+        if self._escape:
+            self._escape = False
+            if ch == "u":
+                self._unicode = ""
+            else:
+                out.append(_JSON_ESCAPES.get(ch, ch))
+            return
+        if ch == "\\":
+            self._escape = True
+        elif ch == '"':
+            self.done = True
+        else:
+            out.append(ch)
+
+
 def _count_user_turns(history: List[Dict], current_message: str) -> int:
     prior_user_turns = sum(1 for h in history if (h.get("role") or "").lower() == "user")
     return prior_user_turns + (1 if (current_message or "").strip() else 0)
 
 
-def _is_context_rich(message: str) -> bool:
+_RICH_TIMEFRAME = pattern(
+    r"\b(today|this week|next week|q[1-4]|quarter|month|by friday|deadline|timeline)\b",
+    prefixes=("today", "this week", "next week", "q", "month", "by friday", "deadline", "timeline"),
+)
+_RICH_STAKEHOLDERS = word_pattern("manager", "team", "vp", "director", "peer", "stakeholder", "customer", "client")
+_RICH_METRICS = word_pattern("kpi", "metric", "revenue", "churn", "quality", "defect", "missed", "late", "throughput", "performance")
+_RICH_EVENTS = word_pattern("reorg", "launch", "incident", "handoff", "meeting", "review", "retro", "1:1", "one-on-one")
+
+
+def _is_context_rich(message: str, features: Optional[MessageFeatures] = None) -> bool:
     """
     Heuristic: context is rich when at least two specificity signals are present.
     Signals: timeframe, stakeholders/team, metrics/symptoms, concrete events.
     """
-    m = (message or "").lower()
+    f = features or extract_features(message)
 
-    timeframe = bool(re.search(r"\b(today|this week|next week|q[1-4]|quarter|month|by friday|deadline|timeline)\b", m))
-    stakeholders = bool(re.search(r"\b(manager|team|vp|director|peer|stakeholder|customer|client)\b", m))
-    metrics = bool(re.search(r"\b(kpi|metric|revenue|churn|quality|defect|missed|late|throughput|performance)\b", m))
-    events = bool(re.search(r"\b(reorg|launch|incident|handoff|meeting|review|retro|1:1|one-on-one)\b", m))
+    timeframe = f.matches(_RICH_TIMEFRAME)
+    stakeholders = f.matches(_RICH_STAKEHOLDERS)
+    metrics = f.matches(_RICH_METRICS)
+    events = f.matches(_RICH_EVENTS)
 
     signals = sum([timeframe, stakeholders, metrics, events])
     return signals >= 2
 
 
-def _build_clarifying_question(message: str) -> str:
-    m = (message or "").lower()
-    if "performance" in m or "team" in m:
+_CLARIFY_PERFORMANCE = keywords("performance", "team")
+_CLARIFY_STUCK = keywords("stuck", "off")
+_CLARIFY_CONFLICT = keywords("conflict", "manager", "boss")
+_CLARIFY_PRIORITY = keywords("priority", "overwhelm", "busy")
+
+
+def _build_clarifying_question(message: str, features: Optional[MessageFeatures] = None) -> str:
+    f = features or extract_features(message)
+    if f.any(_CLARIFY_PERFORMANCE):
         return "Which part is slipping most right now: quality, speed, or ownership?"
-    if "stuck" in m or "off" in m:
+    if f.any(_CLARIFY_STUCK):
         return "What specific moment this week made you feel most stuck?"
-    if "conflict" in m or "manager" in m or "boss" in m:
+    if f.any(_CLARIFY_CONFLICT):
         return "What is the exact conversation you are avoiding right now?"
-    if "priority" in m or "overwhelm" in m or "busy" in m:
+    if f.any(_CLARIFY_PRIORITY):
         return "If you could solve only one thing this week, what would create the biggest relief?"
     return "What is the single most important outcome you need from this situation this week?"
 
 
-def _is_broad_problem_statement(message: str) -> bool:
-    m = (message or "").lower()
-    broad_markers = [
-        "slipping", "stuck", "off", "not sure", "uncertain", "overwhelmed",
-        "burnout", "things are off", "team performance", "isn't working",
-    ]
-    specific_request_markers = [
-        "strategy", "plan", "framework", "negotiate", "script", "decision",
-        "job offer", "promotion", "trade-off", "options", "roadmap",
-    ]
-    has_broad_marker = any(k in m for k in broad_markers)
-    has_specific_request = any(k in m for k in specific_request_markers)
+_BROAD_MARKERS = keywords(
+    "slipping", "stuck", "off", "not sure", "uncertain", "overwhelmed",
+    "burnout", "things are off", "team performance", "isn't working",
+)
+_SPECIFIC_REQUEST_MARKERS = keywords(
+    "strategy", "plan", "framework", "negotiate", "script", "decision",
+    "job offer", "promotion", "trade-off", "options", "roadmap",
+)
+_ASK_MARKERS = keywords("how do i", "help me", "what should i do", "give me")
+
+
+def _is_broad_problem_statement(message: str, features: Optional[MessageFeatures] = None) -> bool:
+    f = features or extract_features(message)
+    has_broad_marker = f.any(_BROAD_MARKERS)
+    has_specific_request = f.any(_SPECIFIC_REQUEST_MARKERS)
     return has_broad_marker and not has_specific_request
 
 
-def _is_specific_request(message: str) -> bool:
-    m = (message or "").lower()
-    specific_request_markers = [
-        "strategy", "plan", "framework", "negotiate", "script", "decision",
-        "job offer", "promotion", "trade-off", "options", "roadmap",
-        "how do i", "help me", "what should i do", "give me",
-    ]
-    return any(k in m for k in specific_request_markers)
+def _is_specific_request(message: str, features: Optional[MessageFeatures] = None) -> bool:
+    f = features or extract_features(message)
+    return f.any(_SPECIFIC_REQUEST_MARKERS) or f.any(_ASK_MARKERS)
 
 
 @dataclass
@@ -196,111 +415,113 @@ class ConversationSignals:
 _STAGE_ORDER = ["diagnose", "reframe", "options", "commit"]
 
 
-def _extract_topic_signature(message: str) -> List[str]:
-    m = (message or "").lower()
-    keyword_groups = [
-        ("trust", r"\btrust\b"),
-        ("stakeholder", r"\bstakeholder\b"),
-        ("manager", r"\b(manager|boss|supervisor)\b"),
-        ("team", r"\bteam\b"),
-        ("performance", r"\b(performance|underperformance|slipping|quality|kpi|metric)\b"),
-        ("promotion", r"\b(promotion|raise|level up|career growth)\b"),
-        ("conflict", r"\b(conflict|tension|pushback|friction)\b"),
-        ("burnout", r"\b(burnout|overwhelm|overwhelmed|stress|stressed)\b"),
-        ("priority", r"\b(priority|prioritization|trade-off|focus)\b"),
-        ("deadline", r"\b(deadline|by friday|timeline|due date|q[1-4]|quarter)\b"),
-        ("reorg", r"\b(reorg|re-?org|restructure|headcount|budget)\b"),
-        ("career", r"\b(career|pivot|transition|new role|job offer|offer)\b"),
-    ]
-
-    topics: List[str] = []
-    for label, pattern in keyword_groups:
-        if re.search(pattern, m):
-            topics.append(label)
+_TOPIC_PATTERNS = [
+    ("trust", word_pattern("trust")),
+    ("stakeholder", word_pattern("stakeholder")),
+    ("manager", word_pattern("manager", "boss", "supervisor")),
+    ("team", word_pattern("team")),
+    ("performance", word_pattern("performance", "underperformance", "slipping", "quality", "kpi", "metric")),
+    ("promotion", word_pattern("promotion", "raise", "level up", "career growth")),
+    ("conflict", word_pattern("conflict", "tension", "pushback", "friction")),
+    ("burnout", word_pattern("burnout", "overwhelm", "overwhelmed", "stress", "stressed")),
+    ("priority", word_pattern("priority", "prioritization", "trade-off", "focus")),
+    ("deadline", pattern(
+        r"\b(deadline|by friday|timeline|due date|q[1-4]|quarter)\b",
+        prefixes=("deadline", "by friday", "timeline", "due date", "q"),
+    )),
+    ("reorg", pattern(
+        r"\b(reorg|re-?org|restructure|headcount|budget)\b", prefixes=("re", "headcount", "budget"),
+    )),
+    ("career", word_pattern("career", "pivot", "transition", "new role", "job offer", "offer")),
+]
+
+
+def _extract_topic_signature(message: str, features: Optional[MessageFeatures] = None) -> List[str]:
+    f = features or extract_features(message)
+    topics: List[str] = [label for label, source in _TOPIC_PATTERNS if f.matches(source)]
     return topics[:4]
 
 
-def _extract_conversation_signals(message: str) -> ConversationSignals:
-    m = (message or "").lower()
-
-    stakeholder = None
-    for label, pattern in [
-        ("manager", r"\b(manager|boss|supervisor|lead)\b"),
-        ("team", r"\bteam\b"),
-        ("peer", r"\b(peer|colleague)\b"),
-        ("stakeholder", r"\bstakeholder\b"),
-        ("customer", r"\b(customer|client)\b"),
-    ]:
-        if re.search(pattern, m):
-            stakeholder = label
-            break
-
-    outcome = None
-    for label, pattern in [
-        ("trust", r"\btrust\b"),
-        ("promotion", r"\b(promotion|raise|level up)\b"),
-        ("alignment", r"\b(alignment|align)\b"),
-        ("underperformance", r"\b(underperformance|performance|slipping|missed)\b"),
-        ("conflict_resolution", r"\b(conflict|resolve|tension|pushback)\b"),
-        ("prioritization", r"\b(priority|prioritize|overwhelm|focus)\b"),
-        ("career_transition", r"\b(career pivot|transition|new role|job offer)\b"),
-    ]:
-        if re.search(pattern, m):
-            outcome = label
-            break
-
-    example_match = re.search(
-        r"\b(yesterday|last week|last month|in (?:the )?(?:meeting|review|retro|1:1|one-on-one)|after the|when we|when i)\b",
-        m,
-    )
-    example = example_match.group(0) if example_match else None
+_STAKEHOLDER_PATTERNS = [
+    ("manager", word_pattern("manager", "boss", "supervisor", "lead")),
+    ("team", word_pattern("team")),
+    ("peer", word_pattern("peer", "colleague")),
+    ("stakeholder", word_pattern("stakeholder")),
+    ("customer", word_pattern("customer", "client")),
+]
+_OUTCOME_PATTERNS = [
+    ("trust", word_pattern("trust")),
+    ("promotion", word_pattern("promotion", "raise", "level up")),
+    ("alignment", word_pattern("alignment", "align")),
+    ("underperformance", word_pattern("underperformance", "performance", "slipping", "missed")),
+    ("conflict_resolution", word_pattern("conflict", "resolve", "tension", "pushback")),
+    ("prioritization", word_pattern("priority", "prioritize", "overwhelm", "focus")),
+    ("career_transition", word_pattern("career pivot", "transition", "new role", "job offer")),
+]
+_EXAMPLE_PATTERN = pattern(
+    r"\b(yesterday|last week|last month|in (?:the )?(?:meeting|review|retro|1:1|one-on-one)|after the|when we|when i)\b",
+    prefixes=("yesterday", "last week", "last month", "in ", "after the", "when we", "when i"),
+)
+_TIMEFRAME_PATTERN = pattern(
+    r"\b(today|this week|next week|this month|next month|q[1-4]|quarter|by friday|deadline|timeline)\b",
+    prefixes=("today", "this week", "next week", "this month", "next month", "q", "by friday", "deadline", "timeline"),
+)
+_CONSTRAINT_PATTERN = word_pattern(
+    "budget", "deadline", "headcount", "time", "resources", "reorg", "politics", "capacity", "bandwidth",
+)
+_LEANING_PATTERNS = [
+    ("action", word_pattern("plan", "implement", "execute", "do next", "next step", "script")),
+    ("advice", word_pattern("strategy", "framework", "advice", "recommend")),
+    ("explore", word_pattern("explore", "think through", "understand", "unpack")),
+    ("clarify", word_pattern("not sure", "uncertain", "confused", "unclear")),
+]
 
-    timeframe_match = re.search(
-        r"\b(today|this week|next week|this month|next month|q[1-4]|quarter|by friday|deadline|timeline)\b",
-        m,
-    )
-    timeframe = timeframe_match.group(0) if timeframe_match else None
 
-    constraint_match = re.search(
-        r"\b(budget|deadline|headcount|time|resources|reorg|politics|capacity|bandwidth)\b",
-        m,
-    )
-    constraint = constraint_match.group(0) if constraint_match else None
-
-    leaning = None
-    if re.search(r"\b(plan|implement|execute|do next|next step|script)\b", m):
-        leaning = "action"
-    elif re.search(r"\b(strategy|framework|advice|recommend)\b", m):
-        leaning = "advice"
-    elif re.search(r"\b(explore|think through|understand|unpack)\b", m):
-        leaning = "explore"
-    elif re.search(r"\b(not sure|uncertain|confused|unclear)\b", m):
-        leaning = "clarify"
+def _first_label(f: MessageFeatures, labelled: List[Tuple[str, str]]) -> Optional[str]:
+    for label, source in labelled:
+        if f.matches(source):
+            return label
+    return None
 
+
+def _extract_conversation_signals(message: str, features: Optional[MessageFeatures] = None) -> ConversationSignals:
+    f = features or extract_features(message)
     return ConversationSignals(
-        stakeholder=stakeholder,
-        outcome=outcome,
-        example=example,
-        timeframe=timeframe,
-        constraint=constraint,
-        leaning=leaning,
-        topic_signature=_extract_topic_signature(message),
+        stakeholder=_first_label(f, _STAKEHOLDER_PATTERNS),
+        outcome=_first_label(f, _OUTCOME_PATTERNS),
+        example=f.search(_EXAMPLE_PATTERN),
+        timeframe=f.search(_TIMEFRAME_PATTERN),
+        constraint=f.search(_CONSTRAINT_PATTERN),
+        leaning=_first_label(f, _LEANING_PATTERNS),
+        topic_signature=_extract_topic_signature(message, f),
     )
 
 
-def _is_user_confused(message: str) -> bool:
-    m = (message or "").lower()
-    return bool(re.search(r"\b(not sure|uncertain|confused|unclear|lost|not following|don't understand)\b", m))
+_CONFUSED_PATTERN = word_pattern("not sure", "uncertain", "confused", "unclear", "lost", "not following", "don't understand")
+_HARD_SHIFT_PATTERN = word_pattern("different topic", "another topic", "switch gears", "unrelated", "separate issue", "on another note")
+_SOFT_SHIFT_PATTERN = pattern(
+    r"\b(anyway|separately|also,? new issue|side note)\b", prefixes=("anyway", "separately", "also", "side note"),
+)
 
 
-def _detect_topic_shift(message: str, previous_topics: List[str], current_topics: List[str]) -> bool:
-    m = (message or "").lower()
-    if re.search(r"\b(different topic|another topic|switch gears|unrelated|separate issue|on another note)\b", m):
+def _is_user_confused(message: str, features: Optional[MessageFeatures] = None) -> bool:
+    f = features or extract_features(message)
+    return f.matches(_CONFUSED_PATTERN)
+
+
+def _detect_topic_shift(
+    message: str,
+    previous_topics: List[str],
+    current_topics: List[str],
+    features: Optional[MessageFeatures] = None,
+) -> bool:
+    f = features or extract_features(message)
+    if f.matches(_HARD_SHIFT_PATTERN):
         return True
 
     prev = set(previous_topics or [])
     curr = set(current_topics or [])
-    has_soft_shift_cue = bool(re.search(r"\b(anyway|separately|also,? new issue|side note)\b", m))
+    has_soft_shift_cue = f.matches(_SOFT_SHIFT_PATTERN)
     if has_soft_shift_cue and prev and curr and not (prev & curr) and len(prev) >= 2 and len(curr) >= 2:
         return True
     return False
@@ -450,28 +671,121 @@ def _select_internal_persona(
         return "challenger", "style_advise_plan"
     return "supportive", "default"
 
+# ---------------------------------------------------------------------------
+# Prompt caching
+# ---------------------------------------------------------------------------
+
+def _prompt_cache_enabled() -> bool:
+    return os.getenv("PROMPT_CACHE_ENABLED", "true").strip().lower() in {"1", "true", "yes", "on"}
+
+
+def _build_system_blocks(
+    stable: List[Optional[str]],
+    session: List[Optional[str]],
+    turn: List[Optional[str]],
+) -> List[Dict[str, Any]]:
+    """
+    Return Anthropic system content blocks in stable → per-session → per-turn
+    order. The stable and per-session blocks end with a cache_control
+    breakpoint so repeat turns only pay full price for the per-turn tail.
+    """
+    blocks: List[Dict[str, Any]] = []
+    for parts, cacheable in ((stable, True), (session, True), (turn, False)):
+        text = "\n\n".join(filter(None, parts))
+        if not text:
+            continue
+        block: Dict[str, Any] = {"type": "text", "text": text}
+        if cacheable and _prompt_cache_enabled():
+            block["cache_control"] = {"type": "ephemeral"}
+        blocks.append(block)
+    return blocks
+
+
+@dataclass
+class PromptCacheStats:
+    requests: int = 0
+    input_tokens: int = 0
+    output_tokens: int = 0
+    cache_creation_input_tokens: int = 0
+    cache_read_input_tokens: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.input_tokens + self.cache_creation_input_tokens + self.cache_read_input_tokens
+        return round(self.cache_read_input_tokens / total, 4) if total else 0.0
+
+
+_prompt_cache_stats: Dict[str, PromptCacheStats] = {}
+
+
+def _usage_dict(usage: Any) -> Dict[str, int]:
+    fields = ("input_tokens", "output_tokens", "cache_creation_input_tokens", "cache_read_input_tokens")
+    return {f: int(getattr(usage, f, 0) or 0) for f in fields}
+
+
+def _record_usage(model: str, usage: Any, sink: Optional[Dict[str, Any]] = None) -> None:
+    """Accumulate per-model token/caching counters and copy them into sink."""
+    if usage is None:
+        return
+    counts = _usage_dict(usage)
+    stats = _prompt_cache_stats.setdefault(model, PromptCacheStats())
+    stats.requests += 1
+    for name, value in counts.items():
+        setattr(stats, name, getattr(stats, name) + value)
+    logger.debug(
+        "Claude usage model=%s input=%d cache_write=%d cache_read=%d output=%d",
+        model, counts["input_tokens"], counts["cache_creation_input_tokens"],
+        counts["cache_read_input_tokens"], counts["output_tokens"],
+    )
+    if sink is not None:
+        sink.update(counts)
+
+
+def prompt_cache_stats() -> Dict[str, Any]:
+    return {
+        model: {**asdict(stats), "hit_rate": stats.hit_rate}
+        for model, stats in _prompt_cache_stats.items()
+    }
+
 # ---------------------------------------------------------------------------
 # Client helpers
 # ---------------------------------------------------------------------------
 
 def _anthropic_available() -> bool:
-    return bool(os.getenv("ANTHROPIC_API_KEY"))
+    return bool(anthropic_api_keys())
 
 def _openai_available() -> bool:
     return bool(os.getenv("OPENAI_API_KEY"))
 
 def _get_anthropic_client():
-    from anthropic import AsyncAnthropic
-    return AsyncAnthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
+    return get_llm_clients().anthropic()
+
+def _get_openai_client():
+    return get_llm_clients().openai()
 
 # ---------------------------------------------------------------------------
 # Model selection  (Sonnet → Opus auto-upgrade)
 # ---------------------------------------------------------------------------
 
+_COMPLEX_DECISION_KEYWORDS = keywords(
+    "job offer", "multiple offers", "should i choose",
+    "trade-off", "权衡", "多个选择", "难以决定",
+)
+_DEEP_REFLECTION_KEYWORDS = keywords(
+    "i don't know why", "self-sabotage", "pattern",
+    "为什么我总是", "自我破坏", "深层原因",
+)
+_STRATEGIC_PLANNING_KEYWORDS = keywords(
+    "career pivot", "5 year plan", "long-term",
+    "职业转型", "长期规划", "战略",
+)
+
+
 def select_model(
     conversation_history: List[Dict],
     current_message: str,
     user_context: Optional[Dict] = None,
+    features: Optional[MessageFeatures] = None,
 ) -> Tuple[str, List[str]]:
     """
     Return (model_id, upgrade_reasons).
@@ -482,34 +796,21 @@ def select_model(
 
     upgrade_signals: List[str] = []
 
-    # 1. Long context
-    if len(conversation_history) > 40:
-        upgrade_signals.append("long_context")
+    f = features or extract_features(current_message)
 
-    msg = current_message.lower()
-
-    # 2. Complex decision
-    if any(kw in msg for kw in [
-        "job offer", "multiple offers", "should i choose",
-        "trade-off", "权衡", "多个选择", "难以决定",
-    ]):
+    # 1. Complex decision
+    if f.any(_COMPLEX_DECISION_KEYWORDS):
         upgrade_signals.append("complex_decision")
 
-    # 3. Deep reflection
-    if any(kw in msg for kw in [
-        "i don't know why", "self-sabotage", "pattern",
-        "为什么我总是", "自我破坏", "深层原因",
-    ]):
+    # 2. Deep reflection
+    if f.any(_DEEP_REFLECTION_KEYWORDS):
         upgrade_signals.append("deep_reflection")
 
-    # 4. Strategic planning
-    if any(kw in msg for kw in [
-        "career pivot", "5 year plan", "long-term",
-        "职业转型", "长期规划", "战略",
-    ]):
+    # 3. Strategic planning
+    if f.any(_STRATEGIC_PLANNING_KEYWORDS):
         upgrade_signals.append("strategic_planning")
 
-    # 5. Escalation risk from previous Haiku pass
+    # 4. Escalation risk from previous Haiku pass
     if user_context.get("escalation_risk") in ("medium", "high"):
         upgrade_signals.append("escalation_prep")
 
@@ -519,31 +820,117 @@ def select_model(
 # ---------------------------------------------------------------------------
 # Core Claude call  (used by both Sonnet/Opus and Haiku paths)
 # ---------------------------------------------------------------------------
+# Callers hold an llm_dispatch slot around every provider call, so the calls
+# are scheduled by priority class: interactive > summary > background. Each
+# Claude call then leases the pool key with the most rate-limit headroom
+# (see anthropic_keys).
+
+def _estimated_request_tokens(system: Union[str, List[Dict[str, Any]]], messages: List[Dict], max_tokens: int) -> int:
+    # About four characters per token; only used to reserve rate-limit budget.
+    text = len(system) if isinstance(system, str) else sum(len(str(b.get("text", ""))) for b in system or [])
+    return (text + sum(len(str(m.get("content", ""))) for m in messages)) // 4 + max_tokens
+
 
 async def _claude_complete(
     model: str,
-    system: str,
+    system: Union[str, List[Dict[str, Any]]],
     messages: List[Dict],
     max_tokens: int = 800,
+    usage: Optional[Dict[str, Any]] = None,
 ) -> str:
     """Call Claude API and return the response text."""
     client = _get_anthropic_client()
     kwargs: Dict = dict(model=model, max_tokens=max_tokens, messages=messages)
     if system:
         kwargs["system"] = system
-    response = await client.messages.create(**kwargs)
+    pool = get_anthropic_key_pool()
+    lease = await pool.acquire(_estimated_request_tokens(system, messages, max_tokens))
+    try:
+        response = await client.messages.create(**kwargs, extra_headers=lease.headers)
+    finally:
+        await pool.release(lease)
+    _record_usage(model, getattr(response, "usage", None), usage)
     for block in response.content:
         if hasattr(block, "text"):
             return block.text
     return ""
 
+async def _claude_stream(
+    model: str,
+    system: Union[str, List[Dict[str, Any]]],
+    messages: List[Dict],
+    max_tokens: int = 800,
+    usage: Optional[Dict[str, Any]] = None,
+) -> AsyncIterator[str]:
+    """Call Claude with the streaming API and yield raw text deltas."""
+    client = _get_anthropic_client()
+    kwargs: Dict = dict(model=model, max_tokens=max_tokens, messages=messages)
+    if system:
+        kwargs["system"] = system
+    pool = get_anthropic_key_pool()
+    lease = await pool.acquire(_estimated_request_tokens(system, messages, max_tokens))
+    try:
+        async with client.messages.stream(**kwargs, extra_headers=lease.headers) as stream:
+            async for text in stream.text_stream:
+                yield text
+            final = await stream.get_final_message()
+    finally:
+        await pool.release(lease)
+    _record_usage(model, getattr(final, "usage", None), usage)
+
+
+async def _single_chunk(pending: Awaitable[str]) -> AsyncIterator[str]:
+    """Adapt a non-streaming completion to the chunk-iterator interface."""
+    yield await pending
+
+
+_CHUNKS_DONE = object()
+
+
+async def _read_in_slot(chunks: AsyncIterator[str], priority: str, user_id: str, cost: int) -> AsyncIterator[str]:
+    """
+    Read ``chunks`` to the end inside a dispatcher slot on a separate task
+    and yield them from a queue, so the slot and the provider's key lease
+    are held for as long as the provider streams, not for as long as the
+    consumer takes. Closing this iterator early cancels the read and closes
+    ``chunks``.
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def pump() -> None:
+        try:
+            async with get_llm_dispatcher().slot(priority, user_id, cost=cost):
+                async for chunk in chunks:
+                    queue.put_nowait(chunk)
+            queue.put_nowait(_CHUNKS_DONE)
+        except Exception as exc:
+            queue.put_nowait(exc)
+        finally:
+            await chunks.aclose()
+
+    reader = asyncio.create_task(pump())
+    try:
+        while True:
+            item = await queue.get()
+            if item is _CHUNKS_DONE:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        if not reader.done():
+            reader.cancel()
+            try:
+                await reader
+            except asyncio.CancelledError:
+                pass
+
 # ---------------------------------------------------------------------------
 # OpenAI fallback  (if ANTHROPIC_API_KEY is absent)
 # ---------------------------------------------------------------------------
 
 async def _openai_complete(messages: List[Dict], max_tokens: int = 800) -> str:
-    from openai import AsyncOpenAI
-    client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    client = _get_openai_client()
     resp = await client.chat.completions.create(
         model="gpt-4",
         messages=messages,
@@ -556,6 +943,21 @@ async def _openai_complete(messages: List[Dict], max_tokens: int = 800) -> str:
 # Haiku: async background classifier  (fire-and-forget)
 # ---------------------------------------------------------------------------
 
+_classification_counts: Dict[str, int] = {"inline": 0, "inline_missing": 0, "local": 0, "background": 0}
+
+
+def classification_stats() -> Dict[str, int]:
+    return dict(_classification_counts)
+
+
+def _apply_classification(profile: Dict[str, Any], result: Dict[str, Any]) -> None:
+    profile["escalation_risk"]  = result.get("escalation_risk", "none")
+    profile["escalation_reason"] = result.get("escalation_reason")
+    profile["session_tags"]     = result.get("session_tags", [])
+    if result.get("goal_update"):
+        profile["active_goal"] = result["goal_update"]
+
+
 async def _haiku_classify(user_id: str, message: str, response_text: str) -> Dict:
     """
     Run Haiku in the background after the main response is sent.
@@ -576,12 +978,13 @@ Return:
   "session_tags": ["tag1", "tag2"]
 }}"""
 
-        raw = await _claude_complete(
-            model=HAIKU,
-            system="You are a coaching session classifier. Return only valid JSON, no prose.",
-            messages=[{"role": "user", "content": prompt}],
-            max_tokens=200,
-        )
+        async with get_llm_dispatcher().slot(BACKGROUND, user_id, cost=200):
+            raw = await _claude_complete(
+                model=HAIKU,
+                system="You are a coaching session classifier. Return only valid JSON, no prose.",
+                messages=[{"role": "user", "content": prompt}],
+                max_tokens=200,
+            )
 
         start, end = raw.find("{"), raw.rfind("}") + 1
         if start != -1 and end > start:
@@ -590,13 +993,12 @@ Return:
             result = {}
 
         # Persist so select_model can read escalation_risk next turn
-        profile = load_profile(user_id) or {}
-        profile["escalation_risk"]  = result.get("escalation_risk", "none")
-        profile["escalation_reason"] = result.get("escalation_reason")
-        profile["session_tags"]     = result.get("session_tags", [])
-        if result.get("goal_update"):
-            profile["active_goal"] = result["goal_update"]
-        save_profile(user_id, profile)
+        # Blind field-level patch: no read, and the turn's own fields survive.
+        session = ProfileSession(user_id)
+        _apply_classification(session.profile, result)
+        await session.flush()
+        # Training data for the local classifier (ESCALATION_LABEL_LOG).
+        await asyncio.to_thread(log_label, message, response_text, result)
 
         return result
 
@@ -604,26 +1006,60 @@ Return:
         logger.warning("Haiku classifier failed (non-fatal): %s", exc)
         return {}
 
+
+async def _haiku_summarize(previous: Optional[str], messages: List[Dict], user_id: str = "anonymous") -> str:
+    """Summarize older history for compaction, folding in the previous summary."""
+    conversation = "\n".join(
+        f"{'User' if m.get('role') == 'user' else 'Coach'}: {m.get('content', '')}" for m in messages
+    )
+    earlier = f"Summary so far:\n{previous}\n\nConversation since then:\n" if previous else "Conversation:\n"
+    prompt = (
+        f"{earlier}{conversation}\n\n"
+        "Write an updated summary of this coaching conversation in under 200 words: the user's situation, "
+        "goals, constraints, what has been tried or decided, and open questions. Plain prose, no preamble."
+    )
+    max_tokens = get_history_compactor().summary_max_tokens
+    async with get_llm_dispatcher().slot(BACKGROUND, user_id, cost=max_tokens):
+        return await _claude_complete(
+            model=HAIKU,
+            system="You compress coaching conversations into faithful, concise summaries.",
+            messages=[{"role": "user", "content": prompt}],
+            max_tokens=max_tokens,
+        )
+
 # ---------------------------------------------------------------------------
 # Quick-reply generation  (rule-based, no extra LLM call)
 # ---------------------------------------------------------------------------
 
-def _generate_quick_replies(user_message: str, ai_response: str, context: Optional[str] = None) -> List[str]:
-    user  = (user_message or "").lower()
+_QR_COMPENSATION = keywords("promotion", "raise", "salary", "compensation")
+_QR_TRANSITION = keywords("switch", "change career", "transition", "new role")
+_QR_PEOPLE = keywords("team", "manager", "leadership", "conflict", "boss")
+_QR_STUCK = keywords("stuck", "overwhelmed", "burnout", "stress")
+_QR_DECISION = keywords("job offer", "multiple offers", "should i choose")
+
+
+def _generate_quick_replies(
+    user_message: str,
+    ai_response: str,
+    context: Optional[str] = None,
+    features: Optional[MessageFeatures] = None,
+) -> List[str]:
+    user  = features or extract_features(user_message)
     coach = (ai_response  or "").lower()
     options: List[str] = ["Tell me more"]
 
-    if any(k in user for k in ["promotion", "raise", "salary", "compensation"]):
+    if user.any(_QR_COMPENSATION):
         options += ["How do I negotiate this?", "What proof should I prepare?"]
-    if any(k in user for k in ["switch", "change career", "transition", "new role"]):
+    if user.any(_QR_TRANSITION):
         options += ["How do I de-risk this?", "What's my 30-60-90 day plan?"]
-    if any(k in user for k in ["team", "manager", "leadership", "conflict", "boss"]):
+    if user.any(_QR_PEOPLE):
         options += ["How should I handle this?", "Give me a script"]
-    if any(k in user for k in ["stuck", "overwhelmed", "burnout", "stress"]):
+    if user.any(_QR_STUCK):
         options += ["Help me prioritize", "What's the smallest next action?"]
-    if any(k in user for k in ["job offer", "multiple offers", "should i choose"]):
+    if user.any(_QR_DECISION):
         options += ["Walk me through the trade-offs", "What questions should I ask?"]
 
+    # The coach reply is not part of the message scan; three short checks.
     if any(k in coach for k in ["goal", "achieve", "outcome"]):
         options.append("Let's define the exact goal")
     if any(k in coach for k in ["option", "choice", "alternative"]):
@@ -645,13 +1081,15 @@ def _generate_quick_replies(user_message: str, ai_response: str, context: Option
 # Crisis detection  (unchanged logic from llm.py)
 # ---------------------------------------------------------------------------
 
-def _detect_crisis(message: str) -> bool:
-    keywords = [
-        "suicide", "kill myself", "end my life", "want to die",
-        "hurt myself", "no reason to live", "better off dead",
-    ]
-    m = message.lower()
-    return any(k in m for k in keywords)
+_CRISIS_KEYWORDS = keywords(
+    "suicide", "kill myself", "end my life", "want to die",
+    "hurt myself", "no reason to live", "better off dead",
+)
+
+
+def _detect_crisis(message: str, features: Optional[MessageFeatures] = None) -> bool:
+    f = features or extract_features(message)
+    return f.any(_CRISIS_KEYWORDS)
 
 def _crisis_response() -> str:
     return (
@@ -669,54 +1107,82 @@ def _crisis_response() -> str:
 # Main coaching response
 # ---------------------------------------------------------------------------
 
-async def get_coaching_response_claude(
-    message: str,
-    history: Optional[List[Dict]] = None,
-    user_id: str = "anonymous",
-    coaching_style: Optional[str] = None,
-    context: Optional[str] = None,
-) -> Dict:
-    """
-    Primary entry point for the three-model architecture.
-
-    Flow:
-      1. Crisis check  → immediate return (no model needed)
-      2. select_model  → Sonnet or Opus based on signals
-      3. Claude call   → coaching response
-      4. Haiku task    → fire-and-forget background classification
-    """
-    if history is None:
-        history = []
+@dataclass
+class _TurnPlan:
+    """Everything computed locally for one turn before the model is called."""
+    message: str
+    history: List[Dict]
+    user_id: str
+    context: Optional[str]
+    emotion: str
+    style_used: str
+    goal_link: str
+    ei: Any
+    ctx_triggers: Dict[str, str]
+    goal_hierarchy: Dict[str, List[str]]
+    goal_anchor: str
+    session_id: Optional[str]
+    session_state: Dict[str, Any]
+    session_entry: Dict[str, Any]
+    pre_state_rev: int
+    signals: ConversationSignals
+    stage: str
+    stage_reason: str
+    topic_shift: bool
+    user_turn_count: int
+    persona_used: str
+    persona_override_reason: str
+    model: str
+    upgrade_reasons: List[str]
+    system: str
+    system_blocks: List[Dict[str, Any]]
+    messages: List[Dict]
+    features: MessageFeatures
+    # Whether the exchange is appended to the session transcript.
+    record_transcript: bool = False
+    history_compaction: Dict[str, int] = field(default_factory=dict)
+
+
+def _crisis_result() -> Dict:
+    return {
+        "response": _crisis_response(),
+        "quick_replies": ["I'm safe, thanks", "I need to talk to someone", "Find professional help"],
+        "style_used": "supportive",
+        "emotion_detected": "distressed",
+        "goal_link": "wellbeing_first",
+        "emotion_primary": "high_stress",
+        "model_used": None,
+        "upgrade_reasons": [],
+    }
 
-    # ── Crisis gate ──────────────────────────────────────────────────────
-    if _detect_crisis(message):
-        return {
-            "response": _crisis_response(),
-            "quick_replies": ["I'm safe, thanks", "I need to talk to someone", "Find professional help"],
-            "style_used": "supportive",
-            "emotion_detected": "distressed",
-            "goal_link": "wellbeing_first",
-            "emotion_primary": "high_stress",
-            "model_used": None,
-            "upgrade_reasons": [],
-        }
 
+def _plan_turn(
+    message: str,
+    history: List[Dict],
+    user_id: str,
+    coaching_style: Optional[str],
+    context: Optional[str],
+    profile: Dict[str, Any],
+    features: Optional[MessageFeatures] = None,
+    session_id: Optional[str] = None,
+    compacted: Optional[CompactedHistory] = None,
+) -> _TurnPlan:
     # ── Context signals ───────────────────────────────────────────────────
-    emotion    = detect_emotion(message)
-    style_used = coaching_style or route_style(message, coaching_style, emotion)
-    goal_link  = infer_goal_link(message)
-    ei         = analyze_text_emotion(message)
-    ctx_triggers = infer_context_triggers(message)
-
-    profile        = load_profile(user_id) or {}
-    goal_hierarchy = infer_goal_hierarchy(message, goal_link, profile)
+    # One scan of the message feeds every analyzer below.
+    f = features or extract_features(message)
+    emotion    = detect_emotion(message, f)
+    style_used = coaching_style or route_style(message, coaching_style, emotion, f)
+    goal_link  = infer_goal_link(message, f)
+    ei         = analyze_text_emotion(message, f)
+    ctx_triggers = infer_context_triggers(message, features=f)
+
+    goal_hierarchy = infer_goal_hierarchy(message, goal_link, profile, f)
     goal_anchor    = build_goal_anchor(goal_link, goal_hierarchy)
-    framework      = get_framework_for_context(message, emotion, goal_link)
+    framework      = get_framework_for_context(message, emotion, goal_link, f)
 
     # Deterministic stage routing: signal extraction + per-session state.
     user_turn_count = _count_user_turns(history, message)
-    early_turn = user_turn_count <= 3
-    session_id = _extract_session_id(context)
+    session_id = session_id or _extract_session_id(context)
     session_state = profile.get("session_state", {}) if isinstance(profile.get("session_state", {}), dict) else {}
     session_entry: Dict[str, Any] = {}
     if session_id:
@@ -726,17 +1192,16 @@ async def get_coaching_response_claude(
 
     raw_state_rev = session_entry.get("state_rev", 0)
     pre_state_rev = int(raw_state_rev) if isinstance(raw_state_rev, int) else 0
-    post_state_rev = pre_state_rev
 
     previous_stage = session_entry.get("stage") if isinstance(session_entry.get("stage"), str) else None
     raw_previous_topics = session_entry.get("topic_signature")
     previous_topics = [str(t) for t in raw_previous_topics if isinstance(t, str)] if isinstance(raw_previous_topics, list) else []
 
-    signals = _extract_conversation_signals(message)
-    is_specific_request = _is_specific_request(message)
-    context_rich = _is_context_rich(message) or bool(signals.outcome and (signals.example or signals.timeframe or signals.constraint))
-    topic_shift = _detect_topic_shift(message, previous_topics, signals.topic_signature)
-    user_confused = _is_user_confused(message)
+    signals = _extract_conversation_signals(message, f)
+    is_specific_request = _is_specific_request(message, f)
+    context_rich = _is_context_rich(message, f) or bool(signals.outcome and (signals.example or signals.timeframe or signals.constraint))
+    topic_shift = _detect_topic_shift(message, previous_topics, signals.topic_signature, f)
+    user_confused = _is_user_confused(message, f)
 
     stage, stage_reason = _route_stage(
         previous_stage,
@@ -765,117 +1230,221 @@ async def get_coaching_response_claude(
         )
     # ── Model selection ───────────────────────────────────────────────────
     user_context = {"escalation_risk": profile.get("escalation_risk", "none")}
-    model, upgrade_reasons = select_model(history, message, user_context)
+    model, upgrade_reasons = select_model(history, message, user_context, f)
 
     # ── Build system prompt ───────────────────────────────────────────────
+    # Ordered stable → per-session → per-turn so the prefix can be cached.
     style_prompt = STYLE_PROMPTS.get(style_used, "")
-    system = "\n\n".join(filter(None, [
-        GROW_SYSTEM_PROMPT,
-        INTERNAL_PERSONA_PROMPTS.get(persona_used),
-        f"Coaching style this turn: {style_used}. {style_prompt}",
-        f"Enhanced with thought leader framework:\n{framework}" if (framework and stage != "diagnose") else None,
-        f"Emotion detected: {emotion}. Goal alignment: {goal_link}.",
-        f"Persistent profile: {json.dumps(profile, ensure_ascii=False)}",
-        f"Goal hierarchy: {json.dumps(goal_hierarchy, ensure_ascii=False)}",
-        f"Goal anchor: {goal_anchor}",
-        "Structure each turn: (1) brief acknowledgment, (2) one diagnostic question OR one concise recommendation, (3) one concrete next step only when enough context exists.",
-        "If the user message is broad (e.g., 'performance is slipping', 'I feel stuck', 'things are off'), ask one clarifying question first and avoid giving a long diagnosis.",
-        f"Conversation stage: {stage}.",
-        f"Stage routing: previous_stage={previous_stage or 'none'}, stage_reason={stage_reason}, topic_shift={str(topic_shift).lower()}, user_confused={str(user_confused).lower()}.",
-        f"Turn diagnostics: user_turn_count={user_turn_count}, context_rich={str(context_rich).lower()}, enforce_inquiry_first={str(enforce_inquiry_first).lower()}.",
-        "If enforce_inquiry_first is true: ask exactly one clarifying question and avoid frameworks/advice lists in this turn.",
-        build_context_packet(message, [{"role": h.get("role","user"), "content": h.get("content","")} for h in history], context),
-        "Return ONLY valid JSON: {\"response\": string, \"quick_replies\": [string×4], \"suggested_actions\": [string]}. "
-        "quick_replies must be 3-8 words, user-selectable, tailored to the message. No markdown outside JSON.",
-        "response must be <=120 words and include at most one question mark total.",
-    ]))
-
-    # ── Trim history ──────────────────────────────────────────────────────
-    trimmed = history[:2] + history[-10:] if len(history) > 20 else history
-    messages = [{"role": h.get("role", "user"), "content": h.get("content", "")} for h in trimmed]
+    system_blocks = _build_system_blocks(
+        [_stable_system_prompt()],
+        [
+            INTERNAL_PERSONA_PROMPTS.get(persona_used),
+            f"Coaching style this turn: {style_used}. {style_prompt}",
+            f"Enhanced with thought leader framework:\n{framework}" if (framework and stage != "diagnose") else None,
+            # Changes once per summary span, so it stays in the cached prefix.
+            f"Summary of the earlier conversation: {compacted.summary}" if (compacted and compacted.summary) else None,
+        ],
+        [
+            f"Emotion detected: {emotion}. Goal alignment: {goal_link}.",
+            f"Persistent profile: {json.dumps(profile, ensure_ascii=False)}",
+            f"Goal hierarchy: {json.dumps(goal_hierarchy, ensure_ascii=False)}",
+            f"Goal anchor: {goal_anchor}",
+            f"Conversation stage: {stage}.",
+            f"Stage routing: previous_stage={previous_stage or 'none'}, stage_reason={stage_reason}, topic_shift={str(topic_shift).lower()}, user_confused={str(user_confused).lower()}.",
+            f"Turn diagnostics: user_turn_count={user_turn_count}, context_rich={str(context_rich).lower()}, enforce_inquiry_first={str(enforce_inquiry_first).lower()}.",
+            build_context_packet(message, [{"role": h.get("role","user"), "content": h.get("content","")} for h in history], context),
+        ],
+    )
+    system = "\n\n".join(block["text"] for block in system_blocks)
+
+    # ── Fit history to the token budget ───────────────────────────────────
+    if compacted is None:
+        compacted = get_history_compactor().fit(history)
+    messages = [{"role": h.get("role", "user"), "content": h.get("content", "")} for h in compacted.messages]
     messages.append({"role": "user", "content": message})
 
-    # ── LLM call ─────────────────────────────────────────────────────────
-    llm_succeeded = False
-    try:
-        if _anthropic_available():
-            raw = await _claude_complete(model=model, system=system, messages=messages, max_tokens=800)
-        elif _openai_available():
-            # OpenAI doesn't have the same tiering; use gpt-4 flat
-            raw = await _openai_complete([{"role": "system", "content": system}] + messages)
-            model = "gpt-4 (fallback)"
-            upgrade_reasons = []
-        else:
-            raise ValueError("No LLM API key configured.")
+    return _TurnPlan(
+        message=message,
+        history=history,
+        user_id=user_id,
+        context=context,
+        emotion=emotion,
+        style_used=style_used,
+        goal_link=goal_link,
+        ei=ei,
+        ctx_triggers=ctx_triggers,
+        goal_hierarchy=goal_hierarchy,
+        goal_anchor=goal_anchor,
+        session_id=session_id,
+        session_state=session_state,
+        session_entry=session_entry,
+        pre_state_rev=pre_state_rev,
+        signals=signals,
+        stage=stage,
+        stage_reason=stage_reason,
+        topic_shift=topic_shift,
+        user_turn_count=user_turn_count,
+        persona_used=persona_used,
+        persona_override_reason=persona_override_reason,
+        model=model,
+        upgrade_reasons=upgrade_reasons,
+        system=system,
+        system_blocks=system_blocks,
+        messages=messages,
+        features=f,
+        history_compaction=compacted.stats(),
+    )
 
-        # Parse JSON response
-        start, end = raw.find("{"), raw.rfind("}") + 1
-        if start != -1 and end > start:
-            parsed = json.loads(raw[start:end])
-            ai_response = parsed.get("response", "").strip() or raw.strip()
-            quick_replies = [str(x).strip() for x in parsed.get("quick_replies", []) if str(x).strip()][:4]
-            sa = parsed.get("suggested_actions")
-            suggested_actions = [str(x).strip() for x in sa if str(x).strip()] if isinstance(sa, list) else None
-        else:
-            ai_response = raw.strip() or "I'm here to help. Could you tell me more?"
-            quick_replies = []
-            suggested_actions = None
 
-        ai_response, diagnose_rewritten = _enforce_inquiry_first(ai_response, message, stage == "diagnose")
-        ai_response = _enforce_response_limits(ai_response)
+def _plan_meta(plan: _TurnPlan) -> Dict:
+    """Metadata known before the model call; streamed ahead of the first token."""
+    return {
+        "style_used":                plan.style_used,
+        "emotion_detected":          plan.emotion,
+        "goal_link":                 plan.goal_link,
+        "emotion_primary":           plan.ei.primary,
+        "emotion_scores":            plan.ei.scores,
+        "sentiment":                 plan.ei.sentiment,
+        "linguistic_markers":        plan.ei.linguistic_markers,
+        "context_triggers":          plan.ctx_triggers,
+        "goal_hierarchy":            plan.goal_hierarchy,
+        "goal_anchor":               plan.goal_anchor,
+        "progressive_skill_building": progressive_skill_building(plan.style_used, plan.ei.primary),
+        "model_used":                plan.model,
+        "upgrade_reasons":           plan.upgrade_reasons,
+    }
 
-        if diagnose_rewritten:
-            quick_replies = _generate_quick_replies(message, ai_response, context)
-        elif len(quick_replies) < 2:
-            quick_replies = _generate_quick_replies(message, ai_response, context)
 
-        llm_succeeded = True
+def _parse_classification(value: Any) -> Optional[Dict[str, Any]]:
+    """The classification object in Haiku's shape, or None when missing or malformed."""
+    if not isinstance(value, dict) or value.get("escalation_risk") not in ESCALATION_RISKS:
+        return None
+    tags = value.get("session_tags", [])
+    reason, goal = value.get("escalation_reason"), value.get("goal_update")
+    if not isinstance(tags, list) or not all(isinstance(t, str) for t in tags):
+        return None
+    if not all(v is None or isinstance(v, str) for v in (reason, goal)):
+        return None
+    return {
+        "escalation_risk": value["escalation_risk"],
+        "escalation_reason": reason or None,
+        "goal_update": goal if goal and goal.strip().lower() != "null" else None,
+        "session_tags": [t.strip() for t in tags if t.strip()],
+    }
 
-    except Exception as exc:
-        logger.error("LLM call failed: %s", exc)
-        ai_response = "I'm here to help you work through this. Could you tell me more about what's on your mind?"
-        quick_replies = _generate_quick_replies(message, ai_response)
+
+def _parse_model_output(raw: str) -> Tuple[str, List[str], Optional[List[str]], Optional[Dict[str, Any]]]:
+    """Parse the JSON contract into (response, quick_replies, suggested_actions, classification)."""
+    start, end = raw.find("{"), raw.rfind("}") + 1
+    if start != -1 and end > start:
+        parsed = json.loads(raw[start:end])
+        ai_response = parsed.get("response", "").strip() or raw.strip()
+        quick_replies = [str(x).strip() for x in parsed.get("quick_replies", []) if str(x).strip()][:4]
+        sa = parsed.get("suggested_actions")
+        suggested_actions = [str(x).strip() for x in sa if str(x).strip()] if isinstance(sa, list) else None
+        classification = _parse_classification(parsed.get("classification"))
+    else:
+        ai_response = raw.strip() or "I'm here to help. Could you tell me more?"
+        quick_replies = []
         suggested_actions = None
-        model = f"error: {exc}"
-        upgrade_reasons = []
+        classification = None
+    return ai_response, quick_replies, suggested_actions, classification
+
+
+async def _finish_turn(
+    plan: _TurnPlan,
+    ai_response: str,
+    quick_replies: List[str],
+    suggested_actions: Optional[List[str]],
+    *,
+    model: str,
+    upgrade_reasons: List[str],
+    llm_succeeded: bool,
+    session: ProfileSession,
+    usage: Optional[Dict[str, Any]] = None,
+    classification: Optional[Dict[str, Any]] = None,
+) -> Dict:
+    """
+    Persist the turn to the profile and transcript and build the result.
+    An inline ``classification`` is written with the same profile patch;
+    otherwise Haiku classifies the turn in the background.
+    """
+
+    user_id = plan.user_id
+    session_id = plan.session_id
+    session_state = plan.session_state
+    session_entry = plan.session_entry
+    post_state_rev = plan.pre_state_rev
+    turn_index: Optional[int] = None
+    history_digest: Optional[str] = None
 
     # ── Update profile ────────────────────────────────────────────────────
     if session_id and llm_succeeded:
-        session_entry["persona"] = persona_used
-        session_entry["stage"] = stage
-        session_entry["stage_reason"] = stage_reason
-        session_entry["turn_count"] = user_turn_count
-        session_entry["topic_signature"] = signals.topic_signature
-        session_entry["signals"] = asdict(signals)
-        session_entry["state_rev"] = pre_state_rev + 1
-        post_state_rev = pre_state_rev + 1
+        session_entry["persona"] = plan.persona_used
+        session_entry["stage"] = plan.stage
+        session_entry["stage_reason"] = plan.stage_reason
+        session_entry["turn_count"] = plan.user_turn_count
+        session_entry["topic_signature"] = plan.signals.topic_signature
+        session_entry["signals"] = asdict(plan.signals)
+        session_entry["state_rev"] = plan.pre_state_rev + 1
+        post_state_rev = plan.pre_state_rev + 1
         session_state[session_id] = session_entry
 
-    profile = update_profile_from_turn(
-        user_id, message, goal_link,
-        style_used=style_used,
-        emotion_primary=ei.primary,
-        context_triggers=ctx_triggers,
+    profile = apply_turn_to_profile(
+        session.profile, plan.message, plan.goal_link,
+        style_used=plan.style_used,
+        emotion_primary=plan.ei.primary,
+        context_triggers=plan.ctx_triggers,
+        features=plan.features,
     )
     if session_id and isinstance(session_state, dict) and session_state:
         profile["session_state"] = session_state
-    profile = update_behavior_signals(profile, style_used=style_used, goal_link=goal_link)
-    save_profile(user_id, profile)
+    profile = update_behavior_signals(profile, style_used=plan.style_used, goal_link=plan.goal_link)
+    if classification is not None:
+        classification_source: Optional[str] = "inline"
+    else:
+        if _inline_classification_enabled() and llm_succeeded:
+            _classification_counts["inline_missing"] += 1
+        classification = confident_classification(plan.message, ai_response)
+        classification_source = "local" if classification is not None else None
+    if classification is not None:
+        _apply_classification(profile, classification)
+    await session.flush()
     style_shift = style_preference_shift(profile)
 
-    # ── Fire-and-forget Haiku classification ──────────────────────────────
-    if _anthropic_available():
-        asyncio.ensure_future(_haiku_classify(user_id, message, ai_response))
+    if session_id and llm_succeeded and plan.record_transcript:
+        try:
+            turn_index, history_digest = await get_transcript_store().append_turn(
+                user_id, session_id, plan.message, ai_response,
+            )
+        except Exception as exc:
+            logger.warning("Transcript append failed for session %s: %s", session_id, exc)
+
+    # ── Background Haiku classification ───────────────────────────────────
+    # Only when neither the reply nor the local model classified the turn.
+    # Keyed per user: turns still waiting in the queue are superseded.
+    if classification_source is not None:
+        _classification_counts[classification_source] += 1
+    elif _anthropic_available():
+        classification_source = "background"
+        _classification_counts["background"] += 1
+        message = plan.message
+        get_background_jobs().submit(
+            lambda: _haiku_classify(user_id, message, ai_response), key=f"classify:{user_id}",
+        )
 
+    ei = plan.ei
     return {
         "response":                  ai_response,
         "quick_replies":             quick_replies,
         "suggested_actions":         suggested_actions,
-        "style_used":                style_used,
-        "emotion_detected":          emotion,
-        "goal_link":                 goal_link,
+        "style_used":                plan.style_used,
+        "emotion_detected":          plan.emotion,
+        "goal_link":                 plan.goal_link,
         "model_used":                model,
         "upgrade_reasons":           upgrade_reasons,
+        "turn_index":                turn_index,
+        "history_digest":            history_digest,
         "emotion_primary":           ei.primary,
         "emotion_scores":            ei.scores,
         "sentiment":                 ei.sentiment,
@@ -883,22 +1452,271 @@ async def get_coaching_response_claude(
         "behavior_signals": {
             "style_preference_shift":    style_shift,
             "session_event_count":       len(profile.get("session_events", [])),
-            "persona_used":              persona_used,
-            "persona_override_reason":   persona_override_reason,
-            "stage_used":                stage,
-            "stage_reason":              stage_reason,
-            "topic_shift":               topic_shift,
-            "pre_state_rev":            pre_state_rev,
+            "persona_used":              plan.persona_used,
+            "persona_override_reason":   plan.persona_override_reason,
+            "stage_used":                plan.stage,
+            "stage_reason":              plan.stage_reason,
+            "topic_shift":               plan.topic_shift,
+            "pre_state_rev":            plan.pre_state_rev,
             "post_state_rev":           post_state_rev,
+            "prompt_cache":             usage or None,
+            "history_compaction":       plan.history_compaction,
+            "classification":           classification_source,
         },
-        "context_triggers":          ctx_triggers,
+        "context_triggers":          plan.ctx_triggers,
         "recommended_style_shift":   style_shift,
-        "goal_hierarchy":            goal_hierarchy,
-        "goal_anchor":               goal_anchor,
-        "progressive_skill_building": progressive_skill_building(style_used, ei.primary),
-        "outcome_prediction":        outcome_prediction(goal_link, ei.primary, style_shift),
+        "goal_hierarchy":            plan.goal_hierarchy,
+        "goal_anchor":               plan.goal_anchor,
+        "progressive_skill_building": progressive_skill_building(plan.style_used, ei.primary),
+        "outcome_prediction":        outcome_prediction(plan.goal_link, ei.primary, style_shift),
     }
 
+
+async def _load_turn_inputs(
+    user_id: str,
+    session_id: Optional[str],
+    history: Optional[List[Dict]],
+    last_turn_index: Optional[int],
+) -> Tuple[ProfileSession, List[Dict], Optional[Transcript], Optional[Transcript]]:
+    """
+    Load the profile and, for a session, its transcript concurrently.
+    Returns the session, the history to use (the client's when it sent
+    one), the transcript, None if unavailable, and the transcript again
+    when the history was taken from it.
+    """
+    if not session_id:
+        return await ProfileSession.load(user_id), history or [], None, None
+
+    async def load_transcript():
+        try:
+            return await get_transcript_store().load(user_id, session_id)
+        except Exception as exc:
+            logger.warning("Transcript load failed for session %s: %s", session_id, exc)
+            return None
+
+    session, transcript = await asyncio.gather(ProfileSession.load(user_id), load_transcript())
+    if transcript is None:
+        return session, history or [], None, None
+    if history is None:
+        return session, transcript.history(last_turn_index), transcript, transcript
+    return session, history, transcript, None
+
+
+async def _compact_history(
+    user_id: str, history: List[Dict], source: Optional[Transcript] = None,
+) -> CompactedHistory:
+    # Older spans are summarized by Haiku; without Anthropic they are dropped.
+    summarize = functools.partial(_haiku_summarize, user_id=user_id) if _anthropic_available() else None
+    if source is None:
+        return await get_history_compactor().compact(user_id, history, summarize)
+    # ``history`` is a prefix of the transcript's window: key spans on its
+    # stored digests and align them to session positions.
+    return await get_history_compactor().compact(
+        user_id, history, summarize, source.digests()[:len(history)], source.start,
+    )
+
+
+_LLM_FALLBACK_RESPONSE = "I'm here to help you work through this. Could you tell me more about what's on your mind?"
+
+
+async def get_coaching_response_claude(
+    message: str,
+    history: Optional[List[Dict]] = None,
+    user_id: str = "anonymous",
+    coaching_style: Optional[str] = None,
+    context: Optional[str] = None,
+    session_id: Optional[str] = None,
+    last_turn_index: Optional[int] = None,
+) -> Dict:
+    """
+    Primary entry point for the three-model architecture.
+
+    Flow:
+      1. Crisis check  → immediate return (no model needed)
+      2. select_model  → Sonnet or Opus based on signals
+      3. Claude call   → coaching response
+      4. Haiku task    → fire-and-forget background classification
+
+    With ``history`` left as None the session's stored transcript is used,
+    up to ``last_turn_index`` (the last turn the client acknowledged).
+    """
+
+    # ── Crisis gate ──────────────────────────────────────────────────────
+    features = extract_features(message)
+    if _detect_crisis(message, features):
+        return _crisis_result()
+
+    session_id = session_id or _extract_session_id(context)
+    session, history, transcript, source = await _load_turn_inputs(user_id, session_id, history, last_turn_index)
+    compacted = await _compact_history(user_id, history, source)
+    plan = _plan_turn(
+        message, history, user_id, coaching_style, context, session.profile, features, session_id, compacted,
+    )
+    plan.record_transcript = transcript is not None
+    model, upgrade_reasons = plan.model, plan.upgrade_reasons
+    usage: Dict[str, Any] = {}
+
+    # ── LLM call ─────────────────────────────────────────────────────────
+    llm_succeeded = False
+    classification = None
+    try:
+        if _anthropic_available():
+            async with get_llm_dispatcher().slot(INTERACTIVE, user_id, cost=800):
+                raw = await _claude_complete(
+                    model=model, system=plan.system_blocks, messages=plan.messages, max_tokens=800, usage=usage,
+                )
+        elif _openai_available():
+            # OpenAI doesn't have the same tiering; use gpt-4 flat
+            async with get_llm_dispatcher().slot(INTERACTIVE, user_id, cost=800):
+                raw = await _openai_complete([{"role": "system", "content": plan.system}] + plan.messages)
+            model = "gpt-4 (fallback)"
+            upgrade_reasons = []
+        else:
+            raise ValueError("No LLM API key configured.")
+
+        ai_response, quick_replies, suggested_actions, classification = _parse_model_output(raw)
+
+        ai_response, diagnose_rewritten = _enforce_inquiry_first(ai_response, message, plan.stage == "diagnose")
+        ai_response = _enforce_response_limits(ai_response)
+
+        if diagnose_rewritten:
+            quick_replies = _generate_quick_replies(message, ai_response, context, plan.features)
+        elif len(quick_replies) < 2:
+            quick_replies = _generate_quick_replies(message, ai_response, context, plan.features)
+
+        llm_succeeded = True
+
+    except Exception as exc:
+        logger.error("LLM call failed: %s", exc)
+        ai_response = _LLM_FALLBACK_RESPONSE
+        quick_replies = _generate_quick_replies(message, ai_response, features=plan.features)
+        suggested_actions = None
+        model = f"error: {exc}"
+        upgrade_reasons = []
+
+    return await _finish_turn(
+        plan, ai_response, quick_replies, suggested_actions,
+        model=model, upgrade_reasons=upgrade_reasons, llm_succeeded=llm_succeeded,
+        session=session, usage=usage, classification=classification,
+    )
+
+
+async def stream_coaching_response_claude(
+    message: str,
+    history: Optional[List[Dict]] = None,
+    user_id: str = "anonymous",
+    coaching_style: Optional[str] = None,
+    context: Optional[str] = None,
+    session_id: Optional[str] = None,
+    last_turn_index: Optional[int] = None,
+) -> AsyncIterator[Tuple[str, Any]]:
+    """
+    Streaming variant of get_coaching_response_claude.
+
+    Yields ``("meta", dict)`` as soon as the local heuristics finish, then
+    ``("token", str)`` deltas of the ``response`` field as the model produces
+    them, and finally ``("result", dict)`` with the same shape that
+    get_coaching_response_claude returns.
+
+    Non-diagnose turns pass through _StreamingResponseLimits so the word and
+    question limits hold incrementally. Diagnose turns are buffered because the
+    inquiry-first contract can only be judged on the complete text.
+    """
+
+    features = extract_features(message)
+    if _detect_crisis(message, features):
+        result = _crisis_result()
+        yield "meta", {k: v for k, v in result.items() if k not in ("response", "quick_replies")}
+        yield "token", result["response"]
+        yield "result", result
+        return
+
+    session_id = session_id or _extract_session_id(context)
+    session, history, transcript, source = await _load_turn_inputs(user_id, session_id, history, last_turn_index)
+    compacted = await _compact_history(user_id, history, source)
+    plan = _plan_turn(
+        message, history, user_id, coaching_style, context, session.profile, features, session_id, compacted,
+    )
+    plan.record_transcript = transcript is not None
+    model, upgrade_reasons = plan.model, plan.upgrade_reasons
+    usage: Dict[str, Any] = {}
+    yield "meta", _plan_meta(plan)
+
+    diagnose = plan.stage == "diagnose"
+    extractor = _ResponseFieldExtractor()
+    limiter = None if diagnose else _StreamingResponseLimits()
+    raw_parts: List[str] = []
+    streamed_parts: List[str] = []
+
+    llm_succeeded = False
+    classification = None
+    try:
+        if _anthropic_available():
+            chunks = _claude_stream(
+                model=model, system=plan.system_blocks, messages=plan.messages, max_tokens=800, usage=usage,
+            )
+        elif _openai_available():
+            chunks = _single_chunk(_openai_complete([{"role": "system", "content": plan.system}] + plan.messages))
+            model = "gpt-4 (fallback)"
+            upgrade_reasons = []
+        else:
+            raise ValueError("No LLM API key configured.")
+
+        chunks = _read_in_slot(chunks, INTERACTIVE, user_id, cost=800)
+        try:
+            async for chunk in chunks:
+                raw_parts.append(chunk)
+                if limiter is None:
+                    continue
+                delta = limiter.feed(extractor.feed(chunk))
+                if delta:
+                    streamed_parts.append(delta)
+                    yield "token", delta
+        finally:
+            await chunks.aclose()
+        if limiter is not None:
+            delta = limiter.finish()
+            if delta:
+                streamed_parts.append(delta)
+                yield "token", delta
+
+        raw = "".join(raw_parts)
+        ai_response, quick_replies, suggested_actions, classification = _parse_model_output(raw)
+
+        ai_response, diagnose_rewritten = _enforce_inquiry_first(ai_response, message, diagnose)
+        ai_response = _enforce_response_limits(ai_response)
+
+        if diagnose_rewritten:
+            quick_replies = _generate_quick_replies(message, ai_response, context, plan.features)
+        elif len(quick_replies) < 2:
+            quick_replies = _generate_quick_replies(message, ai_response, context, plan.features)
+
+        llm_succeeded = True
+
+    except Exception as exc:
+        logger.error("LLM stream failed: %s", exc)
+        ai_response = _LLM_FALLBACK_RESPONSE
+        quick_replies = _generate_quick_replies(message, ai_response, features=plan.features)
+        suggested_actions = None
+        model = f"error: {exc}"
+        upgrade_reasons = []
+
+    # Whatever already reached the client is authoritative: emit only the
+    # remaining suffix, or keep the streamed text if the final parse diverged.
+    streamed = "".join(streamed_parts)
+    if ai_response.startswith(streamed):
+        tail = ai_response[len(streamed):]
+        if tail:
+            yield "token", tail
+    else:
+        ai_response = streamed
+
+    yield "result", await _finish_turn(
+        plan, ai_response, quick_replies, suggested_actions,
+        model=model, upgrade_reasons=upgrade_reasons, llm_succeeded=llm_succeeded,
+        session=session, usage=usage, classification=classification,
+    )
+
 # ---------------------------------------------------------------------------
 # Session summary  (Sonnet — no upgrade needed for summarisation)
 # ---------------------------------------------------------------------------
@@ -935,20 +1753,22 @@ async def generate_session_summary_claude(
 
     try:
         if _anthropic_available():
-            raw = await _claude_complete(
-                model=SONNET,
-                system="You are an expert at summarising coaching sessions. Return only valid JSON.",
-                messages=[{"role": "user", "content": prompt}],
-                max_tokens=500,
-            )
+            async with get_llm_dispatcher().slot(SUMMARY, user_id, cost=500):
+                raw = await _claude_complete(
+                    model=SONNET,
+                    system="You are an expert at summarising coaching sessions. Return only valid JSON.",
+                    messages=[{"role": "user", "content": prompt}],
+                    max_tokens=500,
+                )
         elif _openai_available():
-            raw = await _openai_complete(
-                [
-                    {"role": "system", "content": "Summarise coaching sessions as JSON."},
-                    {"role": "user", "content": prompt},
-                ],
-                max_tokens=500,
-            )
+            async with get_llm_dispatcher().slot(SUMMARY, user_id, cost=500):
+                raw = await _openai_complete(
+                    [
+                        {"role": "system", "content": "Summarise coaching sessions as JSON."},
+                        {"role": "user", "content": prompt},
+                    ],
+                    max_tokens=500,
+                )
         else:
             raise ValueError("No LLM API key configured.")
 
@@ -0,0 +1,282 @@
+"""
+Process-wide LLM client registry.
+
+One tuned httpx connection pool per provider, shared by every call site
+(main coaching turn, Haiku classifier, session summary) so requests reuse
+keep-alive connections instead of paying a TLS handshake each time.
+
+The registry is opened and closed by the FastAPI lifespan in main.py.
+Code running outside the app (tests, scripts) gets a lazily created one.
+
+Response observers registered with ``add_response_observer`` see every
+provider response, SDK retries included (anthropic_keys reads the
+rate-limit headers this way).
+"""
+
+import functools
+import importlib
+import logging
+import os
+from dataclasses import asdict, dataclass
+from types import ModuleType
+from typing import Any, Callable, Dict, List, Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+PROVIDERS = ("anthropic", "openai")
+
+ResponseObserver = Callable[[Any, Any], None]
+_response_observers: Dict[str, List[ResponseObserver]] = {p: [] for p in PROVIDERS}
+
+
+def add_response_observer(provider: str, observer: ResponseObserver) -> None:
+    """Call ``observer(request, response)`` for every ``provider`` response."""
+    if observer not in _response_observers[provider]:
+        _response_observers[provider].append(observer)
+
+
+def anthropic_api_keys() -> List[str]:
+    """The key pool from ANTHROPIC_API_KEYS (comma-separated), else ANTHROPIC_API_KEY."""
+    pooled = [k.strip() for k in os.getenv("ANTHROPIC_API_KEYS", "").split(",") if k.strip()]
+    if pooled:
+        return pooled
+    key = os.getenv("ANTHROPIC_API_KEY", "").strip()
+    return [key] if key else []
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    raw = os.getenv(name)
+    if raw is None:
+        return default
+    return raw.strip().lower() in {"1", "true", "yes", "on"}
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+    except Exception:
+        return False
+    return True
+
+
+@dataclass
+class PoolStats:
+    requests_total: int = 0
+    errors_total: int = 0
+    in_flight: int = 0
+    peak_in_flight: int = 0
+
+
+@functools.lru_cache(maxsize=None)
+def _counting_transport_cls(httpx_mod: ModuleType):
+    """
+    Build the counting transport for one httpx flavour. Newer SDK releases
+    run on ``httpx2``, which rejects plain ``httpx`` objects, so the wrapper
+    has to subclass whichever module the SDK client is built on.
+    """
+
+    class _CountingStream(httpx_mod.AsyncByteStream):
+        def __init__(self, stream, stats: PoolStats) -> None:
+            self._stream = stream
+            self._stats = stats
+            self._closed = False
+
+        async def __aiter__(self):
+            async for chunk in self._stream:
+                yield chunk
+
+        async def aclose(self) -> None:
+            try:
+                await self._stream.aclose()
+            finally:
+                if not self._closed:
+                    self._closed = True
+                    self._stats.in_flight -= 1
+
+    class _CountingTransport(httpx_mod.AsyncBaseTransport):
+        """Wrap the pooled transport to track request and in-flight counters."""
+
+        def __init__(self, transport, stats: PoolStats, observers: Optional[List[ResponseObserver]] = None) -> None:
+            self._transport = transport
+            self._stats = stats
+            self._observers = observers if observers is not None else []
+
+        async def handle_async_request(self, request):
+            self._stats.requests_total += 1
+            self._stats.in_flight += 1
+            self._stats.peak_in_flight = max(self._stats.peak_in_flight, self._stats.in_flight)
+            try:
+                response = await self._transport.handle_async_request(request)
+            except Exception:
+                self._stats.errors_total += 1
+                self._stats.in_flight -= 1
+                raise
+            response.stream = _CountingStream(response.stream, self._stats)
+            for observer in self._observers:
+                try:
+                    observer(request, response)
+                except Exception as exc:
+                    logger.warning("Response observer failed: %s", exc)
+            return response
+
+        def connection_counts(self) -> Dict[str, int]:
+            # httpx does not expose its httpcore pool publicly; degrade to zeros.
+            pool = getattr(self._transport, "_pool", None)
+            connections = list(getattr(pool, "connections", []) or [])
+            idle = sum(1 for c in connections if getattr(c, "is_idle", lambda: False)())
+            return {"open_connections": len(connections), "idle_connections": idle}
+
+        async def aclose(self) -> None:
+            await self._transport.aclose()
+
+    return _CountingTransport
+
+
+_CountingTransport = _counting_transport_cls(httpx)
+
+
+def _sdk_http_client_cls(provider: str):
+    """The SDK's default async client class, or plain httpx if unavailable."""
+    try:
+        sdk = importlib.import_module(provider)
+    except Exception:
+        return httpx.AsyncClient
+    return getattr(sdk, "DefaultAsyncHttpxClient", httpx.AsyncClient)
+
+
+def _httpx_module_for(client_cls) -> ModuleType:
+    for cls in client_cls.__mro__:
+        root = cls.__module__.partition(".")[0]
+        if root in ("httpx", "httpx2"):
+            return importlib.import_module(root)
+    return httpx
+
+
+class LLMClientRegistry:
+    """Owns one pooled httpx client per provider and the SDK clients on top."""
+
+    def __init__(self) -> None:
+        self.max_connections = int(os.getenv("LLM_HTTP_MAX_CONNECTIONS", "100"))
+        self.max_keepalive = int(os.getenv("LLM_HTTP_MAX_KEEPALIVE", "20"))
+        self.keepalive_expiry = float(os.getenv("LLM_HTTP_KEEPALIVE_EXPIRY_SECONDS", "30"))
+        self.connect_timeout = float(os.getenv("LLM_HTTP_CONNECT_TIMEOUT_SECONDS", "5"))
+        self.read_timeout = float(os.getenv("LLM_HTTP_READ_TIMEOUT_SECONDS", "60"))
+        self.http2 = _env_bool("LLM_HTTP2", False)
+        if self.http2 and not _http2_available():
+            logger.warning("LLM_HTTP2 requested but the h2 package is missing; using HTTP/1.1")
+            self.http2 = False
+
+        self._stats: Dict[str, PoolStats] = {p: PoolStats() for p in PROVIDERS}
+        self._transports: Dict[str, Any] = {}
+        self._http: Dict[str, Any] = {}
+        self._sdk: Dict[str, Any] = {}
+        self._sdk_keys: Dict[str, Optional[str]] = {}
+        self.closed = False
+
+    def timeout_for(self, httpx_mod: ModuleType = httpx):
+        return httpx_mod.Timeout(self.read_timeout, connect=self.connect_timeout)
+
+    @property
+    def timeout(self) -> httpx.Timeout:
+        return self.timeout_for(httpx)
+
+    def http_client(self, provider: str):
+        client = self._http.get(provider)
+        if client is None:
+            client_cls = _sdk_http_client_cls(provider)
+            httpx_mod = _httpx_module_for(client_cls)
+            limits = httpx_mod.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_keepalive,
+                keepalive_expiry=self.keepalive_expiry,
+            )
+            transport = _counting_transport_cls(httpx_mod)(
+                httpx_mod.AsyncHTTPTransport(limits=limits, http2=self.http2),
+                self._stats[provider],
+                _response_observers[provider],
+            )
+            client = client_cls(transport=transport, timeout=self.timeout_for(httpx_mod))
+            self._transports[provider] = transport
+            self._http[provider] = client
+        return client
+
+    def anthropic(self):
+        # Requests pick their pool key per call (anthropic_keys); the client
+        # default is the first one.
+        keys = anthropic_api_keys()
+        key = keys[0] if keys else None
+        if self._sdk.get("anthropic") is None or self._sdk_keys.get("anthropic") != key:
+            from anthropic import AsyncAnthropic
+            self._sdk["anthropic"] = AsyncAnthropic(
+                api_key=key,
+                http_client=self.http_client("anthropic"),
+            )
+            self._sdk_keys["anthropic"] = key
+        return self._sdk["anthropic"]
+
+    def openai(self):
+        key = os.getenv("OPENAI_API_KEY")
+        if self._sdk.get("openai") is None or self._sdk_keys.get("openai") != key:
+            from openai import AsyncOpenAI
+            self._sdk["openai"] = AsyncOpenAI(
+                api_key=key,
+                http_client=self.http_client("openai"),
+            )
+            self._sdk_keys["openai"] = key
+        return self._sdk["openai"]
+
+    def stats(self) -> Dict[str, Any]:
+        providers: Dict[str, Any] = {}
+        for provider in PROVIDERS:
+            entry: Dict[str, Any] = asdict(self._stats[provider])
+            transport = self._transports.get(provider)
+            if transport is not None:
+                entry.update(transport.connection_counts())
+            else:
+                entry.update({"open_connections": 0, "idle_connections": 0})
+            providers[provider] = entry
+        return {
+            "max_connections": self.max_connections,
+            "max_keepalive": self.max_keepalive,
+            "keepalive_expiry": self.keepalive_expiry,
+            "http2": self.http2,
+            "providers": providers,
+        }
+
+    async def aclose(self) -> None:
+        self.closed = True
+        self._sdk.clear()
+        clients, self._http = self._http, {}
+        self._transports = {}
+        for provider, client in clients.items():
+            try:
+                await client.aclose()
+            except Exception as exc:
+                logger.warning("Closing %s HTTP pool failed: %s", provider, exc)
+
+
+_registry: Optional[LLMClientRegistry] = None
+
+
+def get_llm_clients() -> LLMClientRegistry:
+    global _registry
+    if _registry is None or _registry.closed:
+        _registry = LLMClientRegistry()
+    return _registry
+
+
+async def startup_llm_clients() -> LLMClientRegistry:
+    global _registry
+    if _registry is not None and not _registry.closed:
+        await _registry.aclose()
+    _registry = LLMClientRegistry()
+    return _registry
+
+
+async def shutdown_llm_clients() -> None:
+    global _registry
+    if _registry is not None:
+        await _registry.aclose()
+    _registry = None
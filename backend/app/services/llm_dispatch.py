@@ -0,0 +1,174 @@
+"""
+Priority scheduling for outbound LLM calls.
+
+Every model call (coaching turns, streams, session summaries, Haiku
+classification and history summaries) holds a dispatch slot for its
+duration. Slots are granted by priority class, highest first:
+
+  interactive  — chat and streaming turns, a user is waiting
+  summary      — /session-summary generation
+  background   — Haiku classification and history compaction
+
+At most ``LLM_MAX_CONCURRENCY`` calls run at once, and each class is
+further capped (``LLM_CONCURRENCY_INTERACTIVE`` / ``_SUMMARY`` /
+``_BACKGROUND``). Keeping the lower classes' caps below the global limit
+reserves the rest for live chat, so a burst of end-of-session summaries
+cannot take every provider slot.
+
+Within a class, waiting calls are ordered by start-time fair queuing
+across users: each call's tag advances its user's virtual clock by
+``cost / weight`` (cost is the call's token allowance), so one user's
+burst interleaves with other users' calls instead of running ahead of them.
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE = "interactive"
+SUMMARY = "summary"
+BACKGROUND = "background"
+PRIORITIES = (INTERACTIVE, SUMMARY, BACKGROUND)
+
+_DEFAULT_LIMITS = {INTERACTIVE: 16, SUMMARY: 4, BACKGROUND: 4}
+
+# Forget users whose virtual clock has fallen behind the class clock once
+# this many are tracked; they would start at the class clock anyway.
+_MAX_TRACKED_USERS = 10000
+
+
+@dataclass(order=True)
+class _Waiter:
+    tag: float
+    seq: int
+    user_id: str = field(compare=False)
+    enqueued_at: float = field(compare=False)
+    future: "asyncio.Future[None]" = field(compare=False)
+
+
+class _PriorityClass:
+    def __init__(self, name: str, limit: int) -> None:
+        self.name = name
+        self.limit = limit
+        self.queue: List[_Waiter] = []
+        self.running = 0
+        self.virtual_time = 0.0
+        self.user_finish: Dict[str, float] = {}
+        self.dispatched = 0
+        self.cancelled = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def waiting(self) -> int:
+        return sum(1 for w in self.queue if not w.future.done())
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "limit": self.limit,
+            "running": self.running,
+            "waiting": self.waiting(),
+            "dispatched": self.dispatched,
+            "cancelled": self.cancelled,
+            "wait_avg_ms": round(self.wait_total / self.dispatched * 1000, 2) if self.dispatched else 0.0,
+            "wait_max_ms": round(self.wait_max * 1000, 2),
+        }
+
+
+class LLMDispatcher:
+    def __init__(self, max_concurrency: Optional[int] = None, limits: Optional[Dict[str, int]] = None) -> None:
+        self.max_concurrency = max(
+            1, max_concurrency if max_concurrency is not None else int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+        )
+        limits = limits or {}
+        self._classes = {
+            name: _PriorityClass(
+                name,
+                max(1, limits.get(name) or int(os.getenv(f"LLM_CONCURRENCY_{name.upper()}", str(_DEFAULT_LIMITS[name])))),
+            )
+            for name in PRIORITIES
+        }
+        self._running = 0
+        self._seq = itertools.count()
+
+    @asynccontextmanager
+    async def slot(
+        self, priority: str, user_id: str = "anonymous", cost: float = 1.0, weight: float = 1.0,
+    ) -> AsyncIterator[None]:
+        """Hold a dispatch slot of ``priority`` for the duration of the block."""
+        cls = self._classes[priority]
+        await self._acquire(cls, user_id, max(cost, 1e-6) / max(weight, 1e-6))
+        try:
+            yield
+        finally:
+            cls.running -= 1
+            self._running -= 1
+            self._dispatch()
+
+    async def _acquire(self, cls: _PriorityClass, user_id: str, cost: float) -> None:
+        start = max(cls.virtual_time, cls.user_finish.get(user_id, 0.0))
+        cls.user_finish[user_id] = start + cost
+        waiter = _Waiter(start, next(self._seq), user_id, time.monotonic(), asyncio.get_running_loop().create_future())
+        heapq.heappush(cls.queue, waiter)
+        self._dispatch()
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # Granted just before the cancellation landed: hand it back.
+                cls.running -= 1
+                self._running -= 1
+                self._dispatch()
+            else:
+                cls.cancelled += 1
+            raise
+
+    def _dispatch(self) -> None:
+        while self._running < self.max_concurrency:
+            waiter = self._next_waiter()
+            if waiter is None:
+                return
+            cls, waiter = waiter
+            cls.virtual_time = max(cls.virtual_time, waiter.tag)
+            wait = time.monotonic() - waiter.enqueued_at
+            cls.dispatched += 1
+            cls.wait_total += wait
+            cls.wait_max = max(cls.wait_max, wait)
+            cls.running += 1
+            self._running += 1
+            waiter.future.set_result(None)
+            if len(cls.user_finish) > _MAX_TRACKED_USERS:
+                cls.user_finish = {u: t for u, t in cls.user_finish.items() if t > cls.virtual_time}
+
+    def _next_waiter(self):
+        for name in PRIORITIES:
+            cls = self._classes[name]
+            while cls.queue and cls.queue[0].future.done():
+                heapq.heappop(cls.queue)  # cancelled while waiting
+            if cls.queue and cls.running < cls.limit:
+                return cls, heapq.heappop(cls.queue)
+        return None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "running": self._running,
+            **{name: cls.stats() for name, cls in self._classes.items()},
+        }
+
+
+_llm_dispatcher: Optional[LLMDispatcher] = None
+
+
+def get_llm_dispatcher() -> LLMDispatcher:
+    global _llm_dispatcher
+    if _llm_dispatcher is None:
+        _llm_dispatcher = LLMDispatcher()
+    return _llm_dispatcher
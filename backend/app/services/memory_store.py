@@ -1,14 +1,116 @@
+import copy
 import json
 import os
 import logging
-from typing import Dict, Any, Optional
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, Any, List, Optional
+
+from app.services.cache import get_cache_backend
+from app.services.database import run_blocking
+from app.services.message_features import MessageFeatures, extract_features, keywords
+from app.services.profile_cache import ProfileCache
 
 logger = logging.getLogger(__name__)
 
 MEMORY_DIR = os.path.join(os.path.dirname(__file__), "..", "..", "data", "profiles")
 _PROFILE_DIR = MEMORY_DIR
 
+# Append-only profile lists and their caps. The Postgres backend keeps these
+# in child tables (see profile_store); readers always see at most ``cap``
+# entries, oldest first.
+APPEND_ONLY_FIELDS: Dict[str, int] = {
+    "emotion_timeline": 40,
+    "session_events": 50,
+}
+
 _store_backend: Optional[Any] = None
+_profile_cache: Optional[ProfileCache] = None
+_file_lock = threading.Lock()
+
+
+@dataclass
+class ProfilePatch:
+    """
+    The difference between two versions of a profile, in the shape the
+    backends can apply without rewriting the document:
+
+    - ``fields``: top-level keys replaced wholesale
+    - ``removed``: top-level keys deleted
+    - ``merged`` / ``merged_removed``: for dict-valued keys present in both
+      versions, the sub-keys that changed or went away
+    - ``appended``: new tail entries of ``APPEND_ONLY_FIELDS`` lists; a list
+      that was rewritten rather than appended to is in ``fields`` instead
+    """
+
+    fields: Dict[str, Any] = field(default_factory=dict)
+    removed: List[str] = field(default_factory=list)
+    merged: Dict[str, Dict[str, Any]] = field(default_factory=dict)
+    merged_removed: Dict[str, List[str]] = field(default_factory=dict)
+    appended: Dict[str, List[Any]] = field(default_factory=dict)
+
+    def __bool__(self) -> bool:
+        return bool(self.fields or self.removed or self.merged or self.merged_removed or self.appended)
+
+    def apply(self, profile: Dict[str, Any]) -> Dict[str, Any]:
+        """Apply the patch to a profile dict in place (file backend, tests)."""
+        for key in self.removed:
+            profile.pop(key, None)
+        profile.update(self.fields)
+        for key in set(self.merged) | set(self.merged_removed):
+            current = profile.get(key)
+            current = dict(current) if isinstance(current, dict) else {}
+            for sub in self.merged_removed.get(key, ()):
+                current.pop(sub, None)
+            current.update(self.merged.get(key, {}))
+            profile[key] = current
+        for key, entries in self.appended.items():
+            current = profile.get(key)
+            current = list(current) if isinstance(current, list) else []
+            profile[key] = (current + list(entries))[-APPEND_ONLY_FIELDS[key]:]
+        return profile
+
+
+def _appended_tail(old: Any, new: Any, cap: int) -> Optional[List[Any]]:
+    """
+    Entries appended to ``old`` that, after trimming to ``cap``, yield
+    ``new``; None when ``new`` is not such an append (cleared, reordered,
+    edited in place).
+    """
+    if not isinstance(old, list) or not isinstance(new, list):
+        return None
+    for drop in range(len(old) + 1):
+        kept = old[drop:]
+        if new[:len(kept)] != kept:
+            continue
+        tail = new[len(kept):]
+        if (old + tail)[-cap:] == new:
+            return tail
+    return None
+
+
+def diff_profile(old: Dict[str, Any], new: Dict[str, Any]) -> ProfilePatch:
+    patch = ProfilePatch()
+    for key, value in new.items():
+        if key in old and old[key] == value:
+            continue
+        previous = old.get(key)
+        if key in APPEND_ONLY_FIELDS and key in old:
+            tail = _appended_tail(previous, value, APPEND_ONLY_FIELDS[key])
+            if tail is not None:
+                patch.appended[key] = tail
+                continue
+        if isinstance(previous, dict) and isinstance(value, dict):
+            changed = {k: v for k, v in value.items() if k not in previous or previous[k] != v}
+            dropped = [k for k in previous if k not in value]
+            if changed:
+                patch.merged[key] = changed
+            if dropped:
+                patch.merged_removed[key] = dropped
+            continue
+        patch.fields[key] = value
+    patch.removed = [key for key in old if key not in new]
+    return patch
 
 
 def _get_store_backend():
@@ -25,7 +127,7 @@ def _get_store_backend():
     elif store_type == "postgres" or (not store_type and database_url):
         from app.services.profile_store import ProfileStore
         logger.info("Profile storage: postgres")
-        _store_backend = ProfileStore()
+        _store_backend = ProfileStore(timeline_caps=APPEND_ONLY_FIELDS)
     else:
         logger.info("Profile storage: file (default, no DATABASE_URL)")
         _store_backend = "file"
@@ -33,47 +135,194 @@ def _get_store_backend():
     return _store_backend
 
 
+def _get_profile_cache() -> Optional[ProfileCache]:
+    global _profile_cache
+    if os.getenv("PROFILE_CACHE_ENABLED", "true").strip().lower() not in {"1", "true", "yes", "on"}:
+        return None
+    if _profile_cache is None:
+        _profile_cache = ProfileCache(get_cache_backend())
+    return _profile_cache
+
+
+def profile_cache_stats() -> Dict[str, Any]:
+    cache = _get_profile_cache()
+    return cache.stats() if cache is not None else {"enabled": False}
+
+
+async def startup_profile_store() -> None:
+    """Start the Postgres timeline pruner and the profile cache invalidation listener."""
+    backend = _get_store_backend()
+    if backend != "file":
+        backend.start_pruner()
+    cache = _get_profile_cache()
+    if cache is not None:
+        cache.start_listener()
+
+
+async def shutdown_profile_store() -> None:
+    if _profile_cache is not None:
+        await _profile_cache.stop_listener()
+    backend = _store_backend
+    if backend is not None and backend != "file":
+        await backend.stop_pruner()
+
+
 def _profile_path(user_id: str) -> str:
     os.makedirs(MEMORY_DIR, exist_ok=True)
     safe = "".join(c if c.isalnum() or c in "-_" else "_" for c in user_id)
     return os.path.join(MEMORY_DIR, f"{safe}.json")
 
 
-def load_profile(user_id: str) -> Dict[str, Any]:
+def _load_profile_file(user_id: str) -> Dict[str, Any]:
+    path = _profile_path(user_id)
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _save_profile_file(user_id: str, profile: Dict[str, Any]) -> None:
+    os.makedirs(MEMORY_DIR, exist_ok=True)
+    path = _profile_path(user_id)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(profile, f, ensure_ascii=False, indent=2)
+
+
+def _patch_profile_file(user_id: str, patch: ProfilePatch) -> None:
+    with _file_lock:
+        _save_profile_file(user_id, patch.apply(_load_profile_file(user_id)))
+
+
+async def _load_from_store(user_id: str) -> Dict[str, Any]:
     backend = _get_store_backend()
-    
+
     if backend == "file":
-        path = _profile_path(user_id)
-        if not os.path.exists(path):
-            return {}
-        with open(path, "r", encoding="utf-8") as f:
-            return json.load(f)
+        return _load_profile_file(user_id)
+    result = await backend.get_profile(user_id)
+    return result if result is not None else {}
+
+
+async def _save_to_store(user_id: str, profile: Dict[str, Any]) -> None:
+    backend = _get_store_backend()
+
+    if backend == "file":
+        _save_profile_file(user_id, profile)
     else:
-        result = backend.get_profile(user_id)
-        return result if result is not None else {}
+        await backend.save_profile(user_id, profile)
+
+
+async def _patch_store(user_id: str, patch: ProfilePatch) -> None:
+    backend = _get_store_backend()
+
+    if backend == "file":
+        _patch_profile_file(user_id, patch)
+    else:
+        await backend.patch_profile(user_id, patch)
+
+
+async def load_profile_async(user_id: str) -> Dict[str, Any]:
+    cache = _get_profile_cache()
+    if cache is None:
+        return await _load_from_store(user_id)
+    return await cache.get(user_id, lambda: _load_from_store(user_id))
+
+
+async def save_profile_async(user_id: str, profile: Dict[str, Any]) -> None:
+    cache = _get_profile_cache()
+    if cache is None:
+        await _save_to_store(user_id, profile)
+    else:
+        await cache.write(user_id, lambda: _save_to_store(user_id, profile))
+
+
+async def patch_profile_async(user_id: str, patch: ProfilePatch) -> None:
+    """Apply a ProfilePatch to the stored profile without touching the other fields."""
+    if not patch:
+        return
+    cache = _get_profile_cache()
+    if cache is None:
+        await _patch_store(user_id, patch)
+    else:
+        await cache.write(user_id, lambda: _patch_store(user_id, patch), patch.apply)
+
+
+def load_profile(user_id: str) -> Dict[str, Any]:
+    """
+    Blocking variant for scripts and offline callers; request handlers await
+    load_profile_async. Reads the store directly, bypassing the profile cache.
+    """
+    backend = _get_store_backend()
+
+    if backend == "file":
+        return _load_profile_file(user_id)
+    return run_blocking(_load_from_store(user_id))
 
 
 def save_profile(user_id: str, profile: Dict[str, Any]) -> None:
+    """
+    Blocking variant for scripts and offline callers; request handlers await
+    save_profile_async. Drops this process's cached copy but does not bump
+    the shared version, so other workers catch up on their TTL.
+    """
     backend = _get_store_backend()
-    
+
     if backend == "file":
-        os.makedirs(MEMORY_DIR, exist_ok=True)
-        path = _profile_path(user_id)
-        with open(path, "w", encoding="utf-8") as f:
-            json.dump(profile, f, ensure_ascii=False, indent=2)
+        _save_profile_file(user_id, profile)
     else:
-        backend.save_profile(user_id, profile)
+        run_blocking(_save_to_store(user_id, profile))
+    cache = _get_profile_cache()
+    if cache is not None:
+        cache.invalidate(user_id)
 
 
-def update_profile_from_turn(
-    user_id: str,
+class ProfileSession:
+    """
+    Unit of work for one user's profile: load once, mutate ``profile`` in
+    place, flush once. Only the top-level fields that changed since the
+    load are written, as a ProfilePatch, so concurrent writers (the
+    background classifier, another device's turn) keep their own fields
+    and timelines only grow by the entries this session appended.
+
+    A session created without loading starts from an empty snapshot; every
+    field set on it is written and nothing is removed.
+    """
+
+    def __init__(self, user_id: str, profile: Optional[Dict[str, Any]] = None):
+        self.user_id = user_id
+        self.profile: Dict[str, Any] = profile if profile is not None else {}
+        self._snapshot: Dict[str, Any] = copy.deepcopy(self.profile)
+
+    @classmethod
+    async def load(cls, user_id: str) -> "ProfileSession":
+        return cls(user_id, await load_profile_async(user_id) or {})
+
+    def changes(self) -> ProfilePatch:
+        return diff_profile(self._snapshot, self.profile)
+
+    async def flush(self) -> bool:
+        """Write pending changes; returns False when there was nothing to write."""
+        patch = self.changes()
+        if not patch:
+            return False
+        await patch_profile_async(self.user_id, patch)
+        self._snapshot = copy.deepcopy(self.profile)
+        return True
+
+
+_STRESS_LOAD = keywords("stuck", "overwhelmed", "burnout", "anxious")
+_ADVANCEMENT_FOCUS = keywords("promotion", "vp", "director", "career")
+_LEADERSHIP_SCOPE = keywords("team", "stakeholder", "manager", "leadership")
+
+
+def apply_turn_to_profile(
+    profile: Dict[str, Any],
     user_message: str,
     goal_link: str,
     style_used: str,
     emotion_primary: str,
     context_triggers: dict,
+    features: Optional[MessageFeatures] = None,
 ) -> Dict[str, Any]:
-    profile = load_profile(user_id) or {}
     profile.setdefault("goals", [])
     profile.setdefault("patterns", [])
     profile.setdefault("last_topics", [])
@@ -84,12 +333,12 @@ def update_profile_from_turn(
         profile["goals"].append(goal_link)
     
     patterns = set(profile.get("patterns", []))
-    text = (user_message or "").lower()
-    if any(k in text for k in ["stuck", "overwhelmed", "burnout", "anxious"]):
+    f = features or extract_features(user_message)
+    if f.any(_STRESS_LOAD):
         patterns.add("stress_load")
-    if any(k in text for k in ["promotion", "vp", "director", "career"]):
+    if f.any(_ADVANCEMENT_FOCUS):
         patterns.add("advancement_focus")
-    if any(k in text for k in ["team", "stakeholder", "manager", "leadership"]):
+    if f.any(_LEADERSHIP_SCOPE):
         patterns.add("leadership_scope")
     profile["patterns"] = sorted(patterns)
 
@@ -100,7 +349,22 @@ def update_profile_from_turn(
         "goal": goal_link,
         "context": context_triggers or {},
     })
-    profile["emotion_timeline"] = timeline[-40:]
+    profile["emotion_timeline"] = timeline[-APPEND_ONLY_FIELDS["emotion_timeline"]:]
+    return profile
 
+
+def update_profile_from_turn(
+    user_id: str,
+    user_message: str,
+    goal_link: str,
+    style_used: str,
+    emotion_primary: str,
+    context_triggers: dict,
+    features: Optional[MessageFeatures] = None,
+) -> Dict[str, Any]:
+    profile = load_profile(user_id) or {}
+    apply_turn_to_profile(
+        profile, user_message, goal_link, style_used, emotion_primary, context_triggers, features,
+    )
     save_profile(user_id, profile)
     return profile
@@ -0,0 +1,193 @@
+"""
+Single-pass message feature extraction.
+
+The turn pipeline used to lowercase and re-scan the same user message in a
+dozen analyzers (emotion, style, goal link, stage signals, model selection,
+crisis gate, quick replies ...). Each analyzer now registers its keyword
+lists and regexes here at import time; they are compiled into one automaton
+and every message is scanned exactly once:
+
+  - literals (substring semantics, like ``k in text``) are merged into a
+    trie so the combined regex shares prefixes, Aho-Corasick style;
+  - a regex registered with literal prefixes (one of which starts every
+    match) is only run when the scan found one of them; ``word_pattern``
+    builds ``\b(word|...)\b`` regexes whose words are their own prefixes.
+
+Analyzers accept an optional ``features`` argument and fall back to
+``extract_features(text)``, which memoizes recent scans.
+"""
+
+import re
+import threading
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+_lock = threading.Lock()
+_literals: Dict[str, None] = {}
+# regex source -> literal prefixes that gate it (None: run on every message)
+_patterns: Dict[str, Optional[Tuple[str, ...]]] = {}
+_REGEX_SYNTAX = frozenset(".^$*+?{}[]\\|()")
+_automaton: Optional["_Automaton"] = None
+
+
+def keywords(*words: str) -> Tuple[str, ...]:
+    """Register literal keywords (matched as substrings) and return them."""
+    global _automaton
+    with _lock:
+        for word in words:
+            if word and word not in _literals:
+                _literals[word] = None
+                _automaton = None
+    return tuple(words)
+
+
+def pattern(source: str, prefixes: Optional[Iterable[str]] = None) -> str:
+    """
+    Register a regex (matched with ``re.search`` semantics) and return it.
+    ``prefixes``, when given, are literals one of which starts every match;
+    the regex is then only run on messages that contain one of them.
+    """
+    global _automaton
+    gate = tuple(sorted(set(prefixes))) if prefixes is not None else None
+    if gate is not None and (not gate or "" in gate):
+        raise ValueError(f"pattern {source!r} needs non-empty prefixes")
+    with _lock:
+        if source not in _patterns or (_patterns[source] is None and gate is not None):
+            _patterns[source] = gate
+            _automaton = None
+    return source
+
+
+def word_pattern(*words: str) -> str:
+    """Register ``\\b(word|...)\\b`` for plain words and phrases, gated on the words themselves."""
+    for word in words:
+        if not word or not _REGEX_SYNTAX.isdisjoint(word):
+            raise ValueError(f"word_pattern takes plain words, got {word!r}; use pattern() with prefixes")
+    return pattern(r"\b(" + "|".join(words) + r")\b", prefixes=words)
+
+
+def _trie_regex(trie: Dict[str, dict]) -> str:
+    alternatives = []
+    for ch in sorted(k for k in trie if k):
+        alternatives.append(re.escape(ch) + _trie_regex(trie[ch]))
+    if not alternatives:
+        return ""
+    body = alternatives[0] if len(alternatives) == 1 else "(?:" + "|".join(alternatives) + ")"
+    if "" in trie:
+        body = f"(?:{body})?"
+    return body
+
+
+class _Automaton:
+    def __init__(self, literals: Iterable[str], patterns: Dict[str, Optional[Tuple[str, ...]]]) -> None:
+        # Each pattern is confirmed with its own compiled regex, but only when
+        # one of its literal prefixes shows up in the keyword scan. Python's
+        # re has no multi-pattern DFA, so a single alternation of every
+        # pattern costs more than this prefilter.
+        self.patterns: List[Tuple[str, "re.Pattern[str]", Optional[Tuple[str, ...]]]] = []
+        words = dict.fromkeys(literals)
+        for source, prefixes in patterns.items():
+            words.update(dict.fromkeys(prefixes or ()))
+            self.patterns.append((source, re.compile(source), prefixes))
+
+        self.trie: Dict[str, dict] = {}
+        for word in words:
+            node = self.trie
+            for ch in word:
+                node = node.setdefault(ch, {})
+            node[""] = word
+        # Longest trie match at every position; shorter keywords ending
+        # inside it are collected by walking the trie along the match.
+        trie_source = _trie_regex(self.trie)
+        self.regex = re.compile(f"(?=({trie_source}))") if trie_source else None
+
+    def scan(self, text: str) -> Tuple[Set[str], Dict[str, str]]:
+        literal_hits: Set[str] = set()
+        if self.regex is not None:
+            trie = self.trie
+            for m in self.regex.finditer(text):
+                node = trie
+                for ch in m.group(1):
+                    node = node[ch]
+                    word = node.get("")
+                    if word is not None:
+                        literal_hits.add(word)
+
+        pattern_hits: Dict[str, str] = {}
+        for source, compiled, prefixes in self.patterns:
+            if prefixes is not None and literal_hits.isdisjoint(prefixes):
+                continue
+            m = compiled.search(text)
+            if m is not None:
+                pattern_hits[source] = m.group(0)
+        return literal_hits, pattern_hits
+
+
+def _get_automaton() -> _Automaton:
+    global _automaton
+    automaton = _automaton
+    if automaton is None:
+        with _lock:
+            if _automaton is None:
+                _automaton = _Automaton(list(_literals), dict(_patterns))
+            automaton = _automaton
+    return automaton
+
+
+class MessageFeatures:
+    """The shared hit set for one lowercased message."""
+
+    __slots__ = ("text", "literal_hits", "pattern_hits", "_automaton")
+
+    def __init__(self, text: str) -> None:
+        self.text = text
+        self._automaton = _get_automaton()
+        self.literal_hits, self.pattern_hits = self._automaton.scan(text)
+
+    def _refresh(self) -> None:
+        # A module registered new keywords after this scan; rescan once.
+        self._automaton = _get_automaton()
+        self.literal_hits, self.pattern_hits = self._automaton.scan(self.text)
+
+    def has(self, word: str) -> bool:
+        if word not in _literals:
+            return word in self.text
+        if self._automaton is not _automaton:
+            self._refresh()
+        return word in self.literal_hits
+
+    def any(self, words: Iterable[str]) -> bool:
+        if self._automaton is not _automaton:
+            self._refresh()
+        if not self.literal_hits.isdisjoint(words):
+            return True
+        return any(w in self.text for w in words if w not in _literals)
+
+    def count(self, words: Iterable[str]) -> int:
+        return sum(1 for w in words if self.has(w))
+
+    def search(self, source: str) -> Optional[str]:
+        """Text of the leftmost match of a registered pattern, like re.search(...).group(0)."""
+        if source not in _patterns:
+            m = re.search(source, self.text)
+            return m.group(0) if m else None
+        if self._automaton is not _automaton:
+            self._refresh()
+        return self.pattern_hits.get(source)
+
+    def matches(self, source: str) -> bool:
+        return self.search(source) is not None
+
+
+@lru_cache(maxsize=256)
+def _extract_cached(text: str) -> MessageFeatures:
+    return MessageFeatures(text)
+
+
+def extract_features(message: Optional[str]) -> MessageFeatures:
+    """Scan a message once (lowercased) and return its shared hit set."""
+    return _extract_cached((message or "").lower())
+
+
+def registered_counts() -> Dict[str, int]:
+    return {"literals": len(_literals), "patterns": len(_patterns)}
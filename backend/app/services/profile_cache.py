@@ -0,0 +1,223 @@
+"""
+In-process LRU + TTL cache in front of the profile store.
+
+Entries are keyed by user_id and carry the profile version, a shared
+counter in the CacheBackend that every write bumps. A write publishes the
+new version on ``PROFILE_INVALIDATION_CHANNEL``; other workers drop any
+entry older than it. With the in-memory backend the counter and the
+channel are per-process, so ``PROFILE_CACHE_TTL_SECONDS`` bounds how stale
+another worker's copy can get.
+
+Reads return a fresh copy; callers own and may mutate it.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from app.services.cache import CacheBackend, NoopCache
+
+logger = logging.getLogger(__name__)
+
+PROFILE_INVALIDATION_CHANNEL = "profile:invalidate"
+
+
+def _version_key(user_id: str) -> str:
+    return f"profile:version:{user_id}"
+
+
+@dataclass
+class _Entry:
+    version: int
+    expires_at: float
+    payload: str
+
+
+class ProfileCache:
+    def __init__(
+        self,
+        backend: CacheBackend,
+        max_entries: Optional[int] = None,
+        ttl_seconds: Optional[float] = None,
+    ) -> None:
+        self.backend = backend
+        self.max_entries = max(1, max_entries if max_entries is not None else int(os.getenv("PROFILE_CACHE_MAX_ENTRIES", "1024")))
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else float(os.getenv("PROFILE_CACHE_TTL_SECONDS", "60"))
+        self.origin = uuid.uuid4().hex
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        # Loads and writes in flight per user. An invalidation bumps the
+        # user's epoch so a load that started before it never installs.
+        self._loads: Dict[str, int] = {}
+        self._writes: Dict[str, int] = {}
+        self._epochs: Dict[str, int] = {}
+        self._mutex = threading.Lock()
+        self._listener: Optional[asyncio.Task] = None
+        self._counters = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "invalidations": 0}
+
+    async def get(self, user_id: str, loader: Callable[[], Awaitable[Dict[str, Any]]]) -> Dict[str, Any]:
+        """Read-through: the cached copy, or ``loader()`` installed under the current version."""
+        now = time.monotonic()
+        with self._mutex:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry.expires_at <= now:
+                del self._entries[user_id]
+                self._counters["expirations"] += 1
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(user_id)
+                self._counters["hits"] += 1
+                return json.loads(entry.payload)
+            self._counters["misses"] += 1
+            epoch = self._epochs.get(user_id, 0)
+            self._loads[user_id] = self._loads.get(user_id, 0) + 1
+
+        try:
+            # Version first: a write landing after this read bumps it past ours.
+            version = await self.backend.get_counter(_version_key(user_id))
+            profile = await loader()
+        except BaseException:
+            with self._mutex:
+                self._end_load(user_id)
+            raise
+
+        with self._mutex:
+            if self._epochs.get(user_id, 0) == epoch and not self._writes.get(user_id):
+                self._install(user_id, version, json.dumps(profile, ensure_ascii=False))
+            self._end_load(user_id)
+        return profile
+
+    async def write(
+        self,
+        user_id: str,
+        writer: Callable[[], Awaitable[None]],
+        apply: Optional[Callable[[Dict[str, Any]], Dict[str, Any]]] = None,
+    ) -> None:
+        """
+        Write-through: run ``writer`` against the store, bump the version and
+        publish it. ``apply`` updates the cached copy to match the store;
+        without it (or when another write raced this one) the entry is dropped.
+        """
+        with self._mutex:
+            self._writes[user_id] = self._writes.get(user_id, 0) + 1
+            self._bump_epoch(user_id)
+        version = 0
+        try:
+            await writer()
+            version = await self.backend.incr(_version_key(user_id))
+        finally:
+            with self._mutex:
+                alone = self._writes[user_id] == 1
+                entry = self._entries.get(user_id)
+                if entry is not None:
+                    if alone and apply is not None and version and entry.version == version - 1:
+                        profile = apply(json.loads(entry.payload))
+                        self._install(user_id, version, json.dumps(profile, ensure_ascii=False))
+                    else:
+                        self._drop(user_id)
+                self._writes[user_id] -= 1
+                if not self._writes[user_id]:
+                    del self._writes[user_id]
+                    self._forget_epoch(user_id)
+        if version:
+            try:
+                await self.backend.publish(
+                    PROFILE_INVALIDATION_CHANNEL,
+                    {"user_id": user_id, "version": version, "origin": self.origin},
+                )
+            except Exception as exc:
+                logger.warning("Profile invalidation publish failed: %s", exc)
+
+    def invalidate(self, user_id: str, version: Optional[int] = None) -> None:
+        """Drop the local entry (only if older than ``version`` when given)."""
+        with self._mutex:
+            self._bump_epoch(user_id)
+            entry = self._entries.get(user_id)
+            if entry is not None and (version is None or entry.version < version):
+                self._drop(user_id)
+            self._forget_epoch(user_id)
+
+    def clear(self) -> None:
+        with self._mutex:
+            for user_id in list(self._entries):
+                self._drop(user_id)
+            for user_id in list(self._epochs):
+                self._epochs[user_id] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._mutex:
+            lookups = self._counters["hits"] + self._counters["misses"]
+            return {
+                **self._counters,
+                "hit_rate": round(self._counters["hits"] / lookups, 4) if lookups else 0.0,
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "listening": self._listener is not None and not self._listener.done(),
+            }
+
+    # -- invalidation listener ------------------------------------------------
+
+    async def _listen(self) -> None:
+        while True:
+            try:
+                async for message in self.backend.subscribe(PROFILE_INVALIDATION_CHANNEL):
+                    if message.get("origin") == self.origin or not message.get("user_id"):
+                        continue
+                    self.invalidate(str(message["user_id"]), int(message.get("version") or 0) or None)
+                return
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                # Messages may have been missed while disconnected.
+                logger.warning("Profile invalidation listener failed, clearing cache: %s", exc)
+                self.clear()
+                await asyncio.sleep(1.0)
+
+    def start_listener(self) -> None:
+        if isinstance(self.backend, NoopCache) or (self._listener is not None and not self._listener.done()):
+            return
+        self._listener = asyncio.create_task(self._listen(), name="profile-cache-invalidation")
+
+    async def stop_listener(self) -> None:
+        task, self._listener = self._listener, None
+        if task is None:
+            return
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    # -- helpers (caller holds _mutex) ---------------------------------------
+
+    def _install(self, user_id: str, version: int, payload: str) -> None:
+        self._entries[user_id] = _Entry(version, time.monotonic() + self.ttl_seconds, payload)
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._counters["evictions"] += 1
+
+    def _drop(self, user_id: str) -> None:
+        if self._entries.pop(user_id, None) is not None:
+            self._counters["invalidations"] += 1
+
+    def _bump_epoch(self, user_id: str) -> None:
+        if user_id in self._loads or user_id in self._writes:
+            self._epochs[user_id] = self._epochs.get(user_id, 0) + 1
+
+    def _forget_epoch(self, user_id: str) -> None:
+        if user_id not in self._loads and user_id not in self._writes:
+            self._epochs.pop(user_id, None)
+
+    def _end_load(self, user_id: str) -> None:
+        self._loads[user_id] -= 1
+        if not self._loads[user_id]:
+            del self._loads[user_id]
+            self._forget_epoch(user_id)
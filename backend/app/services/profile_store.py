@@ -1,25 +1,66 @@
-import json
+"""
+Postgres profile storage.
+
+The profile document lives in ``coaching_profiles.profile_json`` and is
+updated with targeted JSONB operators: ``-`` for removed keys, ``||`` for
+replaced keys and a per-key ``||`` merge for nested dicts such as
+``session_state``. The append-only lists (``emotion_timeline``,
+``session_events``) live in child tables, one row per entry, indexed by
+``(user_id, ts)``. Reads return the newest ``cap`` entries, so callers see
+the same document shape as before; a background pruner deletes the older
+rows.
+"""
+
+import asyncio
 import logging
 import os
 from datetime import datetime, timezone
-from typing import Any, Dict, Optional
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Set
 
 import psycopg
+from psycopg import sql
 from psycopg.rows import dict_row
+from psycopg.types.json import Jsonb
+
+from app.services.database import Database, get_database
+
+if TYPE_CHECKING:
+    from app.services.memory_store import ProfilePatch
 
 logger = logging.getLogger(__name__)
 
+# Profile list field -> child table holding its entries.
+TIMELINE_TABLES: Dict[str, str] = {
+    "emotion_timeline": "profile_emotion_timeline",
+    "session_events": "profile_session_events",
+}
+
+DEFAULT_TIMELINE_CAPS: Dict[str, int] = {
+    "emotion_timeline": 40,
+    "session_events": 50,
+}
+
 
 class ProfileStore:
-    def __init__(self, database_url: Optional[str] = None):
+    def __init__(self, database_url: Optional[str] = None, timeline_caps: Optional[Dict[str, int]] = None):
         self.database_url = database_url or os.getenv("DATABASE_URL")
         if not self.database_url:
             raise RuntimeError("DATABASE_URL environment variable is required for profile storage")
+        self.timeline_caps = dict(timeline_caps or DEFAULT_TIMELINE_CAPS)
+        self.prune_interval = float(os.getenv("PROFILE_PRUNE_INTERVAL_SECONDS", "60"))
+        self._dirty_users: Set[str] = set()
+        self._pruner: Optional[asyncio.Task] = None
+        self._pruner_stop: Optional[asyncio.Event] = None
         self._ensure_db()
 
     def _ensure_db(self):
+        # One-off schema bootstrap at construction; queries go through the pool.
+        # Workers booting together run it one at a time: the transaction-scoped
+        # advisory lock makes the second wait until the first has committed,
+        # so it sees the lists already moved and copies nothing.
         with psycopg.connect(self.database_url) as conn:
             with conn.cursor() as cur:
+                cur.execute("SELECT pg_advisory_xact_lock(hashtext('coaching_profiles_bootstrap'))")
                 cur.execute("""
                     CREATE TABLE IF NOT EXISTS coaching_profiles (
                         user_id TEXT PRIMARY KEY,
@@ -27,35 +68,205 @@ class ProfileStore:
                         updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
                     )
                 """)
+                for field, table in TIMELINE_TABLES.items():
+                    cur.execute(sql.SQL("""
+                        CREATE TABLE IF NOT EXISTS {table} (
+                            id BIGSERIAL PRIMARY KEY,
+                            user_id TEXT NOT NULL,
+                            ts TIMESTAMPTZ NOT NULL DEFAULT now(),
+                            entry JSONB NOT NULL
+                        )
+                    """).format(table=sql.Identifier(table)))
+                    cur.execute(sql.SQL(
+                        "CREATE INDEX IF NOT EXISTS {index} ON {table} (user_id, ts, id)"
+                    ).format(index=sql.Identifier(f"{table}_user_ts"), table=sql.Identifier(table)))
+                    # Move lists still embedded in profile_json (rows written
+                    # before the child tables existed) into the table. Checked
+                    # under the lock, so only one worker ever moves them.
+                    cur.execute(
+                        "SELECT EXISTS (SELECT 1 FROM coaching_profiles WHERE profile_json ? %s)", (field,),
+                    )
+                    if not cur.fetchone()[0]:
+                        continue
+                    cur.execute(sql.SQL("""
+                        INSERT INTO {table} (user_id, ts, entry)
+                        SELECT p.user_id, p.updated_at, e.entry
+                        FROM coaching_profiles p,
+                             jsonb_array_elements(p.profile_json->%(field)s) WITH ORDINALITY AS e(entry, n)
+                        WHERE jsonb_typeof(p.profile_json->%(field)s) = 'array'
+                        ORDER BY p.user_id, e.n
+                    """).format(table=sql.Identifier(table)), {"field": field})
+                    cur.execute(
+                        "UPDATE coaching_profiles SET profile_json = profile_json - %s WHERE profile_json ? %s",
+                        (field, field),
+                    )
             conn.commit()
 
-    def _get_conn(self):
-        return psycopg.connect(self.database_url)
+    @property
+    def db(self) -> Database:
+        return get_database(self.database_url)
 
-    def get_profile(self, user_id: str) -> Optional[Dict[str, Any]]:
-        with self._get_conn() as conn:
-            with conn.cursor(row_factory=dict_row) as cur:
-                cur.execute(
-                    "SELECT profile_json FROM coaching_profiles WHERE user_id = %s",
-                    (user_id,),
-                )
-                row = cur.fetchone()
+    async def get_profile(self, user_id: str) -> Optional[Dict[str, Any]]:
+        timelines = sql.SQL(", ").join(
+            sql.SQL("""(SELECT jsonb_agg(t.entry ORDER BY t.ts, t.id) FROM (
+                           SELECT entry, ts, id FROM {table} WHERE user_id = %(user_id)s
+                           ORDER BY ts DESC, id DESC LIMIT {cap}) t) AS {field}""").format(
+                table=sql.Identifier(table),
+                cap=sql.Literal(self.timeline_caps[field]),
+                field=sql.Identifier(field),
+            )
+            for field, table in TIMELINE_TABLES.items()
+        )
+        query = sql.SQL(
+            "SELECT profile_json, {timelines} FROM coaching_profiles WHERE user_id = %(user_id)s"
+        ).format(timelines=timelines)
+        async with self.db.connection() as conn:
+            async with conn.cursor(row_factory=dict_row) as cur:
+                await cur.execute(query, {"user_id": user_id})
+                row = await cur.fetchone()
         if not row:
             return None
-        return row["profile_json"]
+        profile = row["profile_json"]
+        for field in TIMELINE_TABLES:
+            if row[field] is not None:
+                profile[field] = row[field]
+        return profile
 
-    def save_profile(self, user_id: str, profile: Dict[str, Any]) -> None:
+    async def save_profile(self, user_id: str, profile: Dict[str, Any]) -> None:
         now = datetime.now(timezone.utc)
-        with self._get_conn() as conn:
-            with conn.cursor() as cur:
-                cur.execute(
-                    """INSERT INTO coaching_profiles (user_id, profile_json, updated_at)
-                       VALUES (%s, %s, %s)
-                       ON CONFLICT (user_id)
-                       DO UPDATE SET profile_json = %s, updated_at = %s""",
-                    (user_id, json.dumps(profile), now, json.dumps(profile), now),
+        document = {k: v for k, v in profile.items() if k not in TIMELINE_TABLES}
+        async with self.db.connection() as conn:
+            await conn.execute(
+                """INSERT INTO coaching_profiles (user_id, profile_json, updated_at)
+                   VALUES (%s, %s, %s)
+                   ON CONFLICT (user_id)
+                   DO UPDATE SET profile_json = EXCLUDED.profile_json, updated_at = EXCLUDED.updated_at""",
+                (user_id, Jsonb(document), now),
+            )
+            for field in TIMELINE_TABLES:
+                await self._replace_timeline(conn, user_id, field, profile.get(field))
+
+    async def patch_profile(self, user_id: str, patch: "ProfilePatch") -> None:
+        """
+        Apply a ProfilePatch in one transaction: removed and replaced keys via
+        ``-`` / ``||``, nested dict keys merged per sub-key, timeline entries
+        inserted as rows.
+        """
+        now = datetime.now(timezone.utc)
+        fields = {k: v for k, v in patch.fields.items() if k not in TIMELINE_TABLES}
+        removed = [k for k in patch.removed if k not in TIMELINE_TABLES]
+
+        current = sql.SQL("coaching_profiles.profile_json")
+        update = sql.SQL("({current} - %s::text[]) || %s::jsonb").format(current=current)
+        params: List[Any] = [list(removed), Jsonb(fields)]
+        for key in set(patch.merged) | set(patch.merged_removed):
+            update = sql.SQL("""{update} || jsonb_build_object(%s::text,
+                (CASE WHEN jsonb_typeof({current}->%s) = 'object' THEN {current}->%s ELSE '{{}}'::jsonb END
+                 - %s::text[]) || %s::jsonb)""").format(update=update, current=current)
+            params.extend([key, key, key, list(patch.merged_removed.get(key, ())), Jsonb(patch.merged.get(key, {}))])
+        # A new row starts from the patch itself.
+        document = {**fields, **{key: dict(value) for key, value in patch.merged.items()}}
+
+        async with self.db.connection() as conn:
+            await conn.execute(
+                sql.SQL("""INSERT INTO coaching_profiles (user_id, profile_json, updated_at)
+                   VALUES (%s, %s, %s)
+                   ON CONFLICT (user_id)
+                   DO UPDATE SET profile_json = {update}, updated_at = EXCLUDED.updated_at""").format(update=update),
+                [user_id, Jsonb(document), now, *params],
+            )
+            for field in TIMELINE_TABLES:
+                if field in patch.fields:
+                    await self._replace_timeline(conn, user_id, field, patch.fields[field])
+                elif field in patch.removed:
+                    await self._replace_timeline(conn, user_id, field, None)
+                elif patch.appended.get(field):
+                    await self._append_timeline(conn, user_id, field, patch.appended[field])
+
+    async def _append_timeline(self, conn: psycopg.AsyncConnection, user_id: str, field: str, entries: List[Any]) -> None:
+        async with conn.cursor() as cur:
+            await cur.executemany(
+                sql.SQL("INSERT INTO {table} (user_id, entry) VALUES (%s, %s)").format(
+                    table=sql.Identifier(TIMELINE_TABLES[field])
+                ),
+                [(user_id, Jsonb(entry)) for entry in entries],
+            )
+        self._dirty_users.add(user_id)
+
+    async def _replace_timeline(self, conn: psycopg.AsyncConnection, user_id: str, field: str, entries: Any) -> None:
+        await conn.execute(
+            sql.SQL("DELETE FROM {table} WHERE user_id = %s").format(table=sql.Identifier(TIMELINE_TABLES[field])),
+            (user_id,),
+        )
+        if isinstance(entries, list) and entries:
+            await self._append_timeline(conn, user_id, field, entries[-self.timeline_caps[field]:])
+
+    async def prune(self, user_ids: Optional[List[str]] = None) -> int:
+        """
+        Delete timeline rows beyond each user's cap. Limited to ``user_ids``
+        when given, otherwise every user. Returns the number of rows deleted.
+        """
+        deleted = 0
+        scope = sql.SQL("WHERE user_id = ANY(%(users)s)") if user_ids is not None else sql.SQL("")
+        async with self.db.connection() as conn:
+            for field, table in TIMELINE_TABLES.items():
+                cur = await conn.execute(
+                    sql.SQL("""DELETE FROM {table} WHERE id IN (
+                           SELECT id FROM (
+                               SELECT id, row_number() OVER (PARTITION BY user_id ORDER BY ts DESC, id DESC) AS n
+                               FROM {table} {scope}
+                           ) ranked WHERE n > %(cap)s)""").format(table=sql.Identifier(table), scope=scope),
+                    {"users": user_ids, "cap": self.timeline_caps[field]},
                 )
-            conn.commit()
+                deleted += cur.rowcount
+        return deleted
+
+    async def prune_dirty(self) -> int:
+        """Prune the users that gained timeline rows since the last call."""
+        if not self._dirty_users:
+            return 0
+        users = sorted(self._dirty_users)
+        self._dirty_users.clear()
+        try:
+            return await self.prune(users)
+        except Exception:
+            self._dirty_users.update(users)
+            raise
+
+    async def _prune_loop(self, stop: asyncio.Event) -> None:
+        full_sweep = True
+        while not stop.is_set():
+            try:
+                deleted = await (self.prune() if full_sweep else self.prune_dirty())
+                full_sweep = False
+                if deleted:
+                    logger.info("Pruned %d profile timeline rows", deleted)
+            except Exception as exc:
+                logger.warning("Profile timeline pruning failed: %s", exc)
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=self.prune_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def start_pruner(self) -> None:
+        if self.prune_interval <= 0 or (self._pruner is not None and not self._pruner.done()):
+            return
+        # Stopped via the event rather than cancel(), so a prune in flight
+        # finishes its statement instead of being interrupted mid-query.
+        self._pruner_stop = asyncio.Event()
+        self._pruner = asyncio.create_task(self._prune_loop(self._pruner_stop), name="profile-timeline-pruner")
+
+    async def stop_pruner(self) -> None:
+        task, self._pruner = self._pruner, None
+        if task is None:
+            return
+        self._pruner_stop.set()
+        await task
+        # Catch up on what the loop had not reached yet.
+        try:
+            await self.prune_dirty()
+        except Exception as exc:
+            logger.warning("Profile timeline pruning failed: %s", exc)
 
 
 _profile_store: Optional[ProfileStore] = None
@@ -66,4 +277,3 @@ def get_profile_store() -> ProfileStore:
     if _profile_store is None:
         _profile_store = ProfileStore()
     return _profile_store
-
@@ -0,0 +1,223 @@
+"""
+Server-sent event framing for the chat stream.
+
+Tokens are coalesced into frames by a time window and a byte budget, and
+text is only split where a reader would not notice: preferably after
+whitespace, otherwise between CJK characters, otherwise between grapheme
+clusters (never inside a combining sequence, an emoji ZWJ sequence or a
+flag). Cached results are sent as pre-split frames without pacing by
+default.
+"""
+
+import asyncio
+import json
+import os
+import unicodedata
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Tuple
+
+SSE_DONE = "data: [DONE]\n\n"
+
+COALESCE_WINDOW_SECONDS = float(os.getenv("SSE_COALESCE_WINDOW_MS", "40")) / 1000.0
+COALESCE_MAX_BYTES = int(os.getenv("SSE_COALESCE_MAX_BYTES", "1024"))
+REPLAY_PACING_SECONDS = float(os.getenv("SSE_REPLAY_PACING_MS", "0")) / 1000.0
+
+_ZWJ = "\u200d"
+
+
+def _extends_cluster(ch: str) -> bool:
+    """Whether ``ch`` belongs to the grapheme cluster before it."""
+    code = ord(ch)
+    return (
+        unicodedata.category(ch) in ("Mn", "Me", "Mc")
+        or ch == _ZWJ
+        or 0xFE00 <= code <= 0xFE0F  # variation selectors
+        or 0xE0100 <= code <= 0xE01EF
+        or 0x1F3FB <= code <= 0x1F3FF  # emoji skin tones
+        or 0xE0020 <= code <= 0xE007F  # emoji tag sequences
+    )
+
+
+def _is_regional_indicator(ch: str) -> bool:
+    return 0x1F1E6 <= ord(ch) <= 0x1F1FF
+
+
+def _is_cjk(ch: str) -> bool:
+    code = ord(ch)
+    return (
+        0x3000 <= code <= 0x30FF  # CJK punctuation, hiragana, katakana
+        or 0x3400 <= code <= 0x4DBF
+        or 0x4E00 <= code <= 0x9FFF
+        or 0xAC00 <= code <= 0xD7AF  # hangul syllables
+        or 0xF900 <= code <= 0xFAFF
+        or 0xFF00 <= code <= 0xFFEF  # fullwidth forms
+        or 0x20000 <= code <= 0x2FA1F
+    )
+
+
+def _boundaries(text: str) -> Iterable[Tuple[int, int]]:
+    """``(index, rank)`` for every grapheme boundary inside ``text``; higher ranks split more naturally."""
+    regional_run = 0
+    for i in range(1, len(text)):
+        prev, ch = text[i - 1], text[i]
+        regional_run = regional_run + 1 if _is_regional_indicator(prev) else 0
+        if _extends_cluster(ch) or prev == _ZWJ:
+            continue
+        if _is_regional_indicator(ch) and regional_run % 2 == 1:
+            continue  # second half of a flag
+        if prev.isspace() and not ch.isspace():
+            yield i, 3
+        elif _is_cjk(prev) or _is_cjk(ch):
+            yield i, 2
+        else:
+            yield i, 1
+
+
+def split_text(text: str, max_bytes: int) -> List[str]:
+    """
+    Split ``text`` into pieces of at most ``max_bytes`` UTF-8 bytes (a single
+    grapheme cluster may exceed it) at the best boundary available.
+    ``"".join(split_text(t, n)) == t``.
+    """
+    if max_bytes <= 0 or len(text.encode("utf-8")) <= max_bytes:
+        return [text] if text else []
+    pieces: List[str] = []
+    start = 0
+    size = 0
+    best: Optional[Tuple[int, int]] = None  # (rank, index) of the best cut so far
+    last = 0
+    for index, rank in _boundaries(text):
+        size += len(text[last:index].encode("utf-8"))
+        last = index
+        if size > max_bytes and best is not None:
+            cut = best[1]
+            pieces.append(text[start:cut])
+            size = len(text[cut:index].encode("utf-8"))
+            start, best = cut, None
+        if best is None or rank >= best[0]:
+            best = (rank, index)
+    tail_size = size + len(text[last:].encode("utf-8"))
+    if tail_size > max_bytes and best is not None and best[1] > start:
+        pieces.append(text[start:best[1]])
+        start = best[1]
+    pieces.append(text[start:])
+    return pieces
+
+
+async def coalesce_tokens(
+    source: AsyncIterator[Tuple[str, Any]],
+    window_seconds: Optional[float] = None,
+    max_bytes: Optional[int] = None,
+) -> AsyncIterator[Tuple[str, Any]]:
+    """
+    Merge consecutive ``("token", text)`` items from ``source`` until
+    ``window_seconds`` have passed since the first one or ``max_bytes`` are
+    buffered; any other item flushes the buffer and passes through. A
+    window of 0 only splits oversized tokens.
+    """
+    window_seconds = COALESCE_WINDOW_SECONDS if window_seconds is None else window_seconds
+    max_bytes = COALESCE_MAX_BYTES if max_bytes is None else max_bytes
+    if window_seconds <= 0:
+        async for kind, payload in source:
+            if kind == "token":
+                for piece in split_text(payload, max_bytes):
+                    yield kind, piece
+            else:
+                yield kind, payload
+        return
+
+    # A pump task reads the source, so waiting on the window never cancels
+    # the source generator mid-step.
+    queue: asyncio.Queue = asyncio.Queue()
+    end, flush = object(), object()
+
+    async def pump() -> None:
+        try:
+            async for item in source:
+                await queue.put(item)
+        except Exception as exc:
+            await queue.put(exc)
+            return
+        await queue.put(end)
+
+    task = asyncio.create_task(pump())
+    loop = asyncio.get_running_loop()
+    buffer: List[str] = []
+    buffered = 0
+    flush_at = 0.0
+    try:
+        while True:
+            if buffer:
+                try:
+                    item = await asyncio.wait_for(queue.get(), timeout=max(0.0, flush_at - loop.time()))
+                except asyncio.TimeoutError:
+                    item = flush
+            else:
+                item = await queue.get()
+
+            if isinstance(item, tuple) and item[0] == "token":
+                if not buffer:
+                    flush_at = loop.time() + window_seconds
+                buffer.append(item[1])
+                buffered += len(item[1].encode("utf-8"))
+                if max_bytes <= 0 or buffered < max_bytes:
+                    continue
+                # Over budget: send the full frames, keep the remainder for
+                # the rest of the window.
+                pieces = split_text("".join(buffer), max_bytes)
+                for piece in pieces[:-1]:
+                    yield "token", piece
+                buffer = [pieces[-1]]
+                buffered = len(pieces[-1].encode("utf-8"))
+                if buffered < max_bytes:
+                    continue
+
+            if buffer:
+                for piece in split_text("".join(buffer), max_bytes):
+                    yield "token", piece
+                buffer, buffered = [], 0
+            if item is end:
+                return
+            if isinstance(item, Exception):
+                raise item
+            if item is not flush and not (isinstance(item, tuple) and item[0] == "token"):
+                yield item
+    finally:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+
+class SSEEmitter:
+    """
+    Formats events with sequential ids and counts the frames and bytes
+    produced. Events up to ``after_event`` (already delivered to a resuming
+    client) are numbered but come back as "" and are not counted.
+    """
+
+    def __init__(self, after_event: int = 0, continue_from: int = 0) -> None:
+        # ``continue_from``: ids already used by an earlier stream; numbering goes on from there.
+        self.after_event = after_event
+        self.last_id = continue_from
+        self.frames = 0
+        self.bytes = 0
+
+    def _frame(self, body: str) -> str:
+        self.last_id += 1
+        if self.last_id <= self.after_event:
+            return ""
+        frame = f"id: {self.last_id}\n{body}"
+        self.frames += 1
+        self.bytes += len(frame.encode("utf-8"))
+        return frame
+
+    def event(self, payload: Dict[str, Any]) -> str:
+        return self._frame(f"data: {json.dumps(payload, ensure_ascii=False)}\n\n")
+
+    def done(self) -> str:
+        return self._frame(SSE_DONE)
+
+    def stats_comment(self) -> str:
+        """SSE comment with the totals so far; clients ignore comments."""
+        return f": frames={self.frames} bytes={self.bytes}\n\n"
+
+    def headers(self) -> Dict[str, str]:
+        return {"X-SSE-Frames": str(self.frames), "X-SSE-Bytes": str(self.bytes)}
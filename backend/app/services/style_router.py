@@ -3,21 +3,32 @@ from typing import Literal, Optional
 CoachingStyle = Literal["directive", "facilitative", "supportive", "strategic"]
 
 from app.prompts.styles import STYLE_PROMPTS
+from app.services.message_features import MessageFeatures, extract_features, keywords
 
+_DIRECTIVE = keywords("urgent", "asap", "decision now", "crisis", "immediately")
+_FACILITATIVE = keywords("stuck", "not sure", "what if", "confused", "options")
+_SUPPORTIVE = keywords("anxious", "burnout", "overwhelmed", "confidence", "afraid")
+_STRATEGIC = keywords("strategy", "long term", "roadmap", "org", "stakeholder", "vp", "director")
 
-def route_style(user_message: str, preferred_style: Optional[str] = None, emotion: Optional[str] = None) -> CoachingStyle:
+
+def route_style(
+    user_message: str,
+    preferred_style: Optional[str] = None,
+    emotion: Optional[str] = None,
+    features: Optional[MessageFeatures] = None,
+) -> CoachingStyle:
     if preferred_style in STYLE_PROMPTS:
         return preferred_style  # explicit user selection wins
 
-    text = (user_message or "").lower()
+    f = features or extract_features(user_message)
 
-    if any(k in text for k in ["urgent", "asap", "decision now", "crisis", "immediately"]):
+    if f.any(_DIRECTIVE):
         return "directive"
-    if any(k in text for k in ["stuck", "not sure", "what if", "confused", "options"]):
+    if f.any(_FACILITATIVE):
         return "facilitative"
-    if any(k in text for k in ["anxious", "burnout", "overwhelmed", "confidence", "afraid"]):
+    if f.any(_SUPPORTIVE):
         return "supportive"
-    if any(k in text for k in ["strategy", "long term", "roadmap", "org", "stakeholder", "vp", "director"]):
+    if f.any(_STRATEGIC):
         return "strategic"
 
     if emotion in ["distressed", "low_confidence"]:
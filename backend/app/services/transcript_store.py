@@ -0,0 +1,317 @@
+"""
+Server-side session transcripts.
+
+Clients send only the new message and the last turn index they have
+acknowledged; the conversation itself lives here, keyed by
+``(user_id, session_id)``. Recent messages are kept in a stream log in the
+CacheBackend, bounded to ``TRANSCRIPT_MAX_MESSAGES`` and expiring
+``TRANSCRIPT_TTL_SECONDS`` after the last turn. With Postgres profile
+storage every message is also written to ``session_transcripts``, and a
+session whose ring has expired is reloaded from there.
+
+A turn is one user message and the assistant reply, numbered from 0. The
+number is assigned when the exchange is appended, under a per-session
+lock in the CacheBackend, so overlapping turns of one session get
+consecutive numbers. With Postgres the table's primary key is the final
+arbiter: a conflicting insert (another worker without a shared cache
+took the number) re-reads the durable tail and retries with the next one.
+
+Every stored message carries the hash-chain digest of the conversation up
+to and including it: ``fold_digest(previous, role, content)``, starting
+from ``EMPTY_DIGEST``. Extending the chain costs one hash of the new
+message, and a client that keeps the same chain can send the digest of the
+history it holds instead of having the server hash all of it. The digest of
+each prefix is also kept under its own CacheBackend key, so looking one up
+reads a single entry rather than the ring.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+import uuid
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Tuple
+
+import psycopg
+
+from app.services.cache import CacheBackend, get_cache_backend
+from app.services.database import Database, get_database
+
+logger = logging.getLogger(__name__)
+
+
+EMPTY_DIGEST = "0" * 64
+
+# How long an append waits for another append to the same session.
+APPEND_LOCK_WAIT_SECONDS = 5.0
+APPEND_LOCK_TTL_SECONDS = 30
+# Inserts retried after a turn-number conflict in Postgres.
+APPEND_CONFLICT_RETRIES = 3
+
+
+def fold_digest(previous: str, role: str, content: str) -> str:
+    """Digest of a conversation whose prefix digests to ``previous``, extended by one message."""
+    message = json.dumps([role, content], ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(f"{previous}{message}".encode("utf-8")).hexdigest()
+
+
+def chain_digest(messages: Iterable[Tuple[str, str]], digest: str = EMPTY_DIGEST) -> str:
+    """Fold ``(role, content)`` pairs into ``digest``."""
+    for role, content in messages:
+        digest = fold_digest(digest, role, content)
+    return digest
+
+
+def _transcript_key(user_id: str, session_id: str) -> str:
+    return f"transcript:{user_id}:{session_id}"
+
+
+def _digest_key(key: str, count: int) -> str:
+    return f"{key}:digest:{count}"
+
+
+def _prefix_length(message: Dict[str, Any]) -> int:
+    """Number of session messages up to and including ``message``."""
+    return 2 * message["turn"] + (message["role"] == "assistant") + 1
+
+
+def _durable_database_url() -> Optional[str]:
+    # Same rule as the profile store: Postgres when forced or when configured.
+    store_type = os.getenv("PROFILE_STORE", "").strip().lower()
+    database_url = os.getenv("DATABASE_URL", "").strip()
+    if store_type == "postgres" or (not store_type and database_url):
+        return database_url or None
+    return None
+
+
+@dataclass
+class Transcript:
+    # {"turn", "role", "content", "digest"}, oldest first.
+    messages: List[Dict[str, Any]] = field(default_factory=list)
+
+    @property
+    def next_turn(self) -> int:
+        return self.messages[-1]["turn"] + 1 if self.messages else 0
+
+    @property
+    def start(self) -> int:
+        """Session position (messages before it) of the oldest message held."""
+        if not self.messages:
+            return 0
+        first = self.messages[0]
+        return 2 * first["turn"] + (first["role"] == "assistant")
+
+    @property
+    def digest(self) -> Optional[str]:
+        return self.messages[-1].get("digest") if self.messages else EMPTY_DIGEST
+
+    def digest_at(self, count: int) -> Optional[str]:
+        """
+        Stored digest of the session's first ``count`` messages, or None when
+        that prefix is no longer in the transcript.
+        """
+        if count == 0:
+            return EMPTY_DIGEST
+        if not self.messages:
+            return None
+        index = count - 1 - self.start
+        if 0 <= index < len(self.messages):
+            return self.messages[index].get("digest")
+        return None
+
+    def history(self, through_turn: Optional[int] = None) -> List[Dict[str, str]]:
+        """Messages as model history, limited to turns up to ``through_turn``."""
+        return [
+            {"role": m["role"], "content": m["content"]}
+            for m in self.messages
+            if through_turn is None or m["turn"] <= through_turn
+        ]
+
+    def digests(self, through_turn: Optional[int] = None) -> List[Optional[str]]:
+        """Stored digest through each message of ``history(through_turn)``."""
+        return [m.get("digest") for m in self.messages if through_turn is None or m["turn"] <= through_turn]
+
+
+class TranscriptStore:
+    def __init__(
+        self,
+        backend: Optional[CacheBackend] = None,
+        database_url: Optional[str] = None,
+        max_messages: Optional[int] = None,
+        ttl_seconds: Optional[int] = None,
+    ) -> None:
+        self.backend = backend or get_cache_backend()
+        self.database_url = database_url if database_url is not None else _durable_database_url()
+        self.max_messages = max(2, max_messages if max_messages is not None else int(os.getenv("TRANSCRIPT_MAX_MESSAGES", "60")))
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else int(os.getenv("TRANSCRIPT_TTL_SECONDS", "86400"))
+        if self.database_url:
+            self._ensure_db()
+
+    def _ensure_db(self) -> None:
+        with psycopg.connect(self.database_url) as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS session_transcripts (
+                    user_id TEXT NOT NULL,
+                    session_id TEXT NOT NULL,
+                    turn INTEGER NOT NULL,
+                    position SMALLINT NOT NULL,
+                    role TEXT NOT NULL,
+                    content TEXT NOT NULL,
+                    digest TEXT,
+                    created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+                    PRIMARY KEY (user_id, session_id, turn, position)
+                )
+            """)
+            conn.execute("ALTER TABLE session_transcripts ADD COLUMN IF NOT EXISTS digest TEXT")
+            conn.commit()
+
+    @property
+    def db(self) -> Database:
+        return get_database(self.database_url)
+
+    async def load(self, user_id: str, session_id: str) -> Transcript:
+        """
+        The newest ``max_messages`` messages of the session. An empty ring
+        is refilled from Postgres so later turns are served from the cache.
+        """
+        key = _transcript_key(user_id, session_id)
+        entries = await self.backend.read_stream(key, "0", 0)
+        messages = [json.loads(entry) for _, entry in entries][-self.max_messages:]
+        if not messages and self.database_url:
+            messages = await self._load_durable(user_id, session_id)
+            for message in messages:
+                await self._append_ring(key, message)
+        return Transcript(messages)
+
+    async def digest_at(self, user_id: str, session_id: str, count: int) -> Optional[str]:
+        """
+        Stored digest of the session's first ``count`` messages, or None when
+        it is unknown. Reads that prefix's cache entry, falling back to its
+        row in Postgres.
+        """
+        if count == 0:
+            return EMPTY_DIGEST
+        if count < 0:
+            return None
+        key = _digest_key(_transcript_key(user_id, session_id), count)
+        raw = await self.backend.get_raw(key)
+        if raw is not None:
+            return raw.decode("utf-8")
+        if not self.database_url:
+            return None
+        turn, position = divmod(count - 1, 2)
+        async with self.db.connection() as conn:
+            cur = await conn.execute(
+                """SELECT digest FROM session_transcripts
+                   WHERE user_id = %s AND session_id = %s AND turn = %s AND position = %s""",
+                (user_id, session_id, turn, position),
+            )
+            row = await cur.fetchone()
+        digest = row[0] if row else None
+        if digest:
+            await self.backend.set_raw(key, digest.encode("utf-8"), self.ttl_seconds)
+        return digest
+
+    async def append_turn(
+        self, user_id: str, session_id: str, user_message: str, assistant_message: str,
+    ) -> Tuple[int, Optional[str]]:
+        """
+        Store one exchange as the session's next turn. Returns the turn
+        number and the transcript digest after it (None when the chain is
+        unknown, e.g. for sessions stored before digests existed).
+        """
+        key = _transcript_key(user_id, session_id)
+        async with self._append_lock(key):
+            tail = await self.load(user_id, session_id)
+            turn, previous_digest = tail.next_turn, tail.digest
+            for attempt in range(APPEND_CONFLICT_RETRIES + 1):
+                messages = _exchange(turn, previous_digest, user_message, assistant_message)
+                if not self.database_url:
+                    break
+                try:
+                    await self._insert_durable(user_id, session_id, messages)
+                    break
+                except psycopg.errors.UniqueViolation:
+                    if attempt == APPEND_CONFLICT_RETRIES:
+                        raise
+                    # Taken by a worker this lock did not cover; continue after it.
+                    durable = Transcript(await self._load_durable(user_id, session_id, 1))
+                    turn, previous_digest = durable.next_turn, durable.digest
+            for message in messages:
+                await self._append_ring(key, message)
+        return turn, messages[-1]["digest"]
+
+    @asynccontextmanager
+    async def _append_lock(self, key: str) -> AsyncIterator[None]:
+        lock_key = f"{key}:append"
+        owner = uuid.uuid4().hex
+        deadline = time.monotonic() + APPEND_LOCK_WAIT_SECONDS
+        while not await self.backend.acquire_lock(lock_key, owner, APPEND_LOCK_TTL_SECONDS):
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Transcript {key} is locked by another append")
+            await asyncio.sleep(0.01)
+        try:
+            yield
+        finally:
+            await self.backend.release_lock(lock_key, owner)
+
+    async def _insert_durable(self, user_id: str, session_id: str, messages: List[Dict[str, Any]]) -> None:
+        async with self.db.connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.executemany(
+                    """INSERT INTO session_transcripts (user_id, session_id, turn, position, role, content, digest)
+                       VALUES (%s, %s, %s, %s, %s, %s, %s)""",
+                    [
+                        (user_id, session_id, m["turn"], position, m["role"], m["content"], m["digest"])
+                        for position, m in enumerate(messages)
+                    ],
+                )
+
+    async def _append_ring(self, key: str, message: Dict[str, Any]) -> None:
+        await self.backend.append_stream(
+            key, json.dumps(message, ensure_ascii=False), self.ttl_seconds, max_entries=self.max_messages,
+        )
+        if message.get("digest"):
+            await self.backend.set_raw(
+                _digest_key(key, _prefix_length(message)), message["digest"].encode("utf-8"), self.ttl_seconds,
+            )
+
+    async def _load_durable(self, user_id: str, session_id: str, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        async with self.db.connection() as conn:
+            cur = await conn.execute(
+                """SELECT turn, role, content, digest FROM session_transcripts
+                   WHERE user_id = %s AND session_id = %s
+                   ORDER BY turn DESC, position DESC LIMIT %s""",
+                (user_id, session_id, limit or self.max_messages),
+            )
+            rows = await cur.fetchall()
+        return [
+            {"turn": turn, "role": role, "content": content, "digest": digest}
+            for turn, role, content, digest in reversed(rows)
+        ]
+
+
+def _exchange(turn: int, previous_digest: Optional[str], user_message: str, assistant_message: str) -> List[Dict[str, Any]]:
+    messages = [
+        {"turn": turn, "role": "user", "content": user_message},
+        {"turn": turn, "role": "assistant", "content": assistant_message},
+    ]
+    digest = previous_digest
+    for message in messages:
+        digest = fold_digest(digest, message["role"], message["content"]) if digest else None
+        message["digest"] = digest
+    return messages
+
+
+_transcript_store: Optional[TranscriptStore] = None
+
+
+def get_transcript_store() -> TranscriptStore:
+    global _transcript_store
+    if _transcript_store is None:
+        _transcript_store = TranscriptStore()
+    return _transcript_store
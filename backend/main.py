@@ -1,9 +1,34 @@
 import os
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from app.routers import chat, health, debug, auth
+from app.services.background_jobs import startup_background_jobs, shutdown_background_jobs
+from app.services.database import startup_database, shutdown_database
+from app.services.escalation_classifier import startup_escalation_classifier
+from app.services.llm_clients import startup_llm_clients, shutdown_llm_clients
+from app.services.memory_store import startup_profile_store, shutdown_profile_store
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await startup_llm_clients()
+    await startup_database()
+    await startup_profile_store()
+    await startup_background_jobs()
+    await startup_escalation_classifier()
+    try:
+        yield
+    finally:
+        # Drain queued Haiku work while its clients and the database are up.
+        await shutdown_background_jobs()
+        await shutdown_profile_store()
+        await shutdown_database()
+        await shutdown_llm_clients()
+
 
-app = FastAPI(title="CoachingApp API", version="1.0.0")
+app = FastAPI(title="CoachingApp API", version="1.0.0", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
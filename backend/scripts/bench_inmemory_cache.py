@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark for InMemoryCache.
+
+Fills the cache to each size with idempotency-style records, then times
+get_json / set_json / acquire_lock + release_lock against it. Per-operation
+latency should stay flat as the cache grows. ``--legacy`` also times the
+previous implementation (a full scan of every value and lock on each call)
+at the smaller sizes for comparison.
+
+    cd backend && PYTHONPATH=. python scripts/bench_inmemory_cache.py [--sizes 1000,10000,100000,200000]
+"""
+import argparse
+import asyncio
+import json
+import random
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from app.services.cache import InMemoryCache
+
+RECORD = {
+    "request_id": "req-0",
+    "signature": "9f2c" * 16,
+    "response": {
+        "response": "Let's map the options before the review. " * 8,
+        "quick_replies": ["Tell me more", "What else?", "Next step", "Summarize"],
+        "style_used": "strategic",
+    },
+}
+
+
+class LegacyInMemoryCache:
+    """The pre-heap backend: every call scans all values and locks under one mutex."""
+
+    def __init__(self) -> None:
+        self._values: Dict[str, tuple] = {}
+        self._locks: Dict[str, tuple] = {}
+        self._mutex = threading.Lock()
+
+    def _cleanup_locked(self) -> None:
+        now = time.monotonic()
+        for key in [k for k, (exp, _) in self._values.items() if exp <= now]:
+            self._values.pop(key, None)
+        for key in [k for k, (exp, _) in self._locks.items() if exp <= now]:
+            self._locks.pop(key, None)
+
+    async def get_json(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._mutex:
+            self._cleanup_locked()
+            entry = self._values.get(key)
+            return json.loads(json.dumps(entry[1], ensure_ascii=False)) if entry else None
+
+    async def set_json(self, key: str, value: Dict[str, Any], ttl_seconds: int) -> bool:
+        with self._mutex:
+            self._cleanup_locked()
+            self._values[key] = (time.monotonic() + ttl_seconds, json.loads(json.dumps(value, ensure_ascii=False)))
+            return True
+
+    async def acquire_lock(self, key: str, owner: str, ttl_seconds: int) -> bool:
+        with self._mutex:
+            self._cleanup_locked()
+            if key in self._locks:
+                return False
+            self._locks[key] = (time.monotonic() + ttl_seconds, owner)
+            return True
+
+    async def release_lock(self, key: str, owner: str) -> None:
+        with self._mutex:
+            self._cleanup_locked()
+            if self._locks.get(key, (0, None))[1] == owner:
+                self._locks.pop(key, None)
+
+
+async def _fill(cache, size: int, rng: random.Random) -> None:
+    for i in range(size):
+        # Mix of 20-minute idempotency records and 7-day summaries.
+        await cache.set_json(f"idem:u{i % 5000}:req-{i}", RECORD, rng.choice((1200, 604800)))
+
+
+async def _per_op_us(cache, size: int, ops: int, rng: random.Random) -> Dict[str, float]:
+    picks = [rng.randrange(size) for _ in range(ops)]
+    keys = [f"idem:u{i % 5000}:req-{i}" for i in picks]
+    timings = {}
+
+    start = time.perf_counter()
+    for key in keys:
+        await cache.get_json(key)
+    timings["get"] = (time.perf_counter() - start) / ops * 1e6
+
+    start = time.perf_counter()
+    for key in keys:
+        await cache.set_json(key, RECORD, 1200)
+    timings["set"] = (time.perf_counter() - start) / ops * 1e6
+
+    start = time.perf_counter()
+    for i in range(ops):
+        lock_key = f"idemlock:bench:{i}"
+        await cache.acquire_lock(lock_key, "owner", 120)
+        await cache.release_lock(lock_key, "owner")
+    timings["lock"] = (time.perf_counter() - start) / ops * 1e6
+    return timings
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", default="1000,10000,100000,200000")
+    parser.add_argument("--ops", type=int, default=20000)
+    parser.add_argument("--legacy", action="store_true", help="also time the full-scan implementation")
+    parser.add_argument("--legacy-max-size", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    sizes = [int(s) for s in args.sizes.split(",") if s]
+
+    print(f"{'impl':<8}{'entries':>10}{'get us':>10}{'set us':>10}{'lock us':>10}")
+    for size in sizes:
+        impls = [("heap", InMemoryCache(max_entries=size * 2, max_bytes=0))]
+        if args.legacy and size <= args.legacy_max_size:
+            impls.append(("legacy", LegacyInMemoryCache()))
+        for name, cache in impls:
+            rng = random.Random(args.seed)
+            asyncio.run(_fill(cache, size, rng))
+            ops = args.ops if name == "heap" else max(200, args.ops // 50)
+            t = asyncio.run(_per_op_us(cache, size, ops, rng))
+            print(f"{name:<8}{size:>10}{t['get']:>10.2f}{t['set']:>10.2f}{t['lock']:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark for the shared message feature scan.
+
+Compares the per-message cost of the turn analyzers when every analyzer
+re-scans the message (what the pipeline did before MessageFeatures) against
+one shared scan feeding all of them.
+
+    cd backend && PYTHONPATH=. python scripts/bench_message_features.py [--messages N]
+"""
+import argparse
+import random
+import time
+
+from app.services import llm_claude as L
+from app.services.emotion_analyzer import detect_emotion
+from app.services.style_router import route_style
+from app.services.context_engine import infer_goal_link
+from app.services.emotion_engine import analyze_text_emotion, infer_context_triggers
+from app.services.goal_architecture import infer_goal_hierarchy
+from app.prompts.proprietary_frameworks import get_framework_for_context
+from app.services.message_features import MessageFeatures, _extract_cached, extract_features, registered_counts
+
+SAMPLES = [
+    "My team performance is slipping and I feel stuck before the Q3 review.",
+    "I got a job offer but I'm not sure whether to switch roles or push for a promotion.",
+    "My manager keeps giving vague feedback and I'm anxious about the deadline on Friday.",
+    "Can you help me plan a difficult conversation with a stakeholder about budget cuts?",
+    "I don't know why I keep procrastinating on the roadmap; it's a pattern.",
+    "We had a reorg last week and the new VP wants a 5 year plan by next month.",
+    "我在考虑职业转型，但是很难决定要不要接受新的 offer。",
+    "Anyway, separately — I want to think through delegation with my new team lead.",
+]
+
+
+def _analyze(message: str, fresh) -> None:
+    emotion = detect_emotion(message, fresh())
+    route_style(message, None, emotion, fresh())
+    goal_link = infer_goal_link(message, fresh())
+    analyze_text_emotion(message, fresh())
+    infer_context_triggers(message, features=fresh())
+    infer_goal_hierarchy(message, goal_link, {}, fresh())
+    get_framework_for_context(message, emotion, goal_link, fresh())
+    signals = L._extract_conversation_signals(message, fresh())
+    L._is_specific_request(message, fresh())
+    L._is_context_rich(message, fresh())
+    L._detect_topic_shift(message, [], signals.topic_signature, fresh())
+    L._is_user_confused(message, fresh())
+    L.select_model([], message, None, fresh())
+    L._generate_quick_replies(message, "Let's plan the next step.", None, fresh())
+    L._detect_crisis(message, fresh())
+
+
+def _per_message_us(messages, run) -> float:
+    start = time.perf_counter()
+    for message in messages:
+        run(message)
+    return (time.perf_counter() - start) / len(messages) * 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    # Unique messages so the memoized scan never hits.
+    messages = [f"{rng.choice(SAMPLES)} ({i})" for i in range(args.messages)]
+    extract_features(messages[0])  # build the automaton outside the timings
+
+    def rescan_each(message: str) -> None:
+        lowered = message.lower()
+        _analyze(message, lambda: MessageFeatures(lowered))
+
+    def shared_scan(message: str) -> None:
+        features = extract_features(message)
+        _analyze(message, lambda: features)
+
+    def scan_only(message: str) -> None:
+        MessageFeatures(message.lower())
+
+    _extract_cached.cache_clear()
+    counts = registered_counts()
+    print(f"registered: {counts['literals']} keywords, {counts['patterns']} patterns")
+    print(f"messages:   {len(messages)}")
+    print(f"scan only:             {_per_message_us(messages, scan_only):8.1f} us/message")
+    print(f"re-scan per analyzer:  {_per_message_us(messages, rescan_each):8.1f} us/message")
+    _extract_cached.cache_clear()
+    print(f"one shared scan:       {_per_message_us(messages, shared_scan):8.1f} us/message")
+
+
+if __name__ == "__main__":
+    main()
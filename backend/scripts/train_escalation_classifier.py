@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Train the local escalation classifier from logged Haiku labels.
+
+Reads the JSON lines written to ESCALATION_LABEL_LOG ({"message",
+"response", "escalation_risk", "session_tags"}), fits the hashed n-gram
+model with minibatch SGD (softmax for the risk, one sigmoid per tag) and
+writes the versioned .npz artifact that ESCALATION_MODEL_PATH points at.
+A held-out split reports accuracy and how many turns each confidence
+threshold would keep away from Haiku.
+
+    cd backend && PYTHONPATH=. python scripts/train_escalation_classifier.py labels.jsonl [more.jsonl] \\
+        --out escalation-model.npz
+"""
+import argparse
+import json
+import random
+import sys
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from app.services.escalation_classifier import (
+    DEFAULT_FEATURES,
+    RISK_LABELS,
+    EscalationClassifier,
+    hashed_features,
+)
+
+
+def _read_labels(paths: List[str]) -> List[Dict]:
+    rows = []
+    for path in paths:
+        with open(path, encoding="utf-8") as fh:
+            for line in fh:
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    continue
+                if row.get("escalation_risk") in RISK_LABELS:
+                    rows.append(row)
+    return rows
+
+
+def _fit(
+    features: List[Tuple[np.ndarray, np.ndarray]],
+    targets: np.ndarray,
+    n_features: int,
+    softmax: bool,
+    epochs: int,
+    lr: float,
+    l2: float,
+    batch_size: int,
+    seed: int,
+) -> Tuple[np.ndarray, np.ndarray]:
+    n, classes = targets.shape
+    weights = np.zeros((n_features, classes), dtype=np.float32)
+    bias = np.zeros(classes, dtype=np.float32)
+    if softmax:
+        # Start from the class priors so rare risks are not over-predicted early.
+        bias[:] = np.log(targets.mean(axis=0) + 1e-6)
+    rng = np.random.default_rng(seed)
+    for _ in range(epochs):
+        order = rng.permutation(n)
+        for start in range(0, n, batch_size):
+            batch = order[start:start + batch_size]
+            rows = np.concatenate([np.full(len(features[i][0]), j) for j, i in enumerate(batch)])
+            cols = np.concatenate([features[i][0] for i in batch])
+            vals = np.concatenate([features[i][1] for i in batch])
+
+            logits = np.tile(bias, (len(batch), 1))
+            np.add.at(logits, rows, weights[cols] * vals[:, None])
+            if softmax:
+                probs = np.exp(logits - logits.max(axis=1, keepdims=True))
+                probs /= probs.sum(axis=1, keepdims=True)
+            else:
+                probs = 1.0 / (1.0 + np.exp(-logits))
+            error = (probs - targets[batch]) / len(batch)
+
+            touched = np.unique(cols)
+            weights[touched] *= 1.0 - lr * l2
+            np.add.at(weights, cols, -lr * error[rows] * vals[:, None])
+            bias -= lr * error.sum(axis=0)
+    return weights, bias
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("labels", nargs="+", help="JSONL label logs")
+    parser.add_argument("--out", required=True, help="artifact path (.npz)")
+    parser.add_argument("--features", type=int, default=DEFAULT_FEATURES)
+    parser.add_argument("--epochs", type=int, default=8)
+    parser.add_argument("--lr", type=float, default=0.5)
+    parser.add_argument("--l2", type=float, default=1e-4)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--min-tag-count", type=int, default=20)
+    parser.add_argument("--max-tags", type=int, default=32)
+    parser.add_argument("--holdout", type=float, default=0.1)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--version", default=None, help="artifact version (default: UTC timestamp)")
+    args = parser.parse_args()
+
+    rows = _read_labels(args.labels)
+    if len(rows) < 10:
+        print(f"Only {len(rows)} labelled turns; need more data.", file=sys.stderr)
+        return 1
+    random.Random(args.seed).shuffle(rows)
+
+    tag_counts = Counter(tag.strip().lower() for row in rows for tag in row.get("session_tags") or [] if tag.strip())
+    tag_labels = [tag for tag, count in tag_counts.most_common(args.max_tags) if count >= args.min_tag_count]
+
+    features = [hashed_features(row.get("message", ""), row.get("response", ""), args.features) for row in rows]
+    risk_targets = np.zeros((len(rows), len(RISK_LABELS)), dtype=np.float32)
+    tag_targets = np.zeros((len(rows), len(tag_labels)), dtype=np.float32)
+    tag_index = {tag: i for i, tag in enumerate(tag_labels)}
+    for n, row in enumerate(rows):
+        risk_targets[n, RISK_LABELS.index(row["escalation_risk"])] = 1.0
+        for tag in row.get("session_tags") or []:
+            if tag.strip().lower() in tag_index:
+                tag_targets[n, tag_index[tag.strip().lower()]] = 1.0
+
+    split = max(1, int(len(rows) * args.holdout))
+    train = slice(split, None)
+    fit = dict(n_features=args.features, epochs=args.epochs, lr=args.lr, l2=args.l2, batch_size=args.batch_size, seed=args.seed)
+    risk_w, risk_b = _fit(features[train], risk_targets[train], softmax=True, **fit)
+    if tag_labels:
+        tag_w, tag_b = _fit(features[train], tag_targets[train], softmax=False, **fit)
+    else:
+        tag_w, tag_b = np.zeros((args.features, 0), dtype=np.float32), np.zeros(0, dtype=np.float32)
+
+    version = args.version or datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    model = EscalationClassifier(
+        risk_w, risk_b, tag_w, tag_b, tag_labels,
+        metadata={"version": version, "examples": len(rows) - split, "trained_at": datetime.now(timezone.utc).isoformat()},
+    )
+
+    held_out = [
+        (model.predict(row.get("message", ""), row.get("response", "")), row["escalation_risk"])
+        for row in rows[:split]
+    ]
+    correct = sum(p.escalation_risk == label for p, label in held_out)
+    print(f"{len(rows) - split} train / {split} held out, {len(tag_labels)} tags")
+    print(f"held-out risk accuracy: {correct / split:.3f}")
+    for threshold in (0.6, 0.7, 0.8, 0.85, 0.9, 0.95):
+        kept = [(p, label) for p, label in held_out if p.confidence >= threshold]
+        accuracy = sum(p.escalation_risk == label for p, label in kept) / len(kept) if kept else 0.0
+        print(f"  threshold {threshold:.2f}: {len(kept) / split:.1%} of turns skip Haiku, accuracy {accuracy:.3f}")
+
+    model.save(args.out)
+    print(f"wrote {args.out} (version {version})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,169 @@
+import asyncio
+import json
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from app.services import anthropic_keys, llm_claude, llm_clients
+from app.services.anthropic_keys import AnthropicKeyPool
+from app.services.cache import InMemoryCache
+
+
+def _reset_in(seconds: float) -> str:
+    return (datetime.now(timezone.utc) + timedelta(seconds=seconds)).isoformat().replace("+00:00", "Z")
+
+
+def _ratelimit_headers(remaining: int, limit: int = 10, reset_seconds: float = 60) -> dict:
+    return {
+        "anthropic-ratelimit-requests-limit": str(limit),
+        "anthropic-ratelimit-requests-remaining": str(remaining),
+        "anthropic-ratelimit-requests-reset": _reset_in(reset_seconds),
+        "anthropic-ratelimit-tokens-limit": "100000",
+        "anthropic-ratelimit-tokens-remaining": "90000",
+        "anthropic-ratelimit-tokens-reset": _reset_in(reset_seconds),
+    }
+
+
+class _StubAnthropic(BaseHTTPRequestHandler):
+    """Messages API stub: each key starts with its own request budget and counts down."""
+
+    budgets: dict = {}
+    seen: list = []
+
+    def do_POST(self):
+        key = self.headers.get("x-api-key")
+        body = json.loads(self.rfile.read(int(self.headers.get("content-length", 0))))
+        self.seen.append(key)
+        self.budgets[key] -= 1
+        payload = json.dumps({
+            "id": f"msg_{len(self.seen)}", "type": "message", "role": "assistant", "model": body["model"],
+            "content": [{"type": "text", "text": f"reply via {key}"}],
+            "stop_reason": "end_turn", "stop_sequence": None,
+            "usage": {"input_tokens": 12, "output_tokens": 4},
+        }).encode()
+        self.send_response(200)
+        for name, value in _ratelimit_headers(self.budgets[key]).items():
+            self.send_header(name, value)
+        self.send_header("content-type", "application/json")
+        self.send_header("content-length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _StubAnthropic)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_calls_go_to_the_key_with_the_most_headroom(stub_server, monkeypatch):
+    pytest.importorskip("anthropic")
+    _StubAnthropic.budgets = {"sk-ant-low": 2, "sk-ant-high": 10}
+    _StubAnthropic.seen = []
+    monkeypatch.setenv("ANTHROPIC_BASE_URL", f"http://127.0.0.1:{stub_server.server_address[1]}")
+    monkeypatch.setenv("ANTHROPIC_API_KEYS", "sk-ant-low,sk-ant-high")
+    monkeypatch.setattr(llm_clients, "_registry", None)
+    monkeypatch.setattr(anthropic_keys, "_key_pool", AnthropicKeyPool(["sk-ant-low", "sk-ant-high"], InMemoryCache()))
+
+    async def scenario():
+        replies = []
+        for _ in range(3):
+            replies.append(await llm_claude._claude_complete(llm_claude.HAIKU, "", [{"role": "user", "content": "hi"}]))
+        await llm_clients.get_llm_clients().aclose()
+        return replies
+
+    replies = asyncio.run(scenario())
+    # Both keys start unobserved; after one call the low-budget key has 10% headroom left.
+    assert _StubAnthropic.seen == ["sk-ant-low", "sk-ant-high", "sk-ant-high"]
+    assert replies[0] == "reply via sk-ant-low"
+    stats = anthropic_keys.get_anthropic_key_pool().stats()
+    low = stats["keys"][anthropic_keys.key_id("sk-ant-low")]
+    assert (low["leases"], low["in_flight"], low["headroom"]) == (1, 0, 0.1)
+    assert "sk-ant-low" not in json.dumps(stats)
+
+
+def test_rate_limited_key_is_skipped_until_retry_after():
+    pool = AnthropicKeyPool(["sk-a", "sk-b"], InMemoryCache(), max_pacing_seconds=0)
+
+    async def scenario():
+        lease = await pool.acquire(100)
+        assert lease.headers == {"x-api-key": "sk-a"}
+        pool.observe("sk-a", 429, {"retry-after": "30"})
+        await pool.release(lease)
+        return [(await pool.acquire()).headers["x-api-key"] for _ in range(2)]
+
+    assert asyncio.run(scenario()) == ["sk-b", "sk-b"]
+    stats = pool.stats()["keys"][anthropic_keys.key_id("sk-a")]
+    assert stats["rate_limited"] == 1 and stats["blocked_seconds"] > 25
+
+
+def test_spent_pool_waits_for_the_earliest_reset():
+    pool = AnthropicKeyPool(["sk-a", "sk-b"], InMemoryCache(), max_pacing_seconds=5)
+    pool.observe("sk-a", 200, _ratelimit_headers(0, reset_seconds=0.3))
+    pool.observe("sk-b", 200, _ratelimit_headers(0, reset_seconds=3))
+
+    started = time.monotonic()
+    lease = asyncio.run(pool.acquire())
+    waited = time.monotonic() - started
+
+    assert lease.headers == {"x-api-key": "sk-a"}
+    assert 0.1 < waited < 2
+    assert pool.stats()["paced"] == 1
+
+
+def test_budgets_are_shared_across_workers_through_the_cache():
+    backend = InMemoryCache()
+    worker_a = AnthropicKeyPool(["sk-a", "sk-b"], backend)
+    worker_b = AnthropicKeyPool(["sk-a", "sk-b"], backend)
+
+    async def scenario():
+        lease = await worker_a.acquire()
+        worker_a.observe("sk-a", 200, _ratelimit_headers(1))
+        await worker_a.release(lease)
+        return (await worker_b.acquire()).headers["x-api-key"]
+
+    # worker_b never called sk-a itself but sees its budget is nearly spent.
+    assert asyncio.run(scenario()) == "sk-b"
+
+
+def test_shared_budgets_are_read_once_per_refresh_interval():
+    reads = []
+
+    class _CountingCache(InMemoryCache):
+        async def get_json(self, key):
+            reads.append(key)
+            return await super().get_json(key)
+
+    pool = AnthropicKeyPool(["sk-a", "sk-b"], _CountingCache(), refresh_interval_seconds=0.05)
+
+    async def scenario():
+        for _ in range(5):
+            await pool.release(await pool.acquire())
+        burst = len(reads)
+        await asyncio.sleep(0.06)
+        await pool.release(await pool.acquire())
+        return burst, len(reads)
+
+    # One read per key for the burst, one more after the interval.
+    assert asyncio.run(scenario()) == (2, 4)
+
+
+def test_without_configured_keys_the_client_credentials_apply():
+    pool = AnthropicKeyPool([], InMemoryCache())
+
+    async def scenario():
+        lease = await pool.acquire(50)
+        await pool.release(lease)
+        return lease
+
+    assert asyncio.run(scenario()).headers == {}
@@ -16,6 +16,7 @@ from app.services.auth import (
     create_auth_response,
     get_google_auth_url,
 )
+from app.services.database import run_blocking
 
 
 @pytest.fixture
@@ -117,111 +118,111 @@ class TestUser:
 class TestUserService:
     def test_create_user(self, clean_db):
         service = UserService(database_url=clean_db)
-        user = service.create_user(
+        user = run_blocking(service.create_user(
             id="user-1",
             email="user1@example.com",
             password="password123",
             full_name="User One",
-        )
+        ))
         assert user.id == "user-1"
         assert user.email == "user1@example.com"
         assert user.full_name == "User One"
 
     def test_get_user_by_id(self, clean_db):
         service = UserService(database_url=clean_db)
-        service.create_user(
+        run_blocking(service.create_user(
             id="user-2",
             email="user2@example.com",
             password="password123",
-        )
-        user = service.get_user_by_id("user-2")
+        ))
+        user = run_blocking(service.get_user_by_id("user-2"))
         assert user is not None
         assert user.email == "user2@example.com"
 
     def test_get_user_by_email(self, clean_db):
         service = UserService(database_url=clean_db)
-        service.create_user(
+        run_blocking(service.create_user(
             id="user-3",
             email="user3@example.com",
             password="password123",
-        )
-        user = service.get_user_by_email("user3@example.com")
+        ))
+        user = run_blocking(service.get_user_by_email("user3@example.com"))
         assert user is not None
         assert user.id == "user-3"
 
     def test_get_nonexistent_user(self, clean_db):
         service = UserService(database_url=clean_db)
-        user = service.get_user_by_id("nonexistent")
+        user = run_blocking(service.get_user_by_id("nonexistent"))
         assert user is None
 
     def test_verify_password_correct(self, clean_db):
         service = UserService(database_url=clean_db)
-        service.create_user(
+        run_blocking(service.create_user(
             id="user-4",
             email="user4@example.com",
             password="correctpassword",
-        )
-        user = service.verify_user_password("user4@example.com", "correctpassword")
+        ))
+        user = run_blocking(service.verify_user_password("user4@example.com", "correctpassword"))
         assert user is not None
         assert user.id == "user-4"
 
     def test_verify_password_wrong(self, clean_db):
         service = UserService(database_url=clean_db)
-        service.create_user(
+        run_blocking(service.create_user(
             id="user-5",
             email="user5@example.com",
             password="correctpassword",
-        )
-        user = service.verify_user_password("user5@example.com", "wrongpassword")
+        ))
+        user = run_blocking(service.verify_user_password("user5@example.com", "wrongpassword"))
         assert user is None
 
     def test_update_user(self, clean_db):
         service = UserService(database_url=clean_db)
-        service.create_user(
+        run_blocking(service.create_user(
             id="user-6",
             email="user6@example.com",
             password="password123",
-        )
-        updated = service.update_user("user-6", full_name="Updated Name", seat_tier="executive")
+        ))
+        updated = run_blocking(service.update_user("user-6", full_name="Updated Name", seat_tier="executive"))
         assert updated is not None
         assert updated.full_name == "Updated Name"
         assert updated.seat_tier == "executive"
 
     def test_duplicate_email_fails(self, clean_db):
         service = UserService(database_url=clean_db)
-        service.create_user(
+        run_blocking(service.create_user(
             id="user-7",
             email="duplicate@example.com",
             password="password123",
-        )
+        ))
         with pytest.raises(Exception):
-            service.create_user(
+            run_blocking(service.create_user(
                 id="user-8",
                 email="duplicate@example.com",
                 password="password456",
-            )
+            ))
 
     def test_google_id_operations(self, clean_db):
         service = UserService(database_url=clean_db)
-        service.create_user(
+        run_blocking(service.create_user(
             id="user-9",
             email="google@example.com",
             password="password123",
             google_id="google-123",
-        )
-        user = service.get_user_by_google_id("google-123")
+        ))
+        user = run_blocking(service.get_user_by_google_id("google-123"))
         assert user is not None
         assert user.id == "user-9"
 
     def test_apple_id_operations(self, clean_db):
         service = UserService(database_url=clean_db)
-        service.create_user(
+        run_blocking(service.create_user(
             id="user-10",
             email="apple@example.com",
             password="password123",
             apple_id="apple-456",
-        )
-        user = service.get_user_by_apple_id("apple-456")
+        ))
+        user = run_blocking(service.get_user_by_apple_id("apple-456"))
         assert user is not None
         assert user.id == "user-10"
 
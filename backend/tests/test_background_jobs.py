@@ -0,0 +1,107 @@
+import asyncio
+
+from app.services.background_jobs import BackgroundJobQueue
+
+
+def test_waiting_jobs_for_a_key_are_replaced_by_the_latest():
+    queue = BackgroundJobQueue(max_queue=10, concurrency=1, drain_seconds=5)
+    ran = []
+
+    async def scenario():
+        release = asyncio.Event()
+
+        async def blocker():
+            await release.wait()
+
+        def job(name):
+            async def run():
+                ran.append(name)
+            return run
+
+        queue.start()
+        queue.submit(blocker, key="busy")
+        await asyncio.sleep(0)
+        for turn in range(3):
+            queue.submit(job(f"u1-{turn}"), key="classify:u1")
+        queue.submit(job("u2-0"), key="classify:u2")
+        depth = queue.stats()["depth"]
+        release.set()
+        await queue.stop()
+        return depth
+
+    depth = asyncio.run(scenario())
+    assert depth == 2
+    assert ran == ["u1-2", "u2-0"]
+    stats = queue.stats()
+    assert (stats["submitted"], stats["coalesced"], stats["completed"], stats["dropped"]) == (5, 2, 3, 0)
+    assert stats["max_depth"] == 2 and not stats["started"]
+
+
+def test_full_queue_drops_the_oldest_and_concurrency_is_capped():
+    queue = BackgroundJobQueue(max_queue=2, concurrency=2, drain_seconds=5)
+    running = []
+    peak = []
+    ran = []
+
+    def job(name):
+        async def run():
+            running.append(name)
+            peak.append(len(running))
+            await asyncio.sleep(0.01)
+            running.remove(name)
+            ran.append(name)
+        return run
+
+    async def scenario():
+        queue.start()
+        for n in range(5):
+            queue.submit(job(n))  # workers have not run yet: 0-2 are pushed out
+        await asyncio.sleep(0.05)
+        for n in range(5, 7):
+            queue.submit(job(n))
+        await queue.stop()
+
+    asyncio.run(scenario())
+    assert sorted(ran) == [3, 4, 5, 6]
+    assert max(peak) == 2
+    assert queue.stats()["dropped"] == 3
+
+
+def test_stop_drops_what_does_not_finish_in_time():
+    queue = BackgroundJobQueue(max_queue=10, concurrency=1, drain_seconds=0.05)
+
+    async def forever():
+        await asyncio.sleep(30)
+
+    async def scenario():
+        queue.start()
+        queue.submit(forever, key="a")
+        queue.submit(forever, key="b")
+        await asyncio.sleep(0)
+        await queue.stop()
+
+    asyncio.run(scenario())
+    stats = queue.stats()
+    assert stats["dropped"] == 2  # one cancelled mid-run, one never started
+    assert stats["depth"] == 0 and stats["running"] == 0
+
+
+def test_jobs_outside_the_lifespan_still_run_and_are_tracked():
+    queue = BackgroundJobQueue(max_queue=10, concurrency=1, drain_seconds=5)
+    ran = []
+
+    async def job():
+        ran.append(1)
+
+    async def failing():
+        raise RuntimeError("boom")
+
+    async def scenario():
+        queue.submit(job, key="x")
+        queue.submit(failing, key="x")
+        await queue.join()
+
+    asyncio.run(scenario())
+    assert ran == [1]
+    stats = queue.stats()
+    assert (stats["unmanaged"], stats["completed"], stats["failed"]) == (2, 1, 1)
@@ -0,0 +1,429 @@
+import asyncio
+import json
+import time
+
+import pytest
+
+from app.services import cache as cache_module
+from app.services.cache import CacheCodec, InMemoryCache, NoopCache, TieredCache
+
+
+def test_wait_for_returns_stored_value_immediately():
+    cache = InMemoryCache()
+
+    async def scenario():
+        await cache.set_json("k", {"v": 1}, 60)
+        return await cache.wait_for("k", 5)
+
+    assert asyncio.run(scenario()) == {"v": 1}
+
+
+def test_wait_for_wakes_on_set_without_polling(monkeypatch):
+    monkeypatch.setattr(cache_module, "WAIT_RECHECK_SECONDS", 30.0)
+    cache = InMemoryCache()
+    reads = []
+    get_json = cache.get_json
+
+    async def counting_get(key):
+        reads.append(key)
+        return await get_json(key)
+
+    monkeypatch.setattr(cache, "get_json", counting_get)
+
+    async def leader():
+        await asyncio.sleep(0.05)
+        await cache.set_json("idem:u:r", {"response": "done"}, 60)
+
+    async def scenario():
+        started = time.monotonic()
+        task = asyncio.create_task(leader())
+        value = await cache.wait_for("idem:u:r", 10)
+        await task
+        return value, time.monotonic() - started
+
+    value, elapsed = asyncio.run(scenario())
+    assert value == {"response": "done"}
+    assert elapsed < 1.0
+    assert len(reads) == 2  # the initial read and the one after the wake-up
+    assert len(cache._waiters) == 0
+
+
+def test_wait_for_times_out_and_cleans_up():
+    cache = InMemoryCache()
+
+    async def scenario():
+        return await cache.wait_for("missing", 0.05)
+
+    assert asyncio.run(scenario()) is None
+    assert len(cache._waiters) == 0
+    assert asyncio.run(NoopCache().wait_for("missing", 5)) is None
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_values_and_locks_expire_through_the_heap(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(cache_module.time, "monotonic", clock)
+    cache = InMemoryCache(shards=1)
+
+    async def scenario():
+        await cache.set_json("short", {"v": 1}, 10)
+        await cache.set_json("long", {"v": 2}, 100)
+        assert await cache.acquire_lock("lock", "a", 10)
+        assert not await cache.acquire_lock("lock", "b", 10)
+        clock.now += 11
+        assert await cache.get_json("short") is None
+        assert await cache.get_json("long") == {"v": 2}
+        assert await cache.acquire_lock("lock", "b", 10)
+        await cache.release_lock("lock", "a")  # not the owner any more
+        assert not await cache.acquire_lock("lock", "c", 10)
+
+    asyncio.run(scenario())
+    stats = cache.stats()
+    assert stats["expirations"] == 1
+    assert stats["entries"] == 1
+
+
+def test_lru_eviction_by_entries_and_bytes():
+    cache = InMemoryCache(max_entries=3, max_bytes=0, shards=1)
+
+    async def fill(c, keys):
+        for key in keys:
+            await c.set_json(key, {"k": key}, 60)
+
+    async def scenario():
+        await fill(cache, ["a", "b", "c"])
+        await cache.get_json("a")  # now most recently used
+        await fill(cache, ["d"])
+        return [k for k in "abcd" if await cache.get_json(k) is not None]
+
+    assert asyncio.run(scenario()) == ["a", "c", "d"]
+    assert cache.stats()["evictions"] == 1
+
+    small = InMemoryCache(max_entries=0, max_bytes=100, shards=1)
+    asyncio.run(fill(small, [f"key-{i}" for i in range(10)]))
+    stats = small.stats()
+    assert 0 < stats["bytes"] <= 100
+    assert stats["evictions"] == 10 - stats["entries"]
+
+
+def test_superseded_heap_entries_do_not_accumulate():
+    cache = InMemoryCache(shards=1)
+
+    async def scenario():
+        for i in range(1000):
+            await cache.set_json("same", {"i": i}, 60 + i)
+        return await cache.get_json("same")
+
+    assert asyncio.run(scenario()) == {"i": 999}
+    assert len(cache._shards[0].heap) <= 64
+
+
+def test_raw_values_are_served_without_copying():
+    cache = InMemoryCache()
+
+    async def scenario():
+        await cache.set_raw("raw", b'{"v":"\xc3\xa9"}', 60)
+        first = await cache.get_raw("raw")
+        second = await cache.get_raw("raw")
+        await cache.set_json("json", {"v": "é"}, 60)
+        return first, second, await cache.get_json("raw"), await cache.get_raw("json")
+
+    first, second, decoded, encoded = asyncio.run(scenario())
+    assert first is second
+    assert decoded == {"v": "é"}
+    assert encoded == first
+    assert asyncio.run(NoopCache().get_raw("raw")) is None
+
+
+class _CountingRemote(InMemoryCache):
+    def __init__(self):
+        super().__init__()
+        self.reads = 0
+
+    async def get_raw(self, key):
+        self.reads += 1
+        return await super().get_raw(key)
+
+
+def test_tiered_cache_serves_l1_and_remembers_misses(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(cache_module.time, "monotonic", clock)
+    remote = _CountingRemote()
+    cache = TieredCache(remote, ttl_seconds=30, negative_ttl_seconds=1.0)
+
+    async def scenario():
+        assert await cache.get_json("idem:u:r") is None
+        assert await cache.get_json("idem:u:r") is None  # negative entry
+        clock.now += 2
+        assert await cache.get_json("idem:u:r") is None  # expired, back to L2
+        await remote.set_json("idem:u:r", {"v": 1}, 60)
+        first = await cache.get_json("idem:u:r")
+        second = await cache.get_json("idem:u:r")
+        return first, second
+
+    assert asyncio.run(scenario()) == ({"v": 1}, {"v": 1})
+    assert remote.reads == 3
+    stats = cache.stats()
+    assert (stats["l1_hits"], stats["negative_hits"], stats["l2_hits"], stats["l2_misses"]) == (1, 1, 1, 2)
+    assert stats["l1"]["entries"] == 1
+
+
+def test_tiered_cache_drops_l1_when_another_worker_writes():
+    remote = InMemoryCache()
+    worker_a = TieredCache(remote, ttl_seconds=30, negative_ttl_seconds=30)
+    worker_b = TieredCache(remote, ttl_seconds=30, negative_ttl_seconds=30)
+
+    async def scenario():
+        assert await worker_a.get_json("summary:k") is None
+        await remote.set_json("other", {"v": 0}, 60)
+        await worker_b.set_json("summary:k", {"v": 1}, 60)
+        seen_miss = await worker_a.get_json("summary:k")
+        await worker_a.get_json("summary:k")
+        await worker_b.set_json("summary:k", {"v": 2}, 60)
+        return seen_miss, await worker_a.get_json("summary:k"), await worker_a.wait_for("summary:k", 1)
+
+    assert asyncio.run(scenario()) == ({"v": 1}, {"v": 2}, {"v": 2})
+    assert worker_a.stats()["invalidations"] == 2
+
+
+def test_tiered_get_or_acquire_sees_records_stored_during_the_negative_ttl():
+    class _LaggingRemote(InMemoryCache):
+        # Key notifications have not reached this worker yet.
+        def add_key_listener(self, callback):
+            return True
+
+        def key_listener_active(self):
+            return True
+
+    remote = _LaggingRemote()
+    leader = TieredCache(remote, negative_ttl_seconds=30)
+    duplicate = TieredCache(remote, negative_ttl_seconds=30)
+
+    async def scenario():
+        led = await leader.get_or_acquire("idem:u:r", "idemlock:u:r", "a", 30)
+        followed = await duplicate.get_or_acquire("idem:u:r", "idemlock:u:r", "b", 30)
+        await leader.set_raw("idem:u:r", b'{"v": 1}', 60)
+        await leader.release_lock("idemlock:u:r", "a")
+        assert await duplicate.get_raw("idem:u:r") is None  # plain reads may use the remembered miss
+        return led, followed, await duplicate.get_or_acquire("idem:u:r", "idemlock:u:r", "c", 30)
+
+    led, followed, retried = asyncio.run(scenario())
+    assert (led, followed) == ((None, True), (None, False))
+    assert retried == (b'{"v": 1}', False)
+
+
+def test_tiered_cache_bypasses_l1_without_key_notifications():
+    remote = _CountingRemote()
+    remote.key_listener_active = lambda: False
+    cache = TieredCache(remote)
+
+    async def scenario():
+        await remote.set_json("k", {"v": 1}, 60)
+        await cache.get_json("k")
+        await cache.get_json("missing")
+        await cache.get_json("missing")
+
+    asyncio.run(scenario())
+    assert remote.reads == 3
+    assert cache.stats()["bypassed"] == 3
+
+
+def test_build_cache_backend_wraps_redis_when_l1_enabled(monkeypatch):
+    monkeypatch.setenv("CACHE_ENABLED", "true")
+    monkeypatch.setenv("REDIS_URL", "redis://localhost:6379/0")
+    monkeypatch.setenv("CACHE_L1_ENABLED", "true")
+    backend = cache_module.build_cache_backend()
+    assert isinstance(backend, TieredCache)
+    assert isinstance(backend.remote, cache_module.RedisCache)
+
+    monkeypatch.setenv("CACHE_L1_ENABLED", "false")
+    assert isinstance(cache_module.build_cache_backend(), cache_module.RedisCache)
+
+
+class _FakeScript:
+    def __init__(self, result):
+        self.result = result
+        self.calls = []
+
+    async def __call__(self, keys, args):
+        self.calls.append((keys, args))
+        return self.result
+
+
+def test_redis_lock_operations_are_single_script_calls(monkeypatch):
+    cache = cache_module.RedisCache("redis://localhost:6379/0")
+    release = _FakeScript(1)
+    lookup = _FakeScript([1, b'{"v":1}'])
+    monkeypatch.setattr(cache, "_release_lock", release)
+    monkeypatch.setattr(cache, "_get_or_acquire", lookup)
+
+    async def scenario():
+        await cache.release_lock("lock", "owner-a")
+        hit = await cache.get_or_acquire("idem:u:r", "idemlock:u:r", "owner-b", 120)
+        lookup.result = [0, 1]
+        acquired = await cache.get_or_acquire("idem:u:r", "idemlock:u:r", "owner-b", 120)
+        lookup.result = [0, 0]
+        contended = await cache.get_or_acquire("idem:u:r", "idemlock:u:r", "owner-b", 120)
+        return hit, acquired, contended
+
+    assert asyncio.run(scenario()) == ((b'{"v":1}', False), (None, True), (None, False))
+    assert release.calls == [(["lock"], ["owner-a"])]
+    assert lookup.calls[0] == (["idem:u:r", "idemlock:u:r"], ["owner-b", 120])
+
+
+def test_get_or_acquire_returns_the_record_or_the_lock():
+    remote = InMemoryCache()
+    cache = TieredCache(remote, negative_ttl_seconds=30)
+
+    async def scenario():
+        first = await cache.get_or_acquire("idem:u:r", "idemlock:u:r", "a", 60)
+        second = await cache.get_or_acquire("idem:u:r", "idemlock:u:r", "b", 60)
+        await cache.set_json("idem:u:r", {"v": 1}, 60)
+        await cache.release_lock("idemlock:u:r", "a")
+        third = await cache.get_or_acquire("idem:u:r", "idemlock:u:r", "c", 60)
+        return first, second, third
+
+    assert asyncio.run(scenario()) == ((None, True), (None, False), (b'{"v":1}', False))
+    # The lock decision always checks the remote record, never a remembered miss.
+    assert cache.stats()["negative_hits"] == 0
+
+
+_RECORD = {
+    "request_id": "req-1",
+    "response": {"response": "Let's map the next step. " * 40, "emotion_scores": {"calm": 0.4}, "quick_replies": ["a", "b"]},
+}
+
+
+def test_codec_compresses_large_values_and_reads_legacy_json():
+    codec = CacheCodec(serializer="json", compression="zlib", min_compress_bytes=256)
+    payload = json.dumps(_RECORD, separators=(",", ":")).encode("utf-8")
+
+    stored = codec.encode(payload)
+    small = codec.encode(b'{"v":1}')
+    assert stored[:4] == bytes((0xFF, 1, 0, 1))
+    assert small[:4] == bytes((0xFF, 1, 0, 0))
+    assert len(stored) < len(payload) // 4
+    assert codec.decode(stored) == payload
+    assert codec.decode_value(small) == {"v": 1}
+
+    legacy = json.dumps(_RECORD, ensure_ascii=False).encode("utf-8")
+    assert codec.decode_value(legacy) == _RECORD
+    stats = codec.stats()
+    assert stats["legacy_reads"] == 1
+    assert (stats["encoded"], stats["compressed"]) == (2, 1)
+    assert stats["compression_ratio"] > 2
+
+
+def test_codec_msgpack_round_trip():
+    pytest.importorskip("msgpack")
+    codec = CacheCodec(serializer="msgpack", compression="none")
+    stored = codec.encode_value(_RECORD)
+    assert stored[2] == 1
+    assert codec.decode_value(stored) == _RECORD
+    assert json.loads(codec.decode(stored)) == _RECORD
+
+
+def test_codec_falls_back_without_optional_packages(monkeypatch):
+    import builtins
+
+    real_import = builtins.__import__
+
+    def _no_optional(name, *args, **kwargs):
+        if name in ("msgpack", "zstandard"):
+            raise ImportError(name)
+        return real_import(name, *args, **kwargs)
+
+    monkeypatch.setattr(builtins, "__import__", _no_optional)
+    codec = CacheCodec(serializer="msgpack", compression="zstd")
+    assert (codec.serializer, codec.compression) == ("json", "zlib")
+    with pytest.raises(ValueError):
+        CacheCodec(serializer="pickle")
+
+
+class _FakeRedis:
+    def __init__(self):
+        self.values = {}
+        self.published = []
+
+    async def get(self, key):
+        return self.values.get(key)
+
+    async def set(self, key, value, ex=None, nx=False):
+        self.values[key] = value
+        return True
+
+    async def publish(self, channel, message):
+        self.published.append((channel, message))
+
+
+def test_redis_cache_stores_encoded_values(monkeypatch):
+    cache = cache_module.RedisCache("redis://localhost:6379/0", codec=CacheCodec("json", "zlib", 256))
+    fake = _FakeRedis()
+    monkeypatch.setattr(cache, "_client", fake)
+    payload = json.dumps(_RECORD, separators=(",", ":")).encode("utf-8")
+
+    async def scenario():
+        await cache.set_raw("idem:u:r", payload, 60)
+        fake.values["legacy"] = json.dumps({"v": 1}).encode("utf-8")
+        return await cache.get_raw("idem:u:r"), await cache.get_json("idem:u:r"), await cache.get_json("legacy")
+
+    raw, decoded, legacy = asyncio.run(scenario())
+    assert raw == payload
+    assert decoded == _RECORD
+    assert legacy == {"v": 1}
+    assert fake.values["idem:u:r"][0] == 0xFF
+    assert fake.published == [(cache.KEY_SET_CHANNEL, "idem:u:r")]
+    assert cache.stats()["codec"]["compression_ratio"] > 2
+
+
+def test_stream_log_tails_entries_and_wakes_readers(monkeypatch):
+    monkeypatch.setattr(cache_module, "WAIT_RECHECK_SECONDS", 30.0)
+    monkeypatch.setattr(cache_module, "STREAM_MAX_ENTRIES", 3)
+    cache = InMemoryCache()
+
+    async def producer():
+        await asyncio.sleep(0.05)
+        await cache.append_stream("log", "c", 60)
+
+    async def scenario():
+        first = await cache.append_stream("log", "a", 60)
+        await cache.append_stream("log", "b", 60)
+        head = await cache.read_stream("log", "0", 0)
+        task = asyncio.create_task(producer())
+        started = time.monotonic()
+        tail = await cache.read_stream("log", head[-1][0], 10)
+        waited = time.monotonic() - started
+        await task
+        for entry in "de":
+            await cache.append_stream("log", entry, 60)
+        trimmed = await cache.read_stream("log", first, 0)
+        return head, tail, waited, trimmed, await cache.read_stream("missing", "0", 0.01)
+
+    head, tail, waited, trimmed, missing = asyncio.run(scenario())
+    assert head == [("1", "a"), ("2", "b")]
+    assert tail == [("3", "c")]
+    assert waited < 1.0
+    assert [entry for _, entry in trimmed] == ["c", "d", "e"]  # "b" fell out of the ring
+    assert missing == []
+    assert len(cache._stream_waiters) == 0
+
+
+def test_stream_log_expires(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(cache_module.time, "monotonic", clock)
+    cache = InMemoryCache()
+
+    async def scenario():
+        await cache.append_stream("log", "a", 10)
+        clock.now += 11
+        return await cache.read_stream("log", "0", 0)
+
+    assert asyncio.run(scenario()) == []
+    assert "log" not in cache._streams
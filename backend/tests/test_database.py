@@ -0,0 +1,89 @@
+import asyncio
+import os
+
+import pytest
+
+from app.services import database, memory_store
+from app.services.database import Database, get_database, run_blocking
+
+
+@pytest.fixture
+def test_db_url():
+    url = os.getenv("DATABASE_URL")
+    if not url:
+        pytest.skip("DATABASE_URL not set - skipping PostgreSQL tests")
+    return url
+
+
+def test_pool_settings_from_env(monkeypatch):
+    monkeypatch.setenv("DB_POOL_MIN_SIZE", "2")
+    monkeypatch.setenv("DB_POOL_MAX_SIZE", "1")
+    monkeypatch.setenv("DB_STATEMENT_TIMEOUT_MS", "750")
+    monkeypatch.setenv("DB_POOL_HEALTH_CHECK", "false")
+    db = Database("postgresql://example/db")
+    assert db.min_size == 2
+    assert db.max_size == 2  # never below min_size
+    assert db.statement_timeout_ms == 750
+    assert db.health_check is False
+
+
+def test_get_database_requires_url(monkeypatch):
+    monkeypatch.delenv("DATABASE_URL", raising=False)
+    with pytest.raises(RuntimeError):
+        get_database()
+
+
+def test_pool_is_reused_and_applies_statement_timeout(test_db_url, monkeypatch):
+    monkeypatch.setenv("DB_STATEMENT_TIMEOUT_MS", "1234")
+    db = Database(test_db_url)
+
+    async def scenario():
+        first = await db.pool()
+        async with db.connection() as conn:
+            cur = await conn.execute("SHOW statement_timeout")
+            timeout = (await cur.fetchone())[0]
+        assert await db.pool() is first
+        stats = db.stats()
+        await db.close()
+        return timeout, stats, first
+
+    timeout, stats, pool = asyncio.run(scenario())
+    assert timeout == "1234ms"
+    assert stats["open_pools"] == 1
+    assert stats["requests_num"] >= 1
+    assert pool.closed
+
+
+def test_loops_without_a_pool_use_one_off_connections(test_db_url):
+    db = Database(test_db_url)
+
+    async def scenario():
+        async with db.connection() as conn:
+            cur = await conn.execute("SELECT 1")
+            return (await cur.fetchone())[0]
+
+    assert asyncio.run(scenario()) == 1
+    assert db.stats()["open_pools"] == 0
+
+
+def test_run_blocking_refuses_inside_event_loop():
+    async def scenario():
+        with pytest.raises(RuntimeError):
+            run_blocking(asyncio.sleep(0))
+
+    asyncio.run(scenario())
+
+
+def test_async_profile_roundtrip(test_db_url, monkeypatch):
+    monkeypatch.setattr(memory_store, "_store_backend", None)
+    monkeypatch.delenv("PROFILE_STORE", raising=False)
+
+    async def scenario():
+        try:
+            await memory_store.save_profile_async("u-db-async", {"goals": ["career_advancement"]})
+            return await memory_store.load_profile_async("u-db-async")
+        finally:
+            await database.shutdown_database()
+
+    assert asyncio.run(scenario())["goals"] == ["career_advancement"]
+    assert memory_store.load_profile("u-db-async")["goals"] == ["career_advancement"]
@@ -0,0 +1,97 @@
+import json
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from app.services import escalation_classifier
+from app.services.escalation_classifier import RISK_LABELS, EscalationClassifier, hashed_features
+
+
+N_FEATURES = 1 << 10
+
+
+def _model(risk: str, tags=("burnout",), strength: float = 30.0) -> EscalationClassifier:
+    """A model that puts ``strength`` of logit on ``risk`` for the word "exhausted"."""
+    risk_weights = np.zeros((N_FEATURES, len(RISK_LABELS)), dtype=np.float32)
+    tag_weights = np.zeros((N_FEATURES, len(tags)), dtype=np.float32)
+    indices, _ = hashed_features("exhausted", "", N_FEATURES)
+    risk_weights[indices, RISK_LABELS.index(risk)] = strength
+    tag_weights[indices, :] = strength
+    return EscalationClassifier(
+        risk_weights, np.zeros(len(RISK_LABELS)), tag_weights, np.full(len(tags), -2.0), list(tags),
+        metadata={"version": "test-1"},
+    )
+
+
+def test_hashed_features_are_normalized_and_namespaced():
+    user_indices, values = hashed_features("I am exhausted", "", N_FEATURES)
+    coach_indices, _ = hashed_features("", "I am exhausted", N_FEATURES)
+
+    assert abs(float(np.linalg.norm(values)) - 1.0) < 1e-5
+    assert set(user_indices.tolist()) != set(coach_indices.tolist())
+    assert hashed_features("", "", N_FEATURES)[0].size == 0
+
+
+def test_model_round_trips_through_the_artifact(tmp_path):
+    path = str(tmp_path / "model.npz")
+    _model("high").save(path)
+    loaded = EscalationClassifier.load(path)
+
+    prediction = loaded.predict("I am exhausted", "That sounds hard")
+    assert loaded.version == "test-1"
+    assert prediction.escalation_risk == "high" and prediction.confidence > 0.9
+    assert prediction.session_tags == ["burnout"]
+    assert loaded.predict("Planning my week", "").session_tags == []
+
+
+def test_artifact_with_unknown_format_is_rejected(tmp_path):
+    path = str(tmp_path / "model.npz")
+    model = _model("low")
+    model.save(path)
+    with np.load(path) as data:
+        arrays = dict(data)
+    metadata = json.loads(str(arrays["metadata"]))
+    arrays["metadata"] = np.array(json.dumps({**metadata, "format": 99}))
+    np.savez_compressed(path, **arrays)
+
+    with pytest.raises(ValueError):
+        EscalationClassifier.load(path)
+
+
+def test_only_confident_predictions_skip_haiku(monkeypatch):
+    monkeypatch.setattr(escalation_classifier, "_loaded", True)
+    monkeypatch.setattr(escalation_classifier, "_counts", {"confident": 0, "uncertain": 0, "sampled": 0, "errors": 0})
+    monkeypatch.setattr(escalation_classifier, "CONFIDENCE_THRESHOLD", 0.85)
+    monkeypatch.setattr(escalation_classifier, "HAIKU_SAMPLE_RATE", 0.0)
+
+    monkeypatch.setattr(escalation_classifier, "_classifier", None)
+    assert escalation_classifier.confident_classification("I am exhausted", "") is None
+
+    monkeypatch.setattr(escalation_classifier, "_classifier", _model("medium"))
+    result = escalation_classifier.confident_classification("I am exhausted", "")
+    assert result == {
+        "escalation_risk": "medium", "escalation_reason": None, "goal_update": None, "session_tags": ["burnout"],
+    }
+    assert escalation_classifier.confident_classification("Planning my week", "") is None
+
+    # Confident turns are still sampled to Haiku for fresh labels.
+    monkeypatch.setattr(escalation_classifier, "HAIKU_SAMPLE_RATE", 1.0)
+    assert escalation_classifier.confident_classification("I am exhausted", "") is None
+
+    stats = escalation_classifier.escalation_classifier_stats()
+    assert (stats["version"], stats["confident"], stats["uncertain"], stats["sampled"]) == ("test-1", 1, 1, 1)
+
+
+def test_haiku_labels_are_logged_for_training(tmp_path, monkeypatch):
+    path = tmp_path / "labels.jsonl"
+    monkeypatch.setattr(escalation_classifier, "LABEL_LOG_PATH", str(path))
+
+    escalation_classifier.log_label("I am exhausted", "Tell me more", {"escalation_risk": "medium", "session_tags": ["burnout"]})
+    escalation_classifier.log_label("Hi", "Hello", {"escalation_risk": "unknown"})
+
+    rows = [json.loads(line) for line in path.read_text().splitlines()]
+    assert len(rows) == 1
+    assert (rows[0]["message"], rows[0]["escalation_risk"], rows[0]["session_tags"]) == (
+        "I am exhausted", "medium", ["burnout"],
+    )
@@ -0,0 +1,120 @@
+import asyncio
+
+from app.services.background_jobs import get_background_jobs
+from app.services.cache import InMemoryCache
+from app.services.history_compaction import HistoryCompactor, estimate_tokens, message_tokens
+
+
+def _history(turns: int):
+    history = []
+    for turn in range(turns):
+        history.append({"role": "user", "content": f"question {turn} " + "x" * 36})
+        history.append({"role": "assistant", "content": f"answer {turn} " + "y" * 36})
+    return history
+
+
+def test_token_estimate_counts_wide_characters_individually():
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("abcdefgh") == 2
+    assert estimate_tokens("我需要帮助") == 5
+    assert message_tokens({"role": "user", "content": "abcd"}) == 5
+
+
+def test_short_history_is_sent_verbatim():
+    compactor = HistoryCompactor(InMemoryCache(), budget_tokens=1000, span=4, summary_max_tokens=20)
+    history = _history(3)
+    compacted = asyncio.run(compactor.compact("u1", history, None))
+    assert compacted.messages == history
+    assert compacted.summary is None and compacted.omitted == 0
+
+
+def test_older_spans_are_summarized_in_the_background_and_cached():
+    compactor = HistoryCompactor(InMemoryCache(), budget_tokens=100, span=4, summary_max_tokens=20)
+    calls = []
+
+    async def summarize(previous, messages):
+        calls.append((previous, [m["content"].split()[1] for m in messages]))
+        return f"summary of {len(messages)} after {previous}"
+
+    async def scenario():
+        history = _history(6)  # 12 messages of 15 tokens; 5 fit in 80
+        first = await compactor.compact("u1", history, summarize)
+        await get_background_jobs().join()
+        second = await compactor.compact("u1", history, summarize)
+        # Two turns later the cut moves into the next span.
+        longer = _history(8)
+        third = await compactor.compact("u1", longer, summarize)
+        await get_background_jobs().join()
+        fourth = await compactor.compact("u1", longer, summarize)
+        return first, second, third, fourth
+
+    first, second, third, fourth = asyncio.run(scenario())
+    assert (first.summary, first.omitted, len(first.messages)) == (None, 8, 4)
+    assert (second.summarized, second.omitted) == (8, 0)
+    assert second.summary == "summary of 8 after None"
+    assert second.tokens <= 100
+    # Until the new span is summarized the previous summary stands in.
+    assert (third.summary, third.summarized, third.omitted) == (second.summary, 8, 4)
+    assert calls[1] == ("summary of 8 after None", ["4", "4", "5", "5"])
+    assert fourth.summary == "summary of 4 after summary of 8 after None"
+    assert fourth.summarized == 12
+    assert compactor.stats()["summaries_built"] == 2
+
+
+def test_transcript_digests_key_the_summaries_without_rehashing(monkeypatch):
+    from app.services import history_compaction
+    from app.services.transcript_store import TranscriptStore
+
+    compactor = HistoryCompactor(InMemoryCache(), budget_tokens=100, span=4, summary_max_tokens=20)
+    store = TranscriptStore(InMemoryCache(), database_url="", max_messages=20)
+
+    async def summarize(previous, messages):
+        return f"summary of {len(messages)}"
+
+    def no_rehash(*args, **kwargs):
+        raise AssertionError("summary key was rehashed")
+
+    async def scenario():
+        for message in _history(6)[::2]:
+            await store.append_turn("u1", "s1", message["content"], message["content"].replace("question", "answer"))
+        transcript = await store.load("u1", "s1")
+        history, digests = transcript.history(), transcript.digests()
+        monkeypatch.setattr(history_compaction, "chain_digest", no_rehash)
+        await compactor.compact("u1", history, summarize, digests)
+        await get_background_jobs().join()
+        return await compactor.compact("u1", history, summarize, digests), digests
+
+    compacted, digests = asyncio.run(scenario())
+    assert (compacted.summary, compacted.summarized) == ("summary of 8", 8)
+    assert asyncio.run(compactor.backend.get_json(f"histsum:u1:{digests[7]}")) is not None
+
+
+def test_sliding_transcript_window_keeps_span_boundaries():
+    from app.services.transcript_store import TranscriptStore
+
+    compactor = HistoryCompactor(InMemoryCache(), budget_tokens=100, span=4, summary_max_tokens=20)
+    # A full ring of 12 messages slides by one exchange every turn.
+    store = TranscriptStore(InMemoryCache(), database_url="", max_messages=12)
+    built = []
+
+    async def summarize(previous, messages):
+        built.append([m["content"].split()[1] for m in messages])
+        return f"summary {len(built)}"
+
+    async def scenario():
+        results = []
+        for turn in range(20):
+            message = _history(turn + 1)[-2]
+            await store.append_turn("u1", "s1", message["content"], message["content"].replace("question", "answer"))
+            transcript = await store.load("u1", "s1")
+            history = transcript.history()
+            results.append(await compactor.compact("u1", history, summarize, transcript.digests(), transcript.start))
+            await get_background_jobs().join()
+        return results
+
+    results = asyncio.run(scenario())
+    # The cut advances two messages a turn: one new span every other turn,
+    # and each summary covers only the span that was added.
+    assert len(built) == 9
+    assert all(len(span) == 4 for span in built[1:])
+    assert [r.omitted for r in results[8:]] == [4, 0] * 6
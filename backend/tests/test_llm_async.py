@@ -333,3 +333,436 @@ def test_internal_persona_session_lock(tmp_path, monkeypatch):
     assert resp1.behavior_signals is not None
     assert resp2.behavior_signals is not None
     assert resp1.behavior_signals.get("persona_used") == resp2.behavior_signals.get("persona_used")
+
+
+# ---------------------------------------------------------------------------
+# Streaming
+# ---------------------------------------------------------------------------
+
+def _chunked(text: str, size: int):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+def test_streaming_limits_match_batch_enforcement():
+    from app.services import llm_claude
+
+    long_text = " ".join(f"w{i}" for i in range(130))
+    samples = [
+        "",
+        "   ",
+        "Short answer? And another? Third one？",
+        "Spaces   and\nnewlines\tcollapse  ",
+        long_text,
+        " ".join(["word"] * 119) + " end, -",
+        " ".join(["word"] * 119) + " last, - next",
+        " ".join(["word"] * 118) + " x, - ;",
+    ]
+    for text in samples:
+        expected = llm_claude._enforce_response_limits(text.strip())
+        for size in (1, 3, 7, 1000):
+            limiter = llm_claude._StreamingResponseLimits()
+            out = "".join(limiter.feed(c) for c in _chunked(text, size)) + limiter.finish()
+            assert out == expected, (text, size)
+
+
+def test_response_field_extractor_decodes_across_chunks():
+    from app.services import llm_claude
+
+    raw = '```json\n{"quick_replies": ["response"], "response": "Line\\none \\"q\\" \\u00e9\\ud83d\\ude00 done", "x": 1}\n```'
+    for size in (1, 2, 5, len(raw)):
+        extractor = llm_claude._ResponseFieldExtractor()
+        out = "".join(extractor.feed(c) for c in _chunked(raw, size))
+        assert out == 'Line\none "q" é😀 done'
+        assert extractor.done
+
+
+def _collect_stream(gen):
+    async def _run():
+        return [event async for event in gen]
+    return asyncio.run(_run())
+
+
+def _patch_claude_stream(monkeypatch, raw: str, size: int = 4):
+    from app.services import llm_claude
+    monkeypatch.setattr(llm_claude, "_anthropic_available", lambda: True)
+
+    async def _fake_stream(*args, **kwargs):
+        for chunk in _chunked(raw, size):
+            yield chunk
+
+    async def _no_haiku(*args, **kwargs):
+        return {}
+
+    monkeypatch.setattr(llm_claude, "_claude_stream", _fake_stream)
+    monkeypatch.setattr(llm_claude, "_haiku_classify", _no_haiku)
+
+
+def test_stream_emits_meta_then_incremental_tokens(tmp_path, monkeypatch):
+    from app.services import memory_store, llm_claude
+    monkeypatch.setattr(memory_store, "MEMORY_DIR", str(tmp_path))
+    raw = '{"response":"Start with a weekly scorecard for your manager and team, then review misses in Friday retros.","quick_replies":["Show template","What to track","Run the retro","Align my manager"]}'
+    _patch_claude_stream(monkeypatch, raw)
+
+    events = _collect_stream(llm_claude.stream_coaching_response_claude(
+        "My manager needs weekly quality metrics and my team missed Friday deadlines after the reorg",
+        user_id="u-stream-1",
+    ))
+
+    kinds = [k for k, _ in events]
+    assert kinds[0] == "meta"
+    assert kinds[-1] == "result"
+    assert kinds.count("token") > 3
+    assert events[0][1]["model_used"] == llm_claude.SONNET
+
+    result = events[-1][1]
+    streamed = "".join(p for k, p in events if k == "token")
+    assert streamed == result["response"]
+    assert result["response"].startswith("Start with a weekly scorecard")
+    assert result["quick_replies"][0] == "Show template"
+
+
+def test_stream_releases_the_slot_before_a_slow_client_catches_up(tmp_path, monkeypatch):
+    from app.services import memory_store, llm_claude, llm_dispatch
+    monkeypatch.setattr(memory_store, "MEMORY_DIR", str(tmp_path))
+    monkeypatch.setattr(llm_dispatch, "_llm_dispatcher", llm_dispatch.LLMDispatcher(max_concurrency=1))
+    raw = '{"response":"Start with a weekly scorecard for your manager and team, then review misses in Friday retros.","quick_replies":["A","B"]}'
+    _patch_claude_stream(monkeypatch, raw)
+
+    async def scenario():
+        events = llm_claude.stream_coaching_response_claude(
+            "My manager needs weekly quality metrics and my team missed Friday deadlines after the reorg",
+            user_id="u-stream-slow",
+        )
+        first = [await events.__anext__(), await events.__anext__()]
+        # The client has read one token; the provider has long finished.
+        await asyncio.sleep(0.05)
+        running = llm_dispatch.get_llm_dispatcher().stats()["running"]
+        rest = [event async for event in events]
+        return first + rest, running
+
+    events, running = asyncio.run(scenario())
+    assert running == 0
+    assert [k for k, _ in events][:2] == ["meta", "token"]
+    assert "".join(p for k, p in events if k == "token") == events[-1][1]["response"]
+
+
+def test_stream_closes_the_provider_when_the_client_disconnects(tmp_path, monkeypatch):
+    from app.services import memory_store, llm_claude, llm_dispatch
+    monkeypatch.setattr(memory_store, "MEMORY_DIR", str(tmp_path))
+    monkeypatch.setattr(llm_dispatch, "_llm_dispatcher", llm_dispatch.LLMDispatcher(max_concurrency=1))
+    _patch_claude_stream(monkeypatch, "")
+    closed = []
+
+    async def _endless_stream(*args, **kwargs):
+        try:
+            yield '{"response":"Start with a weekly scorecard'
+            await asyncio.Event().wait()
+        finally:
+            closed.append(True)
+
+    monkeypatch.setattr(llm_claude, "_claude_stream", _endless_stream)
+
+    async def scenario():
+        events = llm_claude.stream_coaching_response_claude(
+            "My manager needs weekly quality metrics and my team missed Friday deadlines after the reorg",
+            user_id="u-stream-gone",
+        )
+        kinds = [(await events.__anext__())[0], (await events.__anext__())[0]]
+        await events.aclose()
+        # Checked before the loop shuts down, which would close it anyway.
+        return kinds, list(closed), llm_dispatch.get_llm_dispatcher().stats()["running"]
+
+    kinds, closed_on_disconnect, running = asyncio.run(scenario())
+    assert kinds == ["meta", "token"]
+    assert closed_on_disconnect == [True]
+    assert running == 0
+
+
+def test_stream_diagnose_turn_still_rewritten(tmp_path, monkeypatch):
+    from app.services import memory_store, llm_claude
+    monkeypatch.setattr(memory_store, "MEMORY_DIR", str(tmp_path))
+    raw = '{"response":"Here is a framework: 1. Clarify goals 2. Reset priorities. You should start today.","quick_replies":["a","b","c","d"]}'
+    _patch_claude_stream(monkeypatch, raw)
+
+    events = _collect_stream(llm_claude.stream_coaching_response_claude(
+        "I feel stuck and things are off",
+        user_id="u-stream-2",
+    ))
+
+    tokens = [p for k, p in events if k == "token"]
+    result = events[-1][1]
+    assert result["behavior_signals"]["stage_used"] == "diagnose"
+    assert tokens == [result["response"]]
+    assert result["response"].count("?") == 1
+    assert "framework" not in result["response"].lower()
+
+
+# ---------------------------------------------------------------------------
+# Prompt caching
+# ---------------------------------------------------------------------------
+
+def test_system_prompt_blocks_put_stable_prefix_first(tmp_path, monkeypatch):
+    from app.services import memory_store, llm_claude
+    monkeypatch.setattr(memory_store, "MEMORY_DIR", str(tmp_path))
+
+    plan_a = llm_claude._plan_turn("I want a promotion strategy", [], "u-cache-a", "strategic", None, {})
+    plan_b = llm_claude._plan_turn("My manager keeps blocking me", [], "u-cache-b", "strategic", "session_id=s1", {})
+
+    blocks = plan_a.system_blocks
+    assert blocks[0]["text"] == llm_claude.STABLE_SYSTEM_PROMPT
+    assert blocks[0] == plan_b.system_blocks[0]
+    assert blocks[0]["cache_control"] == {"type": "ephemeral"}
+    assert blocks[1]["cache_control"] == {"type": "ephemeral"}
+    assert "cache_control" not in blocks[-1]
+    assert "Latest user message: I want a promotion strategy" in blocks[-1]["text"]
+    assert plan_a.system == "\n\n".join(b["text"] for b in blocks)
+
+
+def test_prompt_cache_can_be_disabled(tmp_path, monkeypatch):
+    from app.services import memory_store, llm_claude
+    monkeypatch.setattr(memory_store, "MEMORY_DIR", str(tmp_path))
+    monkeypatch.setenv("PROMPT_CACHE_ENABLED", "false")
+
+    plan = llm_claude._plan_turn("hello", [], "u-cache-c", None, None, {})
+    assert all("cache_control" not in b for b in plan.system_blocks)
+
+
+def test_claude_usage_recorded_per_response(tmp_path, monkeypatch):
+    from types import SimpleNamespace
+    from app.services import memory_store, llm_claude
+    monkeypatch.setattr(memory_store, "MEMORY_DIR", str(tmp_path))
+    monkeypatch.setattr(llm_claude, "_anthropic_available", lambda: True)
+    monkeypatch.setattr(llm_claude, "_prompt_cache_stats", {})
+
+    captured = {}
+
+    class _Messages:
+        async def create(self, **kwargs):
+            captured.update(kwargs)
+            return SimpleNamespace(
+                content=[SimpleNamespace(text='{"response":"Noted.","quick_replies":["a","b","c","d"]}')],
+                usage=SimpleNamespace(
+                    input_tokens=120, output_tokens=30,
+                    cache_creation_input_tokens=0, cache_read_input_tokens=2400,
+                ),
+            )
+
+    async def _no_haiku(*args, **kwargs):
+        return {}
+
+    monkeypatch.setattr(llm_claude, "_get_anthropic_client", lambda: SimpleNamespace(messages=_Messages()))
+    monkeypatch.setattr(llm_claude, "_haiku_classify", _no_haiku)
+
+    result = asyncio.run(llm_claude.get_coaching_response_claude("I need a promotion plan", user_id="u-usage"))
+
+    assert isinstance(captured["system"], list)
+    assert result["behavior_signals"]["prompt_cache"]["cache_read_input_tokens"] == 2400
+    stats = llm_claude.prompt_cache_stats()[captured["model"]]
+    assert stats["requests"] == 1
+    assert stats["hit_rate"] == round(2400 / 2520, 4)
+
+
+def test_turn_reads_and_writes_profile_once(monkeypatch):
+    from app.services import memory_store, llm_claude
+
+    class _CountingBackend:
+        def __init__(self):
+            self.calls = []
+            self.profile = {
+                "goals": ["leadership"],
+                "escalation_risk": "low",
+                "emotion_timeline": [{"emotion": "calm"}],
+                "session_events": [],
+                "session_state": {"s1": {"turns": 3}},
+            }
+
+        async def get_profile(self, user_id):
+            self.calls.append("get")
+            return dict(self.profile)
+
+        async def save_profile(self, user_id, profile):
+            self.calls.append("save")
+
+        async def patch_profile(self, user_id, patch):
+            self.calls.append("patch")
+            self.patched = patch
+
+    backend = _CountingBackend()
+    monkeypatch.setattr(memory_store, "_store_backend", backend)
+    _patch_no_anthropic(monkeypatch)
+    payload = '{"response":"Let us map the options.","quick_replies":["A","B"]}'
+    monkeypatch.setattr(llm_claude, "_openai_complete", _make_openai_complete(payload))
+
+    req = llm.CoachingRequest(message="My manager ignores my ideas", user_id="u-uow", context="session_id=s9")
+    asyncio.run(llm.get_coaching_response(req))
+
+    assert backend.calls == ["get", "patch"]
+    # Untouched fields are not rewritten, so a concurrent classifier patch survives.
+    patch = backend.patched
+    assert "escalation_risk" not in patch.fields
+    # Timelines only carry the new entries; session_state only the active session.
+    assert len(patch.appended["emotion_timeline"]) == 1
+    assert len(patch.appended["session_events"]) == 1
+    assert list(patch.merged["session_state"]) == ["s9"]
+    assert "emotion_timeline" not in patch.fields and "session_state" not in patch.fields
+
+
+def test_session_history_comes_from_transcript_store(tmp_path, monkeypatch):
+    from app.services import memory_store, llm_claude, transcript_store
+    from app.services.cache import InMemoryCache
+    monkeypatch.setattr(memory_store, "MEMORY_DIR", str(tmp_path))
+    monkeypatch.setattr(
+        transcript_store, "_transcript_store", transcript_store.TranscriptStore(InMemoryCache(), database_url=""),
+    )
+    _patch_no_anthropic(monkeypatch)
+    seen = []
+
+    async def _fake(messages):
+        seen.append([m["content"] for m in messages if m["role"] != "system"])
+        return '{"response":"Tell me more.","quick_replies":["A","B"]}'
+
+    monkeypatch.setattr(llm_claude, "_openai_complete", _fake)
+
+    async def turn(message, **kwargs):
+        req = llm.CoachingRequest(message=message, user_id="u-transcript", session_id="s-t", **kwargs)
+        return await llm.get_coaching_response(req)
+
+    async def scenario():
+        first = await turn("My manager ignores my ideas")
+        second = await turn("It happened again today", last_turn_index=first.turn_index)
+        # A client that never saw the second reply resumes from turn 0.
+        third = await turn("Sorry, lost connection", last_turn_index=0)
+        return first, second, third
+
+    first, second, third = asyncio.run(scenario())
+    assert (first.turn_index, second.turn_index, third.turn_index) == (0, 1, 2)
+    assert first.history_digest == transcript_store.chain_digest(
+        [("user", "My manager ignores my ideas"), ("assistant", first.response)]
+    )
+    assert seen[1][:-1] == ["My manager ignores my ideas", first.response]
+    assert seen[2][:-1] == ["My manager ignores my ideas", first.response]
+    assert seen[2][-1].endswith("Sorry, lost connection")
+
+
+def test_long_history_stays_on_sonnet_within_the_token_budget(tmp_path, monkeypatch):
+    from app.services import memory_store, llm_claude, history_compaction
+    from app.services.cache import InMemoryCache
+    monkeypatch.setattr(memory_store, "MEMORY_DIR", str(tmp_path))
+    monkeypatch.setattr(
+        history_compaction, "_history_compactor",
+        history_compaction.HistoryCompactor(InMemoryCache(), budget_tokens=200, span=4, summary_max_tokens=40),
+    )
+    history = [
+        {"role": "user" if i % 2 == 0 else "assistant", "content": f"message {i} " + "context " * 10}
+        for i in range(60)
+    ]
+    plan = llm_claude._plan_turn("How do I follow up?", history, "u-long", "strategic", None, {})
+
+    assert plan.model == llm_claude.SONNET and "long_context" not in plan.upgrade_reasons
+    assert sum(history_compaction.message_tokens(m) for m in plan.messages[:-1]) <= 200
+    assert plan.messages[-2] == {"role": history[-1]["role"], "content": history[-1]["content"]}
+    assert plan.history_compaction["omitted"] == 60 - len(plan.messages[:-1])
+
+
+def test_inline_classification_replaces_the_haiku_pass(tmp_path, monkeypatch):
+    from app.services import memory_store, llm_claude
+    from app.services.background_jobs import get_background_jobs
+    monkeypatch.setattr(memory_store, "MEMORY_DIR", str(tmp_path))
+    monkeypatch.setenv("INLINE_CLASSIFICATION_ENABLED", "true")
+    monkeypatch.setattr(llm_claude, "_anthropic_available", lambda: True)
+    replies = iter([
+        '{"response":"What would a good week look like?","quick_replies":["A","B"],'
+        '"classification":{"escalation_risk":"medium","escalation_reason":"Burnout signs",'
+        '"goal_update":"Sustainable workload","session_tags":["burnout"]}}',
+        '{"response":"What would a good week look like?","quick_replies":["A","B"],'
+        '"classification":{"escalation_risk":"severe"}}',
+    ])
+    systems = []
+    haiku = []
+
+    async def _fake_complete(model, system, messages, max_tokens=800, usage=None):
+        systems.append(system[0]["text"])
+        return next(replies)
+
+    async def _fake_haiku(user_id, message, response_text):
+        haiku.append(user_id)
+        return {}
+
+    monkeypatch.setattr(llm_claude, "_claude_complete", _fake_complete)
+    monkeypatch.setattr(llm_claude, "_haiku_classify", _fake_haiku)
+
+    async def scenario():
+        first = await llm.get_coaching_response(llm.CoachingRequest(message="I am exhausted", user_id="u-inline"))
+        await get_background_jobs().join()
+        profile = await memory_store.load_profile_async("u-inline")
+        second = await llm.get_coaching_response(llm.CoachingRequest(message="Still tired", user_id="u-inline"))
+        await get_background_jobs().join()
+        return first, profile, second
+
+    first, profile, second = asyncio.run(scenario())
+    assert llm_claude.CLASSIFICATION_CONTRACT_PROMPT in systems[0]
+    assert first.behavior_signals["classification"] == "inline"
+    assert (profile["escalation_risk"], profile["active_goal"], profile["session_tags"]) == (
+        "medium", "Sustainable workload", ["burnout"],
+    )
+    # A malformed classification falls back to the Haiku pass.
+    assert second.behavior_signals["classification"] == "background"
+    assert haiku == ["u-inline"]
+
+
+def test_confident_local_classification_skips_haiku(tmp_path, monkeypatch):
+    from app.services import memory_store, llm_claude
+    from app.services.background_jobs import get_background_jobs
+    monkeypatch.setattr(memory_store, "MEMORY_DIR", str(tmp_path))
+    monkeypatch.setattr(llm_claude, "_anthropic_available", lambda: True)
+    haiku = []
+
+    async def _fake_complete(model, system, messages, max_tokens=800, usage=None):
+        return '{"response":"What would help most right now?","quick_replies":["A","B"]}'
+
+    async def _fake_haiku(user_id, message, response_text):
+        haiku.append(user_id)
+        return {}
+
+    monkeypatch.setattr(llm_claude, "_claude_complete", _fake_complete)
+    monkeypatch.setattr(llm_claude, "_haiku_classify", _fake_haiku)
+    monkeypatch.setattr(
+        llm_claude, "confident_classification",
+        lambda message, response: {
+            "escalation_risk": "low", "escalation_reason": None, "goal_update": None, "session_tags": ["feedback"],
+        },
+    )
+
+    async def scenario():
+        result = await llm.get_coaching_response(llm.CoachingRequest(message="Feedback went badly", user_id="u-local"))
+        await get_background_jobs().join()
+        return result, await memory_store.load_profile_async("u-local")
+
+    result, profile = asyncio.run(scenario())
+    assert result.behavior_signals["classification"] == "local"
+    assert (profile["escalation_risk"], profile["session_tags"]) == ("low", ["feedback"])
+    assert haiku == []
+
+
+def test_model_calls_are_dispatched_by_priority_class(tmp_path, monkeypatch):
+    from app.services import memory_store, llm_claude, llm_dispatch
+    monkeypatch.setattr(memory_store, "MEMORY_DIR", str(tmp_path))
+    monkeypatch.setattr(llm_dispatch, "_llm_dispatcher", llm_dispatch.LLMDispatcher(max_concurrency=4))
+    _patch_no_anthropic(monkeypatch)
+
+    async def _fake(messages, max_tokens=800):
+        return '{"response":"What matters most here?","quick_replies":["A","B"],"summary":"Short session."}'
+
+    monkeypatch.setattr(llm_claude, "_openai_complete", _fake)
+
+    async def scenario():
+        await llm.get_coaching_response(llm.CoachingRequest(message="I need help", user_id="u-dispatch"))
+        summary = await llm.generate_session_summary(
+            [{"role": "user", "content": "hi"}, {"role": "assistant", "content": "hello"}], "u-dispatch",
+        )
+        return summary
+
+    summary = asyncio.run(scenario())
+    stats = llm_dispatch.get_llm_dispatcher().stats()
+    assert summary["summary"] == "Short session."
+    assert (stats["interactive"]["dispatched"], stats["summary"]["dispatched"], stats["running"]) == (1, 1, 0)
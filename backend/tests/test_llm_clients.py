@@ -0,0 +1,99 @@
+import asyncio
+
+import httpx
+
+from app.services import llm_clients
+from app.services.llm_clients import LLMClientRegistry, PoolStats, _CountingTransport
+
+
+def test_registry_reuses_pooled_clients(monkeypatch):
+    monkeypatch.setenv("ANTHROPIC_API_KEY", "sk-ant-test")
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    registry = LLMClientRegistry()
+
+    first = registry.anthropic()
+    assert registry.anthropic() is first
+    assert registry.openai() is registry.openai()
+    assert registry.http_client("anthropic") is registry.http_client("anthropic")
+    assert registry.http_client("anthropic") is not registry.http_client("openai")
+
+    monkeypatch.setenv("ANTHROPIC_API_KEY", "sk-ant-rotated")
+    assert registry.anthropic() is not first
+
+    asyncio.run(registry.aclose())
+    assert registry.closed
+
+
+def test_registry_reads_pool_tuning_from_env(monkeypatch):
+    monkeypatch.setenv("LLM_HTTP_MAX_CONNECTIONS", "7")
+    monkeypatch.setenv("LLM_HTTP_READ_TIMEOUT_SECONDS", "12")
+    registry = LLMClientRegistry()
+
+    stats = registry.stats()
+    assert stats["max_connections"] == 7
+    assert registry.timeout.read == 12
+    assert stats["providers"]["anthropic"]["requests_total"] == 0
+
+
+def test_counting_transport_tracks_requests_and_errors():
+    stats = PoolStats()
+
+    def handler(request):
+        if request.url.path == "/fail":
+            raise httpx.ConnectError("down", request=request)
+        return httpx.Response(200, stream=httpx.ByteStream(b"{}"))
+
+    transport = _CountingTransport(httpx.MockTransport(handler), stats)
+
+    async def run():
+        async with httpx.AsyncClient(transport=transport) as client:
+            await client.get("http://llm.test/ok")
+            try:
+                await client.get("http://llm.test/fail")
+            except httpx.ConnectError:
+                pass
+
+    asyncio.run(run())
+    assert stats.requests_total == 2
+    assert stats.errors_total == 1
+    assert stats.in_flight == 0
+    assert stats.peak_in_flight == 1
+
+
+def test_startup_and_shutdown_replace_global_registry():
+    async def run():
+        registry = await llm_clients.startup_llm_clients()
+        assert llm_clients.get_llm_clients() is registry
+        await llm_clients.shutdown_llm_clients()
+        return registry
+
+    registry = asyncio.run(run())
+    assert registry.closed
+    assert llm_clients.get_llm_clients() is not registry
+
+
+def test_key_pool_env_and_response_observers(monkeypatch):
+    monkeypatch.setenv("ANTHROPIC_API_KEY", "sk-ant-single")
+    assert llm_clients.anthropic_api_keys() == ["sk-ant-single"]
+    monkeypatch.setenv("ANTHROPIC_API_KEYS", "sk-ant-1, sk-ant-2,")
+    assert llm_clients.anthropic_api_keys() == ["sk-ant-1", "sk-ant-2"]
+
+    observed = []
+
+    def handler(request):
+        return httpx.Response(429, headers={"retry-after": "3"}, stream=httpx.ByteStream(b"{}"))
+
+    def observer(request, response):
+        observed.append((request.url.path, response.status_code, response.headers["retry-after"]))
+
+    def broken(request, response):
+        raise RuntimeError("observer bug")
+
+    transport = _CountingTransport(httpx.MockTransport(handler), PoolStats(), [broken, observer])
+
+    async def run():
+        async with httpx.AsyncClient(transport=transport) as client:
+            return await client.get("http://llm.test/v1/messages")
+
+    assert asyncio.run(run()).status_code == 429
+    assert observed == [("/v1/messages", 429, "3")]
@@ -0,0 +1,107 @@
+import asyncio
+
+from app.services.llm_dispatch import BACKGROUND, INTERACTIVE, SUMMARY, LLMDispatcher
+
+
+async def _run_behind_blocker(dispatcher, calls):
+    """Queue ``calls`` (priority, user, label) behind one held slot; return the grant order."""
+    order = []
+    release = asyncio.Event()
+
+    async def blocker():
+        async with dispatcher.slot(INTERACTIVE, "blocker"):
+            await release.wait()
+
+    async def call(priority, user_id, label):
+        async with dispatcher.slot(priority, user_id):
+            order.append(label)
+            await asyncio.sleep(0)
+
+    held = asyncio.create_task(blocker())
+    await asyncio.sleep(0)
+    tasks = []
+    for priority, user_id, label in calls:
+        tasks.append(asyncio.create_task(call(priority, user_id, label)))
+        await asyncio.sleep(0)
+    release.set()
+    await asyncio.gather(held, *tasks)
+    return order
+
+
+def test_slots_go_to_the_highest_priority_class_first():
+    dispatcher = LLMDispatcher(max_concurrency=1)
+    order = asyncio.run(_run_behind_blocker(dispatcher, [
+        (BACKGROUND, "u1", "classify"),
+        (SUMMARY, "u2", "summary"),
+        (INTERACTIVE, "u3", "chat"),
+    ]))
+
+    assert order == ["chat", "summary", "classify"]
+    stats = dispatcher.stats()
+    assert stats["running"] == 0
+    assert (stats[INTERACTIVE]["dispatched"], stats[SUMMARY]["dispatched"], stats[BACKGROUND]["dispatched"]) == (2, 1, 1)
+    assert stats[BACKGROUND]["wait_max_ms"] > 0
+
+
+def test_users_are_interleaved_within_a_class():
+    dispatcher = LLMDispatcher(max_concurrency=1)
+    order = asyncio.run(_run_behind_blocker(dispatcher, [
+        (INTERACTIVE, "busy", "busy-1"),
+        (INTERACTIVE, "busy", "busy-2"),
+        (INTERACTIVE, "busy", "busy-3"),
+        (INTERACTIVE, "quiet", "quiet-1"),
+    ]))
+
+    assert order == ["busy-1", "quiet-1", "busy-2", "busy-3"]
+
+
+def test_class_caps_reserve_capacity_for_interactive_calls():
+    dispatcher = LLMDispatcher(max_concurrency=3, limits={BACKGROUND: 1})
+
+    async def scenario():
+        release = asyncio.Event()
+
+        async def call(priority, user_id):
+            async with dispatcher.slot(priority, user_id):
+                await release.wait()
+
+        tasks = [asyncio.create_task(call(BACKGROUND, f"u{n}")) for n in range(3)]
+        tasks.append(asyncio.create_task(call(INTERACTIVE, "live")))
+        await asyncio.sleep(0)
+        stats = dispatcher.stats()
+        release.set()
+        await asyncio.gather(*tasks)
+        return stats
+
+    stats = asyncio.run(scenario())
+    assert (stats[BACKGROUND]["running"], stats[BACKGROUND]["waiting"]) == (1, 2)
+    assert stats[INTERACTIVE]["running"] == 1
+
+
+def test_cancelled_waiters_give_up_their_place():
+    dispatcher = LLMDispatcher(max_concurrency=1)
+    order = []
+
+    async def scenario():
+        release = asyncio.Event()
+
+        async def call(label, hold=False):
+            async with dispatcher.slot(SUMMARY, label):
+                order.append(label)
+                if hold:
+                    await release.wait()
+
+        first = asyncio.create_task(call("first", hold=True))
+        await asyncio.sleep(0)
+        abandoned = asyncio.create_task(call("abandoned"))
+        last = asyncio.create_task(call("last"))
+        await asyncio.sleep(0)
+        abandoned.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        await asyncio.gather(first, last)
+
+    asyncio.run(scenario())
+    assert order == ["first", "last"]
+    stats = dispatcher.stats()[SUMMARY]
+    assert (stats["dispatched"], stats["cancelled"], stats["waiting"], stats["running"]) == (2, 1, 0, 0)
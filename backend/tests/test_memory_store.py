@@ -2,6 +2,9 @@ import os
 import pytest
 import psycopg
 from app.services import memory_store
+from app.services.database import run_blocking
+from app.services.memory_store import ProfilePatch, diff_profile
+from app.services.profile_store import TIMELINE_TABLES, ProfileStore
 
 
 @pytest.fixture
@@ -12,6 +15,7 @@ def clean_profiles(test_db_url):
     with psycopg.connect(test_db_url) as conn:
         with conn.cursor() as cur:
             cur.execute("DELETE FROM coaching_profiles")
+            _clear_timelines(cur)
         conn.commit()
     
     yield test_db_url
@@ -19,9 +23,15 @@ def clean_profiles(test_db_url):
     with psycopg.connect(test_db_url) as conn:
         with conn.cursor() as cur:
             cur.execute("DELETE FROM coaching_profiles")
+            _clear_timelines(cur)
         conn.commit()
 
 
+def _clear_timelines(cur):
+    for table in TIMELINE_TABLES.values():
+        cur.execute(f"DELETE FROM {table} WHERE to_regclass('{table}') IS NOT NULL")
+
+
 @pytest.fixture
 def test_db_url():
     url = os.getenv("DATABASE_URL")
@@ -79,3 +89,122 @@ class TestMemoryStore:
         
         assert loaded1 == loaded2
         assert loaded1["goals"] == ["leadership"]
+
+    def test_profile_session_writes_only_changed_fields(self, clean_profiles):
+        memory_store._store_backend = None
+        memory_store.save_profile("u4", {"goals": ["leadership"], "stale": True, "escalation_risk": "none"})
+
+        async def scenario():
+            session = await memory_store.ProfileSession.load("u4")
+            # The background classifier patches a field while the turn is in flight.
+            classifier = memory_store.ProfileSession("u4")
+            classifier.profile["escalation_risk"] = "high"
+            await classifier.flush()
+
+            session.profile["goals"].append("career_advancement")
+            del session.profile["stale"]
+            assert await session.flush() is True
+            assert await session.flush() is False
+            return await memory_store.load_profile_async("u4")
+
+        stored = run_blocking(scenario())
+        assert stored == {"goals": ["leadership", "career_advancement"], "escalation_risk": "high"}
+
+    def test_timelines_are_appended_as_rows_and_capped(self, clean_profiles):
+        memory_store._store_backend = None
+        memory_store.save_profile("u5", {"goals": [], "emotion_timeline": [{"n": i} for i in range(39)]})
+
+        async def turn(n):
+            session = await memory_store.ProfileSession.load("u5")
+            memory_store.apply_turn_to_profile(session.profile, "hi", "g", "supportive", f"e{n}", {})
+            session.profile.setdefault("session_state", {})[f"s{n}"] = {"turns": n}
+            await session.flush()
+
+        async def scenario():
+            for n in range(3):
+                await turn(n)
+            return await memory_store.load_profile_async("u5")
+
+        profile = run_blocking(scenario())
+        timeline = profile["emotion_timeline"]
+        assert len(timeline) == 40
+        assert timeline[0] == {"n": 2}
+        assert [e["emotion"] for e in timeline[-3:]] == ["e0", "e1", "e2"]
+        assert profile["session_state"] == {"s0": {"turns": 0}, "s1": {"turns": 1}, "s2": {"turns": 2}}
+
+        with psycopg.connect(clean_profiles) as conn:
+            rows = conn.execute("SELECT count(*) FROM profile_emotion_timeline WHERE user_id = 'u5'").fetchone()[0]
+            document = conn.execute("SELECT profile_json FROM coaching_profiles WHERE user_id = 'u5'").fetchone()[0]
+        assert rows == 42  # the pruner trims the rows past the cap
+        assert "emotion_timeline" not in document
+
+        store = memory_store._get_store_backend()
+        assert run_blocking(store.prune_dirty()) == 2
+        assert run_blocking(store.prune_dirty()) == 0
+        assert memory_store.load_profile("u5")["emotion_timeline"] == timeline
+
+    def test_embedded_timelines_move_to_child_tables(self, clean_profiles):
+        with psycopg.connect(clean_profiles) as conn:
+            conn.execute(
+                "INSERT INTO coaching_profiles (user_id, profile_json) VALUES ('u6', %s)",
+                (psycopg.types.json.Jsonb({"goals": ["x"], "session_events": [{"n": 1}, {"n": 2}]}),),
+            )
+        ProfileStore(clean_profiles)
+        memory_store._store_backend = None
+        assert memory_store.load_profile("u6") == {"goals": ["x"], "session_events": [{"n": 1}, {"n": 2}]}
+
+    def test_embedded_timelines_move_once_when_workers_boot_together(self, clean_profiles):
+        import threading
+
+        with psycopg.connect(clean_profiles) as conn:
+            conn.execute(
+                "INSERT INTO coaching_profiles (user_id, profile_json) VALUES ('u7', %s)",
+                (psycopg.types.json.Jsonb({"session_events": [{"n": 1}, {"n": 2}]}),),
+            )
+        workers = [threading.Thread(target=ProfileStore, args=(clean_profiles,)) for _ in range(2)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join(10)
+        ProfileStore(clean_profiles)
+
+        with psycopg.connect(clean_profiles) as conn:
+            rows = conn.execute(
+                "SELECT entry FROM profile_session_events WHERE user_id = 'u7' ORDER BY id"
+            ).fetchall()
+        assert [row[0] for row in rows] == [{"n": 1}, {"n": 2}]
+
+
+def test_diff_profile_separates_appends_merges_and_rewrites():
+    old = {
+        "emotion_timeline": [{"n": i} for i in range(40)],
+        "session_events": [{"n": 1}],
+        "session_state": {"a": 1, "b": 2},
+        "goals": ["x"],
+        "gone": True,
+    }
+    new = {
+        "emotion_timeline": [{"n": i} for i in range(2, 42)],
+        "session_events": [],
+        "session_state": {"a": 1, "c": 3},
+        "goals": ["x", "y"],
+    }
+    patch = diff_profile(old, new)
+    assert patch.appended == {"emotion_timeline": [{"n": 40}, {"n": 41}]}
+    assert patch.fields == {"session_events": [], "goals": ["x", "y"]}
+    assert patch.merged == {"session_state": {"c": 3}}
+    assert patch.merged_removed == {"session_state": ["b"]}
+    assert patch.removed == ["gone"]
+    assert patch.apply(old) == new
+    assert not diff_profile(new, new)
+
+
+def test_file_backend_applies_patches(tmp_path, monkeypatch):
+    monkeypatch.setattr(memory_store, "MEMORY_DIR", str(tmp_path))
+    monkeypatch.setattr(memory_store, "_store_backend", "file")
+    memory_store.save_profile("f1", {"session_events": [{"n": i} for i in range(50)], "style_usage": {"a": 1}})
+    patch = ProfilePatch(appended={"session_events": [{"n": 50}]}, merged={"style_usage": {"b": 1}})
+    run_blocking(memory_store.patch_profile_async("f1", patch))
+    profile = memory_store.load_profile("f1")
+    assert profile["session_events"][0] == {"n": 1} and len(profile["session_events"]) == 50
+    assert profile["style_usage"] == {"a": 1, "b": 1}
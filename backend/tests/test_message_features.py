@@ -0,0 +1,103 @@
+import re
+
+import pytest
+
+from app.services import llm_claude, message_features
+from app.services.message_features import MessageFeatures, extract_features, keywords, pattern, word_pattern
+
+
+MESSAGES = [
+    "My team performance is slipping and I feel stuck before the Q3 review.",
+    "I'm overwhelmed — overwhelm is my default. Also, new issue: re-org next month.",
+    "In the meeting yesterday my boss said the deadline moved; not following why.",
+    "job offer vs. promotion?? I don't understand the trade-off, 职业转型 战略",
+    "Anyway, separately: side note about my colleague and the customer escalation",
+    "",
+]
+
+
+def test_keyword_hits_match_substring_semantics():
+    words = list(message_features._literals)
+    for message in MESSAGES:
+        text = message.lower()
+        f = extract_features(message)
+        assert {w for w in words if w in text} == {w for w in words if f.has(w)}
+
+
+def test_pattern_hits_match_re_search():
+    for message in MESSAGES:
+        text = message.lower()
+        f = extract_features(message)
+        for source in message_features._patterns:
+            m = re.search(source, text)
+            assert f.search(source) == (m.group(0) if m else None), source
+
+
+def test_unregistered_lookups_fall_back_to_text():
+    f = extract_features("Quarterly planning offsite")
+    assert f.has("offsite")
+    assert not f.has("onsite")
+    assert f.search(r"\bplan\w*") == "planning"
+
+
+def test_late_registration_rescans_existing_features():
+    f = MessageFeatures("we need a zorblax roadmap")
+    late = keywords("zorblax")
+    late_pattern = pattern(r"\bzorb\w+\b")
+    assert f.any(late)
+    assert f.search(late_pattern) == "zorblax"
+
+
+def test_extract_features_is_memoized_and_lowercased():
+    f = extract_features("Team Conflict")
+    assert f is extract_features("Team Conflict")
+    assert f.text == "team conflict"
+    assert extract_features(None).text == ""
+
+
+def test_patterns_run_only_when_a_declared_prefix_is_seen(monkeypatch):
+    gated = word_pattern("florp", "glorb ride")
+    ungated = pattern(r"\d+ florps?")
+    assert gated == r"\b(florp|glorb ride)\b"
+    assert message_features._patterns[gated] == ("florp", "glorb ride")
+    assert message_features._patterns[ungated] is None
+
+    searched = []
+    real_compile = re.compile
+
+    class _Recorder:
+        def __init__(self, source):
+            self.source, self.compiled = source, real_compile(source)
+
+        def search(self, text):
+            searched.append(self.source)
+            return self.compiled.search(text)
+
+    def _compile(source):
+        return _Recorder(source) if source in (gated, ungated) else real_compile(source)
+
+    monkeypatch.setattr(message_features.re, "compile", _compile)
+    monkeypatch.setattr(message_features, "_automaton", None)
+    f = MessageFeatures("3 glorbs on the ride")
+    assert f.search(gated) is None and f.search(ungated) is None
+    assert searched == [ungated]
+    assert MessageFeatures("a glorb ride, 3 florps").search(gated) == "glorb ride"
+
+
+def test_word_pattern_rejects_regex_syntax():
+    with pytest.raises(ValueError):
+        word_pattern("re-?org")
+    with pytest.raises(ValueError):
+        pattern(r"\b(x\w+)\b", prefixes=())
+
+
+def test_analyzers_accept_shared_features():
+    message = "My manager and I had a conflict in the meeting yesterday about the Q3 deadline."
+    f = extract_features(message)
+    signals = llm_claude._extract_conversation_signals(message, f)
+    assert signals.stakeholder == "manager"
+    assert signals.example == "in the meeting"
+    assert signals.timeframe == "q3"
+    assert llm_claude._is_context_rich(message, f)
+    assert llm_claude.select_model([], message, None, f) == (llm_claude.SONNET, [])
+    assert not llm_claude._detect_crisis(message, f)
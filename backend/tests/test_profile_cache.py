@@ -0,0 +1,122 @@
+import asyncio
+
+from app.services.cache import InMemoryCache
+from app.services.memory_store import ProfilePatch
+from app.services.profile_cache import ProfileCache
+
+
+class _Store:
+    def __init__(self):
+        self.profiles = {}
+        self.reads = 0
+
+    async def load(self, user_id):
+        self.reads += 1
+        return dict(self.profiles.get(user_id, {}))
+
+
+def test_read_through_serves_copies_from_cache():
+    store = _Store()
+    store.profiles["u1"] = {"goals": ["leadership"]}
+    cache = ProfileCache(InMemoryCache(), max_entries=8, ttl_seconds=60)
+
+    async def scenario():
+        first = await cache.get("u1", lambda: store.load("u1"))
+        first["goals"].append("mutated")
+        return await cache.get("u1", lambda: store.load("u1"))
+
+    assert asyncio.run(scenario()) == {"goals": ["leadership"]}
+    assert store.reads == 1
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["size"]) == (1, 1, 1)
+
+
+def test_write_through_applies_patch_and_bumps_version():
+    store = _Store()
+    store.profiles["u1"] = {"goals": ["a"], "session_events": []}
+    backend = InMemoryCache()
+    cache = ProfileCache(backend, max_entries=8, ttl_seconds=60)
+    patch = ProfilePatch(fields={"goals": ["a", "b"]}, appended={"session_events": [{"n": 1}]})
+
+    async def writer():
+        store.profiles["u1"] = patch.apply(dict(store.profiles["u1"]))
+
+    async def scenario():
+        await cache.get("u1", lambda: store.load("u1"))
+        await cache.write("u1", writer, patch.apply)
+        return await cache.get("u1", lambda: store.load("u1")), await backend.get_counter("profile:version:u1")
+
+    profile, version = asyncio.run(scenario())
+    assert profile == {"goals": ["a", "b"], "session_events": [{"n": 1}]}
+    assert version == 1
+    assert store.reads == 1
+
+
+def test_lru_eviction_and_ttl_expiry_are_counted():
+    store = _Store()
+    cache = ProfileCache(InMemoryCache(), max_entries=2, ttl_seconds=60)
+
+    async def scenario():
+        for user_id in ("a", "b", "a", "c"):
+            await cache.get(user_id, lambda: store.load(user_id))
+        cache.ttl_seconds = 0
+        await cache.get("d", lambda: store.load("d"))
+        await cache.get("d", lambda: store.load("d"))
+
+    asyncio.run(scenario())
+    stats = cache.stats()
+    assert stats["evictions"] == 2  # "b" by "c", then "a" by "d"
+    assert stats["expirations"] == 1
+    assert stats["hits"] == 1
+
+
+def test_writes_on_one_worker_invalidate_the_others():
+    store = _Store()
+    store.profiles["u1"] = {"escalation_risk": "none"}
+    shared = InMemoryCache()
+    worker_a = ProfileCache(shared, max_entries=8, ttl_seconds=60)
+    worker_b = ProfileCache(shared, max_entries=8, ttl_seconds=60)
+
+    async def writer():
+        store.profiles["u1"] = {"escalation_risk": "high"}
+
+    async def scenario():
+        worker_b.start_listener()
+        await asyncio.sleep(0)
+        await worker_a.get("u1", lambda: store.load("u1"))
+        await worker_b.get("u1", lambda: store.load("u1"))
+        await worker_a.write("u1", writer)
+        await asyncio.sleep(0.01)
+        seen = await worker_b.get("u1", lambda: store.load("u1"))
+        await worker_b.stop_listener()
+        return seen
+
+    assert asyncio.run(scenario()) == {"escalation_risk": "high"}
+    assert worker_b.stats()["invalidations"] == 1
+
+
+def test_load_racing_a_write_is_not_installed():
+    store = _Store()
+    store.profiles["u1"] = {"v": 1}
+    cache = ProfileCache(InMemoryCache(), max_entries=8, ttl_seconds=60)
+    loaded = asyncio.Event()
+    release = asyncio.Event()
+
+    async def slow_load():
+        profile = await store.load("u1")
+        loaded.set()
+        await release.wait()
+        return profile
+
+    async def writer():
+        store.profiles["u1"] = {"v": 2}
+
+    async def scenario():
+        reader = asyncio.create_task(cache.get("u1", slow_load))
+        await loaded.wait()
+        await cache.write("u1", writer)
+        release.set()
+        assert await reader == {"v": 1}
+        return await cache.get("u1", lambda: store.load("u1"))
+
+    assert asyncio.run(scenario()) == {"v": 2}
@@ -1,10 +1,16 @@
+import os
 import asyncio
+import json
+import threading
+import time
 
 from fastapi.testclient import TestClient
 
 from main import app
 from app.routers import chat as chat_router
-from app.services.llm import CoachingResponse
+from app.services.llm import CoachingRequest, CoachingResponse
+from app.services import cache as cache_module
+from app.services import sse as sse_module
 from app.services.cache import InMemoryCache
 
 
@@ -35,6 +41,18 @@ def test_debug_profile_endpoint(tmp_path, monkeypatch):
     assert "profile" in body
 
 
+def test_debug_metrics_reports_llm_pools():
+    with TestClient(app) as client:
+        r = client.get("/api/debug/metrics")
+    assert r.status_code == 200
+    providers = r.json()["llm_clients"]["providers"]
+    assert set(providers) == {"anthropic", "openai"}
+    assert "in_flight" in providers["anthropic"]
+    assert {"hits", "misses", "evictions"} <= set(r.json()["profile_cache"])
+    if os.getenv("DATABASE_URL"):
+        assert r.json()["database"]["pools"][0]["max_size"] >= 1
+
+
 def test_quick_replies_endpoint():
     client = TestClient(app)
     r = client.post("/api/chat/quick-replies", params={"message": "I want a promotion", "response": "Let's define options"})
@@ -46,7 +64,10 @@ def test_chat_stream_endpoint(monkeypatch):
     monkeypatch.setenv("ANTHROPIC_API_KEY", "sk-ant-REDACTED")
 
     async def _fake(_req):
-        return CoachingResponse(
+        yield "meta", {"style_used": "strategic"}
+        for token in ["One", " two", " three"]:
+            yield "token", token
+        yield "result", CoachingResponse(
             response="One two three",
             quick_replies=["a", "b", "c", "d"],
             style_used="strategic",
@@ -54,7 +75,7 @@ def test_chat_stream_endpoint(monkeypatch):
             goal_link="career_advancement",
         )
 
-    monkeypatch.setattr(chat_router, "get_coaching_response", _fake)
+    monkeypatch.setattr(chat_router, "stream_coaching_response", _fake)
 
     client = TestClient(app)
     r = client.post(
@@ -64,9 +85,39 @@ def test_chat_stream_endpoint(monkeypatch):
     assert r.status_code == 200
     body = r.text
     assert '"meta"' in body
+    assert '"token": "One two three"' in body  # coalesced within one window
+    assert ": frames=3 bytes=" in body
+    assert '"quick_replies": ["a", "b", "c", "d"]' in body
     assert "[DONE]" in body
 
 
+def test_chat_stream_leader_caches_result_and_releases_lock(monkeypatch):
+    monkeypatch.setattr(chat_router, "_anthropic_available", lambda: True)
+    monkeypatch.setattr(chat_router, "_openai_available", lambda: False)
+
+    cache = InMemoryCache()
+    monkeypatch.setattr(chat_router, "response_cache", cache)
+
+    async def _fake(_req):
+        yield "meta", {"style_used": "strategic"}
+        yield "token", "Live answer"
+        yield "result", CoachingResponse(response="Live answer", quick_replies=["a", "b"])
+
+    monkeypatch.setattr(chat_router, "stream_coaching_response", _fake)
+
+    client = TestClient(app)
+    r = client.post(
+        "/api/v1/chat-stream",
+        json={"sessionId": "s-lead", "message": "hello", "userId": "u-lead", "requestId": "req-lead-1"},
+    )
+
+    assert r.status_code == 200
+    assert "Live answer" in r.text
+    record = asyncio.run(cache.get_json("idem:u-lead:req-lead-1"))
+    assert record["response"]["response"] == "Live answer"
+    assert asyncio.run(cache.acquire_lock("idemlock:u-lead:req-lead-1", "other", 5))
+
+
 def test_chat_returns_202_when_follower_wait_times_out(monkeypatch):
     monkeypatch.setattr(chat_router, "_anthropic_available", lambda: True)
     monkeypatch.setattr(chat_router, "_openai_available", lambda: False)
@@ -91,6 +142,33 @@ def test_chat_returns_202_when_follower_wait_times_out(monkeypatch):
     assert "retry_after_ms" in body
 
 
+def test_chat_stream_follower_replays_as_soon_as_leader_stores(monkeypatch):
+    monkeypatch.setattr(chat_router, "_anthropic_available", lambda: True)
+    monkeypatch.setattr(chat_router, "_openai_available", lambda: False)
+    monkeypatch.setattr(cache_module, "WAIT_RECHECK_SECONDS", 30.0)
+    cache = InMemoryCache()
+    monkeypatch.setattr(chat_router, "response_cache", cache)
+
+    request_body = {"sessionId": "s-f", "message": "hello", "userId": "u-f", "requestId": "req-f-1"}
+    signature = chat_router._stream_signature(chat_router.ChatStreamRequest(**request_body))
+    asyncio.run(cache.acquire_lock("idemlock:u-f:req-f-1", "leader", 30))
+
+    def leader_finishes():
+        record = {"request_id": "req-f-1", "signature": signature, "response": {"response": "from leader", "quick_replies": ["a", "b"]}}
+        asyncio.run(cache.set_json("idem:u-f:req-f-1", record, 60))
+
+    timer = threading.Timer(0.2, leader_finishes)
+    timer.start()
+    started = time.monotonic()
+    r = TestClient(app).post("/api/v1/chat-stream", json=request_body)
+    timer.join()
+
+    assert r.status_code == 200
+    assert '"token": "from leader"' in r.text
+    assert "[DONE]" in r.text
+    assert time.monotonic() - started < 2.0
+
+
 def test_chat_stream_uses_cached_response_without_llm(monkeypatch):
     monkeypatch.setattr(chat_router, "_anthropic_available", lambda: True)
     monkeypatch.setattr(chat_router, "_openai_available", lambda: False)
@@ -133,3 +211,326 @@ def test_chat_stream_uses_cached_response_without_llm(monkeypatch):
     assert '"meta"' in body
     assert "cached" in body
     assert "[DONE]" in body
+
+
+def test_chat_replay_serves_stored_bytes_identical_to_leader(monkeypatch):
+    monkeypatch.setattr(chat_router, "_anthropic_available", lambda: True)
+    monkeypatch.setattr(chat_router, "_openai_available", lambda: False)
+    cache = InMemoryCache()
+    monkeypatch.setattr(chat_router, "response_cache", cache)
+    calls = []
+
+    async def _fake(_req):
+        calls.append(1)
+        return CoachingResponse(response="Grüße — answer", quick_replies=["a", "b"], emotion_scores={"calm": 0.5})
+
+    monkeypatch.setattr(chat_router, "get_coaching_response", _fake)
+    client = TestClient(app)
+    body = {"message": "hello", "user_id": "u-raw", "request_id": "req-raw-1"}
+    first = client.post("/api/chat/", json=body)
+
+    def _no_rebuild(_payload):
+        raise AssertionError("cache hits should not rebuild the response model")
+
+    monkeypatch.setattr(chat_router, "_response_from_payload", _no_rebuild)
+    second = client.post("/api/chat/", json=body)
+    polled = client.get("/api/chat/result", params={"user_id": "u-raw", "request_id": "req-raw-1"})
+
+    assert len(calls) == 1
+    assert first.status_code == second.status_code == polled.status_code == 200
+    assert second.content == first.content == polled.content
+    assert second.headers["content-type"] == first.headers["content-type"]
+    record = asyncio.run(cache.get_json("idem:u-raw:req-raw-1"))
+    assert record["response"] == first.json()
+    assert record["response_bytes"] == len(first.content)
+
+    conflict = client.post("/api/chat/", json={**body, "message": "different"})
+    assert conflict.status_code == 409
+
+
+def test_chat_stream_follower_tails_leader_chunks_live(monkeypatch):
+    monkeypatch.setattr(chat_router, "_anthropic_available", lambda: True)
+    monkeypatch.setattr(chat_router, "_openai_available", lambda: False)
+    cache = InMemoryCache()
+    monkeypatch.setattr(chat_router, "response_cache", cache)
+    release = threading.Event()
+
+    async def _fake(_req):
+        yield "meta", {"style_used": "strategic"}
+        yield "token", "Li"
+        while not release.is_set():
+            await asyncio.sleep(0.01)
+        yield "token", "ve answer"
+        yield "result", CoachingResponse(response="Live answer", quick_replies=["a", "b"])
+
+    monkeypatch.setattr(chat_router, "stream_coaching_response", _fake)
+    client = TestClient(app)
+    request_body = {"sessionId": "s-tail", "message": "hello", "userId": "u-tail", "requestId": "req-tail-1"}
+    bodies = {}
+
+    def post(name):
+        bodies[name] = client.post("/api/v1/chat-stream", json=request_body).text
+
+    async def leader_chunks(count):
+        chunks = []
+        while len(chunks) < count:
+            log_key = await _run_log_key(cache, "u-tail", "req-tail-1")
+            chunks += await cache.read_stream(log_key, chunks[-1][0] if chunks else "0", 5) if log_key else []
+        return [chunk for _, chunk in chunks]
+
+    leader = threading.Thread(target=post, args=("leader",))
+    follower = threading.Thread(target=post, args=("follower",))
+    leader.start()
+    try:
+        # The leader is parked mid-reply when the follower joins.
+        assert asyncio.run(leader_chunks(2))[-1] == 'id: 2\ndata: {"token": "Li"}\n\n'
+        follower.start()
+        time.sleep(0.2)
+    finally:
+        release.set()
+    leader.join(5)
+    follower.join(5)
+
+    # Same frames as the leader, not a word-by-word replay of the record.
+    assert bodies["follower"] == bodies["leader"]
+    assert '"token": "ve answer"' in bodies["follower"]
+    assert bodies["follower"].endswith("data: [DONE]\n\n")
+
+
+def _event_ids(body):
+    return [int(line[4:]) for line in body.splitlines() if line.startswith("id: ")]
+
+
+async def _run_log_key(cache, user_id, request_id):
+    """Chunk log of the current leader run, None before a leader has named it."""
+    run = await cache.get_json(chat_router._idem_sig_key(user_id, request_id))
+    return chat_router._idem_log_key(user_id, request_id, run["run"]) if run else None
+
+
+def test_chat_stream_resumes_after_last_event_id_without_llm(monkeypatch):
+    monkeypatch.setattr(chat_router, "_anthropic_available", lambda: True)
+    monkeypatch.setattr(chat_router, "_openai_available", lambda: False)
+    cache = InMemoryCache()
+    monkeypatch.setattr(chat_router, "response_cache", cache)
+    monkeypatch.setattr(sse_module, "COALESCE_WINDOW_SECONDS", 0.0)
+    calls = []
+
+    async def _fake(_req):
+        calls.append(1)
+        yield "meta", {"style_used": "strategic"}
+        for token in ("One", " two", " three"):
+            yield "token", token
+        yield "result", CoachingResponse(response="One two three", quick_replies=["a", "b"])
+
+    monkeypatch.setattr(chat_router, "stream_coaching_response", _fake)
+    client = TestClient(app)
+    request_body = {"sessionId": "s-resume", "message": "hello", "userId": "u-resume", "requestId": "req-resume-1"}
+
+    full = client.post("/api/v1/chat-stream", json=request_body).text
+    resumed = client.post("/api/v1/chat-stream", json=request_body, headers={"Last-Event-ID": "2"}).text
+
+    assert len(calls) == 1
+    assert _event_ids(full) == [1, 2, 3, 4, 5, 6]
+    assert _event_ids(resumed) == [3, 4, 5, 6]
+    assert full.endswith(resumed)
+    assert '"token": "One"' not in resumed
+
+    # Once the chunk log is gone the stored record is replayed, numbered as a replay.
+    cache._streams.clear()
+    replayed = client.post("/api/v1/chat-stream", json=request_body, headers={"Last-Event-ID": "1"})
+    assert _event_ids(replayed.text) == [2, 3]
+    assert '"token": "One two three"' in replayed.text
+    assert replayed.headers["X-SSE-Frames"] == "2"
+    assert replayed.headers["X-SSE-Bytes"] == str(len(replayed.content))
+    assert len(calls) == 1
+
+
+def test_chat_stream_rejects_other_payloads_while_leader_is_running(monkeypatch):
+    monkeypatch.setattr(chat_router, "_anthropic_available", lambda: True)
+    monkeypatch.setattr(chat_router, "_openai_available", lambda: False)
+    cache = InMemoryCache()
+    monkeypatch.setattr(chat_router, "response_cache", cache)
+    release = threading.Event()
+
+    async def _fake(_req):
+        yield "meta", {"style_used": "strategic"}
+        yield "token", "Private"
+        while not release.is_set():
+            await asyncio.sleep(0.01)
+        yield "result", CoachingResponse(response="Private", quick_replies=["a", "b"])
+
+    monkeypatch.setattr(chat_router, "stream_coaching_response", _fake)
+    client = TestClient(app)
+    request_body = {"sessionId": "s-sig", "message": "hello", "userId": "u-sig", "requestId": "req-sig-1"}
+    leader = threading.Thread(target=lambda: client.post("/api/v1/chat-stream", json=request_body))
+    leader.start()
+    try:
+        chunks = []
+        while len(chunks) < 2:
+            log_key = asyncio.run(_run_log_key(cache, "u-sig", "req-sig-1"))
+            chunks = asyncio.run(cache.read_stream(log_key, "0", 5)) if log_key else []
+        assert asyncio.run(cache.get_json("idem:u-sig:req-sig-1")) is None
+        other = {**request_body, "message": "someone else's"}
+        resumed = client.post("/api/v1/chat-stream", json=other, headers={"Last-Event-ID": "1"})
+        joined = client.post("/api/v1/chat-stream", json=other)
+    finally:
+        release.set()
+    leader.join(5)
+
+    assert resumed.status_code == 409 and joined.status_code == 409
+    assert "Private" not in resumed.text + joined.text
+
+
+def test_chat_stream_finishes_from_record_when_chunk_log_stops_early(monkeypatch):
+    monkeypatch.setattr(chat_router, "_anthropic_available", lambda: True)
+    monkeypatch.setattr(chat_router, "_openai_available", lambda: False)
+    monkeypatch.setattr(chat_router, "SSE_KEEPALIVE_SECONDS", 0.05)
+    cache = InMemoryCache()
+    monkeypatch.setattr(chat_router, "response_cache", cache)
+    request_body = {"sessionId": "s-cut", "message": "hello", "userId": "u-cut", "requestId": "req-cut-1"}
+    signature = chat_router._stream_signature(chat_router.ChatStreamRequest(**request_body))
+    result = CoachingResponse(response="Live answer, in full.", quick_replies=["a", "b"])
+
+    async def leader_stopped_publishing():
+        # Two frames reached the log before publishing failed; the record has the whole reply.
+        await cache.set_json("idemsig:u-cut:req-cut-1", {"signature": signature, "run": "r1"}, 60)
+        log_key = chat_router._idem_log_key("u-cut", "req-cut-1", "r1")
+        await cache.append_stream(log_key, 'id: 1\ndata: {"meta": {"style_used": "strategic"}}\n\n', 60)
+        await cache.append_stream(log_key, 'id: 2\ndata: {"token": "Live ans"}\n\n', 60)
+        await cache.set_raw(
+            "idem:u-cut:req-cut-1", chat_router._encode_record(result, signature, "req-cut-1"), 60,
+        )
+
+    asyncio.run(leader_stopped_publishing())
+    client = TestClient(app)
+    body = client.post("/api/v1/chat-stream", json=request_body, headers={"Last-Event-ID": "1"}).text
+
+    assert _event_ids(body) == [2, 3, 4, 5]
+    tokens = [json.loads(line[6:])["token"] for line in body.splitlines() if line.startswith('data: {"token"')]
+    assert "".join(tokens) == "Live answer, in full."
+    assert body.endswith("data: [DONE]\n\n")
+
+
+def test_chat_stream_resumes_after_the_leader_client_disconnects(monkeypatch):
+    monkeypatch.setattr(chat_router, "_anthropic_available", lambda: True)
+    monkeypatch.setattr(chat_router, "_openai_available", lambda: False)
+    cache = InMemoryCache()
+    monkeypatch.setattr(chat_router, "response_cache", cache)
+    monkeypatch.setattr(sse_module, "COALESCE_WINDOW_SECONDS", 0.0)
+    calls = []
+
+    async def _fake(_req):
+        calls.append(1)
+        yield "meta", {"style_used": "strategic"}
+        yield "token", "One"
+        await asyncio.sleep(0.05)
+        yield "token", " two"
+        yield "result", CoachingResponse(response="One two", quick_replies=["a", "b"])
+
+    monkeypatch.setattr(chat_router, "stream_coaching_response", _fake)
+    request = chat_router.ChatStreamRequest(sessionId="s-drop", message="hello", userId="u-drop", requestId="req-drop-1")
+
+    async def scenario():
+        leader = (await chat_router.chat_stream(request, None)).body_iterator
+        seen = [await leader.__anext__(), await leader.__anext__()]
+        await leader.aclose()  # the leader's client goes away after event 2
+        resumed = await chat_router.chat_stream(request, "2")
+        return "".join(seen), "".join([chunk async for chunk in resumed.body_iterator])
+
+    seen, rest = asyncio.run(scenario())
+    assert _event_ids(seen) == [1, 2]
+    assert _event_ids(rest)[0] == 3
+    assert '"token": " two"' in rest and rest.endswith("data: [DONE]\n\n")
+    assert "keepalive" not in rest
+    assert len(calls) == 1
+    assert asyncio.run(cache.get_json("idem:u-drop:req-drop-1"))["response"]["response"] == "One two"
+
+
+def test_chat_stream_stops_waiting_when_the_leader_run_dies(monkeypatch):
+    monkeypatch.setattr(chat_router, "_anthropic_available", lambda: True)
+    monkeypatch.setattr(chat_router, "_openai_available", lambda: False)
+    monkeypatch.setattr(chat_router, "SSE_KEEPALIVE_SECONDS", 0.05)
+    cache = InMemoryCache()
+    monkeypatch.setattr(chat_router, "response_cache", cache)
+    calls = []
+
+    async def _fake(_req):
+        calls.append(1)
+        yield "meta", {"style_used": "strategic"}
+        yield "token", "Fresh"
+        yield "result", CoachingResponse(response="Fresh", quick_replies=["a", "b"])
+
+    monkeypatch.setattr(chat_router, "stream_coaching_response", _fake)
+    request_body = {"sessionId": "s-dead", "message": "hello", "userId": "u-dead", "requestId": "req-dead-1"}
+    signature = chat_router._stream_signature(chat_router.ChatStreamRequest(**request_body))
+
+    async def run_on_another_worker():
+        await cache.acquire_lock("idemlock:u-dead:req-dead-1", "other-worker", 30)
+        await cache.set_json("idemsig:u-dead:req-dead-1", {"signature": signature, "run": "r1"}, 60)
+        log_key = chat_router._idem_log_key("u-dead", "req-dead-1", "r1")
+        await cache.append_stream(log_key, 'id: 1\ndata: {"meta": {"style_used": "strategic"}}\n\n', 60)
+        await cache.append_stream(log_key, 'id: 2\ndata: {"token": "Stale"}\n\n', 60)
+
+    asyncio.run(run_on_another_worker())
+    # That worker dies: its lock goes away with no record stored.
+    timer = threading.Timer(0.2, lambda: asyncio.run(cache.release_lock("idemlock:u-dead:req-dead-1", "other-worker")))
+    timer.start()
+    client = TestClient(app)
+    started = time.monotonic()
+    follower = client.post("/api/v1/chat-stream", json=request_body).text
+    timer.join()
+
+    assert time.monotonic() - started < 2.0
+    assert '"error": "processing_interrupted"' in follower
+    assert calls == []
+
+    # Resuming the dead run leads a new one, in its own log.
+    resumed = client.post("/api/v1/chat-stream", json=request_body, headers={"Last-Event-ID": "2"}).text
+    assert calls == [1]
+    assert _event_ids(resumed)[0] == 1
+    assert '"token": "Fresh"' in resumed and "Stale" not in resumed
+    assert asyncio.run(cache.get_json("idemsig:u-dead:req-dead-1"))["run"] != "r1"
+
+
+def test_chat_stream_passes_session_and_last_turn_index(monkeypatch):
+    monkeypatch.setenv("ANTHROPIC_API_KEY", "sk-ant-REDACTED")
+    seen = []
+
+    async def _fake(req):
+        seen.append((req.session_id, req.last_turn_index, req.history))
+        yield "result", CoachingResponse(response="ok", quick_replies=["a", "b"], turn_index=4)
+
+    monkeypatch.setattr(chat_router, "stream_coaching_response", _fake)
+
+    client = TestClient(app)
+    r = client.post(
+        "/api/v1/chat-stream",
+        json={"sessionId": "s-delta", "message": "next", "userId": "u-delta", "lastTurnIndex": 3},
+    )
+    assert r.status_code == 200
+    assert seen == [("s-delta", 3, None)]
+    assert '"turn_index": 4' in r.text
+
+
+def test_chat_signature_accepts_only_stored_prefix_digests(monkeypatch):
+    from app.services import transcript_store
+
+    store = transcript_store.TranscriptStore(InMemoryCache(), database_url="")
+    monkeypatch.setattr(transcript_store, "_transcript_store", store)
+    history = [{"role": "user", "content": "q0"}, {"role": "assistant", "content": "a0"}]
+    _, stored = asyncio.run(store.append_turn("u-sig", "s-sig", "q0", "a0"))
+    hashed = []
+    monkeypatch.setattr(chat_router, "chain_digest", lambda messages: hashed.append(len(messages)) or "computed")
+
+    def signature(**extra):
+        request = CoachingRequest(message="next", history=history, user_id="u-sig", session_id="s-sig", **extra)
+        return asyncio.run(chat_router._chat_signature(request))
+
+    trusted = signature(history_digest=stored)
+    assert hashed == []
+    assert signature(history_digest="forged") != trusted
+    assert hashed == [2]
+    # The stored digest does not vouch for a different final message.
+    history[-1] = {"role": "assistant", "content": "edited"}
+    assert signature(history_digest=stored) != trusted
+    assert hashed == [2, 2]
@@ -0,0 +1,88 @@
+import asyncio
+
+from app.services.sse import SSEEmitter, coalesce_tokens, split_text
+
+
+def test_split_text_prefers_spaces_then_cjk_and_never_splits_graphemes():
+    english = "Let's map out the next step together. " * 4
+    pieces = split_text(english, 40)
+    assert "".join(pieces) == english
+    assert all(len(p.encode("utf-8")) <= 40 for p in pieces)
+    assert all(p.endswith(" ") for p in pieces[:-1])
+
+    chinese = "我们一起来规划下一步的职业发展目标。" * 3
+    pieces = split_text(chinese, 30)
+    assert "".join(pieces) == chinese
+    assert len(pieces) > 1
+    assert all(len(p.encode("utf-8")) <= 30 for p in pieces)
+
+    family = "\U0001F469\u200d\U0001F469\u200d\U0001F467\u200d\U0001F466"
+    flags = "\U0001F1EF\U0001F1F5\U0001F1F0\U0001F1F7\U0001F1E8\U0001F1F3"
+    accents = "e\u0301" * 10
+    for text in (family * 3, flags, accents):
+        pieces = split_text(text, 8)
+        assert "".join(pieces) == text
+        for piece in pieces:
+            assert not piece.startswith(("\u200d", "\u0301"))
+    assert split_text(family * 3, 8) == [family] * 3
+    assert [len(p) for p in split_text(flags, 8)] == [2, 2, 2]  # flags stay paired
+
+
+def test_split_text_leaves_small_text_alone():
+    assert split_text("short", 1024) == ["short"]
+    assert split_text("", 1024) == []
+    assert split_text("anything goes", 0) == ["anything goes"]
+
+
+def _collect(source, **kwargs):
+    async def run():
+        return [item async for item in coalesce_tokens(source(), **kwargs)]
+
+    return asyncio.run(run())
+
+
+def test_coalesce_merges_tokens_within_the_window():
+    async def source():
+        yield "meta", {"style_used": "strategic"}
+        for token in ("One", " two", " three"):
+            yield "token", token
+        await asyncio.sleep(0.1)
+        yield "token", " four"
+        yield "result", "done"
+
+    assert _collect(source, window_seconds=0.03, max_bytes=1024) == [
+        ("meta", {"style_used": "strategic"}),
+        ("token", "One two three"),
+        ("token", " four"),
+        ("result", "done"),
+    ]
+
+
+def test_coalesce_flushes_on_byte_budget_and_propagates_errors():
+    async def source():
+        for _ in range(10):
+            yield "token", "word "
+
+    items = _collect(source, window_seconds=5.0, max_bytes=12)
+    assert "".join(text for _, text in items) == "word " * 10
+    assert all(len(text) <= 12 for _, text in items)
+
+    async def failing():
+        yield "token", "partial"
+        raise RuntimeError("upstream closed")
+
+    try:
+        _collect(failing, window_seconds=0.05, max_bytes=1024)
+    except RuntimeError as exc:
+        assert str(exc) == "upstream closed"
+    else:
+        raise AssertionError("error was swallowed")
+
+
+def test_emitter_numbers_events_and_skips_delivered_ones():
+    emitter = SSEEmitter(after_event=1)
+    frames = [emitter.event({"meta": {}}), emitter.event({"token": "hi"}), emitter.done()]
+    assert frames[0] == ""
+    assert frames[1] == 'id: 2\ndata: {"token": "hi"}\n\n'
+    assert frames[2] == "id: 3\ndata: [DONE]\n\n"
+    assert emitter.headers() == {"X-SSE-Frames": "2", "X-SSE-Bytes": str(len(frames[1]) + len(frames[2]))}
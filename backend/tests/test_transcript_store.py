@@ -0,0 +1,124 @@
+import asyncio
+import os
+import uuid
+
+import pytest
+
+from app.services.cache import InMemoryCache
+from app.services.transcript_store import EMPTY_DIGEST, TranscriptStore, chain_digest
+
+
+def test_ring_keeps_the_newest_messages():
+    store = TranscriptStore(InMemoryCache(), database_url="", max_messages=4)
+
+    async def scenario():
+        for turn in range(3):
+            await store.append_turn("u1", "s1", f"q{turn}", f"a{turn}")
+        return await store.load("u1", "s1"), await store.load("u1", "other")
+
+    transcript, empty = asyncio.run(scenario())
+    assert [m["content"] for m in transcript.messages] == ["q1", "a1", "q2", "a2"]
+    assert transcript.next_turn == 3
+    assert transcript.history(through_turn=1) == [
+        {"role": "user", "content": "q1"},
+        {"role": "assistant", "content": "a1"},
+    ]
+    assert empty.messages == [] and empty.next_turn == 0
+
+
+def test_each_message_stores_the_chain_digest_of_its_prefix():
+    store = TranscriptStore(InMemoryCache(), database_url="", max_messages=4)
+    conversation = [("user", "q0"), ("assistant", "a0"), ("user", "q1"), ("assistant", "a1"), ("user", "q2"), ("assistant", "a2")]
+
+    async def scenario():
+        for turn in range(3):
+            _, digest = await store.append_turn("u1", "s1", f"q{turn}", f"a{turn}")
+        return digest, await store.load("u1", "s1")
+
+    digest, transcript = asyncio.run(scenario())
+    assert digest == transcript.digest == chain_digest(conversation)
+    assert transcript.digest_at(5) == chain_digest(conversation[:5])
+    assert transcript.digest_at(0) == EMPTY_DIGEST
+    assert transcript.digest_at(2) is None  # trimmed from the ring
+    assert transcript.digest_at(7) is None
+
+
+def test_prefix_digests_are_looked_up_without_reading_the_ring():
+    store = TranscriptStore(InMemoryCache(), database_url="", max_messages=2)
+    conversation = [("user", "q0"), ("assistant", "a0"), ("user", "q1"), ("assistant", "a1")]
+
+    async def scenario():
+        for turn in range(2):
+            await store.append_turn("u1", "s1", f"q{turn}", f"a{turn}")
+
+        async def no_ring(*args, **kwargs):
+            raise AssertionError("digest lookup read the ring")
+
+        store.backend.read_stream = no_ring
+        return [await store.digest_at("u1", "s1", count) for count in range(6)]
+
+    digests = asyncio.run(scenario())
+    # Prefix digests outlive the trimmed ring entries.
+    assert digests == [EMPTY_DIGEST] + [chain_digest(conversation[:n]) for n in range(1, 5)] + [None]
+
+
+def test_overlapping_turns_get_consecutive_numbers():
+    store = TranscriptStore(InMemoryCache(), database_url="", max_messages=10)
+
+    async def scenario():
+        appended = await asyncio.gather(*(store.append_turn("u1", "s1", f"q{n}", f"a{n}") for n in range(3)))
+        return appended, await store.load("u1", "s1")
+
+    appended, transcript = asyncio.run(scenario())
+    assert sorted(turn for turn, _ in appended) == [0, 1, 2]
+    assert [m["turn"] for m in transcript.messages] == [0, 0, 1, 1, 2, 2]
+    pairs = [(m["role"], m["content"]) for m in transcript.messages]
+    assert transcript.digest == chain_digest(pairs)
+    assert transcript.digest_at(4) == chain_digest(pairs[:4])
+
+
+def test_expired_ring_is_reloaded_from_postgres():
+    url = os.getenv("DATABASE_URL")
+    if not url:
+        pytest.skip("DATABASE_URL not set - skipping PostgreSQL tests")
+    cache = InMemoryCache()
+    store = TranscriptStore(cache, database_url=url, max_messages=4)
+    session_id = f"s-{uuid.uuid4().hex}"
+
+    async def scenario():
+        for turn in range(3):
+            await store.append_turn("u-durable", session_id, f"q{turn}", f"a{turn}")
+        cache._streams.clear()
+        reloaded = await store.load("u-durable", session_id)
+        refilled = [entry for _, entry in await cache.read_stream(f"transcript:u-durable:{session_id}", "0", 0)]
+        return reloaded, refilled
+
+    reloaded, refilled = asyncio.run(scenario())
+    assert [m["content"] for m in reloaded.messages] == ["q1", "a1", "q2", "a2"]
+    assert reloaded.next_turn == 3
+    assert len(refilled) == 4
+
+
+def test_turn_taken_by_another_worker_is_retried_with_the_next_number():
+    url = os.getenv("DATABASE_URL")
+    if not url:
+        pytest.skip("DATABASE_URL not set - skipping PostgreSQL tests")
+    # Two workers that share Postgres but not a cache.
+    worker_a = TranscriptStore(InMemoryCache(), database_url=url)
+    worker_b = TranscriptStore(InMemoryCache(), database_url=url)
+    session_id = f"s-{uuid.uuid4().hex}"
+
+    async def scenario():
+        first = await worker_b.append_turn("u-race", session_id, "q0", "a0")
+        second = await worker_a.append_turn("u-race", session_id, "q1", "a1")
+        # worker_b's ring still ends at turn 0; the insert for turn 1 conflicts.
+        third = await worker_b.append_turn("u-race", session_id, "q2", "a2")
+        worker_b.backend._streams.clear()
+        cold = TranscriptStore(InMemoryCache(), database_url=url)
+        return first, second, third, await worker_b.load("u-race", session_id), await cold.digest_at("u-race", session_id, 3)
+
+    first, second, third, durable, cold_digest = asyncio.run(scenario())
+    assert (first[0], second[0], third[0]) == (0, 1, 2)
+    assert [m["content"] for m in durable.messages] == ["q0", "a0", "q1", "a1", "q2", "a2"]
+    assert third[1] == durable.digest == chain_digest([(m["role"], m["content"]) for m in durable.messages])
+    assert cold_digest == chain_digest([("user", "q0"), ("assistant", "a0"), ("user", "q1")])